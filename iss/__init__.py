@@ -1,3 +1,3 @@
 from . import extract, find_spots, pipeline, setup, stitch, utils
-from .pipeline.run import run_pipeline
+from .pipeline.run import run_pipeline, run_worker
 from ._version import __version__
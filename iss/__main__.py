@@ -2,33 +2,52 @@
 # entering the Python interpreter.  To call, use:
 #
 #     python3 -m iss inifile.ini
+#
+# or, to run tasks alongside this on another process or machine:
+#
+#     python3 -m iss --worker inifile.ini
 
-from iss import run_pipeline
+from iss import run_pipeline, run_worker
 import sys
 import os
 import textwrap
 
-def print_usage(message):
+def print_usage(message=None):
     if message:
         message = f"\n\n    ERROR: {message}"
+    else:
+        message = ""
     USAGE = f"""
     === ISS processing software ===
 
     To call, pass a single argument containing the name of the config file.  E.g.,
 
         python3 -m iss config.ini
+
+    If scheduler = True and work_queue = True in the runtime section of the config file, workers which
+    run the extract, find_spots, stitch and register_initial tasks alongside this can be started on any machine
+    sharing the output directory with
+
+        python3 -m iss --worker config.ini
     {message}
     """
     exit(textwrap.dedent(USAGE))
 
-# Ensure there is exactly one argument, and it is an ini file
-if len(sys.argv) == 1:
+# Ensure there is exactly one argument, and it is an ini file, optionally after --worker
+args = sys.argv[1:]
+worker = len(args) > 0 and args[0] == "--worker"
+if worker:
+    args = args[1:]
+if len(args) == 0:
     print_usage("Please pass the config file as an argument")
-if len(sys.argv) >= 3:
+if len(args) >= 2:
     print_usage("Please only pass one config file as an argument")
-if sys.argv[1] in ["--help", "-h"]:
+if args[0] in ["--help", "-h"]:
     print_usage()
-if not os.path.isfile(sys.argv[1]):
-    print_usage(f"Cannot find path {sys.argv[1]}, please specify a valid file")
+if not os.path.isfile(args[0]):
+    print_usage(f"Cannot find path {args[0]}, please specify a valid file")
 
-run_pipeline(sys.argv[1])
+if worker:
+    run_worker(args[0])
+else:
+    run_pipeline(args[0])
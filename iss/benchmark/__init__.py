@@ -0,0 +1,2 @@
+from .synthetic import make_dataset, SCALES
+from .profile import benchmark_pipeline, run_benchmark, load_results, compare_results, STAGES
@@ -0,0 +1,37 @@
+# This file allows the benchmarks to be run from the command line. To run the tiny and small benchmarks and
+# compare them with previous results, use:
+#
+#     python3 -m iss.benchmark --scale tiny small --results benchmark_results.jsonl
+
+import argparse
+from . import run_benchmark, compare_results, SCALES
+
+parser = argparse.ArgumentParser(prog='python3 -m iss.benchmark',
+                                 description='Time and memory profile each stage of the pipeline on synthetic data.')
+parser.add_argument('--scale', nargs='+', default=['tiny'], choices=list(SCALES),
+                    help='Size of synthetic dataset(s) to run benchmark on.')
+parser.add_argument('--results', default=None,
+                    help='.jsonl file to append results to so they can be compared across commits.')
+parser.add_argument('--output_dir', default=None,
+                    help='Empty folder to save synthetic data and pipeline output in. '
+                         'If not given, a temporary folder is used. Only valid with a single scale.')
+parser.add_argument('--label', default=None, help='Description of this benchmark run.')
+parser.add_argument('--backend', default=None, choices=['jax', 'numpy'],
+                    help='Backend used for spot colors and omp. If not given, default in config file is used.')
+parser.add_argument('--no_trace_memory', action='store_true',
+                    help='Do not record peak memory of each stage with tracemalloc, which slows the pipeline down.')
+args = parser.parse_args()
+if args.output_dir is not None and len(args.scale) > 1:
+    parser.error('--output_dir can only be given with a single --scale.')
+
+config_overrides = None if args.backend is None else {'runtime': {'backend': args.backend}}
+for scale in args.scale:
+    result = run_benchmark(scale, args.results, args.output_dir, args.label, config_overrides,
+                           not args.no_trace_memory)
+    if args.results is not None:
+        print(compare_results(args.results, scale))
+        print(compare_results(args.results, scale, 'max_rss'))
+    else:
+        for stage, info in result['stages'].items():
+            print(f"{stage}: " + ', '.join([f"{key} = {value:.2f}" for key, value in info.items()
+                                              if value is not None]))
@@ -0,0 +1,255 @@
+import os
+import json
+import time
+import shutil
+import tempfile
+import tracemalloc
+import subprocess
+import numpy as np
+from typing import Optional, List, Callable
+from .. import setup
+from .._version import __version__
+from ..pipeline import extract_and_filter, find_spots, stitch, register_initial, register, reference_spots, \
+    call_reference_spots, call_spots_omp
+from ..pipeline.run import initialize_nb
+from .synthetic import make_dataset, SCALES
+try:
+    import resource
+except ImportError:
+    # resource module only exists on unix.
+    resource = None
+
+# Stages of the pipeline which are profiled, in the order they are run.
+STAGES = ['extract_and_filter', 'find_spots', 'stitch', 'register_initial', 'register', 'reference_spots',
+          'call_reference_spots', 'call_spots_omp']
+
+
+def get_git_commit() -> Optional[str]:
+    """
+    Gets the git commit of the iss code being benchmarked.
+
+    Returns:
+        Hash of current commit or `None` if code is not in a git repository.
+    """
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=os.path.dirname(os.path.realpath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+
+def get_max_rss() -> Optional[float]:
+    """
+    Gets the maximum resident set size of this process so far.
+
+    Returns:
+        Maximum resident set size in MB or `None` if not on unix.
+    """
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on mac but KB on linux.
+    return max_rss / 1024 ** 2 if os.uname().sysname == 'Darwin' else max_rss / 1024
+
+
+def profile_stage(func: Callable, trace_memory: bool = True) -> tuple:
+    """
+    Runs `func` and records how long it took and how much memory it used.
+
+    Args:
+        func: Function with no arguments to profile.
+        trace_memory: Whether to record the peak memory allocated by python and numpy with `tracemalloc`.
+            This makes `func` run slower.
+
+    Returns:
+        - Whatever `func` returns.
+        - `dict` containing
+            - `wall_time` - Time in seconds taken to run `func`.
+            - `cpu_time` - CPU time in seconds of this process (summed over all threads) while running `func`.
+            - `peak_memory` - Peak memory in MB allocated by python and numpy while running `func`.
+                `None` if `trace_memory == False`.
+            - `max_rss` - Maximum resident set size in MB of this process after running `func`.
+                This never decreases so only increases if `func` used more memory than all previous stages.
+    """
+    if trace_memory:
+        tracemalloc.start()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    try:
+        output = func()
+        wall_time = time.perf_counter() - wall_start
+        cpu_time = time.process_time() - cpu_start
+        peak_memory = tracemalloc.get_traced_memory()[1] / 1024 ** 2 if trace_memory else None
+    finally:
+        if trace_memory:
+            tracemalloc.stop()
+    return output, {'wall_time': wall_time, 'cpu_time': cpu_time, 'peak_memory': peak_memory,
+                    'max_rss': get_max_rss()}
+
+
+def benchmark_pipeline(config_file: str, trace_memory: bool = True) -> dict:
+    """
+    Runs every stage of the pipeline from scratch, recording the time and memory taken by each.
+
+    The stages are run through the same functions as `run_pipeline` but the stitched images are not saved
+    and duplicate spots are not removed from the omp files after `call_spots_omp`.
+
+    Args:
+        config_file: Path to config file. The notebook and tile directory given in it should not exist yet
+            so every stage is run in full.
+        trace_memory: Whether to record the peak memory allocated by python and numpy in each stage with
+            `tracemalloc`. This makes each stage run slower.
+
+    Returns:
+        `stages[stage]` is the `dict` returned by `profile_stage` for each stage in `STAGES`.
+    """
+    config = setup.get_config(config_file)
+    tile_dir = config['file_names']['tile_dir']
+    if os.path.isdir(tile_dir) and len(os.listdir(tile_dir)) > 0:
+        raise ValueError(f"tile_dir = {tile_dir} already contains files so extract_and_filter would not filter "
+                         f"them again. Delete these files first.")
+    nb_path = os.path.join(config['file_names']['output_dir'], config['file_names']['notebook_name'])
+    if os.path.isfile(nb_path) or os.path.isfile(nb_path + '.npz'):
+        raise ValueError(f"Notebook {nb_path} already exists. Delete it first so every stage is run.")
+    nb = initialize_nb(config_file)
+    config = nb.get_config()
+    backend = config['runtime']['backend']
+    stages = {}
+
+    def run_stage(name: str, func: Callable):
+        output, stages[name] = profile_stage(func, trace_memory)
+        return output
+
+    nbp, nbp_debug = run_stage('extract_and_filter',
+                               lambda: extract_and_filter(config['extract'], nb.file_names, nb.basic_info))
+    nb += nbp
+    nb += nbp_debug
+    nb += run_stage('find_spots', lambda: find_spots(config['find_spots'], nb.file_names, nb.basic_info,
+                                                     nb.extract.auto_thresh))
+    nb += run_stage('stitch', lambda: stitch(config['stitch'], nb.basic_info, nb.find_spots.spot_details))
+    nb += run_stage('register_initial', lambda: register_initial(config['register_initial'], nb.basic_info,
+                                                                 nb.find_spots.spot_details))
+    nbp, nbp_debug = run_stage('register', lambda: register(config['register'], nb.basic_info,
+                                                            nb.find_spots.spot_details,
+                                                            nb.register_initial_debug.shift))
+    nb += nbp
+    nb += nbp_debug
+    nbp_ref_spots = run_stage('reference_spots', lambda: reference_spots(nb.file_names, nb.basic_info,
+                                                                         nb.find_spots.spot_details,
+                                                                         nb.stitch.tile_origin,
+                                                                         nb.register.transform, backend))
+    nbp, nbp_ref_spots = run_stage('call_reference_spots',
+                                   lambda: call_reference_spots(config['call_spots'], nb.file_names, nb.basic_info,
+                                                                nbp_ref_spots, nb.extract.hist_values,
+                                                                nb.extract.hist_counts, nb.register.transform))
+    nb += nbp_ref_spots
+    nb += nbp
+    nb += run_stage('call_spots_omp', lambda: call_spots_omp(config['omp'], nb.file_names, nb.basic_info,
+                                                             nb.call_spots, nb.stitch.tile_origin,
+                                                             nb.register.transform, backend))
+    return stages
+
+
+def run_benchmark(scale: str, results_file: Optional[str] = None, output_dir: Optional[str] = None,
+                  label: Optional[str] = None, config_overrides: Optional[dict] = None,
+                  trace_memory: bool = True) -> dict:
+    """
+    Makes the synthetic dataset for `scale` and runs `benchmark_pipeline` on it.
+
+    Args:
+        scale: Key of `SCALES` indicating size of synthetic dataset.
+        results_file: Path to `.jsonl` file. If given, the result is appended to it as a single line
+            so results of different commits can be compared with `compare_results`.
+        output_dir: Folder in which to save the synthetic dataset and pipeline output. It should be empty.
+            If `None`, a temporary folder is used which is deleted afterwards.
+        label: Description of this benchmark run e.g. the change being tested.
+        config_overrides: `config_overrides[section][key]` is added to the config file
+            e.g. `{'runtime': {'backend': 'numpy'}}`.
+        trace_memory: Whether to record the peak memory allocated by python and numpy in each stage with
+            `tracemalloc`. This makes each stage run slower.
+
+    Returns:
+        Benchmark result containing `time` it was run, `commit`, `version`, `label`, `scale`, the `dataset` settings,
+            `config_overrides`, the `make_dataset` time and the `stages` `dict` returned by `benchmark_pipeline`.
+    """
+    if scale not in SCALES:
+        raise ValueError(f"scale = {scale} but should be one of {list(SCALES)}.")
+    result = {'time': time.strftime('%Y-%m-%d %H:%M:%S'), 'commit': get_git_commit(), 'version': __version__,
+              'label': label, 'scale': scale, 'dataset': SCALES[scale], 'config_overrides': config_overrides}
+    temp_dir = None
+    if output_dir is None:
+        temp_dir = tempfile.mkdtemp(prefix=f'iss_benchmark_{scale}_')
+        output_dir = temp_dir
+    try:
+        dataset_start = time.perf_counter()
+        config_file = make_dataset(output_dir, **SCALES[scale], config_overrides=config_overrides)
+        result['make_dataset_time'] = time.perf_counter() - dataset_start
+        result['stages'] = benchmark_pipeline(config_file, trace_memory)
+    finally:
+        if temp_dir is not None:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+    if results_file is not None:
+        with open(results_file, 'a') as f:
+            f.write(json.dumps(result, default=lambda x: np.asarray(x).tolist()) + '\n')
+    return result
+
+
+def load_results(results_file: str, scale: Optional[str] = None) -> List[dict]:
+    """
+    Loads the benchmark results saved by `run_benchmark`.
+
+    Args:
+        results_file: Path to `.jsonl` file containing results.
+        scale: If given, only results at this scale are returned.
+
+    Returns:
+        List of results in the order they were saved.
+    """
+    with open(results_file, 'r') as f:
+        results = [json.loads(line) for line in f if line.strip()]
+    if scale is not None:
+        results = [result for result in results if result['scale'] == scale]
+    return results
+
+
+def compare_results(results_file: str, scale: str, metric: str = 'wall_time', n_results: int = 5) -> str:
+    """
+    Makes a table of `metric` for each stage for the last `n_results` benchmarks at `scale`, with the
+    change relative to the first of them.
+
+    Args:
+        results_file: Path to `.jsonl` file containing results.
+        scale: Scale of results to compare.
+        metric: One of `wall_time`, `cpu_time`, `peak_memory` or `max_rss`.
+        n_results: Number of most recent results to compare.
+
+    Returns:
+        Table with a row for each stage and a column for each result.
+    """
+    results = load_results(results_file, scale)[-n_results:]
+    if len(results) == 0:
+        raise ValueError(f"No results at scale = {scale} in {results_file}.")
+    names = [(result['commit'] or 'unknown')[:8] + (f" ({result['label']})" if result['label'] else '')
+             for result in results]
+    col_width = max([20] + [len(name) + 2 for name in names])
+    lines = [f"{scale} {metric}".ljust(22) + ''.join([name.rjust(col_width) for name in names])]
+    for stage in STAGES + ['total']:
+        values = []
+        for result in results:
+            if stage == 'total':
+                stage_values = [result['stages'][s][metric] for s in result['stages']]
+                value = None if None in stage_values else \
+                    (np.max(stage_values) if metric in ['peak_memory', 'max_rss'] else np.sum(stage_values))
+            else:
+                value = result['stages'][stage][metric] if stage in result['stages'] else None
+            values.append(value)
+        line = stage.ljust(22)
+        for i, value in enumerate(values):
+            if value is None:
+                line += 'N/A'.rjust(col_width)
+            elif i == 0 or values[0] is None:
+                line += f"{value:.2f}".rjust(col_width)
+            else:
+                line += f"{value:.2f} ({100 * (value / values[0] - 1):+.0f}%)".rjust(col_width)
+        lines.append(line)
+    return '\n'.join(lines)
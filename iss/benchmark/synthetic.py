@@ -0,0 +1,272 @@
+import os
+import json
+import numpy as np
+import dask
+import dask.array
+from scipy.ndimage import gaussian_filter
+from typing import Optional, Tuple, List
+from ..setup.tile_details import get_tilepos
+
+# Settings of synthetic dataset at each benchmark scale.
+# n_spots is the number of spots per tile and nz is the number of z-planes in the raw data.
+SCALES = {
+    'tiny': {'n_tiles_yx': (1, 2), 'tile_sz': 256, 'nz': 6, 'n_rounds': 3, 'n_channels': 4, 'n_genes': 6,
+             'n_spots': 400},
+    'small': {'n_tiles_yx': (2, 2), 'tile_sz': 512, 'nz': 10, 'n_rounds': 5, 'n_channels': 5, 'n_genes': 15,
+              'n_spots': 1600},
+    'medium': {'n_tiles_yx': (2, 3), 'tile_sz': 1024, 'nz': 16, 'n_rounds': 7, 'n_channels': 7, 'n_genes': 40,
+               'n_spots': 6000},
+    'large': {'n_tiles_yx': (3, 3), 'tile_sz': 2048, 'nz': 30, 'n_rounds': 7, 'n_channels': 8, 'n_genes': 80,
+              'n_spots': 24000}
+}
+
+
+
+def get_xy_pos(n_tiles_yx: Tuple[int, int], tile_sz: int, overlap: float) -> np.ndarray:
+    """
+    Gets the xy stage position of each tile in the order they would be saved in an nd2 file,
+    i.e. a snake pattern, so that `setup.get_tilepos` recovers the tile arrangement.
+
+    Args:
+        n_tiles_yx: Number of tiles along y and x.
+        tile_sz: yx dimension of each tile in pixels.
+        overlap: Fraction of `tile_sz` which neighbouring tiles overlap by.
+
+    Returns:
+        `float [n_tiles x 2]`. xy position of each tile in pixels.
+    """
+    step = (1 - overlap) * tile_sz
+    xy_pos = []
+    for y in range(n_tiles_yx[0]):
+        x_order = np.arange(n_tiles_yx[1])
+        if y % 2 == 1:
+            x_order = np.flip(x_order)
+        for x in x_order:
+            xy_pos.append([x * step, y * step])
+    return np.array(xy_pos, dtype=float)
+
+
+def get_gene_codes(n_genes: int, n_rounds: int, use_dyes: List[int], rng: np.random.Generator) -> np.ndarray:
+    """
+    Gets a unique random code for each gene. Consecutive genes differ in as many rounds as possible as codes are
+    chosen by taking random codes until `n_genes` unique ones are found.
+
+    Args:
+        n_genes: Number of genes.
+        n_rounds: Number of imaging rounds.
+        use_dyes: Dyes which can be used in codes.
+        rng: Random number generator.
+
+    Returns:
+        `int [n_genes x n_rounds]`. `gene_codes[g, r]` is the dye of gene `g` in round `r`.
+    """
+    if n_genes > len(use_dyes) ** n_rounds:
+        raise ValueError(f"Can only have {len(use_dyes) ** n_rounds} unique codes with {n_rounds} rounds and "
+                         f"{len(use_dyes)} dyes but n_genes = {n_genes}.")
+    gene_codes = np.zeros((0, n_rounds), dtype=int)
+    while gene_codes.shape[0] < n_genes:
+        gene_codes = np.unique(np.append(gene_codes, rng.choice(use_dyes, (n_genes, n_rounds)), axis=0), axis=0)
+    return rng.permutation(gene_codes)[:n_genes]
+
+
+def make_tile(spot_yxz: np.ndarray, spot_amplitude: np.ndarray, tile_origin_yx: np.ndarray, tile_sz: int, nz: int,
+              psf_sigma: Tuple[float, float, float], background: float, noise: float, seed: int) -> np.ndarray:
+    """
+    Makes the raw image of a single tile/channel by convolving the spots inside it with a gaussian psf and adding
+    camera background and noise.
+
+    Args:
+        spot_yxz: `float [n_spots x 3]`. Global yxz coordinate of each spot.
+        spot_amplitude: `float [n_spots]`. Total intensity of each spot.
+        tile_origin_yx: `float [2]`. Global yx coordinate of pixel `[0, 0]` of tile.
+        tile_sz: yx dimension of tile in pixels.
+        nz: Number of z-planes.
+        psf_sigma: yxz standard deviation of gaussian psf in pixels.
+        background: Mean pixel value with no spots.
+        noise: Standard deviation of noise added to each pixel.
+        seed: Seed of the noise.
+
+    Returns:
+        `uint16 [tile_sz x tile_sz x nz]`. Raw image of tile.
+    """
+    local_yxz = np.round(spot_yxz - np.append(tile_origin_yx, 0)).astype(int)
+    in_tile = np.all(np.logical_and(local_yxz >= 0, local_yxz < [tile_sz, tile_sz, nz]), axis=1)
+    image = np.zeros((tile_sz, tile_sz, nz), dtype=np.float32)
+    np.add.at(image, tuple(local_yxz[in_tile].transpose()), spot_amplitude[in_tile])
+    image = gaussian_filter(image, psf_sigma, mode='constant')
+    rng = np.random.default_rng(seed)
+    image += rng.normal(background, noise, image.shape).astype(np.float32)
+    return np.clip(np.round(image), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+
+def make_dapi_tile(cell_yx: np.ndarray, tile_origin_yx: np.ndarray, tile_sz: int, nz: int, cell_sigma: float,
+                   background: float, noise: float, seed: int) -> np.ndarray:
+    """
+    Makes the raw DAPI image of a single tile, with a large smooth blob at each cell centre.
+
+    Args:
+        cell_yx: `float [n_cells x 2]`. Global yx coordinate of each cell centre.
+        tile_origin_yx: `float [2]`. Global yx coordinate of pixel `[0, 0]` of tile.
+        tile_sz: yx dimension of tile in pixels.
+        nz: Number of z-planes.
+        cell_sigma: Standard deviation of each cell in yx pixels.
+        background: Mean pixel value with no cells.
+        noise: Standard deviation of noise added to each pixel.
+        seed: Seed of the noise.
+
+    Returns:
+        `uint16 [tile_sz x tile_sz x nz]`. Raw DAPI image of tile.
+    """
+    local_yx = np.round(cell_yx - tile_origin_yx).astype(int)
+    in_tile = np.all(np.logical_and(local_yx >= 0, local_yx < tile_sz), axis=1)
+    image = np.zeros((tile_sz, tile_sz), dtype=np.float32)
+    image[tuple(local_yx[in_tile].transpose())] = 1
+    image = gaussian_filter(image, cell_sigma, mode='constant')
+    image = image / max(float(image.max()), 1e-6) * 20 * background
+    image = np.repeat(image[:, :, np.newaxis], nz, axis=2)
+    rng = np.random.default_rng(seed)
+    image += rng.normal(background, noise, image.shape).astype(np.float32)
+    return np.clip(np.round(image), 0, np.iinfo(np.uint16).max).astype(np.uint16)
+
+
+def make_dataset(output_dir: str, n_tiles_yx: Tuple[int, int] = (2, 2), tile_sz: int = 256, nz: int = 10,
+                 n_rounds: int = 5, n_channels: int = 5, n_genes: int = 15, n_spots: int = 1200,
+                 is_3d: bool = True, overlap: float = 0.15, max_round_shift: Tuple[int, int] = (10, 10),
+                 psf_sigma: Tuple[float, float, float] = (1.5, 1.5, 1.0), bleed: float = 0.1,
+                 background: float = 200, noise: float = 10, seed: int = 0,
+                 config_overrides: Optional[dict] = None) -> str:
+    """
+    Makes a synthetic dataset of random spots convolved with a psf and saves it as `.npy` raw data, with
+    the corresponding metadata json file, code book and config file, so the full pipeline can be run on it.
+
+    Each spot is assigned a random gene and appears in every round in the channel given by the gene's code,
+    with a fraction `bleed` of its intensity also in the next channel. All spots appear in the anchor channel of the
+    anchor round. Each imaging round is shifted by a random amount relative to the anchor round so
+    registration has something to find.
+
+    Channel 0 is the DAPI channel, channel 1 is the anchor channel and channels `1` to `n_channels-1` are used for
+    imaging with dye `i` appearing in channel `i`.
+
+    The true `spot_yxz` (raw z-plane), `spot_gene`, `spot_amplitude`, `gene_codes`, `round_shift` and
+    `tile_origin_yx` (indexed by nd2 tile index) are saved in `output_dir/ground_truth.npz`.
+
+    Args:
+        output_dir: Folder where raw data, code book and config file are saved.
+            Pipeline output is saved in `output_dir/output` and filtered tiles in `output_dir/tiles`.
+        n_tiles_yx: Number of tiles along y and x.
+        tile_sz: yx dimension of each tile in pixels.
+        nz: Number of z-planes in raw data.
+        n_rounds: Number of imaging rounds.
+        n_channels: Number of channels including the DAPI channel.
+        n_genes: Number of genes in code book.
+        n_spots: Average number of spots in each tile.
+        is_3d: Whether to run the 3D or 2D pipeline.
+        overlap: Fraction of `tile_sz` which neighbouring tiles overlap by.
+        max_round_shift: Maximum yx shift in pixels of an imaging round relative to the anchor round.
+        psf_sigma: yxz standard deviation of gaussian psf in pixels.
+        bleed: Fraction of intensity of each dye which also appears in the next channel.
+        background: Mean raw pixel value with no spots.
+        noise: Standard deviation of noise added to each raw pixel.
+        seed: Seed used for everything random so the same dataset is made each time.
+        config_overrides: `config_overrides[section][key]` is added to the config file
+            e.g. `{'omp': {'max_genes': 5}}`.
+
+    Returns:
+        Path to config file which can be passed to `run_pipeline`.
+    """
+    rng = np.random.default_rng(seed)
+    dapi_channel = 0
+    anchor_channel = 1
+    use_channels = list(np.arange(1, n_channels))
+    n_tiles = n_tiles_yx[0] * n_tiles_yx[1]
+    if n_genes > len(use_channels) ** n_rounds:
+        raise ValueError(f"n_genes = {n_genes} is more than the number of unique codes possible.")
+
+    # Arrange tiles
+    xy_pos = get_xy_pos(n_tiles_yx, tile_sz, overlap)
+    tilepos_yx_nd2 = get_tilepos(xy_pos, tile_sz)[0]
+    step = (1 - overlap) * tile_sz
+    tile_origin_yx = tilepos_yx_nd2 * step
+    image_sz = np.ceil(np.max(tile_origin_yx, axis=0) + tile_sz).astype(int)
+
+    # Spots in global coordinates, in anchor round. Don't put them in first z-plane as that is ignored by default.
+    n_spots_all = int(n_spots * np.prod(image_sz) / tile_sz ** 2)
+    spot_yxz = rng.uniform([0, 0, 1], list(image_sz) + [nz - 1], (n_spots_all, 3))
+    spot_gene = rng.integers(0, n_genes, n_spots_all)
+    spot_amplitude = rng.lognormal(np.log(1000 * noise), 0.5, n_spots_all)
+    gene_codes = get_gene_codes(n_genes, n_rounds, use_channels, rng)
+    round_shift = np.zeros((n_rounds, 3))
+    round_shift[:, :2] = rng.integers(-np.array(max_round_shift), np.array(max_round_shift) + 1, (n_rounds, 2))
+    n_cells = max(1, int(np.prod(image_sz) / 50 ** 2))
+    cell_yx = rng.uniform([0, 0], image_sz, (n_cells, 2))
+
+    # Save raw data for each round as a npy stack with one chunk for each tile.
+    round_names = [f'round{r}' for r in range(n_rounds)]
+    tile_shape = (tile_sz, tile_sz, nz)
+    for r in range(n_rounds + 1):
+        channel_tiles = []
+        for t in range(n_tiles):
+            tile_seed = seed + 1 + (r * n_tiles + t) * n_channels
+            channels = []
+            for c in range(n_channels):
+                if r == n_rounds:
+                    # anchor round
+                    if c == dapi_channel:
+                        delayed_tile = dask.delayed(make_dapi_tile)(cell_yx, tile_origin_yx[t], tile_sz, nz, 10,
+                                                                    background, noise, tile_seed + c)
+                    elif c == anchor_channel:
+                        delayed_tile = dask.delayed(make_tile)(spot_yxz, spot_amplitude, tile_origin_yx[t], tile_sz,
+                                                               nz, psf_sigma, background, noise, tile_seed + c)
+                    else:
+                        delayed_tile = dask.delayed(make_tile)(spot_yxz[:0], spot_amplitude[:0], tile_origin_yx[t],
+                                                               tile_sz, nz, psf_sigma, background, noise,
+                                                               tile_seed + c)
+                else:
+                    spot_dye = gene_codes[spot_gene, r]
+                    amplitude = spot_amplitude * (spot_dye == c) + bleed * spot_amplitude * (spot_dye == c - 1)
+                    delayed_tile = dask.delayed(make_tile)(spot_yxz + round_shift[r], amplitude, tile_origin_yx[t],
+                                                           tile_sz, nz, psf_sigma, background, noise,
+                                                           tile_seed + c)
+                channels.append(dask.array.from_delayed(delayed_tile, tile_shape, dtype=np.uint16))
+            channel_tiles.append(dask.array.stack(channels))
+        round_array = dask.array.stack(channel_tiles).rechunk((1, n_channels) + tile_shape)
+        round_name = round_names[r] if r < n_rounds else 'anchor'
+        dask.array.to_npy_stack(os.path.join(output_dir, round_name), round_array, axis=0)
+
+    # Save metadata, code book and config file
+    metadata = {'xy_pos': xy_pos.tolist(), 'pixel_microns': 0.26, 'pixel_microns_z': 0.9,
+                'sizes': {'t': n_tiles, 'c': n_channels, 'y': tile_sz, 'x': tile_sz, 'z': nz}}
+    with open(os.path.join(output_dir, 'metadata.json'), 'w') as f:
+        json.dump(metadata, f)
+    with open(os.path.join(output_dir, 'codebook.txt'), 'w') as f:
+        for g in range(n_genes):
+            f.write(f"gene_{g} {''.join([str(d) for d in gene_codes[g]])}\n")
+    np.savez(os.path.join(output_dir, 'ground_truth.npz'), spot_yxz=spot_yxz, spot_gene=spot_gene,
+             spot_amplitude=spot_amplitude, gene_codes=gene_codes, round_shift=round_shift,
+             tile_origin_yx=tile_origin_yx)
+
+    config = {'file_names': {'input_dir': output_dir, 'output_dir': os.path.join(output_dir, 'output'),
+                             'tile_dir': os.path.join(output_dir, 'tiles'), 'round': ', '.join(round_names),
+                             'anchor': 'anchor', 'raw_extension': '.npy', 'raw_metadata': 'metadata',
+                             'code_book': os.path.join(output_dir, 'codebook.txt')},
+              'basic_info': {'is_3d': is_3d, 'anchor_channel': anchor_channel, 'dapi_channel': dapi_channel,
+                             'use_channels': ', '.join([str(c) for c in use_channels])},
+              # filter DAPI so stitched DAPI image is made from filtered tiles, not the raw nd2 file.
+              'extract': {'wait_time': 10, 'r_dapi': 10},
+              # no background in synthetic data so annulus around spot is not negative on average.
+              'find_spots': {'auto_isolation_thresh_multiplier': 0},
+              'stitch': {'expected_overlap': overlap}}
+    if config_overrides is not None:
+        for section in config_overrides:
+            config.setdefault(section, {}).update(config_overrides[section])
+    for folder in [config['file_names']['output_dir'], config['file_names']['tile_dir']]:
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+    config_file = os.path.join(output_dir, 'settings.ini')
+    with open(config_file, 'w') as f:
+        for section in config:
+            f.write(f"[{section}]\n")
+            for key, value in config[section].items():
+                f.write(f"{key} = {value}\n")
+            f.write("\n")
+    return config_file
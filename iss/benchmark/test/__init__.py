@@ -0,0 +1 @@
+from .test_synthetic import TestSynthetic
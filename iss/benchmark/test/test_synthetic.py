@@ -0,0 +1,45 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from ..synthetic import make_dataset
+from ...pipeline.run import initialize_nb
+from ...utils import raw
+
+
+class TestSynthetic(unittest.TestCase):
+    """
+    Check that the synthetic dataset can be read in by the pipeline and that spots are where the ground truth
+    says they are.
+    """
+    def test_make_dataset(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            n_tiles_yx = (2, 2)
+            tile_sz = 64
+            overlap = 0.15
+            config_file = make_dataset(output_dir, n_tiles_yx=n_tiles_yx, tile_sz=tile_sz, nz=4, n_rounds=2,
+                                       n_channels=3, n_genes=3, n_spots=10, overlap=overlap)
+            nb = initialize_nb(config_file)
+            self.assertEqual(nb.basic_info.n_tiles, np.prod(n_tiles_yx))
+            self.assertEqual(nb.basic_info.n_rounds, 2)
+            self.assertEqual(nb.basic_info.tile_sz, tile_sz)
+            self.assertEqual(nb.basic_info.anchor_round, 2)
+            ground_truth = np.load(os.path.join(output_dir, 'ground_truth.npz'))
+            self.assertTrue(np.allclose(nb.basic_info.tilepos_yx_nd2 * (1 - overlap) * tile_sz,
+                                        ground_truth['tile_origin_yx']))
+
+            # brightest pixel in anchor channel of each tile should be close to a spot.
+            # tile t here is the npy index which is not the same as the nd2 index used in ground_truth.
+            # first z-plane is ignored by default.
+            self.assertEqual(nb.basic_info.use_z, [1, 2, 3])
+            for t in nb.basic_info.use_tiles:
+                image = np.asarray(raw.load(nb.file_names, nb.basic_info, r=nb.basic_info.anchor_round, t=t,
+                                            c=nb.basic_info.anchor_channel))
+                self.assertEqual(image.shape, (tile_sz, tile_sz, 3))
+                max_yxz = np.array(np.unravel_index(np.argmax(image), image.shape))
+                global_yxz = max_yxz + np.append(nb.basic_info.tilepos_yx[t] * (1 - overlap) * tile_sz, 1)
+                self.assertTrue(np.linalg.norm(ground_truth['spot_yxz'] - global_yxz, axis=1).min() < 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
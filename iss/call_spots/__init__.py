@@ -1,3 +1,5 @@
 from .base import color_normalisation, get_bled_codes, get_spot_intensity, dot_product_score, fit_background, \
-    get_gene_efficiency, fit_background_jax_vectorised, get_spot_intensity_jax, get_non_duplicate, omp_spot_score
+    get_gene_efficiency, fit_background_jax_vectorised, get_spot_intensity_jax, get_non_duplicate, omp_spot_score, \
+    get_owned_pixels
 from .bleed_matrix import get_bleed_matrix, get_dye_channel_intensity_guess
+from .results_index import ResultsIndex, get_results_index
@@ -1,5 +1,6 @@
 import warnings
 from scipy.spatial import KDTree
+from scipy.ndimage import maximum_filter
 import numpy as np
 from .. import utils
 from typing import Union, List, Optional, Tuple
@@ -48,6 +49,39 @@ def get_non_duplicate(tile_origin: np.ndarray, use_tiles: List, tile_centre: np.
     return not_duplicate
 
 
+def get_owned_pixels(tile_origin: np.ndarray, use_tiles: List, tile_centre: np.ndarray, tile_sz: int, t: int,
+                     pad: int = 0) -> np.ndarray:
+    """
+    Finds the yx pixels of tile `t` which `get_non_duplicate` keeps, i.e. those closer to the centre of tile `t`
+    than to the centre of any other tile, as well as all pixels within `pad` pixels of these in y and x.
+
+    Spots found on tile `t` outside this region are removed as duplicates, so only pixels in the region are
+    needed, with `pad` large enough to cover the neighbourhood of each spot used to detect it.
+
+    Args:
+        tile_origin: `float [n_tiles x 3]`.
+            `tile_origin[t,:]` is the bottom left yxz coordinate of tile `t`.
+        use_tiles: ```int [n_use_tiles]```.
+            Tiles used in the experiment.
+        tile_centre: ```float [3]```
+            ```tile_centre[:2]``` are yx coordinates in ```yx_pixels``` of the centre of a tile.
+        tile_sz: yx dimension of tiles in ```yx_pixels```.
+        t: Tile of interest.
+        pad: Number of pixels by which region owned by tile `t` is expanded in y and x.
+
+    Returns:
+        ```bool [tile_sz x tile_sz]```.
+            Whether each yx pixel of tile `t` is within `pad` pixels of a pixel owned by tile `t`.
+    """
+    pixel_yxz = np.zeros((tile_sz ** 2, 3), dtype=int)
+    pixel_yxz[:, :2] = np.array(np.meshgrid(np.arange(tile_sz), np.arange(tile_sz), indexing='ij')).reshape(2, -1).T
+    owned = get_non_duplicate(tile_origin, use_tiles, tile_centre, pixel_yxz,
+                              np.full(tile_sz ** 2, t)).reshape(tile_sz, tile_sz)
+    if pad > 0:
+        owned = maximum_filter(owned, size=2 * pad + 1, mode='constant', cval=False)
+    return owned
+
+
 def color_normalisation(hist_values: np.ndarray, hist_counts: np.ndarray,
                         thresh_intensities: Union[float, List[float], np.ndarray],
                         thresh_probs: Union[float, List[float], np.ndarray], method: str) -> np.ndarray:
@@ -518,17 +552,23 @@ def omp_spot_score(nbp: NotebookPage, score_multiplier: float,
     return score
 
 
-def quality_threshold(nb: Notebook, method='omp') -> np.ndarray:
+def get_quality_thresholds(nb: Notebook, method: str = 'omp') -> Tuple[float, float, Optional[float]]:
     """
+    Gets the thresholds used to decide which spots are good enough to keep. These are taken from the
+    `thresholds` page if the notebook has it, otherwise from the `thresholds` section of the config file.
 
     Args:
-        nb:
+        nb: Notebook containing at least the `call_spots` page.
+        method: `'omp'` or `'anchor'` (same as `'ref'`), the gene calling method the thresholds are for.
 
     Returns:
-
+        - `score_thresh` - Spots must have score above this.
+        - `intensity_thresh` - Spots must have intensity above this.
+        - `score_multiplier` - `score_multiplier` used in `omp_spot_score`. `None` if `method` is not `'omp'`.
     """
     if method.lower() != 'omp' and method.lower() != 'ref' and method.lower() != 'anchor':
         raise ValueError(f"method must be 'omp' or 'anchor but {method} given.")
+    score_multiplier = None
     if nb.has_page('thresholds'):
         intensity_thresh = nb.thresholds.intensity
         if method.lower() == 'omp':
@@ -546,6 +586,26 @@ def quality_threshold(nb: Notebook, method='omp') -> np.ndarray:
             score_multiplier = config['score_omp_multiplier']
         else:
             score_thresh = config['score_ref']
+    return score_thresh, intensity_thresh, score_multiplier
+
+
+def quality_threshold(nb: Notebook, method='omp', score_thresh: Optional[float] = None) -> np.ndarray:
+    """
+    Indicates which spots have score and intensity above the thresholds given by `get_quality_thresholds`.
+
+    Args:
+        nb: Notebook containing at least the `call_spots` page and `omp` page if `method` is `'omp'`,
+            or `ref_spots` page otherwise.
+        method: `'omp'` or `'anchor'` (same as `'ref'`), the gene calling method to get spots of.
+        score_thresh: If given, spots must have score above this instead of the score threshold given by
+            `get_quality_thresholds`.
+
+    Returns:
+        `bool [n_spots]`. Whether each spot passes the thresholds.
+    """
+    score_thresh_default, intensity_thresh, score_multiplier = get_quality_thresholds(nb, method)
+    if score_thresh is None:
+        score_thresh = score_thresh_default
     if method.lower() == 'omp':
         intensity = nb.omp.intensity
         score = omp_spot_score(nb.omp, score_multiplier)
@@ -0,0 +1,264 @@
+import os
+import numpy as np
+from typing import Optional, Union, List
+from .base import get_quality_thresholds, omp_spot_score
+from ..setup.notebook import Notebook
+
+# Average number of spots in each cell of the spatial grid.
+SPOTS_PER_CELL = 16
+
+
+class ResultsIndex:
+    # Arrays saved to the results_index file for each method.
+    _saved_vars = ['global_yxz', 'gene_no', 'score', 'intensity', 'gene_order', 'gene_start', 'grid_origin',
+                   'grid_cell_size', 'grid_shape', 'spatial_order', 'cell_start', 'page_time', 'score_multiplier']
+
+    def __init__(self, global_yxz: np.ndarray, gene_no: np.ndarray, score: np.ndarray, intensity: np.ndarray,
+                 n_genes: int, cell_size: Optional[float] = None):
+        """
+        Index of the spots found with one gene calling method, so the spots of particular genes, within a
+        region or passing quality thresholds can be found in time proportional to the number of spots returned.
+
+        Spots are grouped by gene, best score first, and placed on a uniform grid in yx.
+
+        Args:
+            global_yxz: `float [n_spots x 3]`.
+                Global yxz coordinate of each spot.
+            gene_no: `int [n_spots]`.
+                Gene each spot was assigned to.
+            score: `float [n_spots]`.
+                Score of each spot.
+            intensity: `float [n_spots]`.
+                Intensity of each spot.
+            n_genes: Number of genes in the code book.
+            cell_size: Size of each cell of the spatial grid in yx pixels.
+                If `None`, chosen so there are on average `SPOTS_PER_CELL` spots in each cell.
+        """
+        self.global_yxz = np.asarray(global_yxz, dtype=float).reshape(-1, 3)
+        self.gene_no = np.asarray(gene_no, dtype=int)
+        self.score = np.asarray(score, dtype=float)
+        self.intensity = np.asarray(intensity, dtype=float)
+        n_spots = self.gene_no.size
+
+        # gene_order[gene_start[g]:gene_start[g+1]] are the spots of gene g, best score first.
+        self.gene_order = np.lexsort((-self.score, self.gene_no))
+        self.gene_start = np.searchsorted(self.gene_no[self.gene_order], np.arange(n_genes + 1))
+
+        if n_spots > 0:
+            self.grid_origin = np.floor(self.global_yxz[:, :2].min(axis=0))
+            yx_size = np.ceil(self.global_yxz[:, :2].max(axis=0)) - self.grid_origin
+        else:
+            self.grid_origin = np.zeros(2)
+            yx_size = np.zeros(2)
+        if cell_size is None:
+            cell_size = max(1., np.sqrt(np.prod(np.clip(yx_size, 1, None)) * SPOTS_PER_CELL / max(n_spots, 1)))
+        self.grid_cell_size = float(cell_size)
+        self.grid_shape = np.floor(yx_size / self.grid_cell_size).astype(int) + 1
+        # spatial_order[cell_start[i]:cell_start[i+1]] are the spots in grid cell i (raveled yx index).
+        spot_cell = np.ravel_multi_index(tuple(self._get_grid_yx(self.global_yxz[:, :2]).T), self.grid_shape)
+        self.spatial_order = np.argsort(spot_cell, kind='stable')
+        self.cell_start = np.searchsorted(spot_cell[self.spatial_order], np.arange(np.prod(self.grid_shape) + 1))
+
+        # Notebook information used to check if index is out of date.
+        self.page_time = np.nan
+        self.score_multiplier = np.nan
+        # Default thresholds used when query has quality=True.
+        self.score_thresh = None
+        self.intensity_thresh = None
+
+    @property
+    def n_spots(self) -> int:
+        return self.gene_no.size
+
+    @property
+    def n_genes(self) -> int:
+        return self.gene_start.size - 1
+
+    def _get_grid_yx(self, yx: np.ndarray) -> np.ndarray:
+        """
+        Returns yx grid cell containing each coordinate in `yx`, coordinates outside the grid are put in the
+        nearest cell.
+        """
+        grid_yx = np.floor((np.asarray(yx) - self.grid_origin) / self.grid_cell_size).astype(int)
+        return np.clip(grid_yx, 0, self.grid_shape - 1)
+
+    def _get_spots_in_cells(self, yx_min: np.ndarray, yx_max: np.ndarray) -> np.ndarray:
+        """
+        Returns all spots in grid cells overlapping the yx box from `yx_min` to `yx_max`.
+        """
+        grid_end = self.grid_origin + self.grid_shape * self.grid_cell_size
+        if self.n_spots == 0 or (yx_max < self.grid_origin).any() or (yx_min >= grid_end).any():
+            return np.zeros(0, dtype=int)
+        cell_min = self._get_grid_yx(np.maximum(yx_min, self.grid_origin))
+        cell_max = self._get_grid_yx(np.minimum(yx_max, grid_end))
+        # Cells in same row of grid are consecutive in spatial_order.
+        row_start = np.ravel_multi_index((np.arange(cell_min[0], cell_max[0] + 1), cell_min[1]), self.grid_shape)
+        row_end = row_start + cell_max[1] - cell_min[1] + 1
+        return np.concatenate([self.spatial_order[self.cell_start[i]:self.cell_start[j]]
+                               for i, j in zip(row_start, row_end)])
+
+    def _get_spots_of_genes(self, genes: np.ndarray, score_thresh: Optional[float] = None) -> np.ndarray:
+        """
+        Returns all spots of `genes` with score above `score_thresh`.
+        """
+        spots = []
+        for g in genes:
+            gene_spots = self.gene_order[self.gene_start[g]:self.gene_start[g + 1]]
+            if score_thresh is not None:
+                # scores of each gene are in descending order.
+                gene_spots = gene_spots[:np.searchsorted(-self.score[gene_spots], -score_thresh, side='left')]
+            spots.append(gene_spots)
+        return np.concatenate(spots) if len(spots) > 0 else np.zeros(0, dtype=int)
+
+    def query(self, genes: Optional[Union[int, List, np.ndarray]] = None, yxz_min: Optional[List] = None,
+              yxz_max: Optional[List] = None, centre: Optional[List] = None, radius: Optional[float] = None,
+              score_thresh: Optional[float] = None, score_max: Optional[float] = None,
+              intensity_thresh: Optional[float] = None, quality: bool = False) -> np.ndarray:
+        """
+        Finds spots which satisfy all the conditions given.
+
+        Args:
+            genes: Only spots assigned to these genes are returned.
+            yxz_min: `float [3]`. Only spots with global yxz coordinate at or above this are returned.
+                `None` in place of a value means no lower limit in that dimension.
+            yxz_max: `float [3]`. Only spots with global yxz coordinate at or below this are returned.
+                `None` in place of a value means no upper limit in that dimension.
+            centre: `float [3]`. Only spots within `radius` of this global yxz coordinate are returned.
+                Distances are computed from yxz coordinates in pixels, so z pixels count the same as yx pixels.
+            radius: Distance from `centre` that spots must be within.
+            score_thresh: Only spots with score above this are returned.
+            score_max: Only spots with score at or below this are returned.
+            intensity_thresh: Only spots with intensity above this are returned.
+            quality: If `True`, `score_thresh` and `intensity_thresh` not given are set to the thresholds
+                that `call_spots.quality_threshold` uses.
+
+        Returns:
+            `int [n_found]`. Indices of spots found in ascending order.
+        """
+        if quality:
+            if score_thresh is None:
+                score_thresh = self.score_thresh
+            if intensity_thresh is None:
+                intensity_thresh = self.intensity_thresh
+        if (centre is None) != (radius is None):
+            raise ValueError('Both centre and radius must be given for a radius query.')
+        box_min = np.full(3, -np.inf)
+        box_max = np.full(3, np.inf)
+        if yxz_min is not None:
+            box_min = np.array([-np.inf if val is None else val for val in yxz_min], dtype=float)
+        if yxz_max is not None:
+            box_max = np.array([np.inf if val is None else val for val in yxz_max], dtype=float)
+        if centre is not None:
+            centre = np.asarray(centre, dtype=float)
+            box_min = np.maximum(box_min, centre - radius)
+            box_max = np.minimum(box_max, centre + radius)
+        use_box = np.isfinite(box_min).any() or np.isfinite(box_max).any()
+        if genes is not None:
+            genes = np.unique(np.asarray(genes, dtype=int).flatten())
+
+        if use_box:
+            spots = self._get_spots_in_cells(box_min[:2], box_max[:2])
+            if genes is not None:
+                use_gene = np.zeros(self.n_genes, dtype=bool)
+                use_gene[genes] = True
+                spots = spots[use_gene[self.gene_no[spots]]]
+        elif genes is not None:
+            spots = self._get_spots_of_genes(genes, score_thresh)
+        else:
+            spots = np.arange(self.n_spots)
+
+        keep = np.ones(spots.size, dtype=bool)
+        if use_box:
+            spot_yxz = self.global_yxz[spots]
+            keep = np.logical_and(keep, (spot_yxz >= box_min).all(axis=1))
+            keep = np.logical_and(keep, (spot_yxz <= box_max).all(axis=1))
+            if centre is not None:
+                keep = np.logical_and(keep, np.sum((spot_yxz - centre) ** 2, axis=1) <= radius ** 2)
+        if score_thresh is not None:
+            keep = np.logical_and(keep, self.score[spots] > score_thresh)
+        if score_max is not None:
+            keep = np.logical_and(keep, self.score[spots] <= score_max)
+        if intensity_thresh is not None:
+            keep = np.logical_and(keep, self.intensity[spots] > intensity_thresh)
+        return np.sort(spots[keep])
+
+    def save(self, file_name: str, method: str):
+        """
+        Saves index to `file_name`, keeping the index of any other method already in the file.
+
+        Args:
+            file_name: npz file to save index to.
+            method: `'omp'` or `'ref_spots'`, name of the notebook page the spots came from.
+        """
+        arrays = {}
+        if os.path.isfile(file_name):
+            with np.load(file_name) as saved:
+                arrays = {key: saved[key] for key in saved.files if not key.startswith(method + '__')}
+        for var in self._saved_vars:
+            arrays[f'{method}__{var}'] = getattr(self, var)
+        np.savez(file_name, **arrays)
+
+    @classmethod
+    def load(cls, file_name: str, method: str) -> Optional['ResultsIndex']:
+        """
+        Loads index saved with `save`.
+
+        Args:
+            file_name: npz file index was saved to.
+            method: `'omp'` or `'ref_spots'`, name of the notebook page the spots came from.
+
+        Returns:
+            Index or `None` if no index of `method` in `file_name`.
+        """
+        if not os.path.isfile(file_name):
+            return None
+        with np.load(file_name) as saved:
+            if f'{method}__gene_no' not in saved.files:
+                return None
+            index = cls.__new__(cls)
+            for var in cls._saved_vars:
+                setattr(index, var, saved[f'{method}__{var}'])
+        index.grid_cell_size = float(index.grid_cell_size)
+        index.page_time = float(index.page_time)
+        index.score_multiplier = float(index.score_multiplier)
+        index.score_thresh = None
+        index.intensity_thresh = None
+        return index
+
+
+def get_results_index(nb: Notebook, method: str = 'omp') -> ResultsIndex:
+    """
+    Returns index of the spots found with `method`, loaded from `nb.file_names.results_index`.
+    The index is made and saved if the file does not contain it, or it was made from a different version of
+    the notebook page or with a different `score_omp_multiplier`.
+
+    Args:
+        nb: Notebook containing at least the `stitch`, `call_spots` and `omp` page if `method` is `'omp'`,
+            or `ref_spots` page otherwise.
+        method: `'omp'` or `'anchor'` (same as `'ref'`), the gene calling method to get spots of.
+
+    Returns:
+        Index of spots, with `score_thresh` and `intensity_thresh` set to the current thresholds.
+    """
+    score_thresh, intensity_thresh, score_multiplier = get_quality_thresholds(nb, method)
+    page_name = 'omp' if method.lower() == 'omp' else 'ref_spots'
+    nbp = getattr(nb, page_name)
+    # time page was added to notebook identifies which version of the page the index was made from.
+    page_time = nb._page_times[page_name]
+    if score_multiplier is None:
+        score_multiplier = np.nan
+    index = ResultsIndex.load(nb.file_names.results_index, page_name)
+    if index is None or index.page_time != page_time or index.n_spots != nbp.gene_no.size or \
+            not np.array_equal(index.score_multiplier, score_multiplier, equal_nan=True):
+        if page_name == 'omp':
+            score = omp_spot_score(nbp, score_multiplier)
+        else:
+            score = nbp.score
+        global_yxz = nbp.local_yxz + nb.stitch.tile_origin[nbp.tile]
+        index = ResultsIndex(global_yxz, nbp.gene_no, score, nbp.intensity, len(nb.call_spots.gene_names))
+        index.page_time = page_time
+        index.score_multiplier = score_multiplier
+        index.save(nb.file_names.results_index, page_name)
+    index.score_thresh = score_thresh
+    index.intensity_thresh = intensity_thresh
+    return index
@@ -1,3 +1,4 @@
 from .test_bleed_matrix import TestScaledKMeans, TestGetBleedMatrix, TestGetDyeChannelIntensityGuess
 from .test_base import TestColorNormalisation, TestDotProductScore, TestFitBackground, TestGetGeneEfficiency, \
     TestGetSpotIntensity
+from .test_results_index import TestResultsIndex
@@ -3,7 +3,7 @@ import os
 import numpy as np
 from ...utils import matlab, errors
 from ..base import color_normalisation, dot_product_score, fit_background, get_gene_efficiency, \
-    fit_background_jax_vectorised, get_spot_intensity, get_spot_intensity_jax
+    fit_background_jax_vectorised, get_spot_intensity, get_spot_intensity_jax, get_non_duplicate, get_owned_pixels
 import jax.numpy as jnp
 
 
@@ -222,3 +222,34 @@ class TestGetSpotIntensity(unittest.TestCase):
             intensity_jax = np.asarray(get_spot_intensity_jax(jnp.array(spot_colors)))
             diff = intensity - intensity_jax
             self.assertTrue(np.abs(diff).max() <= self.tol)
+
+
+class TestGetOwnedPixels(unittest.TestCase):
+    """
+    Check each pixel is owned by the same tile as get_non_duplicate finds and that padding includes all pixels
+    near those owned.
+    """
+    def test_get_owned_pixels(self):
+        tile_sz = 30
+        rng = np.random.default_rng(0)
+        # 2 x 3 grid of tiles with about 5 pixels of overlap, tile 4 not used.
+        tile_origin = np.zeros((6, 3))
+        tile_origin[:, :2] = np.array([[y, x] for y in range(2) for x in range(3)]) * 25 + \
+            rng.integers(-2, 3, (6, 2))
+        use_tiles = [0, 1, 2, 3, 5]
+        tile_centre = np.array([(tile_sz - 1) / 2, (tile_sz - 1) / 2, 0])
+        pixel_yxz = np.zeros((tile_sz ** 2, 3), dtype=int)
+        pixel_yxz[:, :2] = np.array(np.meshgrid(np.arange(tile_sz), np.arange(tile_sz),
+                                                indexing='ij')).reshape(2, -1).T
+        for t in use_tiles:
+            owned = get_owned_pixels(tile_origin, use_tiles, tile_centre, tile_sz, t)
+            not_duplicate = get_non_duplicate(tile_origin, use_tiles, tile_centre, pixel_yxz,
+                                              np.full(tile_sz ** 2, t))
+            self.assertTrue(np.array_equal(owned[pixel_yxz[:, 0], pixel_yxz[:, 1]], not_duplicate))
+            # neighbouring tiles overlap so some pixels are not owned.
+            self.assertTrue(0 < owned.sum() < tile_sz ** 2)
+            pad = 3
+            owned_pad = get_owned_pixels(tile_origin, use_tiles, tile_centre, tile_sz, t, pad)
+            owned_yx = np.array(np.where(owned)).T
+            dist = np.abs(pixel_yxz[:, np.newaxis, :2] - owned_yx[np.newaxis]).max(axis=2).min(axis=1)
+            self.assertTrue(np.array_equal(owned_pad[pixel_yxz[:, 0], pixel_yxz[:, 1]], dist <= pad))
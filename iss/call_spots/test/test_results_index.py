@@ -0,0 +1,50 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from ..results_index import ResultsIndex
+
+
+class TestResultsIndex(unittest.TestCase):
+    def test_query(self):
+        # each query should give same spots as checking all spots.
+        rng = np.random.default_rng(0)
+        n_spots = 2000
+        n_genes = 7
+        global_yxz = np.column_stack([rng.uniform(-50, 900, n_spots), rng.uniform(100, 600, n_spots),
+                                      rng.integers(0, 20, n_spots)])
+        gene_no = rng.integers(0, n_genes - 1, n_spots)  # last gene has no spots
+        score = np.round(rng.uniform(0, 1, n_spots), 2)
+        intensity = rng.uniform(0, 1, n_spots)
+        index = ResultsIndex(global_yxz, gene_no, score, intensity, n_genes)
+        index.score_thresh = 0.3
+        index.intensity_thresh = 0.2
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file_name = os.path.join(tmpdir, 'results_index.npz')
+            index.save(file_name, 'omp')
+            ResultsIndex(global_yxz[:10], gene_no[:10], score[:10], intensity[:10], n_genes).save(file_name,
+                                                                                                  'ref_spots')
+            index_loaded = ResultsIndex.load(file_name, 'omp')
+            self.assertIsNone(ResultsIndex.load(file_name, 'other'))
+            self.assertEqual(ResultsIndex.load(file_name, 'ref_spots').n_spots, 10)
+        index_loaded.score_thresh = 0.3
+        index_loaded.intensity_thresh = 0.2
+        centre = np.array([300, 300, 10])
+        queries = [({'genes': [1, 6]}, np.isin(gene_no, [1, 6])),
+                   ({'genes': 2, 'score_thresh': 0.5}, (gene_no == 2) & (score > 0.5)),
+                   ({'quality': True}, (score > 0.3) & (intensity > 0.2)),
+                   ({'score_thresh': 0.2, 'score_max': 0.6}, (score > 0.2) & (score <= 0.6)),
+                   ({'yxz_min': [100, 200, None], 'yxz_max': [400, None, 5]},
+                    (global_yxz[:, 0] >= 100) & (global_yxz[:, 0] <= 400) & (global_yxz[:, 1] >= 200) &
+                    (global_yxz[:, 2] <= 5)),
+                   ({'centre': centre, 'radius': 60, 'genes': [0, 3], 'intensity_thresh': 0.5},
+                    (np.linalg.norm(global_yxz - centre, axis=1) <= 60) & np.isin(gene_no, [0, 3]) &
+                    (intensity > 0.5)),
+                   ({'yxz_min': [2000, 0, 0]}, np.zeros(n_spots, dtype=bool))]
+        for kwargs, expected in queries:
+            for ind in [index, index_loaded]:
+                self.assertTrue(np.array_equal(ind.query(**kwargs), np.where(expected)[0]))
+
+
+if __name__ == '__main__':
+    unittest.main()
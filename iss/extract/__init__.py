@@ -1,4 +1,5 @@
-from .base import wait_for_data, get_extract_info, strip_hack, get_pixel_length
+from .base import wait_for_data, get_extract_info, strip_hack, get_pixel_length, filter_image, \
+    clear_filter_buffers
 from ..utils.nd2 import get_nd2_tile_ind
 from .scale import get_scale
 from .fstack import focus_stack
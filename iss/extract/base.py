@@ -2,6 +2,9 @@ import numpy as np
 import os
 import warnings
 import time
+import threading
+import cv2
+from scipy.ndimage import correlate, uniform_filter1d
 
 from tqdm import tqdm
 from .. import utils
@@ -95,8 +98,186 @@ def strip_hack(image: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
     return image, change_columns
 
 
+def get_pixel_stats(image: np.ndarray, hist_bin_edges: np.ndarray,
+                    max_pixel_value: int) -> Tuple[float, np.ndarray, int, float]:
+    """
+    Gets median of absolute pixel values, histogram, number of pixels above `max_pixel_value` and max pixel value
+    of `image`.
+
+    If `image` is integer and `hist_bin_edges` are integers shifted by 0.5, these are all found from a single
+    `np.bincount` of the pixel values, which is much quicker than `np.median`, `np.histogram` with a large number of
+    bins and separate passes for the clipped pixels. The results are identical to those of the slow method,
+    which is used otherwise.
+
+    Args:
+        image: ```int [n_y x n_x (x n_z)]```
+            Image to get statistics of.
+        hist_bin_edges: ```float [len(nbp['hist_values']) + 1]```
+            ```hist_values``` shifted by 0.5 to give bin edges not centres.
+        max_pixel_value: Pixels with value above this are counted as clipped.
+
+    Returns:
+        - ```median_abs``` - ```float```. Median of ```abs(image)```.
+        - ```hist_counts``` - ```int [len(nbp['hist_values'])]```.
+            ```hist_counts[i]``` is the number of pixels found in ```image``` with value equal to
+            ```hist_values[i]```.
+        - ```n_clip_pixels``` - ```int``` Number of pixels in ```image``` with value more than ```max_pixel_value```.
+        - ```image_max``` - ```float```. Max pixel value in ```image```.
+    """
+    hist_values = hist_bin_edges[:-1] + 0.5
+    image_min = image.min()
+    image_max = image.max()
+    if not np.issubdtype(image.dtype, np.integer) or \
+            not np.array_equal(hist_values, np.arange(hist_values[0], hist_values[0] + len(hist_values))) or \
+            int(image_max) - int(image_min) > max(image.size, len(hist_values)):
+        median_abs = np.median(np.abs(image))
+        hist_counts = np.histogram(image, hist_bin_edges)[0]
+        n_clip_pixels = np.sum(image > max_pixel_value)
+        return median_abs, hist_counts, n_clip_pixels, image_max
+
+    # counts[i] is number of pixels with value image_min + i.
+    counts = np.bincount((image - image_min).ravel(), minlength=int(image_max - image_min) + 1)
+    values = np.arange(int(image_min), int(image_max) + 1)
+
+    # Only keep values within range of histogram.
+    hist_counts = np.zeros(len(hist_values), dtype=np.int64)
+    hist_start = int(hist_values[0])
+    use_start = max(hist_start, int(image_min))
+    use_end = min(hist_start + len(hist_values), int(image_max) + 1)
+    if use_end > use_start:
+        hist_counts[use_start - hist_start:use_end - hist_start] = \
+            counts[use_start - int(image_min):use_end - int(image_min)]
+
+    n_clip_pixels = counts[values > max_pixel_value].sum()
+
+    # median from cumulative histogram of absolute values.
+    abs_counts = np.bincount(np.abs(values), weights=counts).astype(np.int64)
+    abs_cumsum = np.cumsum(abs_counts)
+    n_pixels = abs_cumsum[-1]
+    median_abs = np.searchsorted(abs_cumsum, n_pixels // 2, side='right')
+    if n_pixels % 2 == 0:
+        median_abs = (np.searchsorted(abs_cumsum, n_pixels // 2 - 1, side='right') + median_abs) / 2
+    return float(median_abs), hist_counts, n_clip_pixels, image_max
+
+
+# Buffers used by filter_image. One set per thread so each worker filtering tiles reuses its own buffers.
+# The buffers of every thread are also recorded in _filter_buffer_sets so clear_filter_buffers can free them.
+# _filter_buffer_generation is increased on clearing so each thread then starts a new set.
+_filter_buffers = threading.local()
+_filter_buffer_sets = []
+_filter_buffer_generation = 0
+_filter_buffer_lock = threading.Lock()
+
+
+def get_filter_buffer(name: str, shape: Tuple[int, ...], dtype: np.dtype = np.float32) -> np.ndarray:
+    """
+    Returns buffer of given `shape` and `dtype` which is kept and reused by later calls from the same thread
+    with the same `name`. It is only re-allocated if the `shape` or `dtype` changes.
+    Buffers are kept until `clear_filter_buffers` is called.
+
+    Args:
+        name: Name of buffer.
+        shape: Shape of buffer.
+        dtype: Data type of buffer.
+
+    Returns:
+        `dtype [shape]`. Buffer, its values are not initialised.
+    """
+    if getattr(_filter_buffers, 'generation', None) != _filter_buffer_generation:
+        with _filter_buffer_lock:
+            _filter_buffers.buffers = {}
+            _filter_buffers.generation = _filter_buffer_generation
+            _filter_buffer_sets.append(_filter_buffers.buffers)
+    buffers = _filter_buffers.buffers
+    buffer = buffers.get(name)
+    if buffer is None or buffer.shape != tuple(shape) or buffer.dtype != dtype:
+        # delete old buffer first so both are not in memory at the same time.
+        buffers.pop(name, None)
+        buffer = np.empty(shape, dtype=dtype)
+        buffers[name] = buffer
+    return buffer
+
+
+def clear_filter_buffers():
+    """
+    Frees the buffers made by `get_filter_buffer` in all threads. Buffers still being used by a thread are freed
+    once that thread has finished with them.
+    """
+    global _filter_buffer_generation
+    with _filter_buffer_lock:
+        for buffers in _filter_buffer_sets:
+            buffers.clear()
+        _filter_buffer_sets.clear()
+        _filter_buffer_generation += 1
+
+
+def filter_image(image: np.ndarray, filter_kernel: np.ndarray, scale: float,
+                 smooth_kernel: Optional[np.ndarray] = None,
+                 bad_columns: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Convolves `image` with `filter_kernel`, multiplies by `scale`, correlates with `smooth_kernel`, sets
+    `bad_columns` to 0 and rounds to the nearest integer. This gives the same result as
+
+    ```python
+    image = utils.morphology.convolve_2d(image, filter_kernel) * scale
+    image = utils.morphology.imfilter(image, smooth_kernel, oa=False)
+    image[:, bad_columns] = 0
+    image = np.rint(image)
+    ```
+
+    to within float32 precision (a few pixels may differ by 1) but all the work is done in `float32` buffers
+    which are reused by later calls from the same thread, so no full size arrays are allocated per image.
+    `scale` is folded into `filter_kernel` so is not a separate pass through the image.
+
+    Args:
+        image: `[n_y x n_x (x n_z)]`.
+            Image to filter, each z-plane is convolved separately with `filter_kernel`.
+        filter_kernel: `float [ny_kernel x nx_kernel]`.
+            2D kernel to convolve each z-plane with.
+        scale: Factor to multiply the filtered image by.
+        smooth_kernel: `float [ny_smooth x nx_smooth (x nz_smooth)]`.
+            Kernel to correlate filtered image with, padding with 0. `None` means no smoothing.
+        bad_columns: `int [n_bad_columns]`.
+            Columns of image to set to 0.
+
+    Returns:
+        `float32 [n_y x n_x (x n_z)]`.
+            Filtered image with integer values. This is a buffer which is overwritten by the next call to
+            `filter_image` from the same thread.
+    """
+    if image.dtype not in [np.uint8, np.uint16, np.int16, np.float32]:
+        # cv2 can only filter these into float32 image so convert first.
+        image_float = get_filter_buffer('image', image.shape)
+        np.copyto(image_float, image, casting='unsafe')
+        image = image_float
+    image_filtered = get_filter_buffer('filtered', image.shape)
+    cv2.filter2D(np.ascontiguousarray(image), cv2.CV_32F, np.flip(filter_kernel) * scale, dst=image_filtered,
+                 borderType=cv2.BORDER_REPLICATE)
+    if smooth_kernel is not None:
+        smooth_kernel = utils.morphology.ensure_odd_kernel(smooth_kernel, 'start')
+        if smooth_kernel.ndim < image_filtered.ndim:
+            smooth_kernel = smooth_kernel[:, :, np.newaxis]
+        if np.all(smooth_kernel == smooth_kernel.flat[0]):
+            # Uniform kernel is separable so can smooth one axis at a time in place, quicker and no extra buffer.
+            for axis in range(smooth_kernel.ndim):
+                if smooth_kernel.shape[axis] > 1:
+                    uniform_filter1d(image_filtered, smooth_kernel.shape[axis], axis, image_filtered,
+                                     mode='constant', cval=0)
+            image_filtered *= smooth_kernel.flat[0] * smooth_kernel.size
+        else:
+            # oa convolve uses lots of memory and much slower here.
+            image_smooth = get_filter_buffer('smooth', image_filtered.shape)
+            correlate(image_filtered, smooth_kernel.astype(np.float32), output=image_smooth, mode='constant',
+                      cval=0)
+            image_filtered = image_smooth
+    if bad_columns is not None:
+        image_filtered[:, bad_columns] = 0
+    return np.rint(image_filtered, out=image_filtered)
+
+
 def get_extract_info(image: np.ndarray, auto_thresh_multiplier: float, hist_bin_edges: np.ndarray, max_pixel_value: int,
-                     scale: float, z_info: Optional[int] = None) -> Tuple[float, np.ndarray, int, float]:
+                     scale: float, z_info: Optional[int] = None,
+                     good_columns: Optional[np.ndarray] = None) -> Tuple[float, np.ndarray, int, float]:
     """
     Gets information from filtered scaled images useful for later in the pipeline.
     If 3D image, only z-plane used for `auto_thresh` and `hist_counts` calculation for speed and the that the
@@ -104,7 +285,7 @@ def get_extract_info(image: np.ndarray, auto_thresh_multiplier: float, hist_bin_
 
     Args:
         image: ```int [n_y x n_x (x n_z)]```
-            Image of tile after filtering and scaling.
+            Image of tile after filtering and scaling. Can be ```float``` if all values are integers.
         auto_thresh_multiplier: ```auto_thresh``` is set to ```auto_thresh_multiplier * median(abs(image))```
             so that pixel values above this are likely spots. Typical = 10
         hist_bin_edges: ```float [len(nbp['hist_values']) + 1]```
@@ -113,6 +294,10 @@ def get_extract_info(image: np.ndarray, auto_thresh_multiplier: float, hist_bin_
             If no shift was applied, this would be ```np.iinfo(np.uint16).max```.
         scale: Factor by which, ```image``` has been multiplied in order to fill out available values in tiff file.
         z_info: z-plane to get `auto_thresh` and `hist_counts` from.
+        good_columns: ```int [n_good_columns]```.
+            Only these columns of ```image``` are used to get `auto_thresh` and `hist_counts`.
+            Clipped pixels are counted from all columns so other columns should be 0.
+            If ```None```, all columns used.
 
     Returns:
         - ```auto_thresh``` - ```int``` Pixel values above ```auto_thresh``` in ```image``` are likely spots.
@@ -123,19 +308,27 @@ def get_extract_info(image: np.ndarray, auto_thresh_multiplier: float, hist_bin_
         - ```clip_scale``` - ```float``` Suggested scale factor to multiply un-scaled ```image``` by in order for
             ```n_clip_pixels``` to be 0.
     """
+    if good_columns is None:
+        good_columns = slice(None)
     if image.ndim == 3:
         if z_info is None:
             raise ValueError("z_info not provided")
-        auto_thresh = np.median(np.abs(image[:, :, z_info])) * auto_thresh_multiplier
-        hist_counts = np.histogram(image[:, :, z_info], hist_bin_edges)[0]
+        image_info = image[:, good_columns, z_info]
     else:
-        auto_thresh = np.median(np.abs(image)) * auto_thresh_multiplier
-        hist_counts = np.histogram(image, hist_bin_edges)[0]
-    n_clip_pixels = np.sum(image > max_pixel_value)
+        image_info = image[:, good_columns]
+    if not np.issubdtype(image_info.dtype, np.integer):
+        # get_pixel_stats is quicker on int32.
+        image_info = image_info.astype(np.int32)
+    median_abs, hist_counts, n_clip_pixels, image_max = get_pixel_stats(image_info, hist_bin_edges, max_pixel_value)
+    if image.ndim == 3:
+        # clipped pixels are counted from all z-planes.
+        n_clip_pixels = np.count_nonzero(image > max_pixel_value)
+        image_max = image.max() if n_clip_pixels > 0 else None
+    auto_thresh = median_abs * auto_thresh_multiplier
     if n_clip_pixels > 0:
         # image has already been multiplied by scale hence inclusion of scale here
         # max_pixel_value / image.max() is less than 1 so recommended scaling becomes smaller than scale.
-        clip_scale = scale * max_pixel_value / image.max()
+        clip_scale = scale * max_pixel_value / image_max
     else:
         clip_scale = 0
     return np.round(auto_thresh).astype(int), hist_counts, n_clip_pixels, clip_scale
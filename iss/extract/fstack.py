@@ -1,6 +1,8 @@
+import os
 import numpy as np
 from scipy import ndimage
 from scipy.signal import medfilt2d
+from concurrent.futures import ThreadPoolExecutor
 import cv2
 from typing import Optional, Tuple
 
@@ -44,7 +46,7 @@ def im2double(im: np.ndarray) -> np.ndarray:
 
 
 def focus_stack(im_stack: np.ndarray, nhsize: int = 9, focus: Optional[np.ndarray] = None, alpha: float = 0.2,
-                sth: float = 13) -> np.ndarray:
+                sth: float = 13, n_threads: Optional[int] = None) -> np.ndarray:
     """
     Generate extended depth-of-field image from focus sequence
     using noise-robust selective all-in-focus algorithm [1].
@@ -60,6 +62,9 @@ def focus_stack(im_stack: np.ndarray, nhsize: int = 9, focus: Optional[np.ndarra
 
     Modified by Josh, 2021
 
+    The only ```[M x N x P]``` array made is the ```float32``` focus measure,
+    everything after that is done one z-plane at a time.
+
     Args:
         im_stack: Element ```[:,:,p,:]``` is greyscale or RGB image at z-plane ```p```.
             RGB: ```uint8 [M x N x P x 3]```
@@ -69,6 +74,8 @@ def focus_stack(im_stack: np.ndarray, nhsize: int = 9, focus: Optional[np.ndarra
             Vector with focus of each frame. If ```None```, will use ```np.arange(P)```.
         alpha: A scalar in ```[0,1]```. See [1] for details.
         sth: A scalar. See [1] for details.
+        n_threads: Number of threads used to compute the focus measure of different z-planes at the same time.
+            If ```None```, will use the number of CPUs.
 
     Returns:
         ```int [M x N]```. All In Focus (AIF) image.
@@ -76,27 +83,27 @@ def focus_stack(im_stack: np.ndarray, nhsize: int = 9, focus: Optional[np.ndarra
     rgb = np.ndim(im_stack) == 4
     if focus is None:
         focus = np.arange(im_stack.shape[2])
-    if rgb:
-        imagesR = im_stack[:, :, :, 0].astype(float)
-        imagesG = im_stack[:, :, :, 1].astype(float)
-        imagesB = im_stack[:, :, :, 2].astype(float)
-    fm = get_fmeasure(im_stack, nhsize)
-    S, fm = get_smeasure(fm, nhsize, focus)
-    fm = get_weights(S, fm, alpha, sth)
+    fm = get_fmeasure(im_stack, nhsize, n_threads)
+    S, fmax = get_smeasure(fm, nhsize, focus)
+    phi = get_phi(S, alpha, sth)
     '''Fuse Images'''
-    fmn = np.sum(fm, 2)  # normalisation factor
+    fmn = np.zeros(im_stack.shape[:2])  # normalisation factor
+    im = np.zeros(im_stack.shape[:2] + im_stack.shape[3:])
+    for p in range(im_stack.shape[2]):
+        omega = get_weights(phi, fm[:, :, p] / fmax)
+        fmn += omega
+        if rgb:
+            im += im_stack[:, :, p].astype(np.float32) * omega[:, :, np.newaxis]
+        else:
+            im += im_stack[:, :, p].astype(np.float32) * omega
     if rgb:
-        im = np.zeros_like(im_stack[:, :, 0])
-        im[:, :, 0] = np.sum(imagesR * fm, 2) / fmn
-        im[:, :, 1] = np.sum(imagesG * fm, 2) / fmn
-        im[:, :, 2] = np.sum(imagesB * fm, 2) / fmn
-        im = np.round(im).astype(np.uint8)
+        im = np.round(im / fmn[:, :, np.newaxis]).astype(np.uint8)
     else:
-        im = np.round((np.sum(im_stack.astype(float) * fm, 2) / fmn)).astype(int)
+        im = np.round(im / fmn).astype(int)
     return im
 
 
-def get_fmeasure(im_stack: np.ndarray, nhsize: int) -> np.ndarray:
+def get_fmeasure(im_stack: np.ndarray, nhsize: int, n_threads: Optional[int] = None) -> np.ndarray:
     """
     Returns focus measure value for each pixel.
 
@@ -105,19 +112,33 @@ def get_fmeasure(im_stack: np.ndarray, nhsize: int) -> np.ndarray:
             RGB: ```uint8 [M x N x P x 3]```.
             Gray: ```uint16 [M x N x P]```.
         nhsize: Size of focus measure window. Typical: ```M/200```.
+        n_threads: Number of threads used to compute the focus measure of different z-planes at the same time.
+            If ```None```, will use the number of CPUs.
 
     Returns:
-        ```float [M x N x P]```. Focus measure image.
+        ```float32 [M x N x P]```. Focus measure image.
     """
     rgb = np.ndim(im_stack) == 4
     im_shape = np.shape(im_stack)
-    fm = np.zeros((im_shape[:3]))
-    for p in range(im_shape[2]):
+    fm = np.zeros((im_shape[:3]), dtype=np.float32)
+
+    def get_fmeasure_plane(p: int):
         if rgb:
             im = rgb2gray(im_stack[:, :, p])
         else:
             im = im_stack[:, :, p]
-        fm[:, :, p] = gfocus(im2double(im), nhsize)
+        # same as im2double but float32
+        fm[:, :, p] = gfocus(im.astype(np.float32) / np.iinfo(im.dtype).max, nhsize)
+
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+    if min(n_threads, im_shape[2]) > 1:
+        # cv2 releases the GIL while filtering so planes are filtered in parallel.
+        with ThreadPoolExecutor(max_workers=min(n_threads, im_shape[2])) as executor:
+            list(executor.map(get_fmeasure_plane, range(im_shape[2])))
+    else:
+        for p in range(im_shape[2]):
+            get_fmeasure_plane(p)
     return fm
 
 
@@ -134,44 +155,58 @@ def get_smeasure(fm: np.ndarray, nhsize: int, focus: np.ndarray) -> Tuple[np.nda
 
     Returns:
         - ```S``` - ```float [M x N]```. Selectivity measure image.
-        - ```fm``` - ```float [M x N x P]```. Normalised focus measure image.
+        - ```fmax``` - ```float [M x N]```. Max projection of ```fm```, used to normalise it.
     """
     M, N, P = np.shape(fm)
     u, s_squared, A, fmax = gauss3p(focus, fm)
+    # so each plane of error signal is computed in same precision as fm.
+    u, s_squared, A = u.astype(fm.dtype), s_squared.astype(fm.dtype), A.astype(fm.dtype)
     # Aprox. RMS of error signal as sum|Signal-Noise| instead of sqrt(sum(Signal-noise)^2):
     err = np.zeros((M, N))
     for p in range(P):
         # +1 for self.focus is due to python vs matlab indexing
         # this bit is twice as slow vectorized for 2048 x 2048 x 51 image
-        err = err + np.abs(fm[:, :, p] - A * np.exp(-(focus[p] + 1 - u) ** 2 / (2 * s_squared)))
-    fm = fm / np.expand_dims(fmax, 2)
+        err += np.abs(fm[:, :, p] - A * np.exp(-(focus[p] + 1 - u) ** 2 / (2 * s_squared)))
     h = np.ones((nhsize, nhsize)) / (nhsize ** 2)
     inv_psnr = ndimage.correlate(err / (P * fmax), h, mode='nearest')
     # inv_psnr = cv2.filter2D(err / (P * fmax), -1, h, borderType=cv2.BORDER_REPLICATE)
     S = 20 * np.log10(1 / inv_psnr)
     S[np.isnan(S)] = np.nanmin(S)
-    return S, fm
+    return S, fmax
 
 
-def get_weights(S: np.ndarray, fm: np.ndarray, alpha: float, sth: float) -> np.ndarray:
+def get_phi(S: np.ndarray, alpha: float, sth: float) -> np.ndarray:
     """
-    Computes sharpening parameter phi and then
-    returns cut off frequency for high pass convolve_2d, ```omega```.
+    Computes sharpening parameter phi.
 
     Args:
         S: ```float [M x N]```.
             Selectivity measure image.
-        fm: ```float [M x N x P]```.
-            Normalised focus measure image.
         alpha: A scalar in ```[0, 1]```. Typical: ```0.2```.
         sth: A scalar. Typical: ```13```.
 
     Returns:
-        ```float [M x N]```. Cut off frequency for high pass convolve_2d.
+        ```float32 [M x N]```. Sharpening parameter phi.
     """
     phi = 0.5 * (1 + np.tanh(alpha * (S - sth))) / alpha
     phi = medfilt2d(phi, 3)
-    omega = 0.5 + 0.5 * np.tanh(np.expand_dims(phi, 2) * (fm - 1))
+    return phi.astype(np.float32)
+
+
+def get_weights(phi: np.ndarray, fm: np.ndarray) -> np.ndarray:
+    """
+    Returns cut off frequency for high pass convolve_2d, ```omega```, of a single z-plane.
+
+    Args:
+        phi: ```float [M x N]```.
+            Sharpening parameter.
+        fm: ```float [M x N]```.
+            Normalised focus measure image of z-plane.
+
+    Returns:
+        ```float [M x N]```. Cut off frequency for high pass convolve_2d.
+    """
+    omega = 0.5 + 0.5 * np.tanh(phi * (fm - 1))
     return omega
 
 
@@ -1,2 +1,4 @@
 from .test_fstack import TestFstack
 from .test_strip_hack import TestStripHack
+from .test_pixel_stats import TestPixelStats
+from .test_filter import TestFilter
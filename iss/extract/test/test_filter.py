@@ -0,0 +1,57 @@
+import unittest
+import numpy as np
+import threading
+from ..base import filter_image, get_filter_buffer, clear_filter_buffers, _filter_buffer_sets
+from ...utils import morphology
+
+
+class TestFilter(unittest.TestCase):
+    def test_filter_image(self):
+        # float32 filtering should match float64 method to within rounding.
+        rng = np.random.default_rng(0)
+        filter_kernel = morphology.hanning_diff(3, 12)
+        bad_columns = np.array([5, 6])
+        for shape, smooth_shape in [((60, 70, 5), (3, 3, 3)), ((60, 70, 5), (3, 3)), ((60, 70), (3, 5)),
+                                    ((60, 70, 5), None)]:
+            image = rng.integers(0, 2000, shape).astype(np.uint16)
+            smooth_kernel = None if smooth_shape is None else np.ones(smooth_shape) / np.prod(smooth_shape)
+            if shape == (60, 70, 5) and smooth_shape == (3, 3):
+                # non-uniform kernel
+                smooth_kernel = rng.random(smooth_shape)
+            scale = 7.3
+            im_old = morphology.convolve_2d(image, filter_kernel) * scale
+            if smooth_kernel is not None:
+                if smooth_kernel.ndim < image.ndim:
+                    smooth_kernel_old = smooth_kernel[:, :, np.newaxis]
+                else:
+                    smooth_kernel_old = smooth_kernel
+                im_old = morphology.imfilter(im_old, smooth_kernel_old, oa=False)
+            im_old[:, bad_columns] = 0
+            im_old = np.rint(im_old)
+            for im_in in [image, image.astype(np.int64)]:
+                im_new = filter_image(im_in, filter_kernel, scale, smooth_kernel, bad_columns)
+                self.assertEqual(im_new.dtype, np.float32)
+                self.assertTrue(np.abs(im_new - im_old).max() <= 1)
+                self.assertTrue(np.array_equal(im_new[:, bad_columns], np.zeros_like(im_new[:, bad_columns])))
+            # buffer reused for next image of same shape.
+            self.assertTrue(filter_image(image, filter_kernel, scale, smooth_kernel) is im_new)
+
+    def test_clear_filter_buffers(self):
+        buffer = get_filter_buffer('test', (4, 5))
+        self.assertTrue(get_filter_buffer('test', (4, 5)) is buffer)
+        thread_buffers = []
+        thread = threading.Thread(target=lambda: thread_buffers.append(get_filter_buffer('test', (4, 5))))
+        thread.start()
+        thread.join()
+        # each thread has own buffer.
+        self.assertFalse(thread_buffers[0] is buffer)
+        clear_filter_buffers()
+        # buffers of all threads freed.
+        self.assertEqual(len(_filter_buffer_sets), 0)
+        self.assertFalse(get_filter_buffer('test', (4, 5)) is buffer)
+        self.assertEqual(len(_filter_buffer_sets), 1)
+        clear_filter_buffers()
+
+
+if __name__ == '__main__':
+    unittest.main()
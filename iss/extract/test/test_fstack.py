@@ -27,6 +27,14 @@ class TestFstack(unittest.TestCase):
             diff = output_python.astype(int) - output_matlab.astype(int)
             self.assertTrue(np.abs(diff).max() <= self.tol)
 
+    def test_focus_stack_threads(self):
+        # planes filtered in parallel should give exactly the same image as one at a time.
+        rng = np.random.default_rng(0)
+        input_im = rng.integers(0, 5000, (60, 70, 7)).astype(np.uint16)
+        output_single = focus_stack(input_im, n_threads=1)
+        output_parallel = focus_stack(input_im, n_threads=3)
+        self.assertTrue(np.array_equal(output_single, output_parallel))
+
 
 if __name__ == '__main__':
     unittest.main()
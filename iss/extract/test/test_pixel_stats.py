@@ -0,0 +1,28 @@
+import unittest
+import numpy as np
+from ..base import get_pixel_stats
+
+
+class TestPixelStats(unittest.TestCase):
+    shift = 15000
+    hist_values = np.arange(-shift, np.iinfo(np.uint16).max - shift + 2, 1)
+    hist_bin_edges = np.concatenate((hist_values - 0.5, hist_values[-1:] + 0.5))
+    max_pixel_value = np.iinfo(np.uint16).max - shift
+
+    def test_pixel_stats(self):
+        # quick method should give same results as slow method for integer images, including those with
+        # pixels outside the histogram range and with an even number of pixels.
+        rng = np.random.default_rng(0)
+        for sd in [3, 200, 40000]:
+            for shape in [(31, 40), (20, 21, 3)]:
+                image = np.rint(rng.normal(rng.uniform(-50, 50), sd, shape)).astype(np.int32)
+                median_abs, hist_counts, n_clip_pixels, image_max = \
+                    get_pixel_stats(image, self.hist_bin_edges, self.max_pixel_value)
+                self.assertEqual(median_abs, np.median(np.abs(image)))
+                self.assertTrue(np.array_equal(hist_counts, np.histogram(image, self.hist_bin_edges)[0]))
+                self.assertEqual(n_clip_pixels, np.sum(image > self.max_pixel_value))
+                self.assertEqual(image_max, image.max())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -7,6 +7,10 @@ import jax.numpy as jnp
 import jax
 from functools import partial
 
+# detect_spots uses get_local_maxima_max_filter rather than get_local_maxima_jax if more than this fraction of
+# pixels in the image are above the intensity threshold.
+MAX_FILTER_DENSITY_THRESH = 0.01
+
 
 def spot_yxz(spot_details: np.ndarray, tile: int, round: int, channel: int,
              return_isolated: bool = False) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
@@ -97,10 +101,12 @@ def detect_spots_dilate(image: np.ndarray, intensity_thresh: float, radius_xy: O
 
 
 def detect_spots(image: np.ndarray, intensity_thresh: float, radius_xy: Optional[int], radius_z: Optional[int] = None,
-                 remove_duplicates: bool = False, se: Optional[np.ndarray] = None):
+                 remove_duplicates: bool = False, se: Optional[np.ndarray] = None,
+                 use_max_filter: Optional[bool] = None):
     """
     Finds local maxima in image exceeding ```intensity_thresh```.
-    This is achieved by looking at neighbours of pixels above intensity_thresh.
+    This is achieved either by looking at neighbours of pixels above intensity_thresh (quick if few such pixels)
+    or by running separable max filters over the whole image (quick if many such pixels, only for cuboid se).
     Should use for a small se.
 
     Args:
@@ -112,14 +118,17 @@ def detect_spots(image: np.ndarray, intensity_thresh: float, radius_xy: Optional
             Must be more than 1 to be 3D.
             If ```None```, 2D filter is used.
         remove_duplicates: Whether to only keep one pixel if two or more pixels are local maxima and have
-            same intensity. Only works with integer image.
+            same intensity. If ```True```, the pixel kept is the first in raster (y, then x, then z) order.
         se: ```int [se_sz_y x se_sz_x x se_sz_z]```.
             Can give structuring element manually rather than using a cuboid element.
             Must only contain zeros and ones.
+        use_max_filter: Whether to use ```get_local_maxima_max_filter``` rather than ```get_local_maxima_jax```.
+            Both give the same spots. If ```None```, max filter used if ```se``` is a cuboid and more than
+            ```MAX_FILTER_DENSITY_THRESH``` of pixels are above ```intensity_thresh```.
 
     Returns:
         - ```peak_yxz``` - ```int [n_peaks x image.ndim]```.
-            yx or yxz location of spots found.
+            yx or yxz location of spots found, in raster order.
         - ```peak_intensity``` - ```float [n_peaks]```.
             Pixel value of spots found.
     """
@@ -146,38 +155,50 @@ def detect_spots(image: np.ndarray, intensity_thresh: float, radius_xy: Optional
         warnings.warn(f"2D image provided but 3D filter asked for.\n"
                       f"Using the middle plane ({mid_z}) of this filter.")
         se = se[:, :, mid_z]
+        pad_size_z = 0
+    se_cuboid = bool(np.all(se > 0))
 
     # set central pixel to 0
     se[np.ix_(*[(np.floor((se.shape[i] - 1) / 2).astype(int),) for i in range(se.ndim)])] = 0
     se_shifts = utils.morphology.get_shifts_from_kernel(se)
-
-    consider_yxz = np.where(image > intensity_thresh)
-    n_consider = consider_yxz[0].shape[0]
-    if remove_duplicates:
-        # perturb image by small amount so two neighbouring pixels that did have the same value now differ slightly.
-        # hence when find maxima, will only get one of the pixels not both.
-        rng = np.random.default_rng(0)   # So shift is always the same.
-        # rand_shift must be larger than small to detect a single spot.
-        rand_im_shift = rng.uniform(low=2e-6, high=0.2, size=n_consider).astype(np.float32)
-        image = image.astype(np.float32)
-        image[consider_yxz] = image[consider_yxz] + rand_im_shift
-
-    consider_intensity = image[consider_yxz]
-    consider_yxz = list(consider_yxz)
-
-    keep = np.asarray(get_local_maxima_jax(image, se_shifts, pad_size_y, pad_size_x, pad_size_z, consider_yxz,
-                                           consider_intensity))
     if remove_duplicates:
-        peak_intensity = np.round(consider_intensity[keep]).astype(int)
+        # Neighbours before a pixel in raster order must be strictly less than it, so for two neighbouring pixels
+        # with the same value, only the first is a local maxima. This is the same as subtracting a tiny amount
+        # proportional to the raster index from each pixel.
+        shifts = np.asarray(se_shifts).transpose()
+        se_shifts_before = shifts[np.arange(shifts.shape[0]), np.argmax(shifts != 0, axis=1)] < 0
+    else:
+        se_shifts_before = np.zeros(se_shifts[0].shape[0], dtype=bool)
+
+    consider = image > intensity_thresh
+    if use_max_filter is None:
+        use_max_filter = se_cuboid and np.count_nonzero(consider) > MAX_FILTER_DENSITY_THRESH * image.size
+    elif use_max_filter and not se_cuboid:
+        raise ValueError("use_max_filter is True but se is not a cuboid so max filter is not separable.")
+    if use_max_filter:
+        if remove_duplicates:
+            se_shifts_before = tuple([se_shifts[i][se_shifts_before] for i in range(se.ndim)])
+        else:
+            se_shifts_before = None
+        peak_yxz = get_local_maxima_max_filter(image, consider, pad_size_y, pad_size_x, pad_size_z,
+                                               se_shifts_before)
+        peak_intensity = image[tuple([peak_yxz[:, i] for i in range(image.ndim)])]
     else:
+        consider_yxz = np.where(consider)
+        consider_intensity = image[consider_yxz]
+        consider_yxz = list(consider_yxz)
+        keep = np.asarray(get_local_maxima_jax(image, se_shifts, jnp.asarray(se_shifts_before), pad_size_y,
+                                               pad_size_x, pad_size_z, consider_yxz, consider_intensity))
         peak_intensity = consider_intensity[keep]
-    peak_yxz = np.array(consider_yxz).transpose()[keep]
+        peak_yxz = np.array(consider_yxz).transpose()[keep]
+    if remove_duplicates:
+        peak_intensity = peak_intensity.astype(int)
     return peak_yxz, peak_intensity
 
 
-@partial(jax.jit, static_argnums=(2, 3, 4))
+@partial(jax.jit, static_argnums=(3, 4, 5))
 def get_local_maxima_jax(image: jnp.ndarray, se_shifts: Tuple[jnp.ndarray, jnp.ndarray, jnp.ndarray],
-                         pad_size_y: int, pad_size_x: int, pad_size_z: int,
+                         se_shifts_before: jnp.ndarray, pad_size_y: int, pad_size_x: int, pad_size_z: int,
                          consider_yxz: List[jnp.ndarray], consider_intensity: jnp.ndarray) -> jnp.ndarray:
     """
     Finds the local maxima from a given set of pixels to consider.
@@ -187,6 +208,9 @@ def get_local_maxima_jax(image: jnp.ndarray, se_shifts: Tuple[jnp.ndarray, jnp.n
             ```image``` to find spots on.
         se_shifts: `(image.ndim x  int [n_shifts])`.
             y, x, z shifts which indicate neighbourhood about each spot where local maxima search carried out.
+        se_shifts_before: `bool [n_shifts]`.
+            Neighbours at shifts where this is `True` must be strictly less than the pixel for it to be
+            a local maxima. Otherwise, they must be less than or equal to it.
         pad_size_y: How much to zero pad image in y.
         pad_size_x: How much to zero pad image in x.
         pad_size_z: How much to zero pad image in z.
@@ -206,11 +230,119 @@ def get_local_maxima_jax(image: jnp.ndarray, se_shifts: Tuple[jnp.ndarray, jnp.n
     keep = jnp.ones(consider_yxz[0].shape[0], dtype=bool)
     for i in range(se_shifts[0].shape[0]):
         # Note that in each iteration, only consider coordinates which can still possibly be local maxima.
-        keep = keep * (image[tuple([consider_yxz[j] + se_shifts[j][i] for j in range(image.ndim)])] <=
-                       consider_intensity)
+        neighbour_intensity = image[tuple([consider_yxz[j] + se_shifts[j][i] for j in range(image.ndim)])]
+        keep = keep * jnp.where(se_shifts_before[i], neighbour_intensity < consider_intensity,
+                                neighbour_intensity <= consider_intensity)
     return keep
 
 
+def max_filter_1d(image: np.ndarray, pad_size: int, axis: int) -> np.ndarray:
+    """
+    Finds the maximum of `image` in a window of `2 * pad_size + 1` pixels centred on each pixel along `axis`,
+    with pixels outside `image` taken to be zero.
+
+    Only `log2(2 * pad_size + 1) + 1` shifted maximums of the whole image are needed, each done in
+    the image's own dtype and memory order, so this is much quicker than `scipy.ndimage.maximum_filter1d`.
+
+    Args:
+        image: `[n_y x n_x (x n_z)]`.
+            Image to filter.
+        pad_size: Window is `2 * pad_size + 1` pixels along `axis`.
+        axis: Axis of `image` to filter along.
+
+    Returns:
+        `[n_y x n_x (x n_z)]`.
+            `image` after max filtering along `axis`. Same dtype as `image`.
+    """
+    def axis_slice(start: Optional[int], stop: Optional[int]) -> tuple:
+        # slice of whole image between start and stop along axis.
+        index = [slice(None)] * image.ndim
+        index[axis] = slice(start, stop)
+        return tuple(index)
+
+    window_size = 2 * pad_size + 1
+    n = image.shape[axis]
+    padded_shape = list(image.shape)
+    padded_shape[axis] = n + 2 * pad_size
+    image_max = np.zeros_like(image, shape=padded_shape)
+    image_max[axis_slice(pad_size, pad_size + n)] = image
+    # image_max[i] becomes max of image_max[i:i+width] with width doubling each iteration.
+    width = 1
+    while 2 * width <= window_size:
+        np.maximum(image_max[axis_slice(None, -width)], image_max[axis_slice(width, None)],
+                   out=image_max[axis_slice(None, -width)])
+        width *= 2
+    # Window of pixel i is union of the windows of width starting at i and i + window_size - width.
+    return np.maximum(image_max[axis_slice(None, n)],
+                      image_max[axis_slice(window_size - width, window_size - width + n)])
+
+
+def get_local_maxima_max_filter(image: np.ndarray, consider: np.ndarray, pad_size_y: int, pad_size_x: int,
+                                pad_size_z: int, se_shifts_before: Optional[Tuple[np.ndarray, ...]] = None,
+                                slab_nz: int = 8) -> np.ndarray:
+    """
+    Finds the local maxima in a cuboid neighbourhood from a given set of pixels to consider.
+
+    The maximum in the neighbourhood of every pixel is found with a separable max filter along each axis in turn.
+    This is done in the image's own dtype on slabs of `slab_nz` z-planes, so only a few z-planes are copied
+    at once and the time taken does not depend on how many pixels there are to consider.
+    Pixels outside the image are taken to be zero, as in `get_local_maxima_jax`.
+
+    Args:
+        image: ```float [n_y x n_x x n_z]```.
+            ```image``` to find spots on.
+        consider: ```bool [n_y x n_x x n_z]```.
+            Pixels which can be local maxima e.g. those above an intensity threshold.
+        pad_size_y: Neighbourhood is `2 * pad_size_y + 1` pixels in y.
+        pad_size_x: Neighbourhood is `2 * pad_size_x + 1` pixels in x.
+        pad_size_z: Neighbourhood is `2 * pad_size_z + 1` pixels in z.
+        se_shifts_before: `(image.ndim x  int [n_shifts_before])`.
+            y, x, z shifts to neighbours which must be strictly less than a pixel for it to be a local maxima.
+            If `None`, all neighbours can be equal to a local maxima.
+        slab_nz: Number of z-planes to find local maxima on at once.
+
+    Returns:
+        `int [n_peaks x image.ndim]`.
+            yx or yxz location of local maxima, in raster order.
+    """
+    n_dims = image.ndim
+    if n_dims == 2:
+        image = image[:, :, np.newaxis]
+        consider = consider[:, :, np.newaxis]
+    n_z = image.shape[2]
+    is_peak = np.zeros_like(consider)
+    for z_start in range(0, n_z, slab_nz):
+        z_end = min(z_start + slab_nz, n_z)
+        consider_slab = consider[:, :, z_start:z_end]
+        if not consider_slab.any():
+            continue
+        # include pad_size_z planes either side of slab, so max in z is correct at the slab edges.
+        z_start_pad = max(z_start - pad_size_z, 0)
+        z_end_pad = min(z_end + pad_size_z, n_z)
+        image_max = image[:, :, z_start_pad:z_end_pad]
+        if pad_size_z > 0:
+            image_max = max_filter_1d(image_max, pad_size_z, 2)
+        image_max = image_max[:, :, z_start - z_start_pad:z_end - z_start_pad]
+        for axis, pad_size in enumerate([pad_size_y, pad_size_x]):
+            if pad_size > 0:
+                image_max = max_filter_1d(image_max, pad_size, axis)
+        is_peak[:, :, z_start:z_end] = np.logical_and(consider_slab, image[:, :, z_start:z_end] >= image_max)
+    peak_yxz = np.array(np.where(is_peak), dtype=int).transpose()
+    if se_shifts_before is not None:
+        # Only few local maxima so quick to check for equal neighbours before them.
+        peak_intensity = image[tuple(peak_yxz.transpose())]
+        keep = np.ones(peak_yxz.shape[0], dtype=bool)
+        for i in range(se_shifts_before[0].shape[0]):
+            neighbour_yxz = peak_yxz.copy()
+            neighbour_yxz[:, :len(se_shifts_before)] += np.array([shift[i] for shift in se_shifts_before])
+            in_image = np.all(np.logical_and(neighbour_yxz >= 0, neighbour_yxz < image.shape), axis=1)
+            neighbour_intensity = np.zeros_like(peak_intensity)
+            neighbour_intensity[in_image] = image[tuple(neighbour_yxz[in_image].transpose())]
+            keep = np.logical_and(keep, neighbour_intensity < peak_intensity)
+        peak_yxz = peak_yxz[keep]
+    return peak_yxz[:, :n_dims]
+
+
 def get_isolated(image: np.ndarray, spot_yxz: np.ndarray, thresh: float, radius_inner: float, radius_xy: float,
                  radius_z: Optional[float] = None, filter_image: bool = False) -> np.ndarray:
     """
@@ -237,7 +369,7 @@ def get_isolated(image: np.ndarray, spot_yxz: np.ndarray, thresh: float, radius_
 
     """
     se = utils.strel.annulus(radius_inner, radius_xy, radius_z)
-    # With just coords, takes about 3s for 50 z-planes.
+    # With just coords, takes about 1.5s for 50 z-planes.
 
     if filter_image:
         # This filtering takes around 40s for 50 z-planes.
@@ -112,6 +112,33 @@ class TestBase(unittest.TestCase):
             self.assertTrue(np.abs(diff).max() <= 0)  # check match MATLAB
             self.assertTrue(np.abs(diff2).max() <= 0)  # check against slower python method
 
+    def test_detect_spots_max_filter(self):
+        """
+        Check detect_spots finds the same spots with separable max filter as with jax method, on uint16 and
+        signed images with many equal neighbouring pixels.
+        """
+        rng = np.random.default_rng(0)
+        for dtype, is_3d in [(np.uint16, True), (np.int32, True), (np.float32, False)]:
+            shape = (40, 50, 13) if is_3d else (40, 50)
+            # zyx image stored like tiles loaded by utils.npy.load_tile.
+            image = rng.integers(-5 * (dtype != np.uint16), 10, shape[::-1]).astype(dtype).transpose()
+            radius_z = 2 if is_3d else None
+            for remove_duplicates in [False, True]:
+                peak_yxz, peak_intensity = detect_spots(image, 3, 2, radius_z, remove_duplicates,
+                                                        use_max_filter=False)
+                peak_yxz2, peak_intensity2 = detect_spots(image, 3, 2, radius_z, remove_duplicates,
+                                                          use_max_filter=True)
+                self.assertTrue(np.array_equal(peak_yxz, peak_yxz2))
+                self.assertTrue(np.array_equal(peak_intensity, peak_intensity2))
+
+        # With remove_duplicates, only first of equal neighbouring pixels in raster order kept.
+        image = np.zeros((5, 5, 3), dtype=np.uint16)
+        image[2, 2:4, 1] = 10
+        image[1, 3, 2] = 10
+        for use_max_filter in [False, True]:
+            peak_yxz = detect_spots(image, 0, 2, 2, True, use_max_filter=use_max_filter)[0]
+            self.assertTrue(np.array_equal(peak_yxz, [[1, 3, 2]]))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -8,9 +8,9 @@ import warnings
 def fit_coefs(bled_codes: np.ndarray, pixel_colors: np.ndarray, genes: np.ndarray,
               weight: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
     """
-    Old method before Jax.
     This finds the least squared solution for how the `n_genes` `bled_codes` can best explain each `pixel_color`.
     Can also find weighted least squared solution if `weight` provided.
+    All pixels are solved at once through `solve_lstsq_batch` rather than looping over pixels.
 
     Args:
         bled_codes: `float [(n_rounds x n_channels) x n_genes]`.
@@ -31,23 +31,55 @@ def fit_coefs(bled_codes: np.ndarray, pixel_colors: np.ndarray, genes: np.ndarra
             coefficient found through least squares fitting for each gene.
 
     """
-    n_pixels = pixel_colors.shape[1]
-    residual = np.zeros((n_pixels, pixel_colors.shape[0]))
-    coefs = np.zeros_like(genes, dtype=float)
     if weight is None:
-        for s in range(n_pixels):
-            coefs[s] = np.linalg.lstsq(bled_codes[:, genes[s]], pixel_colors[:, s], rcond=None)[0]
-            residual[s] = pixel_colors[:, s] - bled_codes[:, genes[s]] @ coefs[s]
+        pixel_colors = pixel_colors.transpose()
+        bled_codes_s = np.moveaxis(bled_codes[:, genes], 0, 1)  # [n_pixels x (n_rounds x n_channels) x n_genes_add]
     else:
-        pixel_colors = pixel_colors * weight.transpose()
-        for s in range(n_pixels):
-            bled_codes_s = bled_codes[:, genes[s]] * weight[s][:, np.newaxis]
-            coefs[s] = np.linalg.lstsq(bled_codes_s, pixel_colors[:, s], rcond=None)[0]
-            residual[s] = pixel_colors[:, s] - bled_codes_s @ coefs[s]
+        pixel_colors = pixel_colors.transpose() * weight
+        bled_codes_s = np.moveaxis(bled_codes[:, genes], 0, 1) * weight[:, :, np.newaxis]
+    coefs = solve_lstsq_batch(bled_codes_s, pixel_colors)
+    residual = pixel_colors - np.einsum('sij,sj->si', bled_codes_s, coefs)
+    if weight is not None:
         residual = residual / weight
     return residual, coefs
 
 
+def solve_lstsq_batch(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    Finds the least squares solution `x[s]` of `a[s] @ x[s] = b[s]` for every `s` at once.
+    The QR decompositions `a[s] = q[s] @ r[s]` are found together and `r[s] @ x[s] = q[s].T @ b[s]` solved, which,
+    unlike the normal equations, does not square the condition number of `a[s]`. Systems which are rank deficient,
+    i.e. where a diagonal element of `r[s]` is not more than `rcond` times the largest, are solved with the
+    pseudo-inverse instead, giving the minimum norm solution as `np.linalg.lstsq` would.
+
+    Args:
+        a: `float [n_systems x n_equations x n_unknowns]`.
+        b: `float [n_systems x n_equations]`.
+
+    Returns:
+        `float [n_systems x n_unknowns]`.
+            Least squares solution for each system.
+    """
+    n_systems, n_equations, n_unknowns = a.shape
+    if n_unknowns == 0:
+        return np.zeros((n_systems, 0), dtype=np.result_type(a, b))
+    if n_equations < n_unknowns:
+        # every system is rank deficient.
+        return np.einsum('sji,si->sj', np.linalg.pinv(a), b)
+    q, r = np.linalg.qr(a)
+    r_diag = np.abs(np.diagonal(r, axis1=1, axis2=2))
+    # Same default rcond as np.linalg.lstsq.
+    rcond = np.finfo(r.dtype).eps * max(n_equations, n_unknowns)
+    singular = r_diag.min(axis=1) <= rcond * r_diag.max(axis=1)
+    x = np.zeros((n_systems, n_unknowns), dtype=r.dtype)
+    if (~singular).any():
+        x[~singular] = np.linalg.solve(r[~singular], np.einsum('sij,si->sj', q[~singular],
+                                                               b[~singular])[:, :, np.newaxis])[:, :, 0]
+    if singular.any():
+        x[singular] = np.einsum('sji,si->sj', np.linalg.pinv(a[singular]), b[singular])
+    return x
+
+
 def get_best_gene_base(residual_pixel_colors: np.ndarray, all_bled_codes: np.ndarray,
                        norm_shift: float, score_thresh: float, inverse_var: np.ndarray,
                        ignore_genes: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
@@ -190,13 +222,10 @@ def get_best_gene(residual_pixel_colors: np.ndarray, all_bled_codes: np.ndarray,
             `dot_product_score` for spot `s` with gene `best_gene[s]`.
     """
 
-    n_pixels, n_genes_added = genes_added.shape
-    n_genes = all_bled_codes.shape[0]
-    coefs_all = np.zeros((n_pixels, n_genes))
-    pixel_ind = np.repeat(np.arange(n_pixels), n_genes_added)
-    coefs_all[(pixel_ind, genes_added.flatten())] = coefs.flatten()
-
-    inverse_var = 1 / (coefs_all ** 2 @ all_bled_codes ** 2 * alpha + background_var)
+    n_pixels = genes_added.shape[0]
+    # Only genes added contribute to variance so no need to multiply coefficients of all genes.
+    gene_var = np.einsum('sg,sgi->si', coefs ** 2, all_bled_codes[genes_added] ** 2)
+    inverse_var = 1 / (gene_var * alpha + background_var)
     ignore_genes = np.concatenate((genes_added, np.tile(background_genes, [n_pixels, 1])), axis=1)
     best_gene, pass_score_thresh, best_score = \
         get_best_gene_base(residual_pixel_colors, all_bled_codes, norm_shift, score_thresh, inverse_var, ignore_genes)
@@ -1,4 +1,4 @@
-from typing import Optional, List
+from typing import Optional, List, Tuple, Union
 import numpy as np
 from tqdm import tqdm
 from .. import utils
@@ -111,6 +111,12 @@ def get_spot_colors(yxz_base: np.ndarray, t: int, transforms: np.ndarray, nbp_fi
                                           np.min(yxz_transform < tile_sz, axis=1))  # set color to nan if out range
                 if in_range.any():
                     yxz_transform = yxz_transform[in_range]
+                    if not nbp_basic.is_3d:
+                        # In 2D, read just the pixels required from the memmap rather than a cropped image.
+                        spot_colors[in_range, r, c] = utils.npy.load_tile(nbp_file, nbp_basic, t, r, c,
+                                                                          yxz_transform[:, :2])
+                        pbar.update(1)
+                        continue
 
                     # only load in section of image required for speed.
                     yxz_min = np.min(yxz_transform, axis=0)
@@ -118,14 +124,50 @@ def get_spot_colors(yxz_base: np.ndarray, t: int, transforms: np.ndarray, nbp_fi
                     load_y = np.arange(yxz_min[0], yxz_max[0] + 1)
                     load_x = np.arange(yxz_min[1], yxz_max[1] + 1)
                     load_z = np.arange(yxz_min[2], yxz_max[2] + 1)
-                    image = utils.npy.load_tile(nbp_file, nbp_basic, t, r, c,
-                                                [load_y, load_x, load_z][:2+nbp_basic.is_3d])
+                    image = utils.npy.load_tile(nbp_file, nbp_basic, t, r, c, [load_y, load_x, load_z])
 
                     yxz_transform = yxz_transform - yxz_min  # shift yxz so load in correct colors from cropped image.
-                    if image.ndim == 3:
-                        spot_colors[in_range, r, c] = image[yxz_transform[:, 0], yxz_transform[:, 1],
-                                                            yxz_transform[:, 2]]
-                    else:
-                        spot_colors[in_range, r, c] = image[yxz_transform[:, 0], yxz_transform[:, 1]]
+                    spot_colors[in_range, r, c] = image[yxz_transform[:, 0], yxz_transform[:, 1],
+                                                        yxz_transform[:, 2]]
                 pbar.update(1)
     return spot_colors
+
+
+def get_spot_colors_use(yxz_base: np.ndarray, t: int, transforms: np.ndarray, nbp_file: NotebookPage,
+                        nbp_basic: NotebookPage,
+                        return_in_bounds: bool = False) -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
+    """
+    NumPy equivalent of `spot_colors.get_spot_colors_jax`, with the same output i.e. only
+    `nbp_basic.use_rounds` and `nbp_basic.use_channels` are returned.
+
+    Args:
+        yxz_base: `int16 [n_spots x 3]`.
+            Local yxz coordinates of spots found in the reference round/reference channel of tile `t`
+            yx coordinates are in units of `yx_pixels`. z coordinates are in units of `z_pixels`.
+        t: Tile that spots were found on.
+        transforms: `float [n_tiles x n_rounds x n_channels x 4 x 3]`.
+            `transforms[t, r, c]` is the affine transform to get from tile `t`, `ref_round`, `ref_channel` to
+            tile `t`, round `r`, channel `c`.
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        return_in_bounds: if `True`, then only `spot_colors` which are within the tile bounds in all
+            `use_rounds` / `use_channels` will be returned.
+            The corresponding `yxz_base` coordinates will also be returned in this case.
+
+    Returns:
+        - `spot_colors` - `int32 [n_spots x n_rounds_use x n_channels_use]` or
+            `int32 [n_spots_in_bounds x n_rounds_use x n_channels_use]`.
+            `spot_colors[s, r, c]` is the spot color for spot `s` in round `use_rounds[r]`, channel `use_channels[c]`.
+            It is `-nbp_basic.tile_pixel_value_shift` if spot `s` is out of bounds in that round/channel.
+        - `yxz_base` - `int16 [n_spots_in_bounds x 3]`.
+            If `return_in_bounds`, the `yxz_base` corresponding to spots in bounds for all `use_rounds` / `use_channels`
+            will be returned.
+    """
+    spot_colors = get_spot_colors(yxz_base, t, transforms, nbp_file, nbp_basic)
+    spot_colors = spot_colors[np.ix_(np.arange(yxz_base.shape[0]), nbp_basic.use_rounds,
+                                     nbp_basic.use_channels)].astype(np.int32)
+    if return_in_bounds:
+        good = ~np.any(spot_colors == -nbp_basic.tile_pixel_value_shift, axis=(1, 2))
+        return spot_colors[good], yxz_base[good]
+    else:
+        return spot_colors
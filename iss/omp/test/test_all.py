@@ -182,6 +182,40 @@ class TestFitCoefs(unittest.TestCase):
             self.assertTrue(np.abs(diff1_weight).max() <= self.tol)
             self.assertTrue(np.abs(diff2_weight).max() <= self.tol)
 
+    def test_fit_coefs_singular(self):
+        # Check batched solve gives same answer as lstsq when some pixels have rank deficient systems.
+        n_round_channels, n_genes, n_pixels, n_genes_add = 12, 20, 50, 3
+        bled_codes = np.random.rand(n_round_channels, n_genes)
+        bled_codes[:, 1] = bled_codes[:, 0] * 2  # gene 1 is a multiple of gene 0 so singular if both used.
+        pixel_colors = np.random.rand(n_round_channels, n_pixels)
+        genes = np.array([np.random.choice(np.arange(2, n_genes), n_genes_add, False) for _ in range(n_pixels)])
+        genes[:10, :2] = [0, 1]
+        residual, coefs = no_jax.fit_coefs(bled_codes, pixel_colors, genes)
+        for s in range(n_pixels):
+            coefs_lstsq = np.linalg.lstsq(bled_codes[:, genes[s]], pixel_colors[:, s], rcond=None)[0]
+            residual_lstsq = pixel_colors[:, s] - bled_codes[:, genes[s]] @ coefs_lstsq
+            self.assertTrue(np.abs(coefs[s] - coefs_lstsq).max() <= self.tol)
+            self.assertTrue(np.abs(residual[s] - residual_lstsq).max() <= self.tol)
+
+    def test_fit_coefs_ill_conditioned(self):
+        # Check batched solve is accurate for nearly singular systems which are not rank deficient.
+        rng = np.random.default_rng(0)
+        n_round_channels, n_genes, n_pixels = 12, 3, 20
+        bled_codes = rng.random((n_round_channels, n_genes))
+        # condition number of ~1e6 so ~1e12 for normal equations.
+        bled_codes[:, 1] = bled_codes[:, 0] + 1e-6 * rng.random(n_round_channels)
+        true_coefs = rng.random((n_pixels, n_genes))
+        pixel_colors = (true_coefs @ bled_codes.transpose()).transpose()
+        genes = np.tile(np.arange(n_genes), (n_pixels, 1))
+        residual, coefs = no_jax.fit_coefs(bled_codes, pixel_colors, genes)
+        self.assertTrue(np.abs(coefs - true_coefs).max() <= 1e-4)
+        self.assertTrue(np.abs(residual).max() <= self.tol)
+        # All zero system has minimum norm solution of 0.
+        residual, coefs = no_jax.fit_coefs(np.zeros((n_round_channels, 1)), pixel_colors, np.zeros((n_pixels, 1),
+                                                                                                    dtype=int))
+        self.assertTrue((coefs == 0).all())
+        self.assertTrue(np.array_equal(residual, pixel_colors.transpose()))
+
 
 class TestGetBestGene(unittest.TestCase):
     """
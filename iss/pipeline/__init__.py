@@ -7,3 +7,5 @@ from .register import register
 from .reference_spots import reference_spots
 from .call_reference_spots import call_reference_spots
 from .omp import call_spots_omp
+from .warm_up import set_jax_cache, warm_up_jax
+from .run_tasks import run_tasks
@@ -4,7 +4,7 @@ import numpy as np
 import os
 from tqdm import tqdm
 from ..setup.notebook import NotebookPage, Notebook
-from typing import Tuple
+from typing import Tuple, List, Optional
 import warnings
 
 
@@ -31,9 +31,54 @@ def extract_and_filter(config: dict, nbp_file: NotebookPage,
         - `NotebookPage[extract_debug]` - Page containing variables which are not needed later in the pipeline
             but may be useful for debugging purposes.
     """
+    nbp, nbp_debug = extract_setup(config, nbp_file, nbp_basic)
+    filters = get_filters(config, nbp_file, nbp_basic)
+    use_rounds, round_files, n_images = get_extract_rounds(nbp_file, nbp_basic, filters['filter_kernel_dapi'])
+
+    n_clip_error_images = 0
+    with tqdm(total=n_images) as pbar:
+        pbar.set_description(f'Loading in tiles from {nbp_file.raw_extension}, filtering and saving as .npy')
+        for r in use_rounds:
+            round_dask_array = wait_for_round(config, nbp_file, nbp_basic, round_files[r], r)
+            if r == nbp_basic.anchor_round:
+                n_clip_error_images = 0  # reset for anchor as different scale used.
+                set_scale_anchor(config, nbp_file, nbp_basic, nbp_debug, filters)
+            for t in nbp_basic.use_tiles:
+                tile_info = extract_tile(config, nbp_file, nbp_basic, filters, t, r, nbp_debug.z_info,
+                                         round_dask_array, pbar)
+                n_clip_error_images = add_tile_info(config, nbp_file, nbp_basic, nbp, nbp_debug, tile_info, t, r,
+                                                    n_clip_error_images)
+    pbar.close()
+    utils.raw.cache.clear()
+    extract.clear_filter_buffers()
+    if not nbp_basic.use_anchor:
+        nbp_debug.scale_anchor_tile = None
+        nbp_debug.scale_anchor_z = None
+        nbp_debug.scale_anchor = None
+    return nbp, nbp_debug
+
+
+def extract_setup(config: dict, nbp_file: NotebookPage,
+                  nbp_basic: NotebookPage) -> Tuple[NotebookPage, NotebookPage]:
+    """
+    Does everything in the extract step which must happen before any tiles are filtered,
+    i.e. finding the filter radii, the psf if deconvolving and `scale`.
+    `config` is updated with any of these values which were not given.
+
+    Args:
+        config: Dictionary obtained from `'extract'` section of config file.
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+
+    Returns:
+        - `NotebookPage[extract]` - Page with `auto_thresh`, `hist_values` and `hist_counts` initialised.
+        - `NotebookPage[extract_debug]` - Page with all variables not found from individual tiles added.
+    """
     # initialise notebook pages
     if not nbp_basic.is_3d:
         config['deconvolve'] = False  # only deconvolve if 3d pipeline
+    # raw images loaded to find psf and scale are kept so not read again when extracting.
+    utils.raw.cache.resize(config['raw_cache_mb'] * 1024 ** 2)
     nbp = setup.NotebookPage("extract")
     nbp_debug = setup.NotebookPage("extract_debug")
     # initialise output of this part of pipeline as 'vars' key
@@ -42,7 +87,6 @@ def extract_and_filter(config: dict, nbp_file: NotebookPage,
     nbp.hist_values = np.arange(-nbp_basic.tile_pixel_value_shift, np.iinfo(np.uint16).max -
                                 nbp_basic.tile_pixel_value_shift + 2, 1)
     nbp.hist_counts = np.zeros((len(nbp.hist_values), nbp_basic.n_rounds, nbp_basic.n_channels), dtype=int)
-    hist_bin_edges = np.concatenate((nbp.hist_values - 0.5, nbp.hist_values[-1:] + 0.5))
     # initialise debugging info as 'debug' page
     nbp_debug.n_clip_pixels = np.zeros_like(nbp.auto_thresh, dtype=int)
     nbp_debug.clip_extract_scale = np.zeros_like(nbp.auto_thresh)
@@ -63,12 +107,6 @@ def extract_and_filter(config: dict, nbp_file: NotebookPage,
     nbp_debug.r2 = config['r2']
     nbp_debug.r_dapi = config['r_dapi']
 
-    filter_kernel = utils.morphology.hanning_diff(nbp_debug.r1, nbp_debug.r2)
-    if nbp_debug.r_dapi is not None:
-        filter_kernel_dapi = utils.strel.disk(nbp_debug.r_dapi)
-    else:
-        filter_kernel_dapi = None
-
     if config['r_smooth'] is not None:
         if len(config['r_smooth']) == 2:
             if nbp_basic.is_3d:
@@ -84,11 +122,6 @@ def extract_and_filter(config: dict, nbp_file: NotebookPage,
         if config['r_smooth'][0] > config['r2']:
             raise ValueError(f"Smoothing radius, {config['r_smooth'][0]}, is larger than the outer radius of the\n"
                              f"hanning filter, {config['r2']}, making the filtering step redundant.")
-
-        # smooth_kernel = utils.strel.fspecial(*tuple(config['r_smooth']))
-        smooth_kernel = np.ones(tuple(np.array(config['r_smooth'], dtype=int)*2-1))
-        smooth_kernel = smooth_kernel / np.sum(smooth_kernel)
-
         if np.max(config['r_smooth']) == 1:
             warnings.warn('Max radius of smooth filter was 1, so not using.')
             config['r_smooth'] = None
@@ -111,9 +144,6 @@ def extract_and_filter(config: dict, nbp_file: NotebookPage,
         # normalise psf so min is 0 and max is 1.
         psf = psf - psf.min()
         psf = psf / psf.max()
-        pad_im_shape = np.array([nbp_basic.tile_sz, nbp_basic.tile_sz, nbp_basic.nz]) + \
-                       np.array(config['wiener_pad_shape']) * 2
-        wiener_filter = extract.get_wiener_filter(psf, pad_im_shape, config['wiener_constant'])
         nbp_debug.psf = psf
         nbp_debug.psf_intensity_thresh = config['psf_intensity_thresh']
         nbp_debug.psf_tiles_used = psf_tiles_used
@@ -128,175 +158,336 @@ def extract_and_filter(config: dict, nbp_file: NotebookPage,
         scale_norm_max = np.iinfo('uint16').max - nbp_basic.tile_pixel_value_shift
         if not scale_norm_min <= config['scale_norm'] <= scale_norm_max:
             raise utils.errors.OutOfBoundsError("scale_norm", config['scale_norm'], scale_norm_min, scale_norm_max)
-        # If using smoothing, apply this as well before scal
-        if config['r_smooth'] is None:
-            smooth_kernel_2d = None
-        else:
-            if smooth_kernel.ndim == 3:
-                # take central plane of smooth filter if 3D as scale is found from a single z-plane.
-                smooth_kernel_2d = smooth_kernel[:, :, config['r_smooth'][2]-1]
-            else:
-                smooth_kernel_2d = smooth_kernel.copy()
-            # smoothing is averaging so to average in 2D, need to re normalise filter
-            smooth_kernel_2d = smooth_kernel_2d / np.sum(smooth_kernel_2d)
+        filters = get_filters(config, nbp_file, nbp_basic, False)
         nbp_debug.scale_tile, nbp_debug.scale_channel, nbp_debug.scale_z, config['scale'] = \
             extract.get_scale(nbp_file, nbp_basic, 0, nbp_basic.use_tiles, nbp_basic.use_channels, nbp_basic.use_z,
-                              config['scale_norm'], filter_kernel, smooth_kernel_2d)
+                              config['scale_norm'], filters['filter_kernel'], filters['smooth_kernel_2d'])
     else:
         nbp_debug.scale_tile = None
         nbp_debug.scale_channel = None
         nbp_debug.scale_z = None
-        smooth_kernel_2d = None
     nbp_debug.scale = config['scale']
 
-    # get rounds to iterate over
-    use_channels_anchor = [c for c in [nbp_basic.dapi_channel, nbp_basic.anchor_channel] if c is not None]
-    use_channels_anchor.sort()
-    if filter_kernel_dapi is None:
-        # If not filtering DAPI, skip over the DAPI channel.
-        use_channels_anchor = np.setdiff1d(use_channels_anchor, nbp_basic.dapi_channel)
+    if config['n_clip_error'] is None:
+        # default is 1% of pixels on single z-plane
+        config['n_clip_error'] = int(nbp_basic.tile_sz * nbp_basic.tile_sz / 100)
+    return nbp, nbp_debug
+
+
+def get_filters(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage, wiener: bool = True) -> dict:
+    """
+    Gets all the kernels used to filter the raw images. These only depend on `config` so can be recomputed by any
+    process once `extract_setup` has been run.
+
+    Args:
+        config: Dictionary obtained from `'extract'` section of config file after `extract_setup` has been run.
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        wiener: Whether to compute the wiener filter. If `True`, the psf file must exist if `config['deconvolve']`.
+
+    Returns:
+        Dictionary containing `filter_kernel`, `filter_kernel_dapi`, `smooth_kernel`, `smooth_kernel_2d`,
+            `wiener_filter` and `hist_bin_edges`. Any filter which is not used is `None`.
+    """
+    filters = {'filter_kernel': utils.morphology.hanning_diff(config['r1'], config['r2'])}
+    if config['r_dapi'] is not None:
+        filters['filter_kernel_dapi'] = utils.strel.disk(config['r_dapi'])
+    else:
+        filters['filter_kernel_dapi'] = None
+
+    if config['r_smooth'] is not None:
+        # smooth_kernel = utils.strel.fspecial(*tuple(config['r_smooth']))
+        smooth_kernel = np.ones(tuple(np.array(config['r_smooth'], dtype=int) * 2 - 1))
+        filters['smooth_kernel'] = smooth_kernel / np.sum(smooth_kernel)
+        # If using smoothing, apply this as well before scale
+        if smooth_kernel.ndim == 3:
+            # take central plane of smooth filter if 3D as scale is found from a single z-plane.
+            smooth_kernel_2d = smooth_kernel[:, :, config['r_smooth'][2] - 1]
+        else:
+            smooth_kernel_2d = smooth_kernel.copy()
+        # smoothing is averaging so to average in 2D, need to re normalise filter
+        filters['smooth_kernel_2d'] = smooth_kernel_2d / np.sum(smooth_kernel_2d)
+    else:
+        filters['smooth_kernel'] = None
+        filters['smooth_kernel_2d'] = None
+
+    if config['deconvolve'] and wiener:
+        psf = np.moveaxis(np.load(nbp_file.psf), 0, 2)  # Put z to last index
+        psf = psf - psf.min()
+        psf = psf / psf.max()
+        pad_im_shape = np.array([nbp_basic.tile_sz, nbp_basic.tile_sz, nbp_basic.nz]) + \
+                       np.array(config['wiener_pad_shape']) * 2
+        filters['wiener_filter'] = extract.get_wiener_filter(psf, pad_im_shape, config['wiener_constant'])
+    else:
+        filters['wiener_filter'] = None
+
+    hist_values = np.arange(-nbp_basic.tile_pixel_value_shift, np.iinfo(np.uint16).max -
+                            nbp_basic.tile_pixel_value_shift + 2, 1)
+    filters['hist_bin_edges'] = np.concatenate((hist_values - 0.5, hist_values[-1:] + 0.5))
+    return filters
+
+
+def get_extract_rounds(nbp_file: NotebookPage, nbp_basic: NotebookPage,
+                       filter_kernel_dapi: Optional[np.ndarray]) -> Tuple[List[int], List[str], int]:
+    """
+    Gets the rounds to extract, the raw file of each round and the number of images which will be extracted.
+
+    Args:
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        filter_kernel_dapi: Kernel used to filter DAPI images. If `None`, DAPI images are not extracted.
+
+    Returns:
+        - `use_rounds` - Rounds to extract, with the anchor round last if used.
+        - `round_files` - `round_files[r]` is the name of the raw file for round `r`.
+        - `n_images` - Number of images which will be extracted.
+    """
+    use_channels_anchor = get_anchor_channels(nbp_basic, filter_kernel_dapi)
     if nbp_basic.use_anchor:
         # always have anchor as first round after imaging rounds
         round_files = nbp_file.round + [nbp_file.anchor]
         use_rounds = nbp_basic.use_rounds + [nbp_basic.n_rounds]
         n_images = (len(use_rounds) - 1) * len(nbp_basic.use_tiles) * len(nbp_basic.use_channels) + \
-                        len(nbp_basic.use_tiles) * len(use_channels_anchor)
+                   len(nbp_basic.use_tiles) * len(use_channels_anchor)
     else:
         round_files = nbp_file.round
         use_rounds = nbp_basic.use_rounds
         n_images = len(use_rounds) * len(nbp_basic.use_tiles) * len(nbp_basic.use_channels)
+    return use_rounds, round_files, n_images
 
-    n_clip_error_images = 0
-    if config['n_clip_error'] is None:
-        # default is 1% of pixels on single z-plane
-        config['n_clip_error'] = int(nbp_basic.tile_sz * nbp_basic.tile_sz / 100)
 
-    with tqdm(total=n_images) as pbar:
-        pbar.set_description(f'Loading in tiles from {nbp_file.raw_extension}, filtering and saving as .npy')
-        for r in use_rounds:
-            # set scale and channels to use
-            im_file = os.path.join(nbp_file.input_dir, round_files[r])
-            if nbp_file.raw_extension == '.npy':
-                extract.wait_for_data(im_file, config['wait_time'], dir=True)
-            else:
-                extract.wait_for_data(im_file + nbp_file.raw_extension, config['wait_time'])
-            round_dask_array = utils.raw.load(nbp_file, nbp_basic, r=r)
-            if r == nbp_basic.anchor_round:
-                n_clip_error_images = 0  # reset for anchor as different scale used.
-                if config['scale_anchor'] is None:
-                    nbp_debug.scale_anchor_tile, _, nbp_debug.scale_anchor_z, config['scale_anchor'] = \
-                        extract.get_scale(nbp_file, nbp_basic, nbp_basic.anchor_round, nbp_basic.use_tiles,
-                                          [nbp_basic.anchor_channel], nbp_basic.use_z,
-                                          config['scale_norm'], filter_kernel, smooth_kernel_2d)
-                else:
-                    nbp_debug.scale_anchor_tile = None
-                    nbp_debug.scale_anchor_z = None
-                nbp_debug.scale_anchor = config['scale_anchor']
-                scale = nbp_debug.scale_anchor
-                use_channels = use_channels_anchor
-            else:
-                scale = nbp_debug.scale
-                use_channels = nbp_basic.use_channels
+def get_anchor_channels(nbp_basic: NotebookPage, filter_kernel_dapi: Optional[np.ndarray]) -> List[int]:
+    """
+    Gets channels to extract on the anchor round.
 
-            # convolve_2d each image
-            for t in nbp_basic.use_tiles:
-                if not nbp_basic.is_3d:
-                    # for 2d all channels in same file
-                    file_exists = os.path.isfile(nbp_file.tile[t][r])
-                    if file_exists:
-                        # mmap load in image for all channels if tiff exists
-                        im_all_channels_2d = np.load(nbp_file.tile[t][r], mmap_mode='r')
-                    else:
-                        # Only save 2d data when all channels collected
-                        # For channels not used, keep all pixels 0.
-                        im_all_channels_2d = np.zeros((nbp_basic.n_channels, nbp_basic.tile_sz,
-                                                       nbp_basic.tile_sz), dtype=np.int32)
-                for c in use_channels:
-                    if r == nbp_basic.anchor_round and c == nbp_basic.anchor_channel:
-                        # max value that can be saved and no shifting done for DAPI
-                        max_tiff_pixel_value = np.iinfo(np.uint16).max
-                    else:
-                        max_tiff_pixel_value = np.iinfo(np.uint16).max - nbp_basic.tile_pixel_value_shift
+    Args:
+        nbp_basic: `basic_info` notebook page
+        filter_kernel_dapi: Kernel used to filter DAPI images. If `None`, DAPI channel is not extracted.
+
+    Returns:
+        Channels to extract on the anchor round.
+    """
+    use_channels_anchor = [c for c in [nbp_basic.dapi_channel, nbp_basic.anchor_channel] if c is not None]
+    use_channels_anchor.sort()
+    if filter_kernel_dapi is None:
+        # If not filtering DAPI, skip over the DAPI channel.
+        use_channels_anchor = np.setdiff1d(use_channels_anchor, nbp_basic.dapi_channel)
+    return use_channels_anchor
+
+
+def wait_for_round(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage, round_file: str, r: int):
+    """
+    Waits for the raw data of round `r` to become available and then returns the lazily loaded data.
+
+    Args:
+        config: Dictionary obtained from `'extract'` section of config file.
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        round_file: Name of the raw file of round `r` in `nbp_file.input_dir`.
+        r: Round to wait for.
+
+    Returns:
+        `dask.array` of raw data for round `r`, as returned by `utils.raw.load`.
+    """
+    im_file = os.path.join(nbp_file.input_dir, round_file)
+    if nbp_file.raw_extension == '.npy':
+        extract.wait_for_data(im_file, config['wait_time'], dir=True)
+    else:
+        extract.wait_for_data(im_file + nbp_file.raw_extension, config['wait_time'])
+    return utils.raw.load(nbp_file, nbp_basic, r=r)
+
+
+def set_scale_anchor(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage, nbp_debug: NotebookPage,
+                     filters: dict):
+    """
+    Finds `scale_anchor` if not given and adds it to `config` and `nbp_debug`.
+
+    Args:
+        config: Dictionary obtained from `'extract'` section of config file.
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        nbp_debug: `extract_debug` notebook page
+        filters: Dictionary returned by `get_filters`.
+    """
+    if config['scale_anchor'] is None:
+        nbp_debug.scale_anchor_tile, _, nbp_debug.scale_anchor_z, config['scale_anchor'] = \
+            extract.get_scale(nbp_file, nbp_basic, nbp_basic.anchor_round, nbp_basic.use_tiles,
+                              [nbp_basic.anchor_channel], nbp_basic.use_z,
+                              config['scale_norm'], filters['filter_kernel'], filters['smooth_kernel_2d'])
+    else:
+        nbp_debug.scale_anchor_tile = None
+        nbp_debug.scale_anchor_z = None
+    nbp_debug.scale_anchor = config['scale_anchor']
+
+
+def extract_tile(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage, filters: dict, t: int, r: int,
+                 z_info: int, round_dask_array=None, pbar: Optional[tqdm] = None,
+                 n_threads: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Filters all channels of tile `t`, round `r` and saves them as npy files.
+    If the npy file already exists, the information is found from the saved image instead.
+
+    Args:
+        config: Dictionary obtained from `'extract'` section of config file after `extract_setup` has been run.
+            If `r` is the anchor round, `config['scale_anchor']` must be set.
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        filters: Dictionary returned by `get_filters`.
+        t: Tile to extract.
+        r: Round to extract.
+        z_info: z-plane to get information from if 3D.
+        round_dask_array: Raw data of round `r` as returned by `utils.raw.load`.
+            If `None`, will be loaded in.
+        pbar: Progress bar to update after each channel.
+        n_threads: Number of threads used by `focus_stack` if 2D. If `None`, will use the number of CPUs.
+
+    Returns:
+        - `auto_thresh` - `int [n_channels]`. `auto_thresh[c]` is the threshold for channel `c`.
+        - `hist_counts` - `int [n_hist_values x n_channels]`. Histogram of each channel.
+        - `n_clip_pixels` - `int [n_channels]`. Number of pixels clipped in each channel.
+        - `clip_extract_scale` - `float [n_channels]`. Scale needed to avoid clipping in each channel.
+        - `new_image` - `bool [n_channels]`. Whether each channel was filtered here rather than loaded from an
+            existing npy file.
+        All are 0 for channels not extracted.
+    """
+    auto_thresh = np.zeros(nbp_basic.n_channels, dtype=int)
+    hist_counts = np.zeros((len(filters['hist_bin_edges']) - 1, nbp_basic.n_channels), dtype=int)
+    n_clip_pixels = np.zeros(nbp_basic.n_channels, dtype=int)
+    clip_extract_scale = np.zeros(nbp_basic.n_channels)
+    new_image = np.zeros(nbp_basic.n_channels, dtype=bool)
+    if r == nbp_basic.anchor_round:
+        scale = config['scale_anchor']
+        use_channels = get_anchor_channels(nbp_basic, filters['filter_kernel_dapi'])
+    else:
+        scale = config['scale']
+        use_channels = nbp_basic.use_channels
+    if round_dask_array is None:
+        round_dask_array = utils.raw.load(nbp_file, nbp_basic, r=r)
+
+    if not nbp_basic.is_3d:
+        # for 2d all channels in same file
+        file_exists = os.path.isfile(nbp_file.tile[t][r])
+        if file_exists:
+            # mmap load in image for all channels if tiff exists
+            im_all_channels_2d = np.load(nbp_file.tile[t][r], mmap_mode='r')
+        else:
+            # Only save 2d data when all channels collected
+            # For channels not used, keep all pixels 0.
+            im_all_channels_2d = np.zeros((nbp_basic.n_channels, nbp_basic.tile_sz,
+                                           nbp_basic.tile_sz), dtype=np.int32)
+    for c in use_channels:
+        if r == nbp_basic.anchor_round and c == nbp_basic.anchor_channel:
+            # max value that can be saved and no shifting done for DAPI
+            max_tiff_pixel_value = np.iinfo(np.uint16).max
+        else:
+            max_tiff_pixel_value = np.iinfo(np.uint16).max - nbp_basic.tile_pixel_value_shift
+        if nbp_basic.is_3d:
+            file_exists = os.path.isfile(nbp_file.tile[t][r][c])
+        if pbar is not None:
+            pbar.set_postfix({'round': r, 'tile': t, 'channel': c, 'exists': str(file_exists)})
+        if file_exists:
+            if r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel:
+                pass
+            else:
+                # Only need to load in mid-z plane if 3D.
+                with utils.timings.span('load', t, r, c):
                     if nbp_basic.is_3d:
-                        file_exists = os.path.isfile(nbp_file.tile[t][r][c])
-                    pbar.set_postfix({'round': r, 'tile': t, 'channel': c, 'exists': str(file_exists)})
-                    if file_exists:
-                        if r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel:
-                            pass
-                        else:
-                            # Only need to load in mid-z plane if 3D.
-                            if nbp_basic.is_3d:
-                                im = utils.npy.load_tile(nbp_file, nbp_basic, t, r, c,
-                                                         yxz=[None, None, nbp_debug.z_info])
-                            else:
-                                im = im_all_channels_2d[c].astype(np.int32) - nbp_basic.tile_pixel_value_shift
-                            nbp.auto_thresh[t, r, c], hist_counts_trc, nbp_debug.n_clip_pixels[t, r, c], \
-                                nbp_debug.clip_extract_scale[t, r, c] = \
-                                extract.get_extract_info(im, config['auto_thresh_multiplier'], hist_bin_edges,
-                                                         max_tiff_pixel_value, scale)
-                            if r != nbp_basic.anchor_round:
-                                nbp.hist_counts[:, r, c] += hist_counts_trc
+                        im = utils.npy.load_tile(nbp_file, nbp_basic, t, r, c, yxz=[None, None, z_info])
                     else:
-                        im = utils.raw.load(nbp_file, nbp_basic, round_dask_array, r, t, c, nbp_basic.use_z)
-                        if not nbp_basic.is_3d:
-                            im = extract.focus_stack(im)
-                        im, bad_columns = extract.strip_hack(im)  # find faulty columns
-                        if config['deconvolve']:
-                            im = extract.wiener_deconvolve(im, config['wiener_pad_shape'], wiener_filter)
-                        if r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel:
-                            im = utils.morphology.top_hat(im, filter_kernel_dapi)
-                            im[:, bad_columns] = 0
-                        else:
-                            # im converted to float in convolve_2d so no point changing dtype before hand.
-                            im = utils.morphology.convolve_2d(im, filter_kernel) * scale
-                            if config['r_smooth'] is not None:
-                                # oa convolve uses lots of memory and much slower here.
-                                im = utils.morphology.imfilter(im, smooth_kernel, oa=False)
-                            im[:, bad_columns] = 0
-                            # get_info is quicker on int32 so do this conversion first.
-                            im = np.rint(im, np.zeros_like(im, dtype=np.int32), casting='unsafe')
-                            # only use image unaffected by strip_hack to get information from tile
-                            good_columns = np.setdiff1d(np.arange(nbp_basic.tile_sz), bad_columns)
-                            nbp.auto_thresh[t, r, c], hist_counts_trc, nbp_debug.n_clip_pixels[t, r, c], \
-                                nbp_debug.clip_extract_scale[t, r, c] = \
-                                extract.get_extract_info(im[:, good_columns], config['auto_thresh_multiplier'],
-                                                         hist_bin_edges, max_tiff_pixel_value, scale,
-                                                         nbp_debug.z_info)
-                            if nbp_debug.n_clip_pixels[t, r, c] > config['n_clip_warn']:
-                                warnings.warn(f"\nTile {t}, round {r}, channel {c} has "
-                                              f"{nbp_debug.n_clip_pixels[t, r, c]} pixels\n"
-                                              f"that will be clipped when converting to uint16.")
-                            if nbp_debug.n_clip_pixels[t, r, c] > config['n_clip_error']:
-                                n_clip_error_images += 1
-                                message = f"\nNumber of images for which more than {config['n_clip_error']} pixels " \
-                                          f"clipped in conversion to uint16 is {n_clip_error_images}."
-                                if n_clip_error_images >= config['n_clip_error_images_thresh']:
-                                    # create new Notebook to save info obtained so far
-                                    nb_fail_name = os.path.join(nbp_file.output_dir, 'notebook_extract_error.npz')
-                                    nb_fail = Notebook(nb_fail_name, None)
-                                    # change names of pages so can add extra properties not in json file.
-                                    nbp.name = 'extract_fail'
-                                    nbp_debug.name = 'extract_debug_fail'
-                                    nbp.fail_trc = np.array([t, r, c])  # record where failure occurred
-                                    nbp_debug.fail_trc = np.array([t, r, c])
-                                    nb_fail += nbp
-                                    nb_fail += nbp_debug
-                                    raise ValueError(f"{message}\nResults up till now saved as {nb_fail_name}.")
-                                else:
-                                    warnings.warn(f"{message}\nWhen this reaches {config['n_clip_error_images_thresh']}"
-                                                  f", the extract step of the algorithm will be interrupted.")
-                            if r != nbp_basic.anchor_round:
-                                nbp.hist_counts[:, r, c] += hist_counts_trc
-                        if nbp_basic.is_3d:
-                            utils.npy.save_tile(nbp_file, nbp_basic, im, t, r, c)
-                        else:
-                            im_all_channels_2d[c] = im
-                    pbar.update(1)
+                        im = im_all_channels_2d[c].astype(np.int32) - nbp_basic.tile_pixel_value_shift
+                auto_thresh[c], hist_counts[:, c], n_clip_pixels[c], clip_extract_scale[c] = \
+                    extract.get_extract_info(im, config['auto_thresh_multiplier'], filters['hist_bin_edges'],
+                                             max_tiff_pixel_value, scale)
+        else:
+            new_image[c] = True
+            with utils.timings.span('load', t, r, c):
+                # Last time raw image needed so remove from cache.
+                im = utils.raw.load(nbp_file, nbp_basic, round_dask_array, r, t, c, nbp_basic.use_z,
+                                    keep_in_cache=False)
+            with utils.timings.span('filter', t, r, c):
                 if not nbp_basic.is_3d:
-                    utils.npy.save_tile(nbp_file, nbp_basic, im_all_channels_2d, t, r)
-    pbar.close()
-    if not nbp_basic.use_anchor:
-        nbp_debug.scale_anchor_tile = None
-        nbp_debug.scale_anchor_z = None
-        nbp_debug.scale_anchor = None
-    return nbp, nbp_debug
+                    im = extract.focus_stack(im, n_threads=n_threads)
+                im, bad_columns = extract.strip_hack(im)  # find faulty columns
+                if config['deconvolve']:
+                    im = extract.wiener_deconvolve(im, config['wiener_pad_shape'], filters['wiener_filter'])
+                if r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel:
+                    im = utils.morphology.top_hat(im, filters['filter_kernel_dapi'])
+                    im[:, bad_columns] = 0
+                else:
+                    # filtered, scaled, smoothed and rounded in float32 buffers reused for each image.
+                    im = extract.filter_image(im, filters['filter_kernel'], scale, filters['smooth_kernel'],
+                                              bad_columns)
+                    # only use image unaffected by strip_hack to get information from tile
+                    good_columns = np.setdiff1d(np.arange(nbp_basic.tile_sz), bad_columns)
+                    auto_thresh[c], hist_counts[:, c], n_clip_pixels[c], clip_extract_scale[c] = \
+                        extract.get_extract_info(im, config['auto_thresh_multiplier'], filters['hist_bin_edges'],
+                                                 max_tiff_pixel_value, scale, z_info, good_columns)
+            if nbp_basic.is_3d:
+                with utils.timings.span('save', t, r, c):
+                    utils.npy.save_tile(nbp_file, nbp_basic, im, t, r, c)
+            else:
+                im_all_channels_2d[c] = im
+        if pbar is not None:
+            pbar.update(1)
+    if not nbp_basic.is_3d:
+        with utils.timings.span('save', t, r):
+            utils.npy.save_tile(nbp_file, nbp_basic, im_all_channels_2d, t, r)
+    return auto_thresh, hist_counts, n_clip_pixels, clip_extract_scale, new_image
+
+
+def add_tile_info(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage, nbp: NotebookPage,
+                  nbp_debug: NotebookPage, tile_info: Tuple[np.ndarray, ...],
+                  t: int, r: int, n_clip_error_images: int) -> int:
+    """
+    Adds the information returned by `extract_tile` to the `extract` and `extract_debug` pages.
+    Also checks how many newly filtered images have had too many pixels clipped. If this exceeds
+    `config['n_clip_error_images_thresh']`, the information found so far is saved and an error is raised.
+
+    Args:
+        config: Dictionary obtained from `'extract'` section of config file after `extract_setup` has been run.
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        nbp: `extract` notebook page which has not been added to the `Notebook` yet.
+        nbp_debug: `extract_debug` notebook page which has not been added to the `Notebook` yet.
+        tile_info: Output of `extract_tile` for tile `t`, round `r`.
+        t: Tile extracted.
+        r: Round extracted.
+        n_clip_error_images: Number of images so far with more than `config['n_clip_error']` pixels clipped.
+
+    Returns:
+        Updated `n_clip_error_images`.
+    """
+    auto_thresh, hist_counts, n_clip_pixels, clip_extract_scale, new_image = tile_info
+    # channels not extracted are 0 in tile_info so can add all channels at once.
+    nbp.auto_thresh[t, r] = auto_thresh
+    nbp_debug.n_clip_pixels[t, r] = n_clip_pixels
+    nbp_debug.clip_extract_scale[t, r] = clip_extract_scale
+    if r != nbp_basic.anchor_round:
+        nbp.hist_counts[:, r] += hist_counts
+    for c in np.where(new_image)[0]:
+        if r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel:
+            continue
+        if n_clip_pixels[c] > config['n_clip_warn']:
+            warnings.warn(f"\nTile {t}, round {r}, channel {c} has "
+                          f"{n_clip_pixels[c]} pixels\n"
+                          f"that will be clipped when converting to uint16.")
+        if n_clip_pixels[c] > config['n_clip_error']:
+            n_clip_error_images += 1
+            message = f"\nNumber of images for which more than {config['n_clip_error']} pixels " \
+                      f"clipped in conversion to uint16 is {n_clip_error_images}."
+            if n_clip_error_images >= config['n_clip_error_images_thresh']:
+                # create new Notebook to save info obtained so far
+                nb_fail_name = os.path.join(nbp_file.output_dir, 'notebook_extract_error.npz')
+                nb_fail = Notebook(nb_fail_name, None)
+                # change names of pages so can add extra properties not in json file.
+                nbp.name = 'extract_fail'
+                nbp_debug.name = 'extract_debug_fail'
+                nbp.fail_trc = np.array([t, r, c])  # record where failure occurred
+                nbp_debug.fail_trc = np.array([t, r, c])
+                nb_fail += nbp
+                nb_fail += nbp_debug
+                raise ValueError(f"{message}\nResults up till now saved as {nb_fail_name}.")
+            else:
+                warnings.warn(f"{message}\nWhen this reaches {config['n_clip_error_images_thresh']}"
+                              f", the extract step of the algorithm will be interrupted.")
+    return n_clip_error_images
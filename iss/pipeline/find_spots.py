@@ -3,6 +3,7 @@ from .. import find_spots as fs
 from tqdm import tqdm
 import numpy as np
 from ..setup.notebook import NotebookPage
+from typing import Optional
 
 
 def find_spots(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage, auto_thresh: np.ndarray) -> NotebookPage:
@@ -29,17 +30,10 @@ def find_spots(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage, au
         # set z details to None if using 2d pipeline
         config['radius_z'] = None
         config['isolation_radius_z'] = None
-        max_spots = config['max_spots_2d']
-    else:
-        max_spots = config['max_spots_3d']
 
     # record threshold for isolated spots in each tile of reference round/channel
-    if config['isolation_thresh'] is None:
-        nbp.isolation_thresh = auto_thresh[:, nbp_basic.ref_round, nbp_basic.anchor_channel] * \
-                                  config['auto_isolation_thresh_multiplier']
-    else:
-        nbp.isolation_thresh = np.ones_like(auto_thresh[:, nbp_basic.ref_round, nbp_basic.anchor_channel]) * \
-                                  config['isolation_thresh']
+    nbp.isolation_thresh = get_isolation_thresh(config, auto_thresh[:, nbp_basic.ref_round,
+                                                                    nbp_basic.anchor_channel])
 
     # have to save spot_yxz and spot_isolated as table to stop pickle issues associated with numpy object arrays.
     # columns of spot_details are: tile, channel, round, isolated, y, x, z
@@ -52,55 +46,130 @@ def find_spots(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage, au
     if nbp_basic.use_anchor:
         use_rounds = use_rounds + [nbp_basic.anchor_round]
         n_images = n_images + len(nbp_basic.use_tiles)
-    n_z = np.max([1, nbp_basic.is_3d * nbp_basic.nz])
     with tqdm(total=n_images) as pbar:
         pbar.set_description(f"Detecting spots on filtered images saved as npy")
         for r in use_rounds:
-            if r == nbp_basic.anchor_round:
-                use_channels = [nbp_basic.anchor_channel]
-            else:
-                use_channels = nbp_basic.use_channels
             for t in nbp_basic.use_tiles:
-                for c in use_channels:
-                    pbar.set_postfix({'round': r, 'tile': t, 'channel': c})
-                    # Find local maxima on shifted uint16 images to save time avoiding conversion to int32.
-                    # Then need to shift the detect_spots and check_neighb_intensity thresh correspondingly.
-                    image = utils.npy.load_tile(nbp_file, nbp_basic, t, r, c, apply_shift=False)
-                    spot_yxz, spot_intensity = fs.detect_spots(image,
-                                                               auto_thresh[t, r, c] + nbp_basic.tile_pixel_value_shift,
-                                                               config['radius_xy'], config['radius_z'], True)
-                    no_negative_neighbour = fs.check_neighbour_intensity(image, spot_yxz,
-                                                                         thresh=nbp_basic.tile_pixel_value_shift)
-                    spot_yxz = spot_yxz[no_negative_neighbour]
-                    spot_intensity = spot_intensity[no_negative_neighbour]
-                    if r == nbp_basic.ref_round:
-                        spot_isolated = fs.get_isolated(image.astype(np.int32) - nbp_basic.tile_pixel_value_shift,
-                                                        spot_yxz, nbp.isolation_thresh[t],
-                                                        config['isolation_radius_inner'],
-                                                        config['isolation_radius_xy'],
-                                                        config['isolation_radius_z'])
-
-                    else:
-                        # if imaging round, only keep highest intensity spots on each z plane
-                        # as only used for registration
-                        keep = np.ones(spot_yxz.shape[0], dtype=bool)
-                        for z in range(n_z):
-                            if nbp_basic.is_3d:
-                                in_z = spot_yxz[:, 2] == z
-                            else:
-                                in_z = np.ones(spot_yxz.shape[0], dtype=bool)
-                            if np.sum(in_z) > max_spots:
-                                intensity_thresh = np.sort(spot_intensity[in_z])[-max_spots]
-                                keep[np.logical_and(in_z, spot_intensity < intensity_thresh)] = False
-                        spot_yxz = spot_yxz[keep]
-                        # don't care if these spots isolated so say they are not
-                        spot_isolated = np.zeros(spot_yxz.shape[0], dtype=bool)
-                    spot_details_trc = np.zeros((spot_yxz.shape[0], spot_details.shape[1]), dtype=np.int16)
-                    spot_details_trc[:, :3] = [t, r, c]
-                    spot_details_trc[:, 3] = spot_isolated
-                    spot_details_trc[:, 4:4+spot_yxz.shape[1]] = spot_yxz  # if 2d pipeline, z coordinate set to 0.
-                    spot_details = np.append(spot_details, spot_details_trc, axis=0)
-                    nbp.spot_no[t, r, c] = spot_yxz.shape[0]
-                    pbar.update(1)
+                spot_details_tr = find_spots_tile(config, nbp_file, nbp_basic, auto_thresh[t, r],
+                                                  nbp.isolation_thresh[t], t, r, pbar)
+                spot_details = np.append(spot_details, spot_details_tr, axis=0)
+                nbp.spot_no[t, r] = get_spot_no(nbp_basic, spot_details_tr, t, r)
     nbp.spot_details = spot_details
     return nbp
+
+
+def get_isolation_thresh(config: dict, auto_thresh_ref: np.ndarray) -> np.ndarray:
+    """
+    Gets the threshold used to decide whether spots on `ref_round` are isolated.
+
+    Args:
+        config: Dictionary obtained from `'find_spots'` section of config file.
+        auto_thresh_ref: `float [n_tiles]`.
+            `auto_thresh_ref[t]` is `auto_thresh[t, ref_round, anchor_channel]`.
+
+    Returns:
+        `float [n_tiles]`. Isolation threshold for each tile.
+    """
+    if config['isolation_thresh'] is None:
+        return auto_thresh_ref * config['auto_isolation_thresh_multiplier']
+    else:
+        return np.ones_like(auto_thresh_ref) * config['isolation_thresh']
+
+
+def find_spots_tile(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage, auto_thresh: np.ndarray,
+                    isolation_thresh: float, t: int, r: int, pbar: Optional[tqdm] = None) -> np.ndarray:
+    """
+    Finds the spots on all channels of tile `t`, round `r`. Only `anchor_channel` is used on the anchor round.
+
+    Args:
+        config: Dictionary obtained from `'find_spots'` section of config file.
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        auto_thresh: `float [n_channels]`.
+            `auto_thresh[c]` is the threshold for the npy file corresponding to tile `t`, round `r`, channel `c`
+            such that all local maxima with pixel values greater than this are considered spots.
+        isolation_thresh: Spots on `ref_round` with a negative neighbourhood intensity below this are isolated.
+        t: Tile to find spots on.
+        r: Round to find spots on.
+        pbar: Progress bar to update after each channel.
+
+    Returns:
+        `int16 [n_spots_tr x 7]`.
+            `spot_details[s]` is `[tile, round, channel, isolated, y, x, z]` of spot `s`.
+    """
+    if nbp_basic.is_3d:
+        max_spots = config['max_spots_3d']
+        radius_z = config['radius_z']
+        isolation_radius_z = config['isolation_radius_z']
+    else:
+        # no z details if using 2d pipeline
+        max_spots = config['max_spots_2d']
+        radius_z = None
+        isolation_radius_z = None
+    if r == nbp_basic.anchor_round:
+        use_channels = [nbp_basic.anchor_channel]
+    else:
+        use_channels = nbp_basic.use_channels
+    n_z = np.max([1, nbp_basic.is_3d * nbp_basic.nz])
+    spot_details = np.empty((0, 7), dtype=np.int16)
+    for c in use_channels:
+        if pbar is not None:
+            pbar.set_postfix({'round': r, 'tile': t, 'channel': c})
+        # Find local maxima on shifted uint16 images to save time avoiding conversion to int32.
+        # Then need to shift the detect_spots and check_neighb_intensity thresh correspondingly.
+        with utils.timings.span('load', t, r, c):
+            image = utils.npy.load_tile(nbp_file, nbp_basic, t, r, c, apply_shift=False)
+        with utils.timings.span('detect', t, r, c):
+            spot_yxz, spot_intensity = fs.detect_spots(image, auto_thresh[c] + nbp_basic.tile_pixel_value_shift,
+                                                       config['radius_xy'], radius_z, True)
+            no_negative_neighbour = fs.check_neighbour_intensity(image, spot_yxz,
+                                                                 thresh=nbp_basic.tile_pixel_value_shift)
+        spot_yxz = spot_yxz[no_negative_neighbour]
+        spot_intensity = spot_intensity[no_negative_neighbour]
+        if r == nbp_basic.ref_round:
+            with utils.timings.span('isolated', t, r, c):
+                spot_isolated = fs.get_isolated(image.astype(np.int32) - nbp_basic.tile_pixel_value_shift,
+                                                spot_yxz, isolation_thresh, config['isolation_radius_inner'],
+                                                config['isolation_radius_xy'], isolation_radius_z)
+
+        else:
+            # if imaging round, only keep highest intensity spots on each z plane
+            # as only used for registration
+            keep = np.ones(spot_yxz.shape[0], dtype=bool)
+            for z in range(n_z):
+                if nbp_basic.is_3d:
+                    in_z = spot_yxz[:, 2] == z
+                else:
+                    in_z = np.ones(spot_yxz.shape[0], dtype=bool)
+                if np.sum(in_z) > max_spots:
+                    intensity_thresh = np.sort(spot_intensity[in_z])[-max_spots]
+                    keep[np.logical_and(in_z, spot_intensity < intensity_thresh)] = False
+            spot_yxz = spot_yxz[keep]
+            # don't care if these spots isolated so say they are not
+            spot_isolated = np.zeros(spot_yxz.shape[0], dtype=bool)
+        spot_details_trc = np.zeros((spot_yxz.shape[0], spot_details.shape[1]), dtype=np.int16)
+        spot_details_trc[:, :3] = [t, r, c]
+        spot_details_trc[:, 3] = spot_isolated
+        spot_details_trc[:, 4:4+spot_yxz.shape[1]] = spot_yxz  # if 2d pipeline, z coordinate set to 0.
+        spot_details = np.append(spot_details, spot_details_trc, axis=0)
+        if pbar is not None:
+            pbar.update(1)
+    return spot_details
+
+
+def get_spot_no(nbp_basic: NotebookPage, spot_details: np.ndarray, t: int, r: int) -> np.ndarray:
+    """
+    Gets the number of spots found on each channel of tile `t`, round `r`.
+
+    Args:
+        nbp_basic: `basic_info` notebook page
+        spot_details: `int [n_spots x 7]`.
+            `spot_details[s]` is `[tile, round, channel, isolated, y, x, z]` of spot `s`.
+        t: Tile of interest.
+        r: Round of interest.
+
+    Returns:
+        `int [n_channels]`. Number of spots found on each channel.
+    """
+    in_tr = np.logical_and(spot_details[:, 0] == t, spot_details[:, 1] == r)
+    return np.bincount(spot_details[in_tr, 2], minlength=nbp_basic.n_channels)
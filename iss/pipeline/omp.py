@@ -4,8 +4,10 @@ import numpy_indexed
 from ..setup.notebook import NotebookPage
 from ..extract import scale
 from ..spot_colors import get_spot_colors_jax, all_pixel_yxz
-from ..call_spots import get_spot_intensity_jax, get_non_duplicate
+from ..call_spots import get_spot_intensity_jax, get_spot_intensity, get_non_duplicate, get_owned_pixels
 from .. import omp
+from ..no_jax.spot_colors import get_spot_colors_use
+from ..no_jax.omp import get_all_coefs as get_all_coefs_no_jax
 import os
 from scipy import sparse
 import jax.numpy as jnp
@@ -14,7 +16,9 @@ import warnings
 
 def call_spots_omp(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage,
                    nbp_call_spots: NotebookPage, tile_origin: np.ndarray,
-                   transform: np.ndarray) -> NotebookPage:
+                   transform: np.ndarray, backend: str = 'jax') -> NotebookPage:
+    if backend not in ['jax', 'numpy']:
+        raise ValueError(f"backend should be either 'jax' or 'numpy' but given value is {backend}")
     nbp = setup.NotebookPage("omp")
 
     # use bled_codes with gene efficiency incorporated and only use_rounds/channels
@@ -25,9 +29,11 @@ def call_spots_omp(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage
     if np.abs(norm_bled_codes - 1).max() > 1e-6:
         raise ValueError("nbp_call_spots.bled_codes_ge don't all have an L2 norm of 1 over "
                          "use_rounds and use_channels.")
-    bled_codes = jnp.asarray(bled_codes)
-    transform = jnp.asarray(transform)
-    color_norm_factor = jnp.asarray(nbp_call_spots.color_norm_factor[rc_ind])
+    color_norm_factor = nbp_call_spots.color_norm_factor[rc_ind]
+    if backend == 'jax':
+        bled_codes = jnp.asarray(bled_codes)
+        transform = jnp.asarray(transform)
+        color_norm_factor = jnp.asarray(color_norm_factor)
     n_genes, n_rounds_use, n_channels_use = bled_codes.shape
     dp_norm_shift = nbp_call_spots.dp_norm_shift * np.sqrt(n_rounds_use)
 
@@ -120,22 +126,41 @@ def call_spots_omp(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage
     for t in use_tiles:
         pixel_yxz_t = np.zeros((0, 3), dtype=np.int16)
         pixel_coefs_t = sparse.csr_matrix(np.zeros((0, n_genes), dtype=np.float32))
+        if spot_shape is not None:
+            # Spots outside the region of the tile closest to its centre are removed as duplicates at the end,
+            # so only need pixels in this region and those within the neighbourhood used to detect spots in it.
+            # spot_shape is found from all pixels of the first tile so that it is the same as before.
+            owned_t = get_owned_pixels(tile_origin, nbp_basic.use_tiles, nbp_basic.tile_centre, nbp_basic.tile_sz,
+                                       t, max(config['radius_xy'], max(spot_shape.shape[:2]) // 2))
+        else:
+            owned_t = None
         for z in use_z:
             print(f"Tile {np.where(use_tiles == t)[0][0] + 1}/{len(use_tiles)},"
                   f" Z-plane {np.where(use_z == z)[0][0] + 1}/{len(use_z)}")
+            pixel_yxz_tz = np.asarray(all_pixel_yxz(nbp_basic.tile_sz, nbp_basic.tile_sz, int(z)))
+            if owned_t is not None:
+                pixel_yxz_tz = pixel_yxz_tz[owned_t[pixel_yxz_tz[:, 0], pixel_yxz_tz[:, 1]]]
             # While iterating through tiles, only save info for rounds/channels using
             # - add all rounds/channels back in later. This returns colors in use_rounds/channels only and no invalid.
-            pixel_colors_tz, pixel_yxz_tz = get_spot_colors_jax(all_pixel_yxz(nbp_basic.tile_sz, nbp_basic.tile_sz,
-                                                                              int(z)), int(t), transform,
-                                                                nbp_file, nbp_basic, return_in_bounds=True)
+            with utils.timings.span('spot_colors', t):
+                if backend == 'jax':
+                    pixel_colors_tz, pixel_yxz_tz = \
+                        get_spot_colors_jax(jnp.asarray(pixel_yxz_tz), int(t), transform, nbp_file, nbp_basic,
+                                            return_in_bounds=True)
+                else:
+                    pixel_colors_tz, pixel_yxz_tz = \
+                        get_spot_colors_use(pixel_yxz_tz, int(t), transform, nbp_file, nbp_basic,
+                                            return_in_bounds=True)
             if pixel_colors_tz.shape[0] == 0:
                 continue
             pixel_colors_tz = pixel_colors_tz / color_norm_factor
 
             # Only keep pixels with significant absolute intensity to save memory.
             # absolute because important to find negative coefficients as well.
-            # pixel_intensity_tz = get_spot_intensity(jnp.abs(pixel_colors_tz))
-            pixel_intensity_tz = get_spot_intensity_jax(jnp.abs(pixel_colors_tz))
+            if backend == 'jax':
+                pixel_intensity_tz = get_spot_intensity_jax(jnp.abs(pixel_colors_tz))
+            else:
+                pixel_intensity_tz = get_spot_intensity(np.abs(pixel_colors_tz))
             keep = pixel_intensity_tz > nbp.initial_intensity_thresh
             if not keep.any():
                 continue
@@ -143,10 +168,13 @@ def call_spots_omp(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage
             pixel_yxz_tz = pixel_yxz_tz[keep]
             del pixel_intensity_tz, keep
 
-            pixel_coefs_tz = sparse.csr_matrix(
-                omp.get_all_coefs(pixel_colors_tz, bled_codes,
+            get_all_coefs = omp.get_all_coefs if backend == 'jax' else get_all_coefs_no_jax
+            with utils.timings.span('coefs', t):
+                pixel_coefs_tz = sparse.csr_matrix(
+                    get_all_coefs(pixel_colors_tz, bled_codes,
                                   nbp_call_spots.background_weight_shift, dp_norm_shift, config['dp_thresh'],
-                                  config['alpha'], config['beta'], config['max_genes'], config['weight_coef_fit'])[0])
+                                  config['alpha'], config['beta'], config['max_genes'],
+                                  config['weight_coef_fit'])[0])
             del pixel_colors_tz
             # Only keep pixels for which at least one gene has non-zero coefficient.
             keep = (np.abs(pixel_coefs_tz).max(axis=1) > 0).nonzero()[0]  # nonzero as is sparse matrix.
@@ -159,13 +187,15 @@ def call_spots_omp(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage
             del pixel_coefs_tz, keep
 
         if spot_shape is None:
-            nbp.shape_tile = int(t)
-            spot_yxz, spot_gene_no = omp.get_spots(pixel_coefs_t, pixel_yxz_t, config['radius_xy'], detect_radius_z)
-            z_scale = nbp_basic.pixel_size_z / nbp_basic.pixel_size_xy
-            spot_shape, spots_used, nbp.spot_shape_float = \
-                omp.spot_neighbourhood(pixel_coefs_t, pixel_yxz_t, spot_yxz, spot_gene_no, config['shape_max_size'],
-                                       config['shape_pos_neighbour_thresh'], config['shape_isolation_dist'], z_scale,
-                                       config['shape_sign_thresh'])
+            with utils.timings.span('spot_shape', t):
+                nbp.shape_tile = int(t)
+                spot_yxz, spot_gene_no = omp.get_spots(pixel_coefs_t, pixel_yxz_t, config['radius_xy'],
+                                                       detect_radius_z)
+                z_scale = nbp_basic.pixel_size_z / nbp_basic.pixel_size_xy
+                spot_shape, spots_used, nbp.spot_shape_float = \
+                    omp.spot_neighbourhood(pixel_coefs_t, pixel_yxz_t, spot_yxz, spot_gene_no,
+                                           config['shape_max_size'], config['shape_pos_neighbour_thresh'],
+                                           config['shape_isolation_dist'], z_scale, config['shape_sign_thresh'])
 
             nbp.shape_spot_local_yxz = spot_yxz[spots_used]
             nbp.shape_spot_gene_no = spot_gene_no[spots_used]
@@ -187,9 +217,10 @@ def call_spots_omp(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage
             initial_pos_neighbour_thresh = int(np.clip(initial_pos_neighbour_thresh,
                                                        config['initial_pos_neighbour_thresh_min'],
                                                        config['initial_pos_neighbour_thresh_max']))
-        spot_info_t = \
-            omp.get_spots(pixel_coefs_t, pixel_yxz_t, config['radius_xy'], detect_radius_z, 0, spot_shape,
-                          initial_pos_neighbour_thresh, spot_yxzg)
+        with utils.timings.span('spots', t):
+            spot_info_t = \
+                omp.get_spots(pixel_coefs_t, pixel_yxz_t, config['radius_xy'], detect_radius_z, 0, spot_shape,
+                              initial_pos_neighbour_thresh, spot_yxzg)
         del spot_yxzg
         n_spots = spot_info_t[0].shape[0]
         spot_info_t = np.concatenate([spot_var.reshape(n_spots, -1).astype(np.int16) for spot_var in spot_info_t],
@@ -200,24 +231,25 @@ def call_spots_omp(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage
         pixel_index = numpy_indexed.indices(pixel_yxz_t, spot_info_t[:, :3])
 
         # append this tile info to all tile info
-        if os.path.isfile(nbp_file.omp_spot_info) and os.path.isfile(nbp_file.omp_spot_coef):
-            # After ran on one tile, need to load in spot_coefs and spot_info, append and then save again.
-            spot_coefs = sparse.load_npz(nbp_file.omp_spot_coef)
-            spot_coefs = sparse.vstack((spot_coefs, pixel_coefs_t[pixel_index]))
-            del pixel_coefs_t, pixel_index
-            sparse.save_npz(nbp_file.omp_spot_coef, spot_coefs)
-            del spot_coefs
-            spot_info = np.load(nbp_file.omp_spot_info)
-            spot_info = np.append(spot_info, spot_info_t, axis=0)
-            del spot_info_t
-            np.save(nbp_file.omp_spot_info, spot_info)
-            del spot_info
-        else:
-            # 1st tile, need to create files to save to
-            sparse.save_npz(nbp_file.omp_spot_coef, pixel_coefs_t[pixel_index])
-            del pixel_coefs_t, pixel_index
-            np.save(nbp_file.omp_spot_info, spot_info_t.astype(np.int16))
-            del spot_info_t
+        with utils.timings.span('save', t):
+            if os.path.isfile(nbp_file.omp_spot_info) and os.path.isfile(nbp_file.omp_spot_coef):
+                # After ran on one tile, need to load in spot_coefs and spot_info, append and then save again.
+                spot_coefs = sparse.load_npz(nbp_file.omp_spot_coef)
+                spot_coefs = sparse.vstack((spot_coefs, pixel_coefs_t[pixel_index]))
+                del pixel_coefs_t, pixel_index
+                sparse.save_npz(nbp_file.omp_spot_coef, spot_coefs)
+                del spot_coefs
+                spot_info = np.load(nbp_file.omp_spot_info)
+                spot_info = np.append(spot_info, spot_info_t, axis=0)
+                del spot_info_t
+                np.save(nbp_file.omp_spot_info, spot_info)
+                del spot_info
+            else:
+                # 1st tile, need to create files to save to
+                sparse.save_npz(nbp_file.omp_spot_coef, pixel_coefs_t[pixel_index])
+                del pixel_coefs_t, pixel_index
+                np.save(nbp_file.omp_spot_info, spot_info_t.astype(np.int16))
+                del spot_info_t
 
     nbp.spot_shape = spot_shape
     nbp.initial_pos_neighbour_thresh = initial_pos_neighbour_thresh
@@ -233,17 +265,25 @@ def call_spots_omp(config: dict, nbp_file: NotebookPage, nbp_basic: NotebookPage
 
     # Get colors, background_coef and intensity of final spots.
     n_spots = np.sum(not_duplicate)
-    nan_value = -nbp_basic.tile_pixel_value_shift - 1
+    nan_value = -nbp_basic.tile_pixel_value_shift
     # Only read in used colors first for background/intensity calculation.
     nd_spot_colors_use = np.ones((n_spots, n_rounds_use, n_channels_use), dtype=np.int32) * nan_value
     for t in nbp_basic.use_tiles:
         in_tile = nbp.tile == t
         if np.sum(in_tile) > 0:
-            nd_spot_colors_use[in_tile] = get_spot_colors_jax(jnp.asarray(nbp.local_yxz[in_tile]), t,
-                                                              transform, nbp_file, nbp_basic)
+            if backend == 'jax':
+                nd_spot_colors_use[in_tile] = get_spot_colors_jax(jnp.asarray(nbp.local_yxz[in_tile]), t,
+                                                                  transform, nbp_file, nbp_basic)
+            else:
+                nd_spot_colors_use[in_tile] = get_spot_colors_use(nbp.local_yxz[in_tile], t, transform, nbp_file,
+                                                                  nbp_basic)
 
-    spot_colors_norm = jnp.array(nd_spot_colors_use) / color_norm_factor
-    nbp.intensity = np.asarray(get_spot_intensity_jax(spot_colors_norm))
+    if backend == 'jax':
+        spot_colors_norm = jnp.array(nd_spot_colors_use) / color_norm_factor
+        nbp.intensity = np.asarray(get_spot_intensity_jax(spot_colors_norm))
+    else:
+        spot_colors_norm = nd_spot_colors_use / color_norm_factor
+        nbp.intensity = get_spot_intensity(spot_colors_norm)
     del spot_colors_norm
 
     # When saving to notebook, include unused rounds/channels.
@@ -1,6 +1,6 @@
-from .. import setup
+from .. import setup, utils
 from ..spot_colors import get_spot_colors_jax
-from ..no_jax.spot_colors import get_spot_colors
+from ..no_jax.spot_colors import get_spot_colors_use
 from ..call_spots import get_non_duplicate
 from ..find_spots import spot_yxz
 import numpy as np
@@ -9,7 +9,7 @@ from ..setup.notebook import NotebookPage
 
 
 def reference_spots(nbp_file: NotebookPage, nbp_basic: NotebookPage, spot_details: np.ndarray,
-                    tile_origin: np.ndarray, transform: np.ndarray) -> NotebookPage:
+                    tile_origin: np.ndarray, transform: np.ndarray, backend: str = 'jax') -> NotebookPage:
     """
     This takes each spot found on the reference round/channel and computes the corresponding intensity
     in each of the imaging rounds/channels.
@@ -31,6 +31,7 @@ def reference_spots(nbp_file: NotebookPage, nbp_basic: NotebookPage, spot_detail
             `transform[t, r, c]` is the affine transform to get from tile `t`, `ref_round`, `ref_channel` to
             tile `t`, round `r`, channel `c`.
             This is saved in the register notebook page i.e. `nb.register.transform`.
+        backend: `'jax'` or `'numpy'`, indicating which implementation is used to read in the spot colors.
 
     Returns:
         `NotebookPage[ref_spots]` - Page containing intensity of each reference spot on each imaging round/channel.
@@ -65,15 +66,23 @@ def reference_spots(nbp_file: NotebookPage, nbp_basic: NotebookPage, spot_detail
     use_tiles = np.array(nbp_basic.use_tiles.copy())
     n_use_tiles = len(use_tiles)
     nd_spot_colors_use = np.zeros((nd_local_tile.shape[0], n_use_rounds, n_use_channels), dtype=np.int32)
-    transform = jnp.asarray(transform)
+    if backend == 'jax':
+        transform = jnp.asarray(transform)
+    elif backend != 'numpy':
+        raise ValueError(f"backend should be either 'jax' or 'numpy' but given value is {backend}")
     print('Reading in spot_colors for ref_round spots')
     for t in nbp_basic.use_tiles:
         in_tile = nd_local_tile == t
         if np.sum(in_tile) > 0:
             print(f"Tile {np.where(use_tiles==t)[0][0]+1}/{n_use_tiles}")
             # this line will return invalid_value for spots outside tile bounds on particular r/c.
-            nd_spot_colors_use[in_tile] = get_spot_colors_jax(jnp.asarray(nd_local_yxz[in_tile]), t,
-                                                              transform, nbp_file, nbp_basic)
+            with utils.timings.span('spot_colors', t):
+                if backend == 'jax':
+                    nd_spot_colors_use[in_tile] = get_spot_colors_jax(jnp.asarray(nd_local_yxz[in_tile]), t,
+                                                                      transform, nbp_file, nbp_basic)
+                else:
+                    nd_spot_colors_use[in_tile] = get_spot_colors_use(nd_local_yxz[in_tile], t, transform,
+                                                                      nbp_file, nbp_basic)
     # good means all spots that were in bounds of tile on every imaging round and channel that was used.
     # nd_spot_colors_use = np.moveaxis(nd_spot_colors_use, 0, -1)
     # use_rc_index = np.ix_(nbp_basic.use_rounds, nbp_basic.use_channels)
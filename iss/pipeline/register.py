@@ -82,11 +82,12 @@ def register(config: dict, nbp_basic: NotebookPage, spot_details: np.ndarray,
     transform_outliers = np.zeros_like(start_transform)
 
     # get PCR output only for tiles/rounds/channels that we are using
-    final_transform[trc_ind], pcr_debug = \
-        pcr.iterate(spot_yxz_ref[nbp_basic.use_tiles], spot_yxz_imaging[trc_ind],
-                    start_transform[trc_ind], config['n_iter'], neighb_dist_thresh,
-                    n_matches_thresh[trc_ind], config['scale_dev_thresh'], config['shift_dev_thresh'],
-                    config['regularize_constant_scale'], config['regularize_constant_shift'])
+    with utils.timings.span('icp'):
+        final_transform[trc_ind], pcr_debug = \
+            pcr.iterate(spot_yxz_ref[nbp_basic.use_tiles], spot_yxz_imaging[trc_ind],
+                        start_transform[trc_ind], config['n_iter'], neighb_dist_thresh,
+                        n_matches_thresh[trc_ind], config['scale_dev_thresh'], config['shift_dev_thresh'],
+                        config['regularize_constant_scale'], config['regularize_constant_shift'])
 
     # save debug info at correct tile, round, channel index
     n_matches[trc_ind] = pcr_debug['n_matches']
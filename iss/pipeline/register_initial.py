@@ -1,17 +1,24 @@
-from .. import utils, setup
+from .. import setup, utils
 import numpy as np
 from tqdm import tqdm
 from ..stitch import compute_shift, update_shifts
 from ..find_spots import spot_yxz
 from ..setup.notebook import NotebookPage
 import warnings
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Executor
+from typing import Optional, Tuple, List
 
 
-def register_initial(config: dict, nbp_basic: NotebookPage, spot_details: np.ndarray) -> NotebookPage:
+def register_initial(config: dict, nbp_basic: NotebookPage, spot_details: np.ndarray,
+                     n_workers: int = 1) -> NotebookPage:
     """
     This finds the shift between ref round/channel to each imaging round for each tile.
     These are then used as the starting point for determining the affine transforms in `pipeline/register.py`.
 
+    The shift search of every round starts from the range given in `config`, the range narrowed while finding the
+    shifts of one round is not used for any other round.
+
     See `'register_initial_debug'` section of `notebook_comments.json` file
     for description of the variables in the page.
 
@@ -21,106 +28,238 @@ def register_initial(config: dict, nbp_basic: NotebookPage, spot_details: np.nda
         spot_details: `int [n_spots x 7]`.
             `spot_details[s]` is `[tile, round, channel, isolated, y, x, z]` of spot `s`.
             This is saved in the find_spots notebook page i.e. `nb.find_spots.spot_details`.
+        n_workers: Number of processes used to find shifts. Rounds are independent so are run at the same time,
+            and if `config['n_seed_tiles'] > 0` so are the tiles within a round after the seed tiles.
+            The result does not depend on `n_workers`.
 
     Returns:
         `NotebookPage[register_initial_debug]` - Page contains information about how shift between ref round/channel
             to each imaging round for each tile was found.
     """
     nbp_debug = setup.NotebookPage("register_initial_debug")
+    start_shift_search = register_initial_setup(config, nbp_basic)
+    nbp_debug.shift_channel = config['shift_channel']
+
+    shift = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds, 3), dtype=int)
+    shift_score = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds), dtype=float)
+    shift_score_thresh = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds), dtype=float)
+    shift_outlier = np.zeros_like(shift)
+    shift_score_outlier = np.zeros_like(shift_score)
+    final_shift_search = np.zeros_like(start_shift_search)
+    final_shift_search[:, :, 2] = start_shift_search[:, :, 2]  # spacing does not change
+
+    if n_workers < 1:
+        raise ValueError(f"n_workers must be at least 1 but value given is {n_workers}.")
+    with tqdm(total=len(nbp_basic.use_rounds) * len(nbp_basic.use_tiles)) as pbar:
+        pbar.set_description(f"Finding shift from ref_round({nbp_basic.ref_round})/ref_channel"
+                             f"({nbp_basic.ref_channel}) to channel {config['shift_channel']} of all imaging rounds")
+        if n_workers > 1:
+            # Shifts are found in processes as compute_shift mostly holds the GIL. Spawn not fork, as forking
+            # a process which has started jax threads can deadlock. Each round thread only waits for the shifts
+            # of its round, results saved in order of round so deterministic.
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) \
+                    as shift_executor, ThreadPoolExecutor(max_workers=len(nbp_basic.use_rounds)) as round_executor:
+                round_results = {r: round_executor.submit(register_initial_round, config, nbp_basic, spot_details,
+                                                          r, start_shift_search[r], pbar, shift_executor)
+                                 for r in nbp_basic.use_rounds}
+                round_results = {r: round_results[r].result() for r in nbp_basic.use_rounds}
+        else:
+            round_results = {r: register_initial_round(config, nbp_basic, spot_details, r, start_shift_search[r],
+                                                       pbar) for r in nbp_basic.use_rounds}
+        for r in nbp_basic.use_rounds:
+            shift[:, r], shift_score[:, r], shift_score_thresh[:, r], shift_outlier[:, r], \
+                shift_score_outlier[:, r], final_shift_search[r, :, :2] = round_results[r]
+
+    nbp_debug.shift = shift
+    nbp_debug.start_shift_search = start_shift_search
+    nbp_debug.final_shift_search = final_shift_search
+    nbp_debug.shift_score = shift_score
+    nbp_debug.shift_score_thresh = shift_score_thresh
+    nbp_debug.shift_outlier = shift_outlier
+    nbp_debug.shift_score_outlier = shift_score_outlier
+
+    return nbp_debug
+
+
+def register_initial_setup(config: dict, nbp_basic: NotebookPage) -> np.ndarray:
+    """
+    Sets the default values in `config` and finds the range of shifts to search at the start for each round.
+
+    Args:
+        config: Dictionary obtained from `'register_initial'` section of config file. Will be updated.
+        nbp_basic: `basic_info` notebook page
+
+    Returns:
+        `int [n_rounds x 3 x 3]`.
+            `start_shift_search[r, i, :]` is `[min, max, step]` of the shift search in direction `i` for round `r`.
+    """
     if config['shift_channel'] is None:
         config['shift_channel'] = nbp_basic.ref_channel
     if not np.isin(config['shift_channel'], nbp_basic.use_channels):
         raise ValueError(f"config['shift_channel'] should be in nb.basic_info.use_channels, but value given is\n"
                          f"{config['shift_channel']} which is not in use_channels = {nbp_basic.use_channels}.")
-    nbp_debug.shift_channel = config['shift_channel']
-
-    coords = ['y', 'x', 'z']
-    shifts = [{}]
     start_shift_search = np.zeros((nbp_basic.n_rounds, 3, 3), dtype=int)
-    for i in range(len(coords)):
-        shifts[0][coords[i]] = np.arange(config['shift_min'][i],
-                                         config['shift_max'][i] +
-                                         config['shift_step'][i] / 2, config['shift_step'][i]).astype(int)
+    for i in range(3):
         start_shift_search[nbp_basic.use_rounds, i, :] = [config['shift_min'][i], config['shift_max'][i],
                                                           config['shift_step'][i]]
     if not nbp_basic.is_3d:
         config['shift_widen'][2] = 0  # so don't look for shifts in z direction
         config['shift_max_range'][2] = 0
-        shifts[0]['z'] = np.array([0], dtype=int)
         start_shift_search[:, 2, :2] = 0
-    shifts = shifts * nbp_basic.n_rounds  # get one set of shifts for each round
+    return start_shift_search
 
-    shift = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds, 3), dtype=int)
-    shift_score = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds), dtype=float)
-    shift_score_thresh = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds), dtype=float)
+
+def register_initial_round(config: dict, nbp_basic: NotebookPage, spot_details: np.ndarray, r: int,
+                           start_shift_search: np.ndarray,
+                           pbar: Optional[tqdm] = None,
+                           executor: Optional[Executor] = None) -> Tuple[np.ndarray, np.ndarray, np.ndarray,
+                                                                         np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Finds the shift between ref round/channel and round `r` for each tile.
+    The search is narrowed to near the shifts already found once 3 tiles have a good shift, and tiles whose
+    score fell below the threshold are searched again near the good shifts at the end.
+
+    If `config['n_seed_tiles'] > 0`, only the `n_seed_tiles` tiles nearest the centre are found one after the
+    other while narrowing the search. All other tiles are then searched over the same narrowed range so can be
+    found at the same time, if `executor` is given. The result does not depend on `executor`.
+
+    Rounds are independent of each other so this can be run for each round as soon as its spots are found.
+
+    Args:
+        config: Dictionary obtained from `'register_initial'` section of config file
+            after `register_initial_setup` has been run.
+        nbp_basic: `basic_info` notebook page
+        spot_details: `int [n_spots x 7]`.
+            `spot_details[s]` is `[tile, round, channel, isolated, y, x, z]` of spot `s`.
+            Only needs to contain spots on `ref_round` and round `r`.
+        r: Round to find shifts for.
+        start_shift_search: `int [3 x 3]`.
+            `start_shift_search[i, :]` is `[min, max, step]` of the shift search in direction `i` at the start.
+        pbar: Progress bar to update after each tile.
+        executor: If given, shifts are found with this e.g. a `ProcessPoolExecutor` shared between rounds.
+            Tiles after the seed tiles are then all submitted at once.
+
+    Returns:
+        - `shift` - `int [n_tiles x 3]`. `shift[t]` is the yxz shift from tile `t`, ref round to tile `t`, round `r`.
+        - `shift_score` - `float [n_tiles]`. Score of each shift.
+        - `shift_score_thresh` - `float [n_tiles]`. Score needed for each shift to be considered good.
+        - `shift_outlier` - `int [n_tiles x 3]`. Shift found before the second search for shifts which were not good.
+            0 for good shifts.
+        - `shift_score_outlier` - `float [n_tiles]`. Score of `shift_outlier`.
+        - `final_shift_search` - `int [3 x 2]`. `[min, max]` of the shift search in each direction at the end.
+    """
+    coords = ['y', 'x', 'z']
+    shifts = {}
+    for i in range(len(coords)):
+        shifts[coords[i]] = np.arange(start_shift_search[i, 0], start_shift_search[i, 1] +
+                                      start_shift_search[i, 2] / 2, start_shift_search[i, 2]).astype(int)
+    if not nbp_basic.is_3d:
+        shifts['z'] = np.array([0], dtype=int)
+
+    shift = np.zeros((nbp_basic.n_tiles, 3), dtype=int)
+    shift_score = np.zeros(nbp_basic.n_tiles, dtype=float)
+    shift_score_thresh = np.zeros(nbp_basic.n_tiles, dtype=float)
 
     c_ref = nbp_basic.ref_channel
     r_ref = nbp_basic.ref_round
     c_imaging = config['shift_channel']
     # to convert z coordinate units to xy pixels when calculating distance to nearest neighbours
     z_scale = nbp_basic.pixel_size_z / nbp_basic.pixel_size_xy
-    with tqdm(total=len(nbp_basic.use_rounds) * len(nbp_basic.use_tiles)) as pbar:
-        pbar.set_description(f"Finding shift from ref_round({r_ref})/ref_channel({c_ref}) to channel {c_imaging} "
-                             f"of all imaging rounds")
-        for r in nbp_basic.use_rounds:
-            for t in nbp_basic.use_tiles:
-                pbar.set_postfix({'round': r, 'tile': t})
-                shift[t, r], shift_score[t, r], shift_score_thresh[t, r] = \
-                    compute_shift(spot_yxz(spot_details, t, r_ref, c_ref), spot_yxz(spot_details, t, r, c_imaging),
-                                  config['shift_score_thresh'], config['shift_score_thresh_multiplier'],
-                                  config['shift_score_thresh_min_dist'], config['shift_score_thresh_max_dist'],
-                                  config['neighb_dist_thresh'], shifts[r]['y'], shifts[r]['x'], shifts[r]['z'],
-                                  config['shift_widen'], config['shift_max_range'], z_scale,
-                                  config['nz_collapse'], config['shift_step'][2])[:3]
-                good_shifts = shift_score[:, r] > shift_score_thresh[:, r]
-                if np.sum(good_shifts) >= 3:
-                    # once found shifts, refine shifts to be searched around these
-                    for i in range(len(coords)):
-                        shifts[r][coords[i]] = update_shifts(shifts[r][coords[i]], shift[good_shifts, r, i])
-                pbar.update(1)
-    pbar.close()
+
+    def shift_args(t: int) -> list:
+        # arguments of compute_shift for tile t with current search range.
+        return [spot_yxz(spot_details, t, r_ref, c_ref), spot_yxz(spot_details, t, r, c_imaging),
+                config['shift_score_thresh'], config['shift_score_thresh_multiplier'],
+                config['shift_score_thresh_min_dist'], config['shift_score_thresh_max_dist'],
+                config['neighb_dist_thresh'], shifts['y'], shifts['x'], shifts['z'], config['shift_widen'],
+                config['shift_max_range'], z_scale, config['nz_collapse'], config['shift_step'][2]]
+
+    def save_shift(t: int, result: tuple):
+        shift[t], shift_score[t], shift_score_thresh[t] = result[:3]
+        if pbar is not None:
+            pbar.update(1)
+
+    def find_shift(t: int):
+        if pbar is not None:
+            pbar.set_postfix({'round': r, 'tile': t})
+        with utils.timings.span('shift', t, r, c_imaging):
+            if executor is None:
+                result = compute_shift(*shift_args(t))
+            else:
+                result = executor.submit(compute_shift, *shift_args(t)).result()
+        save_shift(t, result)
+
+    if config['n_seed_tiles'] > 0:
+        seed_tiles = get_seed_tiles(nbp_basic.tilepos_yx, nbp_basic.use_tiles, config['n_seed_tiles'])
+    else:
+        seed_tiles = list(nbp_basic.use_tiles)
+    for t in seed_tiles:
+        find_shift(t)
+        good_shifts = shift_score > shift_score_thresh
+        if np.sum(good_shifts) >= 3:
+            # once found shifts, refine shifts to be searched around these
+            for i in range(len(coords)):
+                shifts[coords[i]] = update_shifts(shifts[coords[i]], shift[good_shifts, i])
+    # search range no longer changes so remaining tiles independent of each other.
+    other_tiles = [t for t in nbp_basic.use_tiles if t not in seed_tiles]
+    if executor is not None and len(other_tiles) > 1:
+        futures = [executor.submit(compute_shift, *shift_args(t)) for t in other_tiles]
+        for t, future in zip(other_tiles, futures):
+            save_shift(t, future.result())
+    else:
+        for t in other_tiles:
+            find_shift(t)
 
     # amend shifts for which score fell below score_thresh
     shift_outlier = shift.copy()
     shift_score_outlier = shift_score.copy()
     n_shifts = len(nbp_basic.use_tiles)
-    final_shift_search = np.zeros_like(start_shift_search)
-    final_shift_search[:, :, 2] = start_shift_search[:, :, 2]  # spacing does not change
-    for r in nbp_basic.use_rounds:
-        good_shifts = shift_score[:, r] > shift_score_thresh[:, r]
-        for i in range(len(coords)):
-            # change shift search to be near good shifts found
-            # this will only do something if 3>sum(good_shifts)>0, otherwise will have been done in previous loop.
-            if np.sum(good_shifts) > 0:
-                shifts[r][coords[i]] = update_shifts(shifts[r][coords[i]], shift[good_shifts, r, i])
-            elif good_shifts.size > 0:
-                shifts[r][coords[i]] = update_shifts(shifts[r][coords[i]], shift[:, r, i])
-        final_shift_search[r, :, 0] = [np.min(shifts[r][key]) for key in shifts[r].keys()]
-        final_shift_search[r, :, 1] = [np.max(shifts[r][key]) for key in shifts[r].keys()]
-        shift_outlier[good_shifts, r] = 0  # only keep outlier information for not good shifts
-        shift_score_outlier[good_shifts, r] = 0
-        if (np.sum(good_shifts) < 2 and n_shifts > 4) or (np.sum(good_shifts) == 0 and n_shifts > 0):
-            warnings.warn(f"Round {r}: {n_shifts - np.sum(good_shifts)}/{n_shifts} "
-                          f"of shifts fell below score threshold")
-        for t in np.where(good_shifts == False)[0]:
-            if t not in nbp_basic.use_tiles:
-                continue
-            # re-find shifts that fell below threshold by only looking at shifts near to others found
-            # score set to 0 so will find do refined search no matter what.
-            shift[t, r], shift_score[t, r] = compute_shift(spot_yxz(spot_details, t, r_ref, c_ref),
-                                                           spot_yxz(spot_details, t, r, c_imaging), 0, None, None,
-                                                           None, config['neighb_dist_thresh'], shifts[r]['y'],
-                                                           shifts[r]['x'], shifts[r]['z'], None, None, z_scale,
-                                                           config['nz_collapse'], config['shift_step'][2])[:2]
-            warnings.warn(f"\nShift for tile {t} to round {r} changed from\n"
-                          f"{shift_outlier[t, r]} to {shift[t, r]}.")
+    good_shifts = shift_score > shift_score_thresh
+    for i in range(len(coords)):
+        # change shift search to be near good shifts found
+        # this will only do something if 3>sum(good_shifts)>0, otherwise will have been done in previous loop.
+        if np.sum(good_shifts) > 0:
+            shifts[coords[i]] = update_shifts(shifts[coords[i]], shift[good_shifts, i])
+        elif good_shifts.size > 0:
+            shifts[coords[i]] = update_shifts(shifts[coords[i]], shift[:, i])
+    final_shift_search = np.array([[np.min(shifts[key]), np.max(shifts[key])] for key in coords])
+    shift_outlier[good_shifts] = 0  # only keep outlier information for not good shifts
+    shift_score_outlier[good_shifts] = 0
+    if (np.sum(good_shifts) < 2 and n_shifts > 4) or (np.sum(good_shifts) == 0 and n_shifts > 0):
+        warnings.warn(f"Round {r}: {n_shifts - np.sum(good_shifts)}/{n_shifts} "
+                      f"of shifts fell below score threshold")
+    for t in np.where(good_shifts == False)[0]:
+        if t not in nbp_basic.use_tiles:
+            continue
+        # re-find shifts that fell below threshold by only looking at shifts near to others found
+        # score set to 0 so will find do refined search no matter what.
+        with utils.timings.span('shift_outlier', t, r, c_imaging):
+            shift[t], shift_score[t] = compute_shift(spot_yxz(spot_details, t, r_ref, c_ref),
+                                                     spot_yxz(spot_details, t, r, c_imaging), 0, None, None,
+                                                     None, config['neighb_dist_thresh'], shifts['y'],
+                                                     shifts['x'], shifts['z'], None, None, z_scale,
+                                                     config['nz_collapse'], config['shift_step'][2])[:2]
+        warnings.warn(f"\nShift for tile {t} to round {r} changed from\n"
+                      f"{shift_outlier[t]} to {shift[t]}.")
+    return shift, shift_score, shift_score_thresh, shift_outlier, shift_score_outlier, final_shift_search
 
-    nbp_debug.shift = shift
-    nbp_debug.start_shift_search = start_shift_search
-    nbp_debug.final_shift_search = final_shift_search
-    nbp_debug.shift_score = shift_score
-    nbp_debug.shift_score_thresh = shift_score_thresh
-    nbp_debug.shift_outlier = shift_outlier
-    nbp_debug.shift_score_outlier = shift_score_outlier
 
-    return nbp_debug
+def get_seed_tiles(tilepos_yx: np.ndarray, use_tiles: List[int], n_seed_tiles: int) -> List[int]:
+    """
+    Returns the tiles nearest the centre of all tiles used. Shifts of these are found first in
+    `register_initial_round` to narrow the search for the other tiles.
+
+    Args:
+        tilepos_yx: `int [n_tiles x 2]`. `tilepos_yx[t]` is the yx position of tile `t` in the tile grid.
+        use_tiles: `int [n_use_tiles]`. Tiles used in the pipeline.
+        n_seed_tiles: Number of tiles to return.
+
+    Returns:
+        `int [min(n_seed_tiles, n_use_tiles)]`. Tiles in order of distance to centre, ties broken by tile number.
+    """
+    use_tiles = np.asarray(use_tiles, dtype=int)
+    if len(use_tiles) == 0:
+        return []
+    tile_yx = np.asarray(tilepos_yx, dtype=float)[use_tiles]
+    dist = np.linalg.norm(tile_yx - tile_yx.mean(axis=0), axis=1)
+    return [int(t) for t in use_tiles[np.lexsort((use_tiles, dist))][:n_seed_tiles]]
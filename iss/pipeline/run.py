@@ -1,17 +1,25 @@
 import os
+import time
 from .. import setup, utils
 from . import set_basic_info, extract_and_filter, find_spots, stitch, register_initial, register, reference_spots, \
-    call_reference_spots, call_spots_omp
-from ..call_spots import get_non_duplicate
+    call_reference_spots, call_spots_omp, set_jax_cache, warm_up_jax, run_tasks
+from ..call_spots import get_non_duplicate, get_results_index
 import warnings
 import numpy as np
 from scipy import sparse
+from typing import List
 
 
 def run_pipeline(config_file: str) -> setup.Notebook:
     """
     Bridge function to run every step of the pipeline.
 
+    If `config['runtime']['scheduler']`, the steps up to `register_initial` are run as tasks for each tile and round
+    through `run_tasks`, so each task starts as soon as its inputs exist.
+
+    If `config['runtime']['timings']`, the time and memory used by each step are saved in the `timings` page
+    of the notebook after each step.
+
     Args:
         config_file: Path to config file.
 
@@ -19,12 +27,73 @@ def run_pipeline(config_file: str) -> setup.Notebook:
         `Notebook` containing all information gathered during the pipeline.
     """
     nb = initialize_nb(config_file)
-    run_extract(nb)
-    run_find_spots(nb)
-    run_stitch(nb)
-    run_register(nb)
-    run_reference_spots(nb)
-    run_omp(nb)
+    config = nb.get_config()
+    if config['runtime']['timings']:
+        timings_log = config['runtime']['timings_log']
+        if timings_log is not None:
+            timings_log = os.path.join(nb.file_names.output_dir, timings_log)
+        utils.timings.start(timings_log)
+    try:
+        if config['runtime']['jax_warm_up'] and config['runtime']['backend'] == 'jax':
+            with utils.timings.span('warm_up_jax'):
+                warm_up_jax(nb.basic_info)
+        if config['runtime']['scheduler']:
+            with utils.timings.span('tasks'):
+                run_tasks(nb)
+            utils.timings.update_page(nb)
+        for run_step in [run_extract, run_find_spots, run_stitch, run_register, run_reference_spots, run_omp]:
+            run_step(nb)
+            utils.timings.update_page(nb)
+    finally:
+        utils.timings.stop()
+    return nb
+
+
+def run_worker(config_file: str, poll_time: float = 2) -> setup.Notebook:
+    """
+    Runs the tasks of `run_tasks` alongside `run_pipeline` and any other workers with the same `config_file`,
+    on any machines which share `output_dir`. Requires `config['runtime']['scheduler']` and
+    `config['runtime']['work_queue']`.
+
+    The worker waits until `run_pipeline` has saved the `Notebook` with the `basic_info` page, then runs tasks
+    not claimed by another process until all have finished. No pages are added to the `Notebook`, this is done by
+    `run_pipeline` once all tasks have finished.
+
+    Only the `extract_and_filter`, `find_spots`, `stitch` and `register_initial` tasks of `run_tasks` are shared
+    with workers. `register`, `reference_spots`, `call_reference_spots` and `call_spots_omp` are then run by
+    `run_pipeline` alone.
+
+    Args:
+        config_file: Path to config file.
+        poll_time: Seconds between checks of whether the `Notebook` is ready.
+
+    Returns:
+        `Notebook` as read by the worker.
+    """
+    config = setup.get_config(config_file)
+    if not (config['runtime']['scheduler'] and config['runtime']['work_queue']):
+        raise ValueError("Workers can only be used if scheduler = True and work_queue = True in the runtime "
+                         "section of the config file.")
+    notebook_name = config['file_names']['notebook_name']
+    if not notebook_name.endswith('.npz'):
+        notebook_name = notebook_name + '.npz'
+    nb_path = os.path.join(config['file_names']['output_dir'], notebook_name)
+    if config['runtime']['jax_cache_dir'] is not None:
+        set_jax_cache(os.path.join(config['file_names']['output_dir'], config['runtime']['jax_cache_dir']),
+                      config['runtime']['jax_cache_min_compile_time'])
+    nb = None
+    while nb is None:
+        if os.path.isfile(nb_path):
+            try:
+                nb = setup.Notebook(nb_path, config_file)
+            except Exception as e:
+                # notebook may be being saved or not yet updated to this config by run_pipeline.
+                warnings.warn(f'Could not load notebook: {e}')
+            if nb is not None and not nb.has_page('basic_info'):
+                nb = None
+        if nb is None:
+            time.sleep(poll_time)
+    run_tasks(nb, worker=True)
     return nb
 
 
@@ -34,6 +103,8 @@ def initialize_nb(config_file: str) -> setup.Notebook:
     before saving.
 
     If `Notebook` already exists and contains these pages, it will just be returned.
+    If `config['runtime']['scheduler']`, pages made with a different config are removed first with
+    `remove_changed_pages`.
 
     Args:
         config_file: Path to config file.
@@ -46,6 +117,11 @@ def initialize_nb(config_file: str) -> setup.Notebook:
         # add .npz suffix if not in name
         config['file_names']['notebook_name'] = config['file_names']['notebook_name'] + '.npz'
     nb_path = os.path.join(config['file_names']['output_dir'], config['file_names']['notebook_name'])
+    if config['runtime']['scheduler'] and os.path.isfile(nb_path):
+        remove_changed_pages(nb_path, config_file)
+    if config['runtime']['jax_cache_dir'] is not None:
+        set_jax_cache(os.path.join(config['file_names']['output_dir'], config['runtime']['jax_cache_dir']),
+                      config['runtime']['jax_cache_min_compile_time'])
     nb = setup.Notebook(nb_path, config_file)
     if not nb.has_page("basic_info"):
         nbp_basic = set_basic_info(config['file_names'], config['basic_info'])
@@ -55,6 +131,64 @@ def initialize_nb(config_file: str) -> setup.Notebook:
     return nb
 
 
+def remove_changed_pages(nb_path: str, config_file: str) -> List[str]:
+    """
+    Removes pages from the `Notebook` which were made with a config section different from that in `config_file`,
+    along with all pages added after them, so they are made again when the pipeline is next run.
+    The `Notebook` is then saved with the config in `config_file`.
+
+    Files made by removed steps which would be used instead of making them again (stitched images and
+    OMP results) are deleted. Filtered tiles are not deleted here, as `run_tasks` only filters a tile again if its
+    inputs have changed.
+
+    Only the steps run by `run_tasks` are recomputed for just the tiles and rounds whose inputs changed. A removed
+    `register`, `ref_spots`, `call_spots` or `omp` page is made again for all tiles. These steps are not split into
+    tasks as a change to any tile changes them all: the transform of each tile is regularised using the
+    others, `call_spots` uses the spots of all tiles, and `omp` uses the `spot_shape` found on the central tile and
+    the `call_spots` bled codes for every tile.
+
+    Args:
+        nb_path: Path to notebook.
+        config_file: Path to config file.
+
+    Returns:
+        Names of pages removed.
+    """
+    nb = setup.Notebook(nb_path)
+    config_old = nb.get_config()
+    config_new = setup.get_config(config_file)
+    changed_sections = [section for section in set(config_old.keys()).union(config_new.keys())
+                        if section not in nb._no_compare_config_sections and
+                        config_old.get(section) != config_new.get(section)]
+    # timings page is replaced every step so is not ordered with the pipeline.
+    keep_pages = list(nb._no_save_pages) + ['timings']
+    page_names = [name for name, _ in sorted(nb._page_times.items(), key=lambda x: x[1]) if name not in keep_pages]
+    # page names are either same as config sections or with _debug suffix
+    changed_ind = [i for i in range(len(page_names)) if page_names[i].replace('_debug', '') in changed_sections]
+    if len(changed_ind) == 0:
+        return []
+    remove_pages = page_names[min(changed_ind):]
+    remove_files = []
+    if nb.has_page('file_names'):
+        if 'stitch' in remove_pages:
+            remove_files += [nb.file_names.big_dapi_image, nb.file_names.big_anchor_image]
+        if 'omp' in remove_pages or not nb.has_page('omp'):
+            remove_files += [nb.file_names.omp_spot_shape, nb.file_names.omp_spot_info, nb.file_names.omp_spot_coef]
+    remove_files = [file for file in remove_files if file is not None and os.path.isfile(file)]
+    warnings.warn(f'Config sections {changed_sections} have changed so removing pages {remove_pages} and files '
+                  f'{remove_files} from the notebook.')
+    for file in remove_files:
+        os.remove(file)
+    for page_name in remove_pages:
+        delattr(nb, page_name)
+    if 'basic_info' in remove_pages and nb.has_page('file_names'):
+        delattr(nb, 'file_names')
+    with open(config_file, 'r') as f:
+        nb._config = f.read()
+    nb.save()
+    return remove_pages
+
+
 def run_extract(nb: setup.Notebook):
     """
     This runs the `extract_and_filter` step of the pipeline to produce the tiff files in the tile directory.
@@ -71,7 +205,8 @@ def run_extract(nb: setup.Notebook):
     """
     if not all(nb.has_page(["extract", "extract_debug"])):
         config = nb.get_config()
-        nbp, nbp_debug = extract_and_filter(config['extract'], nb.file_names, nb.basic_info)
+        with utils.timings.span('extract'):
+            nbp, nbp_debug = extract_and_filter(config['extract'], nb.file_names, nb.basic_info)
         nb += nbp
         nb += nbp_debug
     else:
@@ -95,7 +230,8 @@ def run_find_spots(nb: setup.Notebook):
     """
     if not nb.has_page("find_spots"):
         config = nb.get_config()
-        nbp = find_spots(config['find_spots'], nb.file_names, nb.basic_info, nb.extract.auto_thresh)
+        with utils.timings.span('find_spots'):
+            nbp = find_spots(config['find_spots'], nb.file_names, nb.basic_info, nb.extract.auto_thresh)
         nb += nbp
     else:
         warnings.warn('find_spots', utils.warnings.NotebookPageWarning)
@@ -119,22 +255,26 @@ def run_stitch(nb: setup.Notebook):
     """
     config = nb.get_config()
     if not nb.has_page("stitch"):
-        nbp_debug = stitch(config['stitch'], nb.basic_info, nb.find_spots.spot_details)
+        with utils.timings.span('stitch'):
+            nbp_debug = stitch(config['stitch'], nb.basic_info, nb.find_spots.spot_details,
+                               config['runtime']['n_workers'])
         nb += nbp_debug
     else:
         warnings.warn('stitch', utils.warnings.NotebookPageWarning)
     if nb.file_names.big_dapi_image is not None and not os.path.isfile(nb.file_names.big_dapi_image):
         # save stitched dapi
         # Will load in from nd2 file if nb.extract_debug.r_dapi is None i.e. if no DAPI filtering performed.
-        utils.npy.save_stitched(nb.file_names.big_dapi_image, nb.file_names, nb.basic_info,
-                                nb.stitch.tile_origin, nb.basic_info.anchor_round,
-                                nb.basic_info.dapi_channel, nb.extract_debug.r_dapi is None,
-                                config['stitch']['save_image_zero_thresh'])
+        with utils.timings.span('save_stitched', channel=nb.basic_info.dapi_channel):
+            utils.npy.save_stitched(nb.file_names.big_dapi_image, nb.file_names, nb.basic_info,
+                                    nb.stitch.tile_origin, nb.basic_info.anchor_round,
+                                    nb.basic_info.dapi_channel, nb.extract_debug.r_dapi is None,
+                                    config['stitch']['save_image_zero_thresh'])
     if nb.file_names.big_anchor_image is not None and not os.path.isfile(nb.file_names.big_anchor_image):
         # save stitched reference round/channel
-        utils.npy.save_stitched(nb.file_names.big_anchor_image, nb.file_names, nb.basic_info,
-                                nb.stitch.tile_origin, nb.basic_info.ref_round,
-                                nb.basic_info.ref_channel, False, config['stitch']['save_image_zero_thresh'])
+        with utils.timings.span('save_stitched', channel=nb.basic_info.ref_channel):
+            utils.npy.save_stitched(nb.file_names.big_anchor_image, nb.file_names, nb.basic_info,
+                                    nb.stitch.tile_origin, nb.basic_info.ref_round,
+                                    nb.basic_info.ref_channel, False, config['stitch']['save_image_zero_thresh'])
 
 
 def run_register(nb: setup.Notebook):
@@ -155,14 +295,16 @@ def run_register(nb: setup.Notebook):
     """
     config = nb.get_config()
     if not nb.has_page("register_initial_debug"):
-        nbp_initial_debug = register_initial(config['register_initial'], nb.basic_info,
-                                             nb.find_spots.spot_details)
+        with utils.timings.span('register_initial'):
+            nbp_initial_debug = register_initial(config['register_initial'], nb.basic_info,
+                                                 nb.find_spots.spot_details, config['runtime']['n_workers'])
         nb += nbp_initial_debug
     else:
         warnings.warn('register_initial_debug', utils.warnings.NotebookPageWarning)
     if not all(nb.has_page(["register", "register_debug"])):
-        nbp, nbp_debug = register(config['register'], nb.basic_info, nb.find_spots.spot_details,
-                                  nb.register_initial_debug.shift)
+        with utils.timings.span('register'):
+            nbp, nbp_debug = register(config['register'], nb.basic_info, nb.find_spots.spot_details,
+                                      nb.register_initial_debug.shift)
         nb += nbp
         nb += nbp_debug
     else:
@@ -190,12 +332,18 @@ def run_reference_spots(nb: setup.Notebook):
     """
     if not all(nb.has_page(["ref_spots", "call_spots"])):
         config = nb.get_config()
-        nbp_ref_spots = reference_spots(nb.file_names, nb.basic_info, nb.find_spots.spot_details,
-                                        nb.stitch.tile_origin, nb.register.transform)
-        nbp, nbp_ref_spots = call_reference_spots(config['call_spots'], nb.file_names, nb.basic_info, nbp_ref_spots,
-                                                  nb.extract.hist_values, nb.extract.hist_counts, nb.register.transform)
+        with utils.timings.span('reference_spots'):
+            nbp_ref_spots = reference_spots(nb.file_names, nb.basic_info, nb.find_spots.spot_details,
+                                            nb.stitch.tile_origin, nb.register.transform,
+                                            config['runtime']['backend'])
+        with utils.timings.span('call_reference_spots'):
+            nbp, nbp_ref_spots = call_reference_spots(config['call_spots'], nb.file_names, nb.basic_info,
+                                                      nbp_ref_spots, nb.extract.hist_values, nb.extract.hist_counts,
+                                                      nb.register.transform)
         nb += nbp_ref_spots
         nb += nbp
+        with utils.timings.span('results_index'):
+            get_results_index(nb, 'ref')
         # only raise error after saving to notebook if spot_colors have nan in wrong places.
         utils.errors.check_color_nan(nbp_ref_spots.colors, nb.basic_info)
     else:
@@ -206,8 +354,9 @@ def run_reference_spots(nb: setup.Notebook):
 def run_omp(nb: setup.Notebook):
     if not nb.has_page("omp"):
         config = nb.get_config()
-        nbp = call_spots_omp(config['omp'], nb.file_names, nb.basic_info, nb.call_spots,
-                             nb.stitch.tile_origin, nb.register.transform)
+        with utils.timings.span('omp'):
+            nbp = call_spots_omp(config['omp'], nb.file_names, nb.basic_info, nb.call_spots,
+                                 nb.stitch.tile_origin, nb.register.transform, config['runtime']['backend'])
         nb += nbp
 
         # Update omp_info files after omp notebook page saved into notebook
@@ -221,6 +370,8 @@ def run_omp(nb: setup.Notebook):
         spot_coefs = sparse.load_npz(nb.file_names.omp_spot_coef)
         sparse.save_npz(nb.file_names.omp_spot_coef, spot_coefs[not_duplicate])
         np.save(nb.file_names.omp_spot_info, spot_info[not_duplicate])
+        with utils.timings.span('results_index'):
+            get_results_index(nb, 'omp')
 
         # only raise error after saving to notebook if spot_colors have nan in wrong places.
         utils.errors.check_color_nan(nbp.colors, nb.basic_info)
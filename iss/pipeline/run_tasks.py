@@ -0,0 +1,297 @@
+import os
+import threading
+import numpy as np
+from .. import setup, utils, extract
+from ..utils.tasks import TaskScheduler, file_fingerprint
+from .extract_run import extract_setup, get_filters, wait_for_round, set_scale_anchor, extract_tile, add_tile_info
+from .find_spots import find_spots_tile, get_isolation_thresh, get_spot_no
+from .register_initial import register_initial_setup, register_initial_round
+from .stitch import stitch
+
+# basic_info variables which the extract and find_spots tasks of a single tile and round depend on.
+# Others like use_tiles and n_rounds are not included, so adding tiles or rounds does not affect existing tasks.
+TILE_BASIC_INFO = ['is_3d', 'anchor_channel', 'dapi_channel', 'ref_channel', 'use_channels', 'use_z',
+                   'tile_pixel_value_shift', 'tile_sz', 'n_channels', 'nz', 'pixel_size_xy', 'pixel_size_z',
+                   'use_anchor']
+
+
+def run_tasks(nb: setup.Notebook, worker: bool = False):
+    """
+    Runs the `extract_and_filter`, `find_spots`, `stitch` and `register_initial` steps of the pipeline as a set of
+    tasks for each tile and round, each starting as soon as the tasks it depends on have finished.
+
+    The tasks are:
+
+    - `extract_setup`: finds filter radii, psf and `scale` once the first round is available.
+    - `extract_scale_anchor`: finds `scale_anchor` once the anchor round is available.
+    - `extract_t{t}_r{r}`: filters all channels of tile `t`, round `r` once round `r` is available.
+    - `find_spots_t{t}_r{r}`: finds spots on tile `t`, round `r` once it has been extracted.
+    - `stitch`: finds the tile origins once spots on the reference round have been found on every tile.
+    - `register_initial_r{r}`: finds the shift to round `r` for every tile once spots on round `r` and the
+        reference round have been found on every tile.
+
+    So, while later rounds are still being imaged, earlier rounds can already be through to `register_initial`.
+    The result of each task is saved in the folder `{output_dir}/{notebook_name}_tasks`, so if the pipeline
+    is interrupted, only unfinished tasks are run when it is restarted.
+
+    The saved result of a task is only used if its inputs are the same as when it was saved: the config section of
+    its step, the `basic_info` it uses, the size and modification time of the raw or filtered files it reads and the
+    results of previous steps it uses, whether these come from other tasks or from pages already in the notebook.
+    So if a page is removed after the config or raw data changes, only the tasks whose inputs changed are run
+    again.
+
+    `extract`, `extract_debug`, `find_spots`, `stitch` and `register_initial_debug` pages are added to the
+    `Notebook` once all tasks have finished. If `Notebook` already contains a page, the tasks for it are not run.
+
+    If `config['runtime']['work_queue']`, other processes sharing `output_dir`, started with `run_worker`, can run
+    the same tasks at once. Each task is then claimed by one process with a lease file in the tasks folder, and
+    this function returns once all tasks have finished in any process.
+
+    `register`, reference spot colors, `call_spots` and `omp` are not split into tasks. The point cloud registration
+    of each tile is regularised using all the others and reference spot colors need the final `tile_origin` and
+    `transform`, so these steps are run afterwards as before.
+
+    Args:
+        nb: `Notebook` containing `file_names` and `basic_info` pages.
+        worker: If `True`, only the tasks are run and no pages are added to `nb`, which is left to the process
+            running `run_pipeline`.
+    """
+    config = nb.get_config()
+    nbp_file = nb.file_names
+    nbp_basic = nb.basic_info
+    marker_dir = os.path.join(nbp_file.output_dir,
+                              config['file_names']['notebook_name'].replace('.npz', '') + '_tasks')
+    scheduler = TaskScheduler(marker_dir, config['runtime']['n_workers'],
+                              config['runtime']['lease_time'] if config['runtime']['work_queue'] else None)
+    r_ref = nbp_basic.ref_round
+    use_rounds = nbp_basic.use_rounds + [nbp_basic.anchor_round] * nbp_basic.use_anchor
+    extract_done = all(nb.has_page(["extract", "extract_debug"]))
+    find_spots_done = nb.has_page("find_spots")
+
+    # Keys identifying inputs of each task
+    basic_key = {key: getattr(nbp_basic, key) for key in nbp_basic._times}
+    tile_basic_key = {key: basic_key[key] for key in TILE_BASIC_INFO}
+
+    def raw_files(r: int, tiles: list) -> list:
+        # files containing raw data of tiles on round r.
+        round_file = os.path.join(nbp_file.input_dir, (nbp_file.round + [nbp_file.anchor])[r])
+        if nbp_file.raw_extension == '.npy':
+            return [os.path.join(round_file, f'{t_nd2}.npy') for t_nd2 in
+                    [utils.nd2.get_nd2_tile_ind(t, nbp_basic.tilepos_yx_nd2, nbp_basic.tilepos_yx) for t in tiles]]
+        return [round_file + nbp_file.raw_extension]
+
+    def tile_files(t: int, r: int) -> list:
+        # filtered image files of tile t, round r.
+        return np.atleast_1d(nbp_file.tile[t][r]).tolist()
+
+    # Extract
+    def extract_config() -> dict:
+        # config['extract'] with all values set in extract_setup.
+        nbp_config = scheduler.result('extract_setup')[2]
+        return {key: getattr(nbp_config, key) if nbp_config.has_item(key) else None for key in config['extract']}
+
+    filters = {}
+    filters_lock = threading.Lock()
+
+    def extract_filters() -> dict:
+        # only compute filters once in this process as wiener filter can be slow.
+        with filters_lock:
+            if len(filters) == 0:
+                filters.update(get_filters(extract_config(), nbp_file, nbp_basic))
+        return filters
+
+    def run_extract_setup():
+        # scale found from first round and psf from reference round so need to wait for these.
+        wait_rounds = [0] * (len(nbp_file.round) > 0)
+        if nbp_basic.is_3d and config['extract']['deconvolve'] and not os.path.isfile(nbp_file.psf):
+            wait_rounds += [r_ref]
+        for r in np.unique(wait_rounds):
+            wait_for_round(config['extract'], nbp_file, nbp_basic, (nbp_file.round + [nbp_file.anchor])[r], r)
+        nbp, nbp_debug = extract_setup(config['extract'], nbp_file, nbp_basic)
+        return nbp, nbp_debug, setup.NotebookPage('extract_config', config['extract'])
+
+    def run_extract_scale_anchor():
+        config_extract = extract_config()
+        wait_for_round(config_extract, nbp_file, nbp_basic, nbp_file.anchor, nbp_basic.anchor_round)
+        nbp_scale = setup.NotebookPage('extract_scale_anchor')
+        set_scale_anchor(config_extract, nbp_file, nbp_basic, nbp_scale, extract_filters())
+        return nbp_scale
+
+    def run_extract_tile(t: int, r: int):
+        if scheduler.is_stale(f'extract_t{t}_r{r}'):
+            # filtered images saved previously were made from different inputs so filter again.
+            for file in tile_files(t, r):
+                if os.path.isfile(file):
+                    os.remove(file)
+        config_extract = extract_config()
+        if r == nbp_basic.anchor_round:
+            config_extract['scale_anchor'] = scheduler.result('extract_scale_anchor').scale_anchor
+        round_dask_array = wait_for_round(config_extract, nbp_file, nbp_basic,
+                                          (nbp_file.round + [nbp_file.anchor])[r], r)
+        # n_workers tiles are extracted at once so share the CPUs between them.
+        tile_info = extract_tile(config_extract, nbp_file, nbp_basic, extract_filters(), t, r,
+                                 scheduler.result('extract_setup')[1].z_info, round_dask_array,
+                                 n_threads=max(1, (os.cpu_count() or 1) // scheduler.n_workers))
+        nbp_tile = setup.NotebookPage('extract_tile')
+        nbp_tile.auto_thresh, nbp_tile.hist_counts, nbp_tile.n_clip_pixels, nbp_tile.clip_extract_scale, \
+            nbp_tile.new_image = tile_info
+        return nbp_tile
+
+    if not extract_done:
+        scheduler.add('extract_setup', run_extract_setup,
+                      key=lambda: [config['extract'], basic_key,
+                                   file_fingerprint(raw_files(0, nbp_basic.use_tiles) * (len(nbp_file.round) > 0)),
+                                   file_fingerprint(nbp_file.psf)])
+        if nbp_basic.use_anchor:
+            scheduler.add('extract_scale_anchor', run_extract_scale_anchor, ['extract_setup'],
+                          key=lambda: [basic_key, scheduler.result_hash('extract_setup'),
+                                       file_fingerprint(raw_files(nbp_basic.anchor_round, nbp_basic.use_tiles))])
+
+    # Find spots
+    def auto_thresh_tr(t: int, r: int) -> np.ndarray:
+        if extract_done:
+            return nb.extract.auto_thresh[t, r]
+        return scheduler.result(f'extract_t{t}_r{r}').auto_thresh
+
+    def run_find_spots_tile(t: int, r: int):
+        auto_thresh = auto_thresh_tr(t, r)
+        isolation_thresh = get_isolation_thresh(config['find_spots'],
+                                                np.array([auto_thresh[nbp_basic.anchor_channel]]))[0]
+        nbp_tile = setup.NotebookPage('find_spots_tile')
+        nbp_tile.spot_details = find_spots_tile(config['find_spots'], nbp_file, nbp_basic, auto_thresh,
+                                                isolation_thresh, t, r)
+        return nbp_tile
+
+    def spot_details_rounds(rounds: list) -> np.ndarray:
+        # spot_details of all tiles on rounds given.
+        if find_spots_done:
+            return nb.find_spots.spot_details
+        return np.concatenate([scheduler.result(f'find_spots_t{t}_r{r}').spot_details
+                               for r in rounds for t in nbp_basic.use_tiles])
+
+    def extract_deps(r: int) -> list:
+        return ['extract_setup'] + ['extract_scale_anchor'] * (r == nbp_basic.anchor_round)
+
+    # add extract task followed by find spots task for each tile so find spots can start before the whole
+    # round has been extracted.
+    for r in use_rounds:
+        for t in nbp_basic.use_tiles:
+            if not extract_done:
+                scheduler.add(f'extract_t{t}_r{r}', lambda t=t, r=r: run_extract_tile(t, r), extract_deps(r),
+                              key=lambda t=t, r=r: [tile_basic_key, r == nbp_basic.anchor_round, tile_files(t, r),
+                                                    file_fingerprint(raw_files(r, [t])),
+                                                    [scheduler.result_hash(dep) for dep in extract_deps(r)]])
+            if not find_spots_done:
+                scheduler.add(f'find_spots_t{t}_r{r}', lambda t=t, r=r: run_find_spots_tile(t, r),
+                              [f'extract_t{t}_r{r}'] * (not extract_done),
+                              key=lambda t=t, r=r: [config['find_spots'], tile_basic_key,
+                                                    r == nbp_basic.anchor_round, auto_thresh_tr(t, r),
+                                                    file_fingerprint(tile_files(t, r))])
+
+    def spot_details_key(rounds: list) -> np.ndarray:
+        # spot_details of rounds given sorted, so same whether from tasks or find_spots page.
+        spot_details = spot_details_rounds(rounds)
+        spot_details = spot_details[np.isin(spot_details[:, 1], rounds)]
+        return spot_details[np.lexsort(spot_details.T[::-1])]
+
+    def find_spots_deps(r: int) -> list:
+        if find_spots_done:
+            return []
+        return [f'find_spots_t{t}_r{r_dep}' for r_dep in np.unique([r_ref, r]) for t in nbp_basic.use_tiles]
+
+    # Stitch
+    if not nb.has_page("stitch"):
+        scheduler.add('stitch', lambda: stitch(config['stitch'], nbp_basic, spot_details_rounds([r_ref])),
+                      find_spots_deps(r_ref),
+                      key=lambda: [config['stitch'], basic_key, spot_details_key([r_ref])])
+
+    # Register initial
+    start_shift_search = register_initial_setup(config['register_initial'], nbp_basic)
+
+    def run_register_initial_round(r: int):
+        nbp_round = setup.NotebookPage('register_initial_round')
+        nbp_round.shift, nbp_round.shift_score, nbp_round.shift_score_thresh, nbp_round.shift_outlier, \
+            nbp_round.shift_score_outlier, nbp_round.final_shift_search = \
+            register_initial_round(config['register_initial'], nbp_basic,
+                                   spot_details_rounds(list(np.unique([r_ref, r]))), r, start_shift_search[r])
+        return nbp_round
+
+    if not nb.has_page("register_initial_debug"):
+        for r in nbp_basic.use_rounds:
+            scheduler.add(f'register_initial_r{r}', lambda r=r: run_register_initial_round(r), find_spots_deps(r),
+                          key=lambda r=r: [config['register_initial'], basic_key, start_shift_search[r],
+                                           spot_details_key(list(np.unique([r_ref, r])))])
+
+    scheduler.run()
+    utils.raw.cache.clear()
+    extract.clear_filter_buffers()
+    if worker:
+        return
+
+    # Add pages to notebook in order of pipeline
+    if not extract_done:
+        nbp, nbp_debug, _ = scheduler.result('extract_setup')
+        config_extract = extract_config()
+        n_clip_error_images = 0
+        for r in use_rounds:
+            if r == nbp_basic.anchor_round:
+                n_clip_error_images = 0  # reset for anchor as different scale used.
+                nbp_scale = scheduler.result('extract_scale_anchor')
+                nbp_debug.scale_anchor_tile = nbp_scale.scale_anchor_tile
+                nbp_debug.scale_anchor_z = nbp_scale.scale_anchor_z
+                nbp_debug.scale_anchor = nbp_scale.scale_anchor
+            for t in nbp_basic.use_tiles:
+                nbp_tile = scheduler.result(f'extract_t{t}_r{r}')
+                n_clip_error_images = add_tile_info(config_extract, nbp_file, nbp_basic, nbp, nbp_debug,
+                                                    (nbp_tile.auto_thresh, nbp_tile.hist_counts,
+                                                     nbp_tile.n_clip_pixels, nbp_tile.clip_extract_scale,
+                                                     nbp_tile.new_image), t, r, n_clip_error_images)
+        if not nbp_basic.use_anchor:
+            nbp_debug.scale_anchor_tile = None
+            nbp_debug.scale_anchor_z = None
+            nbp_debug.scale_anchor = None
+        nb += nbp
+        nb += nbp_debug
+
+    if not find_spots_done:
+        nbp = setup.NotebookPage("find_spots")
+        nbp.isolation_thresh = get_isolation_thresh(config['find_spots'],
+                                                    nb.extract.auto_thresh[:, r_ref, nbp_basic.anchor_channel])
+        nbp.spot_no = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds + nbp_basic.n_extra_rounds,
+                                nbp_basic.n_channels), dtype=np.int32)
+        for r in use_rounds:
+            for t in nbp_basic.use_tiles:
+                nbp.spot_no[t, r] = get_spot_no(nbp_basic, scheduler.result(f'find_spots_t{t}_r{r}').spot_details,
+                                                t, r)
+        nbp.spot_details = spot_details_rounds(use_rounds)
+        nb += nbp
+
+    if not nb.has_page("stitch"):
+        nb += scheduler.result('stitch')
+
+    if not nb.has_page("register_initial_debug"):
+        nbp_debug = setup.NotebookPage("register_initial_debug")
+        nbp_debug.shift_channel = config['register_initial']['shift_channel']
+        shift = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds, 3), dtype=int)
+        shift_score = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds), dtype=float)
+        shift_score_thresh = np.zeros((nbp_basic.n_tiles, nbp_basic.n_rounds), dtype=float)
+        shift_outlier = np.zeros_like(shift)
+        shift_score_outlier = np.zeros_like(shift_score)
+        final_shift_search = np.zeros_like(start_shift_search)
+        final_shift_search[:, :, 2] = start_shift_search[:, :, 2]  # spacing does not change
+        for r in nbp_basic.use_rounds:
+            nbp_round = scheduler.result(f'register_initial_r{r}')
+            shift[:, r] = nbp_round.shift
+            shift_score[:, r] = nbp_round.shift_score
+            shift_score_thresh[:, r] = nbp_round.shift_score_thresh
+            shift_outlier[:, r] = nbp_round.shift_outlier
+            shift_score_outlier[:, r] = nbp_round.shift_score_outlier
+            final_shift_search[r, :, :2] = nbp_round.final_shift_search
+        nbp_debug.shift = shift
+        nbp_debug.start_shift_search = start_shift_search
+        nbp_debug.final_shift_search = final_shift_search
+        nbp_debug.shift_score = shift_score
+        nbp_debug.shift_score_thresh = shift_score_thresh
+        nbp_debug.shift_outlier = shift_outlier
+        nbp_debug.shift_score_outlier = shift_score_outlier
+        nb += nbp_debug
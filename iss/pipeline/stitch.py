@@ -1,16 +1,26 @@
 from .. import setup
 from ..stitch import compute_shift, update_shifts, get_tile_origin, get_shifts_to_search
+from .register_initial import get_seed_tiles
 from tqdm import tqdm
 from ..find_spots import spot_yxz
 import numpy as np
 import warnings
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from ..setup.notebook import NotebookPage
 
 
-def stitch(config: dict, nbp_basic: NotebookPage, spot_details: np.ndarray) -> NotebookPage:
+def stitch(config: dict, nbp_basic: NotebookPage, spot_details: np.ndarray, n_workers: int = 1) -> NotebookPage:
     """
     This gets the origin of each tile such that a global coordinate system can be built.
 
+    The shift between each pair of overlapping tiles is found one pair after the other, narrowing the search once
+    3 good shifts have been found. If `config['n_seed_pairs'] > 0`, the pairs nearest the centre are found this way
+    only until `n_seed_pairs` good shifts have been found in that direction. All other pairs are searched over the
+    same narrowed range so are found at the same time by `n_workers` processes, giving the same result for
+    any `n_workers`. The shifts found are the same as with `n_seed_pairs = 0` unless the narrowed range misses
+    one, but `score_thresh` and `final_shift_search` depend on the shifts searched so can differ slightly.
+
     See `'stitch'` section of `notebook_comments.json` file
     for description of the variables in the page.
 
@@ -20,6 +30,8 @@ def stitch(config: dict, nbp_basic: NotebookPage, spot_details: np.ndarray) -> N
         spot_details: `int [n_spots x 7]`.
             `spot_details[s]` is `[tile, round, channel, isolated, y, x, z]` of spot `s`.
             This is saved in the find_spots notebook page i.e. `nb.find_spots.spot_details`.
+        n_workers: Number of processes used to find shifts once `n_seed_pairs` good shifts have been found.
+            Only used if `config['n_seed_pairs'] > 0`.
 
     Returns:
         `NotebookPage[stitch]` - Page contains information about how tiles were stitched together to give
@@ -46,45 +58,84 @@ def stitch(config: dict, nbp_basic: NotebookPage, spot_details: np.ndarray) -> N
     # find shifts between overlapping tiles
     c = nbp_basic.ref_channel
     r = nbp_basic.ref_round
-    t_neighb = {'south': [], 'west': []}
     # to convert z coordinate units to xy pixels when calculating distance to nearest neighbours
     z_scale = nbp_basic.pixel_size_z / nbp_basic.pixel_size_xy
-    with tqdm(total=2 * len(nbp_basic.use_tiles)) as pbar:
+    # point clouds only found once for each tile as each tile is in up to 4 pairs.
+    tile_yxz = {t: spot_yxz(spot_details, t, r, c) for t in nbp_basic.use_tiles}
+    for t in nbp_basic.use_tiles:
+        # align to south neighbour followed by west neighbour
+        t_neighb = {'south': np.where(np.sum(nbp_basic.tilepos_yx == nbp_basic.tilepos_yx[t, :] + [1, 0],
+                                             axis=1) == 2)[0],
+                    'west': np.where(np.sum(nbp_basic.tilepos_yx == nbp_basic.tilepos_yx[t, :] + [0, 1],
+                                            axis=1) == 2)[0]}
+        for j in directions:
+            if t_neighb[j] in nbp_basic.use_tiles:
+                shift_info[j]['pairs'] = np.append(shift_info[j]['pairs'],
+                                                   np.array([t, t_neighb[j][0]]).reshape(1, 2), axis=0)
+    for j in directions:
+        n_pairs = shift_info[j]['pairs'].shape[0]
+        shift_info[j]['shifts'] = np.zeros((n_pairs, 3), dtype=int)
+        shift_info[j]['score'] = np.zeros((n_pairs, 1), dtype=float)
+        shift_info[j]['score_thresh'] = np.zeros((n_pairs, 1), dtype=float)
+
+    def shift_args(j: str, i: int) -> list:
+        # arguments of compute_shift to find shift of pair i in direction j with current search range.
+        t, t_neighb = shift_info[j]['pairs'][i]
+        return [tile_yxz[t], tile_yxz[t_neighb], config['shift_score_thresh'],
+                config['shift_score_thresh_multiplier'], config['shift_score_thresh_min_dist'],
+                config['shift_score_thresh_max_dist'], config['neighb_dist_thresh'], shifts[j]['y'],
+                shifts[j]['x'], shifts[j]['z'], config['shift_widen'], config['shift_max_range'], z_scale,
+                config['nz_collapse'], config['shift_step'][2]]
+
+    def save_shift(j: str, i: int, shift_output: tuple):
+        shift_info[j]['shifts'][i], shift_info[j]['score'][i], shift_info[j]['score_thresh'][i] = \
+            shift_output[:3]
+
+    pair_order = {}
+    for j in directions:
+        if config['n_seed_pairs'] > 0:
+            # find pairs nearest the centre first. Pair position is mean position of its two tiles.
+            pair_pos = np.mean(nbp_basic.tilepos_yx[shift_info[j]['pairs']], axis=1)
+            pair_order[j] = get_seed_tiles(pair_pos, np.arange(shift_info[j]['pairs'].shape[0]), len(pair_pos))
+        else:
+            pair_order[j] = list(range(shift_info[j]['pairs'].shape[0]))
+    n_pairs = sum([shift_info[j]['pairs'].shape[0] for j in directions])
+    seed_pairs = {}
+    with tqdm(total=n_pairs) as pbar:
         pbar.set_description(f"Finding overlap between tiles in round {r} (ref_round)")
-        for t in nbp_basic.use_tiles:
-            # align to south neighbour followed by west neighbour
-            t_neighb['south'] = np.where(np.sum(nbp_basic.tilepos_yx == nbp_basic.tilepos_yx[t, :] + [1, 0],
-                                                axis=1) == 2)[0]
-            t_neighb['west'] = np.where(np.sum(nbp_basic.tilepos_yx == nbp_basic.tilepos_yx[t, :] + [0, 1],
-                                               axis=1) == 2)[0]
-            for j in directions:
-                pbar.set_postfix({'tile': t, 'direction': j})
-                if t_neighb[j] in nbp_basic.use_tiles:
-                    shift, score, score_thresh = compute_shift(spot_yxz(spot_details, t, r, c),
-                                                               spot_yxz(spot_details, t_neighb[j][0], r, c),
-                                                               config['shift_score_thresh'],
-                                                               config['shift_score_thresh_multiplier'],
-                                                               config['shift_score_thresh_min_dist'],
-                                                               config['shift_score_thresh_max_dist'],
-                                                               config['neighb_dist_thresh'], shifts[j]['y'],
-                                                               shifts[j]['x'], shifts[j]['z'],
-                                                               config['shift_widen'], config['shift_max_range'],
-                                                               z_scale, config['nz_collapse'],
-                                                               config['shift_step'][2])[:3]
-                    shift_info[j]['pairs'] = np.append(shift_info[j]['pairs'],
-                                                       np.array([t, t_neighb[j][0]]).reshape(1, 2), axis=0)
-                    shift_info[j]['shifts'] = np.append(shift_info[j]['shifts'], np.array(shift).reshape(1, 3), axis=0)
-                    shift_info[j]['score'] = np.append(shift_info[j]['score'], np.array(score).reshape(1, 1), axis=0)
-                    shift_info[j]['score_thresh'] = np.append(shift_info[j]['score_thresh'],
-                                                              np.array(score_thresh).reshape(1, 1), axis=0)
-                    good_shifts = (shift_info[j]['score'] > shift_info[j]['score_thresh']).flatten()
-                    if np.sum(good_shifts) >= 3:
-                        # once found shifts, refine shifts to be searched around these
-                        for i in range(len(coords)):
-                            shifts[j][coords[i]] = update_shifts(shifts[j][coords[i]],
-                                                                 shift_info[j]['shifts'][good_shifts, i])
+        for j in directions:
+            seed_pairs[j] = []
+            good_shifts = np.zeros(shift_info[j]['pairs'].shape[0], dtype=bool)
+            for i in pair_order[j]:
+                if 0 < config['n_seed_pairs'] <= np.sum(good_shifts):
+                    break
+                pbar.set_postfix({'tile': shift_info[j]['pairs'][i, 0], 'direction': j})
+                save_shift(j, i, compute_shift(*shift_args(j, i)))
+                seed_pairs[j].append(i)
+                # pairs not found yet have score and score_thresh of 0 so are not good.
+                good_shifts = (shift_info[j]['score'] > shift_info[j]['score_thresh']).flatten()
+                if np.sum(good_shifts) >= 3:
+                    # once found shifts, refine shifts to be searched around these
+                    for k in range(len(coords)):
+                        shifts[j][coords[k]] = update_shifts(shifts[j][coords[k]],
+                                                             shift_info[j]['shifts'][good_shifts, k])
+                pbar.update(1)
+        # search range no longer changes so remaining pairs independent of each other.
+        other_pairs = [(j, i) for j in directions for i in range(shift_info[j]['pairs'].shape[0])
+                       if i not in seed_pairs[j]]
+        if n_workers > 1 and len(other_pairs) > 1:
+            # spawn not fork, as forking a process which has started jax threads can deadlock.
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=multiprocessing.get_context('spawn')) \
+                    as executor:
+                futures = [executor.submit(compute_shift, *shift_args(j, i)) for j, i in other_pairs]
+                for (j, i), future in zip(other_pairs, futures):
+                    save_shift(j, i, future.result())
+                    pbar.update(1)
+        else:
+            for j, i in other_pairs:
+                pbar.set_postfix({'tile': shift_info[j]['pairs'][i, 0], 'direction': j})
+                save_shift(j, i, compute_shift(*shift_args(j, i)))
                 pbar.update(1)
-    pbar.close()
 
     # amend shifts for which score fell below score_thresh
     for j in directions:
@@ -110,9 +161,9 @@ def stitch(config: dict, nbp_basic: NotebookPage, spot_details: np.ndarray) -> N
             # re-find shifts that fell below threshold by only looking at shifts near to others found
             # score set to 0 so will find do refined search no matter what.
             shift_info[j]['shifts'][i], shift_info[j]['score'][i] = \
-                compute_shift(spot_yxz(spot_details, t, r, c), spot_yxz(spot_details, t_neighb, r, c), 0, None, None,
-                              None, config['neighb_dist_thresh'], shifts[j]['y'], shifts[j]['x'], shifts[j]['z'],
-                              None, None, z_scale, config['nz_collapse'], config['shift_step'][2])[:2]
+                compute_shift(tile_yxz[t], tile_yxz[t_neighb], 0, None, None, None, config['neighb_dist_thresh'],
+                              shifts[j]['y'], shifts[j]['x'], shifts[j]['z'], None, None, z_scale,
+                              config['nz_collapse'], config['shift_step'][2])[:2]
             warnings.warn(f"\nShift from tile {t} to tile {t_neighb} changed from\n"
                           f"{shift_info[j]['outlier_shifts'][i]} to {shift_info[j]['shifts'][i]}.")
 
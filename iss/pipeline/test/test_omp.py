@@ -0,0 +1,74 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from scipy import sparse
+from ...benchmark import make_dataset, SCALES
+from ..run import initialize_nb
+from .. import extract_and_filter, find_spots, stitch, register_initial, register, reference_spots, \
+    call_reference_spots, call_spots_omp
+
+
+class TestCallSpotsOmp(unittest.TestCase):
+    """
+    Check that the `'numpy'` backend of `call_spots_omp` finds the same spots with the same coefficients as the
+    `'jax'` backend on a small synthetic dataset.
+    Jax works in single precision so coefficients only match to `tol`, the number of neighbours
+    of a spot can differ by 1 if a neighbouring coefficient is very close to the threshold and the color of a spot
+    can differ if a transformed coordinate is very close to a half integer so is rounded the other way.
+    """
+    tol = 1e-2
+
+    def test_backend(self):
+        with tempfile.TemporaryDirectory() as output_dir:
+            config_file = make_dataset(output_dir, **SCALES['tiny'])
+            nb = initialize_nb(config_file)
+            config = nb.get_config()
+            nbp, nbp_debug = extract_and_filter(config['extract'], nb.file_names, nb.basic_info)
+            nb += nbp
+            nb += nbp_debug
+            nb += find_spots(config['find_spots'], nb.file_names, nb.basic_info, nb.extract.auto_thresh)
+            nb += stitch(config['stitch'], nb.basic_info, nb.find_spots.spot_details)
+            nb += register_initial(config['register_initial'], nb.basic_info, nb.find_spots.spot_details)
+            nbp, nbp_debug = register(config['register'], nb.basic_info, nb.find_spots.spot_details,
+                                      nb.register_initial_debug.shift)
+            nb += nbp
+            nb += nbp_debug
+            nbp_ref_spots = reference_spots(nb.file_names, nb.basic_info, nb.find_spots.spot_details,
+                                            nb.stitch.tile_origin, nb.register.transform)
+            nbp, nbp_ref_spots = call_reference_spots(config['call_spots'], nb.file_names, nb.basic_info,
+                                                      nbp_ref_spots, nb.extract.hist_values, nb.extract.hist_counts,
+                                                      nb.register.transform)
+            nb += nbp_ref_spots
+            nb += nbp
+
+            nbp_omp = {}
+            spot_info = {}
+            spot_coef = {}
+            for backend in ['jax', 'numpy']:
+                nbp_omp[backend] = call_spots_omp(nb.get_config()['omp'], nb.file_names, nb.basic_info,
+                                                  nb.call_spots, nb.stitch.tile_origin, nb.register.transform,
+                                                  backend)
+                spot_info[backend] = np.load(nb.file_names.omp_spot_info)
+                spot_coef[backend] = sparse.load_npz(nb.file_names.omp_spot_coef).toarray()
+                # call_spots_omp resumes from these files so remove them to run the next backend from scratch.
+                for file in [nb.file_names.omp_spot_info, nb.file_names.omp_spot_coef, nb.file_names.omp_spot_shape]:
+                    os.remove(file)
+
+            self.assertTrue(nbp_omp['jax'].gene_no.size > 0)
+            # spot_info is [y, x, z, gene_no, n_neighbours_pos, n_neighbours_neg, tile].
+            same_info = [0, 1, 2, 3, 6]
+            self.assertTrue(np.array_equal(spot_info['jax'][:, same_info], spot_info['numpy'][:, same_info]))
+            self.assertTrue(np.abs(spot_info['jax'][:, 4:6] - spot_info['numpy'][:, 4:6]).max() <= 1)
+            self.assertTrue(np.abs(spot_coef['jax'] - spot_coef['numpy']).max() <= self.tol)
+            for var in ['local_yxz', 'tile', 'gene_no']:
+                self.assertTrue(np.array_equal(nbp_omp['jax'].__getattribute__(var),
+                                               nbp_omp['numpy'].__getattribute__(var)))
+            color_diff = (nbp_omp['jax'].colors != nbp_omp['numpy'].colors).any(axis=(1, 2))
+            self.assertTrue(color_diff.mean() <= 0.001)
+            self.assertTrue(np.abs(nbp_omp['jax'].intensity[~color_diff] -
+                                   nbp_omp['numpy'].intensity[~color_diff]).max() <= self.tol)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+import numpy as np
+from typing import Optional, List
+from ..register_initial import register_initial, get_seed_tiles
+from ...setup import NotebookPage
+
+
+def get_register_initial_config() -> dict:
+    """
+    Returns the default `'register_initial'` section of the config file.
+    """
+    return {'shift_channel': None, 'shift_min': [-100, -100, -3], 'shift_max': [100, 100, 3],
+            'shift_step': [5, 5, 3], 'shift_widen': [10, 10, 1], 'shift_max_range': [500, 500, 10],
+            'neighb_dist_thresh': 2, 'shift_score_thresh': None, 'shift_score_thresh_multiplier': 1.5,
+            'shift_score_thresh_min_dist': 11, 'shift_score_thresh_max_dist': 20, 'nz_collapse': 30,
+            'n_seed_tiles': 0}
+
+
+def get_spot_details(round_shifts: np.ndarray, n_tiles_yx: tuple = (2, 3), tile_sz: int = 400, n_spots: int = 600,
+                     seed: int = 0):
+    """
+    Makes 2D spots on the ref round (`n_rounds`) and, for each imaging round `r`, the same spots shifted by about
+    `round_shifts[r]` with some spots removed.
+
+    Args:
+        round_shifts: `int [n_rounds x 2]`. yx shift from ref round to each imaging round.
+        n_tiles_yx: Number of tiles in y and x.
+        tile_sz: yx size of each tile in pixels.
+        n_spots: Number of spots on each tile of the ref round.
+        seed: Seed of random number generator.
+
+    Returns:
+        - spot_details - `int [n_spots x 7]`. `[tile, round, channel, isolated, y, x, z]` of each spot.
+        - true_shift - `int [n_tiles x n_rounds x 3]`. Shift applied to each tile and round.
+    """
+    rng = np.random.default_rng(seed)
+    n_rounds = len(round_shifts)
+    n_tiles = n_tiles_yx[0] * n_tiles_yx[1]
+    spot_details = []
+    true_shift = np.zeros((n_tiles, n_rounds, 3), dtype=int)
+    for t in range(n_tiles):
+        ref_yx = rng.integers(0, tile_sz, (n_spots, 2))
+        spot_details.append(np.column_stack([np.full((n_spots, 3), [t, n_rounds, 0]), np.ones(n_spots), ref_yx,
+                                             np.zeros(n_spots)]))
+        for r in range(n_rounds):
+            true_shift[t, r, :2] = round_shifts[r] + rng.integers(-2, 3, 2)
+            keep = rng.random(n_spots) < 0.8
+            yx = ref_yx[keep] + true_shift[t, r, :2] + rng.integers(-1, 2, (keep.sum(), 2))
+            spot_details.append(np.column_stack([np.full((keep.sum(), 3), [t, r, 0]), np.ones(keep.sum()), yx,
+                                                 np.zeros(keep.sum())]))
+    return np.vstack(spot_details).astype(int), true_shift
+
+
+def get_nbp_basic(n_rounds: int, n_tiles_yx: tuple = (2, 3), use_rounds: Optional[List[int]] = None) -> NotebookPage:
+    """
+    Makes `basic_info` notebook page for 2D data made with `get_spot_details`.
+
+    Args:
+        n_rounds: Number of imaging rounds. The ref round is `n_rounds`.
+        n_tiles_yx: Number of tiles in y and x.
+        use_rounds: Imaging rounds to use. If `None`, all are used.
+
+    Returns:
+        `basic_info` notebook page.
+    """
+    n_tiles = n_tiles_yx[0] * n_tiles_yx[1]
+    nbp_basic = NotebookPage('basic_info')
+    nbp_basic.n_tiles = n_tiles
+    nbp_basic.n_rounds = n_rounds
+    nbp_basic.use_rounds = list(range(n_rounds)) if use_rounds is None else use_rounds
+    nbp_basic.use_tiles = list(range(n_tiles))
+    nbp_basic.use_channels = [0]
+    nbp_basic.ref_round = n_rounds
+    nbp_basic.ref_channel = 0
+    nbp_basic.is_3d = False
+    nbp_basic.pixel_size_xy = 0.1
+    nbp_basic.pixel_size_z = 0.3
+    nbp_basic.tilepos_yx = np.array([[y, x] for y in range(n_tiles_yx[0]) for x in range(n_tiles_yx[1])])
+    return nbp_basic
+
+
+class TestRegisterInitial(unittest.TestCase):
+    tol = 1
+
+    def test_rounds_independent(self):
+        # Search range narrowed in one round should not be used for the next round so shift of each round is
+        # found whatever the shifts of the other rounds are.
+        round_shifts = np.array([[70, -70], [-70, 70], [5, 10]])
+        spot_details, true_shift = get_spot_details(round_shifts)
+        nbp = register_initial(get_register_initial_config(), get_nbp_basic(len(round_shifts)), spot_details)
+        self.assertTrue(np.abs(nbp.shift - true_shift).max() <= self.tol)
+        self.assertTrue((nbp.start_shift_search == nbp.start_shift_search[0]).all())
+        for r in range(len(round_shifts)):
+            self.assertTrue((nbp.final_shift_search[r, :2, 0] <= true_shift[:, r, :2].min(axis=0)).all())
+            self.assertTrue((nbp.final_shift_search[r, :2, 1] >= true_shift[:, r, :2].max(axis=0)).all())
+            # same result if only this round used.
+            nbp_r = register_initial(get_register_initial_config(), get_nbp_basic(len(round_shifts), use_rounds=[r]),
+                                     spot_details)
+            self.assertTrue(np.array_equal(nbp_r.shift[:, r], nbp.shift[:, r]))
+            self.assertTrue(np.array_equal(nbp_r.shift_score[:, r], nbp.shift_score[:, r]))
+            self.assertTrue(np.array_equal(nbp_r.final_shift_search[r], nbp.final_shift_search[r]))
+
+    def test_n_workers(self):
+        # result should not depend on number of processes used.
+        round_shifts = np.array([[30, -20], [-10, 40]])
+        spot_details, true_shift = get_spot_details(round_shifts, n_tiles_yx=(3, 3), seed=1)
+        for n_seed_tiles in [0, 3]:
+            nbp = {}
+            for n_workers in [1, 2]:
+                config = get_register_initial_config()
+                config['n_seed_tiles'] = n_seed_tiles
+                nbp[n_workers] = register_initial(config, get_nbp_basic(len(round_shifts), (3, 3)), spot_details,
+                                                  n_workers)
+            self.assertTrue(np.abs(nbp[1].shift - true_shift).max() <= self.tol)
+            for var in ['shift', 'shift_score', 'shift_score_thresh', 'shift_outlier', 'shift_score_outlier',
+                        'final_shift_search']:
+                self.assertTrue(np.array_equal(nbp[1].__getattribute__(var), nbp[2].__getattribute__(var)))
+
+
+class TestGetSeedTiles(unittest.TestCase):
+    def test_get_seed_tiles(self):
+        tilepos_yx = np.array([[y, x] for y in range(3) for x in range(3)])
+        self.assertEqual(get_seed_tiles(tilepos_yx, list(range(9)), 1), [4])
+        # ties broken by tile number.
+        self.assertEqual(get_seed_tiles(tilepos_yx, list(range(9)), 5), [4, 1, 3, 5, 7])
+        self.assertEqual(sorted(get_seed_tiles(tilepos_yx, list(range(9)), 20)), list(range(9)))
+        # centre is of tiles used.
+        self.assertEqual(get_seed_tiles(tilepos_yx, [0, 1, 3, 4], 1), [0])
+        self.assertEqual(get_seed_tiles(tilepos_yx, [8, 5, 7], 2), [8, 5])
+        self.assertEqual(get_seed_tiles(tilepos_yx, [], 2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import numpy as np
+from ..stitch import stitch
+from ...setup import NotebookPage
+
+
+def get_stitch_config() -> dict:
+    """
+    Returns the default `'stitch'` section of the config file.
+    """
+    return {'expected_overlap': 0.1, 'auto_n_shifts': [20, 20, 1], 'shift_south_min': None,
+            'shift_south_max': None, 'shift_west_min': None, 'shift_west_max': None, 'shift_step': [5, 5, 3],
+            'shift_widen': [10, 10, 1], 'shift_max_range': [300, 300, 10], 'neighb_dist_thresh': 2,
+            'shift_score_thresh': None, 'shift_score_thresh_multiplier': 2, 'shift_score_thresh_min_dist': 11,
+            'shift_score_thresh_max_dist': 20, 'nz_collapse': 30, 'n_seed_pairs': 0}
+
+
+def get_tile_spots(n_tiles_yx: tuple = (3, 4), tile_sz: int = 400, overlap: float = 0.1, spot_density: float = 0.002,
+                   seed: int = 0):
+    """
+    Makes 2D spots in a global coordinate system and puts those within each tile on the ref round/channel of
+    that tile. Tiles are on a grid with about `overlap` overlap between neighbouring tiles.
+
+    Args:
+        n_tiles_yx: Number of tiles in y and x.
+        tile_sz: yx size of each tile in pixels.
+        overlap: Fraction of `tile_sz` neighbouring tiles overlap by.
+        spot_density: Number of spots per pixel.
+        seed: Seed of random number generator.
+
+    Returns:
+        - spot_details - `int [n_spots x 7]`. `[tile, round, channel, isolated, y, x, z]` of each spot.
+        - nbp_basic - `basic_info` notebook page. Ref round and channel are 0.
+        - tile_origin - `int [n_tiles x 3]`. yxz origin of each tile.
+    """
+    rng = np.random.default_rng(seed)
+    n_tiles = n_tiles_yx[0] * n_tiles_yx[1]
+    tilepos_yx = np.array([[y, x] for y in range(n_tiles_yx[0]) for x in range(n_tiles_yx[1])])
+    tile_origin = np.zeros((n_tiles, 3), dtype=int)
+    tile_origin[:, :2] = tilepos_yx * int((1 - overlap) * tile_sz) + rng.integers(-3, 4, (n_tiles, 2))
+    tile_origin[:, :2] -= tile_origin[:, :2].min(axis=0)
+    global_sz = tile_origin[:, :2].max(axis=0) + tile_sz
+    n_spots = int(spot_density * np.prod(global_sz))
+    global_yx = rng.integers(0, global_sz, (n_spots, 2))
+    spot_details = []
+    for t in range(n_tiles):
+        local_yx = global_yx - tile_origin[t, :2]
+        local_yx = local_yx[np.all((local_yx >= 0) & (local_yx < tile_sz), axis=1)]
+        n_tile_spots = local_yx.shape[0]
+        spot_details.append(np.column_stack([np.full((n_tile_spots, 2), [t, 0]), np.zeros(n_tile_spots),
+                                             np.ones(n_tile_spots), local_yx, np.zeros(n_tile_spots)]))
+    nbp_basic = NotebookPage('basic_info')
+    nbp_basic.n_tiles = n_tiles
+    nbp_basic.use_tiles = list(range(n_tiles))
+    nbp_basic.tilepos_yx = tilepos_yx
+    nbp_basic.tile_sz = tile_sz
+    nbp_basic.ref_round = 0
+    nbp_basic.ref_channel = 0
+    nbp_basic.is_3d = False
+    nbp_basic.pixel_size_xy = 0.1
+    nbp_basic.pixel_size_z = 0.3
+    return np.vstack(spot_details).astype(int), nbp_basic, tile_origin
+
+
+class TestStitch(unittest.TestCase):
+    tol = 1
+
+    def test_n_seed_pairs(self):
+        # Finding seed pairs first then others at the same time with multiple processes should find the same shifts.
+        # score_thresh depends on the shifts searched so can differ.
+        spot_details, nbp_basic, tile_origin = get_tile_spots()
+        nbp = stitch(get_stitch_config(), nbp_basic, spot_details)
+        self.assertTrue(np.abs(nbp.tile_origin - tile_origin).max() <= self.tol)
+        nbp_seed = {}
+        for n_workers in [1, 2]:
+            config = get_stitch_config()
+            config['n_seed_pairs'] = 3
+            nbp_seed[n_workers] = stitch(config, nbp_basic, spot_details, n_workers)
+        self.assertTrue(np.array_equal(nbp.tile_origin, nbp_seed[2].tile_origin))
+        for j in ['south', 'west']:
+            for var in ['pairs', 'shifts', 'score', 'outlier_shifts', 'outlier_score']:
+                self.assertTrue(np.array_equal(nbp.__getattribute__(f'{j}_{var}'),
+                                               nbp_seed[2].__getattribute__(f'{j}_{var}')))
+        # result does not depend on number of processes.
+        self.assertTrue(np.array_equal(nbp_seed[1].tile_origin, nbp_seed[2].tile_origin))
+        for j in ['south', 'west']:
+            for var in ['pairs', 'shifts', 'score', 'score_thresh', 'outlier_shifts', 'outlier_score',
+                        'final_shift_search']:
+                self.assertTrue(np.array_equal(nbp_seed[1].__getattribute__(f'{j}_{var}'),
+                                               nbp_seed[2].__getattribute__(f'{j}_{var}')))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,60 @@
+import os
+import time
+import numpy as np
+import jax
+import jax.numpy as jnp
+from typing import Optional
+from ..setup.notebook import NotebookPage
+from ..spot_colors import apply_transforms_jax
+
+
+def set_jax_cache(cache_dir: Optional[str], min_compile_time: float = 1.0):
+    """
+    Enables the persistent on-disk `jax` compilation cache so compiled kernels are re-used between processes.
+    Without it, every new process (e.g. each restart of the pipeline or each per-tile job) recompiles all the
+    jitted functions from scratch.
+
+    Args:
+        cache_dir: Directory where compiled kernels are saved. Will be created if it does not exist.
+            If `None`, the cache is not enabled.
+        min_compile_time: Only kernels which took longer than this many seconds to compile are saved to
+            `cache_dir`. Cheaper kernels are quicker to recompile than to load.
+    """
+    if cache_dir is None:
+        return
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    jax.config.update('jax_compilation_cache_dir', cache_dir)
+    jax.config.update('jax_persistent_cache_min_compile_time_secs', min_compile_time)
+    jax.config.update('jax_persistent_cache_min_entry_size_bytes', 0)
+
+
+def warm_up_jax(nbp_basic: NotebookPage, max_transform_coords: int = 2 ** 24):
+    """
+    Compiles `apply_transforms_jax` for the shapes `get_spot_colors_jax` uses to find the color of every pixel on a
+    z-plane, as done in `call_reference_spots` and `call_spots_omp`, so compilation is done once up front
+    (or loaded from the persistent cache set by `set_jax_cache`) rather than in the middle of the first tile.
+
+    !!! note
+        No other kernels are compiled here. `jax` compiles a new kernel for each new input shape and the
+        number of pixels the omp kernels are called with depends on the data (pixels in bounds, those passing the
+        intensity threshold and those remaining after each iteration), so kernels compiled in advance would not be
+        used. The persistent cache is what avoids compiling these again in each new process.
+
+    Args:
+        nbp_basic: `basic_info` notebook page.
+        max_transform_coords: `max_transform_coords` used in `get_spot_colors_jax`.
+    """
+    n_pixels = nbp_basic.tile_sz ** 2
+    n_use_rc = len(nbp_basic.use_rounds) * len(nbp_basic.use_channels)
+    n_transforms = int(np.clip(max_transform_coords // n_pixels, 1, n_use_rc))
+    time_start = time.time()
+
+    z_scale = nbp_basic.pixel_size_z / nbp_basic.pixel_size_xy
+    tile_sz = jnp.array([nbp_basic.tile_sz, nbp_basic.tile_sz, nbp_basic.nz if nbp_basic.is_3d else 1],
+                        dtype=jnp.int16)
+    yxz = jnp.zeros((n_pixels, 3), dtype=jnp.int16)
+    transforms = jnp.tile(jnp.vstack((jnp.eye(3), jnp.zeros((1, 3)))), (n_transforms, 1, 1))
+    apply_transforms_jax(yxz, transforms, jnp.array(nbp_basic.tile_centre), z_scale,
+                         tile_sz)[0].block_until_ready()
+    print(f'Compiling jax kernels: took {round(time.time() - time_start, 2)} seconds')
@@ -6,19 +6,20 @@ import numpy as np
 import numbers
 from typing import Union, Optional, List
 import os
-from tqdm import tqdm
 
 
 def view_raw(config_file: str, rounds: Union[int, List[int]], tiles: Union[int, List[int]],
-             channels: Optional[Union[int, List[int]]] = None):
+             channels: Optional[Union[int, List[int]]] = None, cache_mb: int = 512):
     """
-    Function to view raw data in napari
+    Function to view raw data in napari.
+    The raw data is not loaded when the viewer opens, each z-plane of each channel is only loaded when displayed.
 
     Args:
         config_file: path to config file for experiment
         rounds: rounds to view
         tiles: npy (as opposed to nd2 fov) tile indices to view
         channels: channels to view
+        cache_mb: Maximum size in MB of loaded z-planes kept, so scrolling back to a z-plane is quick.
     """
     config = setup.get_config(config_file)
     if not config['file_names']['notebook_name'].endswith('.npz'):
@@ -44,19 +45,16 @@ def view_raw(config_file: str, rounds: Union[int, List[int]], tiles: Union[int,
         channels = [channels]
 
     viewer = napari.Viewer()
-    n_images = len(rounds) * len(tiles) * len(channels)
-    with tqdm(total=n_images) as pbar:
-        pbar.set_description(f'Loading in raw data')
-        for r in rounds:
-            round_dask_array = raw.load(nb.file_names, nb.basic_info, r=r)
-            for t in tiles:
-                all_channel_image = np.zeros((nb.basic_info.n_channels, nb.basic_info.nz, nb.basic_info.tile_sz,
-                                              nb.basic_info.tile_sz), dtype=np.uint16)
-                for c in channels:
-                    pbar.set_postfix({'round': r, 'tile': t, 'channel': c})
-                    all_channel_image[c] = np.moveaxis(raw.load(nb.file_names, nb.basic_info, round_dask_array, r, t, c,
-                                                                nb.basic_info.use_z), -1, 0)
-                    pbar.update(1)
-                viewer.add_image(all_channel_image, name=f"Round {r}, Tile {t} Raw Data")
+    plane_cache = raw.RawTileCache(cache_mb * 1024 ** 2)
+    contrast_limits = None
+    for r in rounds:
+        for t in tiles:
+            image = raw.load_lazy(nb.file_names, nb.basic_info, r, t, channels, nb.basic_info.use_z, plane_cache)
+            if contrast_limits is None:
+                # napari would load whole image to find contrast limits so just use middle z-plane of first channel.
+                plane = image[channels[0], image.shape[1] // 2].compute()
+                contrast_limits = [int(plane.min()), max(int(plane.max()), int(plane.min()) + 1)]
+            viewer.add_image(image, name=f"Round {r}, Tile {t} Raw Data", contrast_limits=contrast_limits,
+                             multiscale=False)
     viewer.dims.axis_labels = ['channel', 'z', 'y', 'x']
     napari.run()
@@ -1,9 +1,9 @@
 import os
 import pandas as pd
 import numpy as np
-from ...call_spots.base import quality_threshold
+from ...call_spots.results_index import get_results_index
 from .legend import iss_legend
-from ..call_spots import view_codes, view_bleed_matrix, view_bled_codes, view_spot, omp_spot_score
+from ..call_spots import view_codes, view_bleed_matrix, view_bled_codes, view_spot
 from ..omp import view_omp, view_omp_fit
 import napari
 from napari.qt import thread_worker
@@ -48,21 +48,23 @@ class iss_plot:
             self.n_spots = self.omp_0_ind + self.nb.omp.tile.size  # number of anchor + number of omp spots
         else:
             self.n_spots = self.omp_0_ind
+        # global coordinates and scores of spots of each method from index.
+        self.results_index = {'anchor': get_results_index(self.nb, 'anchor')}
+        if self.nb.has_page('omp'):
+            self.results_index['omp'] = get_results_index(self.nb, 'omp')
         spot_zyx = np.zeros((self.n_spots, 3))
-        spot_zyx[:self.omp_0_ind] = (self.nb.ref_spots.local_yxz + self.nb.stitch.tile_origin[self.nb.ref_spots.tile]
-                                     )[:, [2, 0, 1]]
+        spot_zyx[:self.omp_0_ind] = self.results_index['anchor'].global_yxz[:, [2, 0, 1]]
         if self.nb.has_page('omp'):
-            spot_zyx[self.omp_0_ind:] = (self.nb.omp.local_yxz + self.nb.stitch.tile_origin[self.nb.omp.tile]
-                                         )[:, [2, 0, 1]]
+            spot_zyx[self.omp_0_ind:] = self.results_index['omp'].global_yxz[:, [2, 0, 1]]
         if not self.nb.basic_info.is_3d:
             spot_zyx = spot_zyx[:, 1:]
 
         # indicate spots shown when plot first opened - omp if exists, else anchor
+        show_spots = np.zeros(self.n_spots, dtype=bool)
         if self.nb.has_page('omp'):
-            show_spots = np.zeros(self.n_spots, dtype=bool)
-            show_spots[self.omp_0_ind:] = quality_threshold(self.nb, 'omp')
+            show_spots[self.omp_0_ind + self.results_index['omp'].query(quality=True)] = True
         else:
-            show_spots = quality_threshold(self.nb, 'anchor')
+            show_spots[self.results_index['anchor'].query(quality=True)] = True
 
         # color to plot for all genes in the notebook
         gene_color = np.ones((len(self.nb.call_spots.gene_names), 3))
@@ -170,7 +172,6 @@ class iss_plot:
         self.viewer_status_on_select()
 
         config = self.nb.get_config()['thresholds']
-        self.score_omp_multiplier = config['score_omp_multiplier']
         self.score_thresh_slider = QDoubleRangeSlider(Qt.Orientation.Horizontal)  # Slider to change score_thresh
         # Scores for anchor/omp are different so reset score range when change method
         self.score_range = {'anchor': [config['score_ref'], 1]}
@@ -257,21 +258,17 @@ class iss_plot:
         method selected by button and genes selected through clicking on the legend.
         """
         if self.method_buttons.method == 'OMP':
-            score = omp_spot_score(self.nb.omp, self.score_omp_multiplier)
-            method_ind = np.arange(self.omp_0_ind, self.n_spots)
-            intensity_ok = self.nb.omp.intensity > self.intensity_thresh_slider.value()
+            method_0_ind = self.omp_0_ind
         else:
-            score = self.nb.ref_spots.score
-            method_ind = np.arange(self.omp_0_ind)
-            intensity_ok = self.nb.ref_spots.intensity > self.intensity_thresh_slider.value()
+            method_0_ind = 0
         # Keep record of last score range set for each method
         self.score_range[self.method_buttons.method.lower()] = self.score_thresh_slider.value()
-        qual_ok = np.array([score > self.score_thresh_slider.value()[0], score <= self.score_thresh_slider.value()[1],
-                            intensity_ok]).all(axis=0)
-        spots_shown = np.zeros(self.n_spots, dtype=bool)
         # Only show spots which belong to a gene that is active and that passes quality threshold
-        genes_shown = np.isin(self.spot_gene_no[method_ind], self.active_genes)
-        spots_shown[method_ind[genes_shown]] = qual_ok[genes_shown]
+        spots_shown = np.zeros(self.n_spots, dtype=bool)
+        spots_shown[method_0_ind + self.results_index[self.method_buttons.method.lower()].query(
+            genes=self.active_genes, score_thresh=self.score_thresh_slider.value()[0],
+            score_max=self.score_thresh_slider.value()[1],
+            intensity_thresh=self.intensity_thresh_slider.value())] = True
         for i in range(len(self.viewer.layers)):
             if i == self.diagnostic_layer_ind:
                 self.viewer.layers[i].shown = spots_shown
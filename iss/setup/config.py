@@ -63,7 +63,8 @@ _options = {
             'omp_spot_info': 'str',
             'omp_spot_coef': 'str',
             'big_dapi_image': 'str',
-            'big_anchor_image': 'str'
+            'big_anchor_image': 'str',
+            'results_index': 'str'
         },
     'extract':
         {
@@ -90,7 +91,8 @@ _options = {
             'r_smooth': 'maybe_list_int',
             'n_clip_warn': 'int',
             'n_clip_error': 'maybe_int',
-            'n_clip_error_images_thresh': 'int'
+            'n_clip_error_images_thresh': 'int',
+            'raw_cache_mb': 'int'
         },
     'find_spots':
         {
@@ -121,6 +123,7 @@ _options = {
             'shift_score_thresh_min_dist': 'number',
             'shift_score_thresh_max_dist': 'number',
             'nz_collapse': 'int',
+            'n_seed_pairs': 'int',
             'save_image_zero_thresh': 'int'
         },
     'register_initial':
@@ -136,7 +139,8 @@ _options = {
             'shift_score_thresh_multiplier': 'number',
             'shift_score_thresh_min_dist': 'number',
             'shift_score_thresh_max_dist': 'number',
-            'nz_collapse': 'int'
+            'nz_collapse': 'int',
+            'n_seed_tiles': 'int'
         },
     'register':
         {
@@ -200,6 +204,19 @@ _options = {
             'score_ref': 'number',
             'score_omp': 'number',
             'score_omp_multiplier': 'number'
+        },
+    'runtime':
+        {
+            'jax_cache_dir': 'maybe_str',
+            'jax_cache_min_compile_time': 'number',
+            'jax_warm_up': 'bool',
+            'backend': 'str',
+            'scheduler': 'bool',
+            'n_workers': 'int',
+            'work_queue': 'bool',
+            'lease_time': 'number',
+            'timings': 'bool',
+            'timings_log': 'maybe_str'
         }
 }
 
@@ -110,6 +110,8 @@ def set_file_names(nb, page_name: str):
         nbp.big_dapi_image = os.path.join(config['output_dir'], config['big_dapi_image'] + '.npz')
     config['big_anchor_image'] = config['big_anchor_image'].replace('.npz', '')
     nbp.big_anchor_image = os.path.join(config['output_dir'], config['big_anchor_image'] + '.npz')
+    config['results_index'] = config['results_index'].replace('.npz', '')
+    nbp.results_index = os.path.join(config['output_dir'], config['results_index'] + '.npz')
 
     if config['anchor'] is not None:
         round_files = config['round'] + [config['anchor']]
@@ -558,21 +560,26 @@ class Notebook:
         # take this out, or else set it at a higher debug level via warnings
         # module.
         save_start_time = time.time()
-        for p_name in self._page_times.keys():
-            if p_name in self._no_save_pages.keys():
-                continue
-            p = getattr(self, p_name)
-            pd = p.to_serial_dict()
-            for k, v in pd.items():
-                if v is None:
-                    # save None objects as string then convert back to None on loading
-                    v = str(v)
-                d[p_name + self._SEP + k] = v
-            d[p_name + self._SEP + self._ADDEDMETA] = self._page_times[p_name]
-        d[self._NBMETA + self._SEP + self._ADDEDMETA] = self._created_time
-        if self._config is not None:
-            d[self._NBMETA + self._SEP + self._CONFIGMETA] = self._config
-        np.savez_compressed(self._file, **d)
+        # import here as utils imports setup so can't import utils at top of file.
+        from ..utils import timings
+        with timings.span('notebook_save'):
+            for p_name in self._page_times.keys():
+                if p_name in self._no_save_pages.keys():
+                    continue
+                p = getattr(self, p_name)
+                pd = p.to_serial_dict()
+                for k, v in pd.items():
+                    if v is None:
+                        # save None objects as string then convert back to None on loading
+                        v = str(v)
+                    d[p_name + self._SEP + k] = v
+                d[p_name + self._SEP + self._ADDEDMETA] = self._page_times[p_name]
+            d[self._NBMETA + self._SEP + self._ADDEDMETA] = self._created_time
+            if self._config is not None:
+                d[self._NBMETA + self._SEP + self._CONFIGMETA] = self._config
+            np.savez_compressed(self._file, **d)
+            if timings.is_recording():
+                timings.add_bytes(written=os.path.getsize(self._file))
         # Finishing the diagnostics described above
         print(f"Notebook saved: took {time.time() - save_start_time} seconds")
 
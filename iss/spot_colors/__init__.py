@@ -1 +1 @@
-from .base import get_spot_colors_jax, all_pixel_yxz, apply_transform_jax
+from .base import get_spot_colors_jax, all_pixel_yxz, apply_transform_jax, apply_transforms_jax
@@ -58,10 +58,38 @@ def apply_transform_jax(yxz: jnp.ndarray, transform: jnp.ndarray, tile_centre: j
                     out_axes=(0, 0))(yxz, transform, tile_centre, z_scale, tile_sz)
 
 
+@partial(jax.jit, static_argnums=3)
+def apply_transforms_jax(yxz: jnp.ndarray, transforms: jnp.ndarray, tile_centre: jnp.ndarray,
+                         z_scale: float, tile_sz) -> Tuple[jnp.ndarray, jnp.ndarray]:
+    """
+    This is `apply_transform_jax` for several transforms at once, so coordinates for several rounds and channels
+    can be found with a single call.
+
+    Args:
+        yxz: ```int16 [n_spots x 3]```.
+            Non-centered yxz coordinates of spots as in `apply_transform_jax`.
+        transforms: ```float [n_transforms x 4 x 3]```.
+            Affine transforms to apply to ```yxz```.
+        tile_centre: ```float [3]```.
+            yxz coordinates of the centre of the tile as in `apply_transform_jax`.
+        z_scale: Scale factor to multiply z coordinates to put them in units of yx pixels.
+        tile_sz: ```int16 [3]```.
+            Dimensions of tile
+
+    Returns:
+        - `yxz_transform` - ```int16 [n_transforms x n_spots x 3]```.
+            `yxz_transform[i]` are the coordinates of `yxz` transformed by `transforms[i]`.
+        - ```in_range``` - ```bool [n_transforms x n_spots]```.
+            Whether spot `s` was in the bounds of the tile when transformed by `transforms[i]`.
+    """
+    return jax.vmap(apply_transform_jax, in_axes=(None, 0, None, None, None),
+                    out_axes=(0, 0))(yxz, transforms, tile_centre, z_scale, tile_sz)
+
+
 def get_spot_colors_jax(yxz_base: jnp.ndarray, t: int, transforms: jnp.ndarray, nbp_file: NotebookPage,
                         nbp_basic: NotebookPage, use_rounds: Optional[List[int]] = None,
-                        use_channels: Optional[List[int]] = None,
-                        return_in_bounds: bool = False) -> Union[np.ndarray, Tuple[np.ndarray, jnp.ndarray]]:
+                        use_channels: Optional[List[int]] = None, return_in_bounds: bool = False,
+                        max_transform_coords: int = 2 ** 24) -> Union[np.ndarray, Tuple[np.ndarray, jnp.ndarray]]:
     """
     Takes some spots found on the reference round, and computes the corresponding spot intensity
     in specified imaging rounds/channels.
@@ -101,7 +129,8 @@ def get_spot_colors_jax(yxz_base: jnp.ndarray, t: int, transforms: jnp.ndarray,
             Otherwise, `spot_colors` will be returned for all the given `yxz_base` but if spot `s` is out of bounds on
             round `r`, channel `c`, then `spot_colors[s, r, c] = invalid_value = -nbp_basic.tile_pixel_value_shift`.
             This is the only scenario for which `spot_colors = invalid_value` due to clipping in the extract step.
-
+        max_transform_coords: Maximum number of spot coordinates transformed at once i.e. `yxz_base` is transformed
+            to `max_transform_coords // n_spots` rounds/channels with a single call.
 
     Returns:
         - `spot_colors` - `int32 [n_spots x n_rounds_use x n_channels_use]` or
@@ -131,33 +160,38 @@ def get_spot_colors_jax(yxz_base: jnp.ndarray, t: int, transforms: jnp.ndarray,
     else:
         tile_sz = jnp.array([nbp_basic.tile_sz, nbp_basic.tile_sz, nbp_basic.nz], dtype=jnp.int16)
 
+    for r in use_rounds:
+        for c in use_channels:
+            if transforms[t, r, c][0, 0] == 0:
+                raise ValueError(f"Transform for tile {t}, round {r}, channel {c} is zero:\n{transforms[t, r, c]}")
+
+    # Transform coordinates for as many rounds and channels at once as fit in max_transform_coords.
+    # Always use the same number of transforms in each call so only compiled once.
+    n_transforms = int(np.clip(max_transform_coords // max(n_spots, 1), 1, n_use_rounds * n_use_channels))
+    rc_all = [(r, c) for r in range(n_use_rounds) for c in range(n_use_channels)]
     with tqdm(total=n_use_rounds * n_use_channels, disable=no_verbose) as pbar:
         pbar.set_description(f"Reading {n_spots} spot_colors found on tile {t} from npy files.")
-        for r in range(n_use_rounds):
-            if not nbp_basic.is_3d:
-                # If 2D, load in all channels first
-                image_all_channels = np.load(nbp_file.tile[t][use_rounds[r]], mmap_mode='r')
-            for c in range(n_use_channels):
-                transform_rc = transforms[t, use_rounds[r], use_channels[c]]
-                pbar.set_postfix({'round': use_rounds[r], 'channel': use_channels[c]})
-                if transform_rc[0, 0] == 0:
-                    raise ValueError(
-                        f"Transform for tile {t}, round {use_rounds[r]}, channel {use_channels[c]} is zero:"
-                        f"\n{transform_rc}")
-                yxz_transform, in_range = apply_transform_jax(yxz_base, transform_rc, tile_centre, z_scale, tile_sz)
-                yxz_transform = np.asarray(yxz_transform)
-                in_range = np.asarray(in_range)
-                yxz_transform = yxz_transform[in_range]
-                if yxz_transform.shape[0] > 0:
-                    # Read in the shifted uint16 colors here, and remove shift later.
-                    if nbp_basic.is_3d:
-                        spot_colors[in_range, r, c] = utils.npy.load_tile(nbp_file, nbp_basic, t, use_rounds[r],
-                                                                          use_channels[c], yxz_transform,
-                                                                          apply_shift=False)
-                    else:
-                        spot_colors[in_range, r, c] = image_all_channels[use_channels[c]][
-                            tuple(np.asarray(yxz_transform[:, i]) for i in range(2))]
-                pbar.update(1)
+        for i in range(0, len(rc_all), n_transforms):
+            rc_batch = rc_all[i:i + n_transforms]
+            transforms_batch = [transforms[t, use_rounds[r], use_channels[c]] for r, c in rc_batch]
+            # pad last batch with repeats of last transform.
+            transforms_batch = jnp.asarray(transforms_batch + transforms_batch[-1:] * (n_transforms - len(rc_batch)))
+            yxz_transform, in_range = apply_transforms_jax(yxz_base, transforms_batch, tile_centre, z_scale, tile_sz)
+            yxz_transform = np.asarray(yxz_transform)
+            in_range = np.asarray(in_range)
+            # Read all channels of a round together, reading pixels in the order they are stored.
+            for r in np.unique([r for r, _ in rc_batch]):
+                batch_ind = [j for j in range(len(rc_batch)) if rc_batch[j][0] == r]
+                channels = [rc_batch[j][1] for j in batch_ind]
+                pbar.set_postfix({'round': use_rounds[r], 'channels': [use_channels[c] for c in channels]})
+                # Read in the shifted uint16 colors here, and remove shift later.
+                colors = utils.npy.load_tile_pixels(nbp_file, nbp_basic, t, use_rounds[r],
+                                                    [use_channels[c] for c in channels],
+                                                    [yxz_transform[j, in_range[j], :2 + int(nbp_basic.is_3d)]
+                                                     for j in batch_ind], apply_shift=False)
+                for j, c, colors_c in zip(batch_ind, channels, colors):
+                    spot_colors[in_range[j], r, c] = colors_c
+                pbar.update(len(channels))
     # Remove shift so now spots outside bounds have color equal to - nbp_basic.tile_pixel_shift_value.
     # It is impossible for any actual spot color to be this due to clipping at the extract stage.
     spot_colors = spot_colors - nbp_basic.tile_pixel_value_shift
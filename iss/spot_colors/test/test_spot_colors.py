@@ -225,6 +225,12 @@ class TestSpotColors(unittest.TestCase):
             spot_colors_jax[np.ix_(np.arange(n_spots), use_rounds, use_channels)] = \
                 get_spot_colors_jax(jnp.array(spot_yxz), t, jnp.array(transforms), nbp_file, nbp_basic, use_rounds,
                                     use_channels)
+            # transforming only 2 rounds/channels at a time should not change result.
+            spot_colors_jax_batch = get_spot_colors_jax(jnp.array(spot_yxz), t, jnp.array(transforms), nbp_file,
+                                                        nbp_basic, use_rounds, use_channels,
+                                                        max_transform_coords=2 * n_spots)
+            self.assertTrue(np.array_equal(spot_colors_jax_batch,
+                                           spot_colors_jax[np.ix_(np.arange(n_spots), use_rounds, use_channels)]))
             diff = spot_colors - spot_colors_jax
             n_wrong_colors = transform_src_diff.shape[0]
             if n_wrong_colors > 0:
@@ -60,4 +60,22 @@ class TestTileOrigin(unittest.TestCase):
             diff = output_python - output_matlab
             self.assertTrue(np.nanmax(np.abs(diff)) <= self.tol)
             # check there are tiles with y, x, z origin equal to 0.
-            self.assertTrue(np.nanmin(output_python, axis=0).max() <= self.tol)
\ No newline at end of file
+            self.assertTrue(np.nanmin(output_python, axis=0).max() <= self.tol)
+
+    def test_disconnected_weights(self):
+        # tiles 0, 1, 2 in a row, tile 3 only connected to tile 4.
+        h_pairs = np.array([[0, 1], [1, 2], [3, 4]])
+        h_shifts = np.array([[0, -10, 0], [1, -10, 0], [0, -10, 0]])
+        # shift from 0 to 2 disagrees with those from 0 to 1 and 1 to 2.
+        v_pairs = np.array([[0, 2]])
+        v_shifts = np.array([[5, -20, 0]])
+        tile_origin = get_tile_origin(v_pairs, v_shifts, h_pairs, h_shifts, 6, 1)
+        self.assertTrue(np.isnan(tile_origin[3:]).all())
+        self.assertFalse(np.isnan(tile_origin[:3]).any())
+        # with weight 0, 0 to 2 shift is ignored so others fit exactly.
+        tile_origin = get_tile_origin(v_pairs, v_shifts, h_pairs, h_shifts, 6, 1, v_weights=np.array([0]))
+        self.assertTrue(np.abs(tile_origin[0] - tile_origin[1] - h_shifts[0]).max() <= self.tol)
+        self.assertTrue(np.abs(tile_origin[1] - tile_origin[2] - h_shifts[1]).max() <= self.tol)
+        # with large weight, 0 to 2 shift fits exactly.
+        tile_origin = get_tile_origin(v_pairs, v_shifts, h_pairs, h_shifts, 6, 1, v_weights=np.array([1000]))
+        self.assertTrue(np.abs(tile_origin[0] - tile_origin[2] - v_shifts[0]).max() <= self.tol)
@@ -1,11 +1,20 @@
 import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import spsolve
+from typing import Optional
 
 
 def get_tile_origin(v_pairs: np.ndarray, v_shifts: np.ndarray, h_pairs: np.ndarray, h_shifts: np.ndarray,
-                    n_tiles: int, home_tile: int) -> np.ndarray:
+                    n_tiles: int, home_tile: int, v_weights: Optional[np.ndarray] = None,
+                    h_weights: Optional[np.ndarray] = None) -> np.ndarray:
     """
     This finds the origin of each tile in a global coordinate system based on the shifts between overlapping tiles.
 
+    The tiles are the nodes of a graph with an edge between each pair of overlapping tiles. Only the tiles in the
+    same connected component as `home_tile` are given an origin, found by a sparse solve of the graph Laplacian
+    of this component, so time and memory scale with the number of pairs.
+
     Args:
         v_pairs: `int [n_v_pairs x 2]`.
             `v_pairs[i,1]` is the tile index of the tile to the south of `v_pairs[i,0]`.
@@ -20,43 +29,56 @@ def get_tile_origin(v_pairs: np.ndarray, v_shifts: np.ndarray, h_pairs: np.ndarr
         n_tiles: Number of tiles (including those not used) in data set.
         home_tile: Index of tile that is anchored to a fixed coordinate when finding tile origins.
             It should be the tile nearest to the centre.
+        v_weights: `float [n_v_pairs]`.
+            Weight of each shift in `v_shifts` in the least squares fit e.g. its score.
+            If `None`, all shifts have weight 1. Pairs with weight 0 are ignored.
+        h_weights: `float [n_h_pairs]`.
+            Weight of each shift in `h_shifts`. If `None`, all shifts have weight 1.
 
     Returns:
-        `float [n_tiles x 3]`. yxz origin of each tile.
+        `float [n_tiles x 3]`. yxz origin of each tile. `nan` for tiles not connected to `home_tile`.
     """
+    pairs = np.concatenate([np.reshape(v_pairs, (-1, 2)), np.reshape(h_pairs, (-1, 2))]).astype(int)
+    shifts = np.concatenate([np.reshape(v_shifts, (-1, 3)), np.reshape(h_shifts, (-1, 3))]).astype(float)
+    weights = []
+    for pairs_j, weights_j in [(v_pairs, v_weights), (h_pairs, h_weights)]:
+        weights.append(np.ones(len(pairs_j)) if weights_j is None else np.asarray(weights_j, dtype=float))
+    weights = np.concatenate(weights)
+    use = weights > 0
+    pairs, shifts, weights = pairs[use], shifts[use], weights[use]
+    t1 = pairs[:, 0]
+    t2 = pairs[:, 1]
 
     # solve a set of linear equations for each shift,
-    # This will be of the form M*x = c, where x and c are both of length n_tiles.
-    # The t'th row is the equation for tile t. c has columns for y, x and z coordinates
-    pairs = {'v': v_pairs, 'h': h_pairs}
-    shifts = {'v': v_shifts, 'h': h_shifts}
-    M = np.zeros((n_tiles+1, n_tiles))
-    c = np.zeros((n_tiles+1, 3))
-    for j in ['v', 'h']:
-        for i in range(pairs[j].shape[0]):
-            t1 = pairs[j][i, 0]
-            t2 = pairs[j][i, 1]
-            M[t1, t1] = M[t1, t1] + 1
-            M[t1, t2] = M[t1, t2] - 1
-            c[t1, :] = c[t1, :] + shifts[j][i, :]   # this is -shifts in MATLAB, but t1, t2 flipped in python
-            M[t2, t2] = M[t2, t2] + 1
-            M[t2, t1] = M[t2, t1] - 1
-            c[t2, :] = c[t2, :] - shifts[j][i, :]   # this is +shifts in MATLAB, but t1, t2 flipped in python
-
-    # now we want to anchor one of the tiles to a fixed coordinate. We do this
-    # for a home tile in the middle, because it is going to be connected; and we set
-    # its coordinate to a large value, so any non-connected ones can be detected.
-    # (BTW this is why spectral clustering works!!)
-    huge = 1e6
-    M[n_tiles, home_tile] = 1
-    c[n_tiles, :] = huge
+    # This will be of the form M*x = c, where x and c are both of length n_tiles and M is the weighted graph
+    # Laplacian. The t'th row is the equation for tile t. c has columns for y, x and z coordinates.
+    # Duplicate entries are summed when converting to csr.
+    M = sparse.coo_matrix((np.concatenate([weights, weights, -weights, -weights]),
+                           (np.concatenate([t1, t2, t1, t2]), np.concatenate([t1, t2, t2, t1]))),
+                          shape=(n_tiles, n_tiles)).tocsr()
+    c = np.zeros((n_tiles, 3))
+    np.add.at(c, t1, weights[:, np.newaxis] * shifts)   # this is -shifts in MATLAB, but t1, t2 flipped in python
+    np.add.at(c, t2, -weights[:, np.newaxis] * shifts)  # this is +shifts in MATLAB, but t1, t2 flipped in python
 
+    # Only tiles connected to the home tile can be given an origin, and the equations for each connected
+    # component are independent so only need to solve those of the home tile.
+    component = connected_components(M, directed=False)[1]
+    connected = np.where(component == component[home_tile])[0]
+    home_ind = np.where(connected == home_tile)[0][0]
+    n_connected = len(connected)
+
+    # As in MATLAB, the home tile is anchored to a coordinate huge with an extra equation and a tiny
+    # regularization is added to M. I.e. tile_offset is the least squares solution of
+    # [M + tiny * I; e_home] * tile_offset = [c; huge].
+    # Solving for tile_offset - huge instead means the values are small so precision is not lost,
+    # and the normal equations of this are sparse.
+    huge = 1e6
     tiny = 1e-4  # for regularization
-    tile_offset0 = np.linalg.lstsq(M + tiny * np.eye(n_tiles + 1, n_tiles), c, rcond=None)[0]
-    # find tiles that are connected to the home tile
-    aligned_ok = tile_offset0[:, 0] > huge/2
-    tile_offset1 = np.ones((n_tiles, 3)) * np.nan
-    tile_offset1[aligned_ok] = tile_offset0[aligned_ok] - huge
-    tile_origin = tile_offset1 - np.nanmin(tile_offset1, axis=0)
+    A = sparse.vstack([M[connected][:, connected] + tiny * sparse.identity(n_connected, format='csr'),
+                       sparse.csr_matrix(([1], ([0], [home_ind])), shape=(1, n_connected))]).tocsr()
+    b = np.vstack([c[connected] - tiny * huge, np.zeros((1, 3))])
+    tile_offset = np.ones((n_tiles, 3)) * np.nan
+    tile_offset[connected] = np.reshape(spsolve((A.T @ A).tocsc(), A.T @ b), (n_connected, 3))
+    tile_origin = tile_offset - np.nanmin(tile_offset, axis=0)
 
     return tile_origin
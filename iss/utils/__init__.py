@@ -1,2 +1,2 @@
-from . import nd2, errors, matlab, morphology, npy, strel, warnings, raw
+from . import nd2, errors, matlab, morphology, npy, strel, warnings, raw, tasks, timings, spot_table
 from .base import round_any, setdiff2d
@@ -105,7 +105,7 @@ def check_color_nan(colors: np.ndarray, nbp_basic: NotebookPage):
     `colors` should only contain the `invalid_value` in rounds/channels not in use_rounds/channels.
     This raises an error if this is not the case or if a round/channel not in use_rounds/channels
     contains a value other than `invalid_value`.
-    `invalid_value = -nbp_basic.tile_pixel_value_shift - 1` if colors is integer i.e. the non-normalised colors,
+    `invalid_value = -nbp_basic.tile_pixel_value_shift` if colors is integer i.e. the non-normalised colors,
     usually spot_colors.
     `invalid_value = -np.nan` if colors is float i.e. the normalised colors or most likely the bled_codes.
 
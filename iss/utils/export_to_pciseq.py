@@ -1,7 +1,10 @@
+import numpy as np
 import pandas as pd
+from typing import Optional, List
 from ..pipeline.run import initialize_nb
-from ..call_spots.base import quality_threshold
+from ..call_spots.results_index import get_results_index
 from ..setup import NotebookPage, Notebook
+from .spot_table import SpotTableWriter
 
 
 def get_thresholds_page(nb: Notebook) -> NotebookPage:
@@ -24,42 +27,67 @@ def get_thresholds_page(nb: Notebook) -> NotebookPage:
     return nbp
 
 
-def export(config_file_path: str, method: str = 'omp'):
+def export(config_file_path: str, method: str = 'omp', file_format: str = 'csv', columns: Optional[List[str]] = None):
     """
     This saves a .csv file containing plotting information for pciseq.
     Also adds the thresholds page to the notebook and re-saves.
     This is so the thresholds cannot be further changed.
 
+    If `file_format` is `'parquet'` or `'arrow'`, the spots are instead written to a columnar file with
+    `utils.spot_table.SpotTableWriter`, one row group per tile, so only the spots of one tile are converted at a
+    time. This is much quicker and smaller than the csv file for large numbers of spots.
+
     Args:
         config_file_path: Path to config .ini file used to make notebook.
         method: 'omp' or 'anchor, which gene calling method to save
+        file_format: `'csv'`, `'parquet'` or `'arrow'`.
+        columns: Optional columns to add to parquet or arrow file as well as the coordinates and gene of each spot.
+            Can contain `'score'`, `'intensity'`, `'tile'` and, if `method='omp'`, `'n_neighbours_pos'` and
+            `'n_neighbours_neg'`.
 
     Returns:
 
     """
     if method.lower() != 'omp' and method.lower() != 'ref' and method.lower() != 'anchor':
         raise ValueError(f"method must be 'omp' or 'anchor but {method} given.")
+    if file_format.lower() not in ['csv', 'parquet', 'arrow']:
+        raise ValueError(f"file_format must be 'csv', 'parquet' or 'arrow' but {file_format} given.")
     # load notebook
     nb = initialize_nb(config_file_path)
 
     # Select spot
-    qual_ok = quality_threshold(nb, method)
-    if method.lower() == 'omp':
-        global_spot_yxz = nb.omp.local_yxz + nb.stitch.tile_origin[nb.omp.tile]
-        spot_gene = nb.call_spots.gene_names[nb.omp.gene_no[qual_ok]]
-    else:
-        global_spot_yxz = nb.ref_spots.local_yxz + nb.stitch.tile_origin[nb.ref_spots.tile]
-        spot_gene = nb.call_spots.gene_names[nb.ref_spots.gene_no[qual_ok]]
-    global_spot_yxz = global_spot_yxz[qual_ok]
+    results_index = get_results_index(nb, method)
+    qual_ok = results_index.query(quality=True)
 
-    df_to_export = pd.DataFrame(data=global_spot_yxz, index=spot_gene, columns=['y', 'x', 'z_stack'])
-    df_to_export['Gene'] = df_to_export.index
-
-    output_path = nb.file_names.output_dir + '/' + config_file_path.split('/')[-1][:-4] + '_' + method + '.csv'
     # Make output_path have method in title
-    df_to_export.to_csv(output_path, index=False)
+    output_path = nb.file_names.output_dir + '/' + config_file_path.split('/')[-1][:-4] + '_' + method + '.' + \
+        file_format.lower()
+    if file_format.lower() == 'csv':
+        global_spot_yxz = results_index.global_yxz[qual_ok]
+        spot_gene = nb.call_spots.gene_names[results_index.gene_no[qual_ok]]
+        df_to_export = pd.DataFrame(data=global_spot_yxz, index=spot_gene, columns=['y', 'x', 'z_stack'])
+        df_to_export['Gene'] = df_to_export.index
+        df_to_export.to_csv(output_path, index=False)
+    else:
+        nbp = nb.omp if method.lower() == 'omp' else nb.ref_spots
+        column_values = {'score': results_index.score, 'intensity': results_index.intensity, 'tile': nbp.tile}
+        if method.lower() == 'omp':
+            column_values['n_neighbours_pos'] = nbp.n_neighbours_pos
+            column_values['n_neighbours_neg'] = nbp.n_neighbours_neg
+        if columns is None:
+            columns = []
+        # write spots of each tile as separate row group.
+        spot_tile = nbp.tile[qual_ok]
+        tile_order = np.argsort(spot_tile, kind='stable')
+        tile_spots = np.split(qual_ok[tile_order], np.flatnonzero(np.diff(spot_tile[tile_order])) + 1)
+        with SpotTableWriter(output_path, nb.call_spots.gene_names, file_format.lower(), columns) as writer:
+            for spots in tile_spots:
+                writer.write(results_index.global_yxz[spots], results_index.gene_no[spots],
+                             **{col: column_values[col][spots] for col in columns if col in column_values})
     print('File saved: ' + output_path)
 
     # Add thresholds page to notebook so cannot make any further changes to config - will trigger save
-    nbp_thresholds = get_thresholds_page(nb)
-    nb += nbp_thresholds
+    # Already added if exported before, in which case thresholds used were from this page.
+    if not nb.has_page('thresholds'):
+        nbp_thresholds = get_thresholds_page(nb)
+        nb += nbp_thresholds
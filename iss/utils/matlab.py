@@ -1,7 +1,7 @@
 import h5py
 import numpy as np
 from scipy import io
-from typing import Union, List
+from typing import Union, List, Optional
 from ..setup.notebook import Notebook
 from ..call_spots.base import quality_threshold
 
@@ -81,84 +81,69 @@ def load_cell(file_name: str, var_name: str) -> list:
     return data
 
 
-def update_dict(nbp, nb, dict, score_thresh):
+def save_page(file, nbp, prefix: str = '', keep: Optional[np.ndarray] = None,
+              spot_vars: Optional[List[str]] = None, skip_vars: Optional[List[str]] = None):
     """
-    Used in save_nb_results to reduced amount of data saved. Only data with score > score_thresh kept.
-    Args:
-        nbp:
-        nb:
-        dict:
-        score_thresh:
-
-    Returns:
+    Appends each variable in notebook page to open .mat file, one at a time so only one variable is ever copied.
 
+    Args:
+        file: .mat file opened in `'wb'` mode.
+        nbp: Notebook page to save.
+        prefix: Added to start of name of each variable in the .mat file.
+        keep: `int [n_keep]`. Indices of spots to save. If `None`, all spots are saved.
+        spot_vars: Variables with a value for each spot, only `keep` spots of these are saved.
+        skip_vars: Variables not to save.
     """
-    pf = nbp.name + '_'
-    if pf != 'omp_' and pf != 'ref_spots_':
-        raise ValueError("Wrong page given, should be 'omp' or 'ref_spots'")
-    nbp.finalized = False
-    score_thresh_old = nbp.score_thresh
-    del nbp.score_thresh
-    nbp.score_thresh = score_thresh
-    if pf == 'omp_':
-        keep = quality_threshold(nb, 'omp')
-    else:
-        keep = quality_threshold(nb, 'ref')
-    del nbp.score_thresh
-    nbp.score_thresh = score_thresh_old
-    nbp.finalized = True
-    for var in ['local_yxz', 'tile', 'colors', 'intensity', 'background_coef', 'gene_no']:
-        dict[pf + var] = dict[pf + var][keep]
-    if pf == 'ref_spots_':
-        del dict[pf + 'background_coef']
-        for var in ['isolated', 'score', 'score_diff']:
-            dict[pf + var] = dict[pf + var][keep]
-    if pf == 'omp_':
-        for var in ['shape_spot_local_yxz', 'shape_spot_gene_no', 'spot_shape_float']:
-            del dict[pf + var]
-        for var in ['coef', 'n_neighbours_pos', 'n_neighbours_neg']:
-            dict[pf + var] = dict[pf + var][keep]
-    return dict
-
-
-def save_nb_results(nb: Notebook, file_name: str, score_thresh_ref_spots = 0.15, score_thresh_omp=0.15):
+    if spot_vars is None:
+        spot_vars = []
+    if skip_vars is None:
+        skip_vars = []
+    page_dict = nbp.to_serial_dict()
+    for var in [k for k in page_dict if not '___' in k and k != 'PAGEINFO' and k not in skip_vars]:
+        value = page_dict[var]
+        if value is None:
+            value = []  # Can't save None values
+        elif var in spot_vars and keep is not None:
+            value = value[keep]
+        io.savemat(file, {prefix + var: value})
+        del value
+
+
+def save_nb_results(nb: Notebook, file_name: str, score_thresh_ref_spots: float = 0.15,
+                    score_thresh_omp: float = 0.15):
     """
     Saves important information in notebook as a .mat file so can load in MATLAB and plot
-    using python_testing/iss_object_from_python.m scripts
+    using python_testing/iss_object_from_python.m scripts.
+
+    Only spots with score above the thresholds given and intensity above the intensity threshold of
+    `quality_threshold` are saved. These are found first, then each variable is written to the file on its own,
+    so the only large array copied at any time is the saved spots of a single variable.
 
     Args:
-        nb:
-        file_name:
+        nb: Notebook containing the results of the experiment.
+        file_name: Path of .mat file to save to.
+        score_thresh_ref_spots: Only `ref_spots` with score above this are saved.
+        score_thresh_omp: Only `omp` spots with score above this are saved.
     """
-    mdic = {}
-    if nb.has_page('file_names'):
-        mdic['tile_file_names'] = nb.file_names.tile
-    if nb.has_page('stitch'):
-        mdic['tile_origin'] = nb.stitch.tile_origin
-    if nb.has_page('register'):
-        mdic['transform'] = nb.register.transform
-
-    if nb.has_page('call_spots'):
-        call_spots_dict = nb.call_spots.to_serial_dict()
-        call_spots_dict = {k: v for k, v in call_spots_dict.items() if not '___' in k}
-        del call_spots_dict['PAGEINFO']
-        mdic.update(call_spots_dict)
-
-    if nb.has_page('ref_spots'):
-        ref_spots_dict = nb.ref_spots.to_serial_dict()
-        # Give 'ref_spots' prefix to key names as same variables in omp page.
-        ref_spots_dict = {ref_spots_dict['PAGEINFO'] + '_' + k: v for k, v in ref_spots_dict.items() if not '___' in k}
-        del ref_spots_dict['ref_spots_PAGEINFO']
-        ref_spots_dict = update_dict(nb.ref_spots, nb, ref_spots_dict, score_thresh_ref_spots)
-        mdic.update(ref_spots_dict)
-
-    if nb.has_page('omp'):
-        omp_dict = nb.omp.to_serial_dict()
-        omp_dict = {omp_dict['PAGEINFO'] + '_' + k:v for k,v in omp_dict.items() if not '___' in k}
-        del omp_dict['omp_PAGEINFO']
-        omp_dict = update_dict(nb.omp, nb, omp_dict, score_thresh_omp)
-        mdic.update(omp_dict)
-    for k, v in mdic.items():
-        if v is None:
-            mdic[k] = []  # Can't save None values
-    io.savemat(file_name, mdic)
+    with open(file_name, 'wb') as file:
+        if nb.has_page('file_names'):
+            io.savemat(file, {'tile_file_names': nb.file_names.tile})
+        if nb.has_page('stitch'):
+            io.savemat(file, {'tile_origin': nb.stitch.tile_origin})
+        if nb.has_page('register'):
+            io.savemat(file, {'transform': nb.register.transform})
+
+        if nb.has_page('call_spots'):
+            save_page(file, nb.call_spots)
+
+        if nb.has_page('ref_spots'):
+            keep = np.where(quality_threshold(nb, 'ref', score_thresh_ref_spots))[0]
+            # Give 'ref_spots' prefix to variable names as same variables in omp page.
+            save_page(file, nb.ref_spots, 'ref_spots_', keep, ['local_yxz', 'isolated', 'tile', 'colors', 'gene_no',
+                                                               'score', 'score_diff', 'intensity'])
+
+        if nb.has_page('omp'):
+            keep = np.where(quality_threshold(nb, 'omp', score_thresh_omp))[0]
+            save_page(file, nb.omp, 'omp_', keep, ['local_yxz', 'tile', 'colors', 'gene_no', 'n_neighbours_pos',
+                                                   'n_neighbours_neg', 'intensity'],
+                      ['shape_spot_local_yxz', 'shape_spot_gene_no', 'spot_shape_float'])
@@ -318,6 +318,107 @@ def manual_convolve(image: jnp.ndarray, y_kernel_shifts: jnp.ndarray, x_kernel_s
                     out_axes=0)(image, y_kernel_shifts, x_kernel_shifts,z_kernel_shifts, coords)
 
 
+def get_kernel_rectangles(kernel: np.ndarray) -> np.ndarray:
+    """
+    Splits the non-zero elements of a 2D binary `kernel` into rectangles which cover each non-zero element once.
+    Each row is split into runs of consecutive non-zero elements and runs which are the same in consecutive
+    rows are merged, so disks and annuli only need a few rectangles.
+
+    Args:
+        kernel: `int [kernel_szY x kernel_szX]`.
+            Binary kernel, only containing 0 and 1.
+
+    Returns:
+        `int [n_rectangles x 4]`.
+            `[y_start, y_stop, x_start, x_stop]` of each rectangle, `stop` is exclusive.
+    """
+    rectangles = []
+    open_rectangles = {}  # rectangles which can still be extended by next row, key is (x_start, x_stop)
+    for y in range(kernel.shape[0]):
+        row = np.concatenate(([0], (kernel[y] > 0).astype(np.int8), [0]))
+        run_change = np.flatnonzero(np.diff(row))
+        runs = set(zip(run_change[::2], run_change[1::2]))
+        for run in list(open_rectangles):
+            if run not in runs:
+                rectangles.append(open_rectangles.pop(run))
+        for run in runs:
+            if run in open_rectangles:
+                open_rectangles[run][1] = y + 1
+            else:
+                open_rectangles[run] = [y, y + 1, run[0], run[1]]
+    rectangles += list(open_rectangles.values())
+    return np.array(rectangles, dtype=int).reshape(-1, 4)
+
+
+def imfilter_coords_rectangles(image: np.ndarray, kernel: np.ndarray, coords: np.ndarray,
+                               padding: float = 0) -> np.ndarray:
+    """
+    Finds result of correlation of `image` with binary `kernel` at `coords` using a summed-area table of each
+    z-plane of `image`. `kernel` is split into rectangles with `get_kernel_rectangles` so the sum about each
+    coordinate only needs 4 values of the summed-area table for each rectangle, rather than one value for each
+    non-zero element of `kernel`. Only one z-plane of `image` is ever copied.
+
+    Args:
+        image: `int [image_szY x image_szX x image_szZ]`.
+            Image to be filtered. If not integer or `bool`, it is converted to `int` before filtering.
+        kernel: `int [kernel_szY x kernel_szX x kernel_szZ]`.
+            Binary kernel, with odd size in each dimension so centre is at `(kernel.shape - 1) / 2`.
+        coords: `int [n_points x 3]`.
+            yxz coordinates where result of filtering is desired.
+        padding: Value of `image` outside its bounds.
+
+    Returns:
+        `int [n_points]`.
+            Result of filtering of `image` at each point in `coords`.
+    """
+    kernel_centre = (np.array(kernel.shape) - 1) // 2
+    # rectangles[i] are the rectangles of kernel z-plane i, with coordinates relative to the centre of kernel.
+    rectangles = [get_kernel_rectangles(kernel[:, :, i]) - np.repeat(kernel_centre[:2], 2)
+                  for i in range(kernel.shape[2])]
+    n_y, n_x, n_z = image.shape
+    result = np.zeros(coords.shape[0], dtype=np.int64)
+    n_pixels_in_image = np.zeros(coords.shape[0], dtype=np.int64)
+    # group coordinates by z-plane.
+    coord_order = np.argsort(coords[:, 2], kind='stable')
+    z_plane_start = np.searchsorted(coords[coord_order, 2], np.arange(n_z + 1))
+    # cv2.integral only accepts some dtypes, use the smallest which gives exact sums.
+    if image.dtype == bool:
+        image = image.view(np.uint8)
+    is_integer = np.issubdtype(image.dtype, np.integer)
+    if image.dtype in [np.uint8, np.uint16, np.int16] or not is_integer:
+        plane_dtype = image.dtype
+    elif image.size > 0 and max(-int(image.min()), int(image.max())) < 2 ** 24:
+        plane_dtype = np.float32
+    else:
+        plane_dtype = np.float64
+    for z in range(n_z):
+        plane_sum = None
+        for i in range(kernel.shape[2]):
+            z_coord = z - (i - kernel_centre[2])
+            if len(rectangles[i]) == 0 or z_coord < 0 or z_coord >= n_z or \
+                    z_plane_start[z_coord] == z_plane_start[z_coord + 1]:
+                continue
+            if plane_sum is None:
+                # summed-area table: plane_sum[y, x] = sum(image[:y, :x, z])
+                plane = image[:, :, z].astype(plane_dtype, copy=False)
+                if not is_integer:
+                    # same as converting image to int.
+                    plane = np.trunc(plane, dtype=np.float64)
+                plane_sum = cv2.integral(plane, sdepth=cv2.CV_64F)
+            use = coord_order[z_plane_start[z_coord]:z_plane_start[z_coord + 1]]
+            y_start = np.clip(coords[use, 0:1] + rectangles[i][:, 0], 0, n_y)
+            y_stop = np.clip(coords[use, 0:1] + rectangles[i][:, 1], 0, n_y)
+            x_start = np.clip(coords[use, 1:2] + rectangles[i][:, 2], 0, n_x)
+            x_stop = np.clip(coords[use, 1:2] + rectangles[i][:, 3], 0, n_x)
+            rectangle_sums = plane_sum[y_stop, x_stop] - plane_sum[y_start, x_stop] - plane_sum[y_stop, x_start] + \
+                plane_sum[y_start, x_start]
+            result[use] += np.rint(rectangle_sums.sum(axis=1)).astype(np.int64)
+            n_pixels_in_image[use] += ((y_stop - y_start) * (x_stop - x_start)).sum(axis=1)
+    if padding != 0:
+        result = result + padding * (np.sum(kernel > 0) - n_pixels_in_image)
+    return result
+
+
 def imfilter_coords(image: np.ndarray, kernel: np.ndarray, coords: np.ndarray, padding: Union[float, str] = 0,
                     corr_or_conv: str = 'corr') -> Union[np.ndarray, Tuple[np.ndarray, np.ndarray]]:
     """
@@ -378,11 +479,13 @@ def imfilter_coords(image: np.ndarray, kernel: np.ndarray, coords: np.ndarray, p
     if (coords.max(axis=0) >= np.array(image.shape)).any():
         raise ValueError(f"Max yxz coordinates provided are {coords.max(axis=0)} but image has shape {image.shape}.")
 
+    if isinstance(padding, numbers.Number):
+        # With constant padding, no need to pad image as can crop kernel at edge of image and use
+        # summed-area tables.
+        return imfilter_coords_rectangles(image, np.flip(kernel), coords, padding)
+
     pad_size = [(int((ax_size-1)/2),)*2 for ax_size in kernel.shape]
     pad_coords = jnp.asarray(coords) + jnp.array([val[0] for val in pad_size])
-    if isinstance(padding, numbers.Number):
-        image_pad = jnp.pad(jnp.asarray(image), pad_size, 'constant', constant_values=padding).astype(int)
-    else:
-        image_pad = jnp.pad(jnp.asarray(image), pad_size, padding).astype(int)
+    image_pad = jnp.pad(jnp.asarray(image), pad_size, padding).astype(int)
     y_shifts, x_shifts, z_shifts = get_shifts_from_kernel(jnp.asarray(np.flip(kernel)))
     return np.asarray(manual_convolve(image_pad, y_shifts, x_shifts, z_shifts, pad_coords))
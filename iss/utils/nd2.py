@@ -61,25 +61,31 @@ def get_metadata(file_path: str) -> dict:
     return metadata
 
 
-def get_image(images: np.ndarray, fov: int, channel: int, use_z: Optional[List[int]] = None) -> np.ndarray:
+def get_image(images: np.ndarray, fov: int, channel: Union[int, List[int]],
+              use_z: Optional[List[int]] = None) -> np.ndarray:
     """
     Using dask array from nd2 file, this loads the image of the desired fov and channel.
 
     Args:
         images: Dask array with `fov`, `channel`, y, x, z as index order.
         fov: `fov` index of desired image
-        channel: `channel` of desired image
+        channel: `channel` of desired image.
+            If a list of channels is given, each frame is only read from the nd2 file once for all of them.
         use_z: `int [n_use_z]`.
             Which z-planes of image to load.
             If `None`, will load all z-planes.
 
     Returns:
-        `uint16 [im_sz_y x im_sz_x x n_use_z]`.
+        `uint16 [(n_channels x) im_sz_y x im_sz_x x n_use_z]`.
             Image of the desired `fov` and `channel`.
     """
     if use_z is None:
         use_z = np.arange(images.shape[-1])
-    return np.asarray(images[fov, channel, :, :, use_z])
+    if isinstance(channel, numbers.Number):
+        return np.asarray(images[fov, channel, :, :, use_z])
+    else:
+        # dask only allows one list index at a time.
+        return np.asarray(images[fov, :, :, :, use_z][list(channel)])
 
 
 def save_metadata(json_file: str, nd2_file: str, use_channels: Optional[List] = None):
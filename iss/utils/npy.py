@@ -20,7 +20,7 @@ def save_tile(nbp_file: NotebookPage, nbp_basic: NotebookPage, image: np.ndarray
         nbp_basic: `basic_info` notebook page
         nbp_extract_debug: `extract_debug` notebook page
         image: `int32 [ny x nx x nz]` or `int32 [n_channels x ny x nx]`.
-            Image to save.
+            Image to save. In 3D, can also be `float32` with integer values and is not modified.
         t: npy tile index considering
         r: Round considering
         c: Channel considering
@@ -28,20 +28,28 @@ def save_tile(nbp_file: NotebookPage, nbp_basic: NotebookPage, image: np.ndarray
     if nbp_basic.is_3d:
         if c is None:
             raise ValueError('3d image but channel not given.')
+        # In 3D, cannot possibly save any un-used channel hence no exception for this case.
+        expected_shape = (nbp_basic.tile_sz, nbp_basic.tile_sz, nbp_basic.nz)
+        if not utils.errors.check_shape(image, expected_shape):
+            raise utils.errors.ShapeError("tile to be saved", image.shape, expected_shape)
+        # z-axis first as quicker to load in this order.
+        image_save = np.empty(image.shape[2:] + image.shape[:2], dtype=np.uint16)
         if r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel:
             # If dapi is given then image should already by uint16 so no clipping
-            image = image.astype(np.uint16)
+            image_save[:] = np.moveaxis(image, 2, 0)
         else:
             # need to shift and clip image so fits into uint16 dtype.
             # clip at 1 not 0 because 0 (or -tile_pixel_value_shift)
             # will be used as an invalid value when reading in spot_colors.
-            image = np.clip(image + nbp_basic.tile_pixel_value_shift, 1, np.iinfo(np.uint16).max,
-                            np.zeros_like(image, dtype=np.uint16), casting="unsafe")
-        # In 3D, cannot possibly save any un-used channel hence no exception for this case.
-        expected_shape = (nbp_basic.tile_sz, nbp_basic.tile_sz, nbp_basic.nz)
-        if not utils.errors.check_shape(image, expected_shape):
-            raise utils.errors.ShapeError("tile to be saved", image.shape, expected_shape)
-        np.save(nbp_file.tile[t][r][c], np.moveaxis(image, 2, 0))
+            # Done a few rows at a time, straight into image_save, so no full size temporary arrays are made.
+            image_save_yxz = np.moveaxis(image_save, 0, 2)
+            n_rows = max(1, 2 ** 20 // max(1, image.shape[1] * image.shape[2]))
+            for y_start in range(0, image.shape[0], n_rows):
+                y_end = y_start + n_rows
+                np.clip(image[y_start:y_end] + nbp_basic.tile_pixel_value_shift, 1, np.iinfo(np.uint16).max,
+                        image_save_yxz[y_start:y_end], casting="unsafe")
+        np.save(nbp_file.tile[t][r][c], image_save)
+        utils.timings.add_bytes(written=image_save.nbytes)
     else:
         if r == nbp_basic.anchor_round:
             if nbp_basic.anchor_channel is not None:
@@ -62,6 +70,7 @@ def save_tile(nbp_file: NotebookPage, nbp_basic: NotebookPage, image: np.ndarray
         if not utils.errors.check_shape(image, expected_shape):
             raise utils.errors.ShapeError("tile to be saved", image.shape, expected_shape)
         np.save(nbp_file.tile[t][r], image)
+        utils.timings.add_bytes(written=image.nbytes)
 
 
 def load_tile(nbp_file: NotebookPage, nbp_basic: NotebookPage, t: int, r: int, c: int,
@@ -137,11 +146,114 @@ def load_tile(nbp_file: NotebookPage, nbp_basic: NotebookPage, t: int, r: int, c
         else:
             # Use mmap when only loading in part of image
             image = np.load(nbp_file.tile[t][r], mmap_mode='r')[c]
+    utils.timings.add_bytes(read=image.nbytes)
     if apply_shift and not (r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel):
         image = image.astype(np.int32) - nbp_basic.tile_pixel_value_shift
     return image
 
 
+def load_tile_pixels(nbp_file: NotebookPage, nbp_basic: NotebookPage, t: int, r: int, channels: List[int],
+                     yxz: List[np.ndarray], apply_shift: bool = True,
+                     max_read_bytes: int = 2 ** 26) -> List[np.ndarray]:
+    """
+    Loads the pixel values at the given coordinates of several channels of a tile and round, as `load_tile` does
+    for each channel with `yxz` an array of coordinates, but reading the npy files in the order they are stored.
+
+    Coordinates are grouped in storage order (by z-plane in 3D, by y row in 2D), and the planes (rows)
+    containing pixels are read with large sequential reads of at most `max_read_bytes` at a time.
+    Pixels are then scattered back to the order of `yxz`. This is much quicker than reading pixels in a
+    random order from a memmap of a file not in memory.
+
+    Args:
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        t: npy tile index considering
+        r: Round considering
+        channels: `int [n_channels_use]`. Channels considering.
+        yxz: `n_channels_use` arrays. `yxz[i]` is `int [n_pixels_i x (2 or 3)]`, the yx(z) coordinates of
+            pixels to load for `channels[i]`.
+        apply_shift: If `True`, dtype will be `int32` otherwise dtype will be `uint16`
+            with the pixels values shifted by `+nbp_basic.tile_pixel_value_shift`.
+        max_read_bytes: Maximum number of bytes read from an npy file at once, unless a single plane (row) is
+            larger than this.
+
+    Returns:
+        `n_channels_use` arrays. `pixels[i]` is `int32 [n_pixels_i]` or `uint16 [n_pixels_i]` of the values at
+            `yxz[i]` of `channels[i]`.
+    """
+    if len(channels) != len(yxz):
+        raise ValueError(f'{len(channels)} channels given but {len(yxz)} sets of coordinates.')
+    n_dim = 2 + int(nbp_basic.is_3d)
+    for coords in yxz:
+        if np.shape(coords)[1] != n_dim:
+            raise ValueError(f'Loading in a {n_dim}D tile but dimension of coordinates given is '
+                             f'{np.shape(coords)[1]}.')
+    pixels = []
+    if nbp_basic.is_3d:
+        for c, coords in zip(channels, yxz):
+            # npy file is stored as z, y, x
+            image = np.load(nbp_file.tile[t][r][c], mmap_mode='r')
+            coords = np.asarray(coords)
+            pixels.append(_gather_pixels(image, (coords[:, 2], coords[:, 0], coords[:, 1]), max_read_bytes))
+    else:
+        # all channels in same npy file, stored as c, y, x, so planes are y rows of a channel.
+        image = np.load(nbp_file.tile[t][r], mmap_mode='r')
+        for c, coords in zip(channels, yxz):
+            coords = np.asarray(coords)
+            pixels.append(_gather_pixels(image[c], (coords[:, 0], coords[:, 1]), max_read_bytes))
+    for i, c in enumerate(channels):
+        if apply_shift and not (r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel):
+            pixels[i] = pixels[i].astype(np.int32) - nbp_basic.tile_pixel_value_shift
+    return pixels
+
+
+def _gather_pixels(image: np.ndarray, coords: Tuple[np.ndarray, ...], max_read_bytes: int) -> np.ndarray:
+    """
+    Returns `image[coords]`, reading `image` (a memmap) in storage order. Only planes (first axis of `image`) which
+    contain pixels are read, as contiguous blocks of consecutive planes of at most `max_read_bytes`.
+    If a block only contains a few pixels, they are read directly from the memmap in storage order instead.
+    """
+    pixels = np.zeros(len(coords[0]), dtype=image.dtype)
+    if len(pixels) == 0:
+        return pixels
+    plane = coords[0]
+    plane_bytes = int(np.prod(image.shape[1:])) * image.dtype.itemsize
+    n_planes_read = max(max_read_bytes // plane_bytes, 1)
+    n_pixels_plane = np.bincount(plane, minlength=image.shape[0])
+    page_size = 4096
+    n_bytes_read = 0
+    plane_start = 0
+    while plane_start < image.shape[0]:
+        if n_pixels_plane[plane_start] == 0:
+            plane_start += 1
+            continue
+        # block from this plane, ending at the last plane with pixels within n_planes_read planes.
+        plane_end = plane_start + np.where(n_pixels_plane[plane_start:plane_start + n_planes_read] > 0)[0][-1] + 1
+        n_pixels_block = np.sum(n_pixels_plane[plane_start:plane_end])
+        if n_pixels_block == len(pixels):
+            in_block = slice(None)
+        else:
+            in_block = np.where(np.logical_and(plane >= plane_start, plane < plane_end))[0]
+        coords_block = tuple(coord[in_block] for coord in coords)
+        if n_pixels_block * page_size < (plane_end - plane_start) * plane_bytes:
+            # few pixels so quicker to read only the pages containing them, in the order they are stored.
+            ind = np.ravel_multi_index(tuple(coord.astype(np.int64) for coord in coords_block), image.shape)
+            order = np.argsort(ind)
+            pixels_block = np.zeros(n_pixels_block, dtype=image.dtype)
+            pixels_block[order] = image.reshape(-1)[ind[order]]
+            n_bytes_read += pixels_block.nbytes
+        else:
+            block = np.asarray(image[plane_start:plane_end])
+            if plane_start > 0:
+                coords_block = (coords_block[0] - plane_start,) + coords_block[1:]
+            pixels_block = block[coords_block]
+            n_bytes_read += block.nbytes
+        pixels[in_block] = pixels_block
+        plane_start = plane_end
+    utils.timings.add_bytes(read=n_bytes_read)
+    return pixels
+
+
 def get_npy_tile_ind(tile_ind_nd2: Union[int, List[int]], tile_pos_yx_nd2: np.ndarray,
                      tile_pos_yx_npy: np.ndarray) -> Union[int, List[int]]:
     """
@@ -171,37 +283,57 @@ def get_npy_tile_ind(tile_ind_nd2: Union[int, List[int]], tile_pos_yx_nd2: np.nd
 
 
 
-def save_stitched(im_file: Optional[str], nbp_file: NotebookPage, nbp_basic: NotebookPage, tile_origin: np.ndarray,
-                  r: int, c: int, from_nd2: bool = False, zero_thresh: int = 0):
+def save_stitched(im_file: Optional[Union[str, List[Optional[str]]]], nbp_file: NotebookPage,
+                  nbp_basic: NotebookPage, tile_origin: np.ndarray, r: int, c: Union[int, List[int]],
+                  from_nd2: bool = False, zero_thresh: int = 0) -> Optional[Union[np.ndarray, List[np.ndarray]]]:
     """
     Stitches together all tiles from round `r`, channel `c` and saves the resultant compressed npz at `im_file`.
     Saved image will be uint16 if from nd2 or from DAPI filtered npy files.
     Otherwise, if from filtered npy files, will remove shift and re-scale to fill int16 range.
 
+    If `c` is a list, all channels are stitched in the same pass through the tiles, so with `from_nd2`,
+    each tile is only read from the nd2 file once for all channels.
+
+    If `im_file` ends in `.npy`, the stitched image is written straight to it through a memory map as each tile
+    is read, so only one tile of each channel is ever in memory, and the memory mapped image is returned.
+
     Args:
-        im_file: Path to save file.
+        im_file: Path to save file. If `c` is a list, this is a list of the same length, path for each channel.
             If `None`, stitched `image` is returned (with z axis last) instead of saved.
+            If it ends in `.npy`, the uncompressed image is saved there and returned as a memory map
+            (with z axis last).
         nbp_file: `file_names` notebook page
         nbp_basic: `basic_info` notebook page
         tile_origin: `float [n_tiles x 3]`.
             yxz origin of each tile on round `r`.
         r: save_stitched will save stitched image of all tiles of round `r`, channel `c`.
         c: save_stitched will save stitched image of all tiles of round `r`, channel `c`.
+            Can be a list of channels.
         from_nd2: If `False`, will stitch together tiles from saved npy files,
             otherwise will load in raw un-filtered images from nd2 file.
         zero_thresh: All pixels with absolute value less than or equal to `zero_thresh` will be set to 0.
-            The larger it is, the smaller the compressed file will be.\
-        save: If True, saves image as im_file, otherwise returns image
+            The larger it is, the smaller the compressed file will be.
+
+    Returns:
+        Stitched image if `im_file` is `None` or ends in `.npy`, or list of stitched image of each channel
+            if `c` is a list (`None` for channels saved as npz files).
     """
+    single_channel = isinstance(c, numbers.Number)
+    channels = [c] if single_channel else list(c)
+    if single_channel or im_file is None:
+        im_files = [im_file] * len(channels)
+    else:
+        im_files = list(im_file)
+        if len(im_files) != len(channels):
+            raise ValueError(f'{len(channels)} channels given but {len(im_files)} files.')
     yx_origin = np.round(tile_origin[:, :2]).astype(int)
     z_origin = np.round(tile_origin[:, 2]).astype(int).flatten()
     yx_size = np.max(yx_origin, axis=0) + nbp_basic.tile_sz
     if nbp_basic.is_3d:
         z_size = z_origin.max() + nbp_basic.nz
-        stitched_image = np.zeros(np.append(z_size, yx_size), dtype=np.uint16)
+        stitched_shape = np.append(z_size, yx_size)
     else:
-        z_size = 1
-        stitched_image = np.zeros(yx_size, dtype=np.uint16)
+        stitched_shape = yx_size
     if from_nd2:
         if nbp_basic.use_anchor:
             # always have anchor as first round after imaging rounds
@@ -210,63 +342,129 @@ def save_stitched(im_file: Optional[str], nbp_file: NotebookPage, nbp_basic: Not
             round_files = nbp_file.round
         nd2_file = os.path.join(nbp_file.input_dir, round_files[r] + nbp_file.raw_extension)
         nd2_all_images = utils.nd2.load(nd2_file)
-        shift = 0  # if from nd2 file, data type is already un-shifted uint16
-    else:
-        if r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel:
-            shift = 0  # if filtered dapi, data type is already un-shifted uint16
+    shifts = []
+    stitched_images = []
+    for c, im_file_c in zip(channels, im_files):
+        if from_nd2 or (r == nbp_basic.anchor_round and c == nbp_basic.dapi_channel):
+            # if from nd2 file or filtered dapi, data type is already un-shifted uint16
+            shifts.append(0)
+            dtype = np.uint16
         else:
             # if from filtered npy files, data type is shifted uint16, want to save stitched as un-shifted int16.
-            shift = nbp_basic.tile_pixel_value_shift
-    if shift != 0:
-        # change dtype to accommodate negative values and set base value to be zero in the shifted image.
-        stitched_image = stitched_image.astype(np.int32) + shift
-    with tqdm(total=z_size * len(nbp_basic.use_tiles)) as pbar:
+            # change dtype to accommodate negative values and set base value to be zero in the shifted image.
+            shifts.append(nbp_basic.tile_pixel_value_shift)
+            dtype = np.int32
+        if im_file_c is not None and im_file_c.endswith('.npy'):
+            # shifted image is written to a temporary file as it is re-scaled to int16 at the end.
+            stitched_images.append(np.lib.format.open_memmap(
+                im_file_c if shifts[-1] == 0 else im_file_c[:-len('.npy')] + '_shifted.npy', 'w+', dtype,
+                tuple(stitched_shape)))
+            if shifts[-1] != 0:
+                stitched_images[-1][:] = shifts[-1]
+        else:
+            stitched_images.append(np.full(stitched_shape, shifts[-1], dtype=dtype))
+    with tqdm(total=len(channels) * len(nbp_basic.use_tiles)) as pbar:
         for t in nbp_basic.use_tiles:
             if from_nd2:
-                image_t = utils.nd2.get_image(nd2_all_images,
-                                              utils.nd2.get_nd2_tile_ind(t, nbp_basic.tilepos_yx_nd2,
-                                                                             nbp_basic.tilepos_yx),
-                                              c, nbp_basic.use_z)
-                # replicate non-filtering procedure in extract_and_filter
-                if not nbp_basic.is_3d:
-                    image_t = extract.focus_stack(image_t)
-                image_t, bad_columns = extract.strip_hack(image_t)  # find faulty columns
-                image_t[:, bad_columns] = 0
-                if nbp_basic.is_3d:
-                    image_t = np.moveaxis(image_t, 2, 0)  # put z-axis back to the start
-            else:
-                if nbp_basic.is_3d:
-                    image_t = np.load(nbp_file.tile[t][r][c], mmap_mode='r')
+                # all channels of each frame are read together.
+                images_t = utils.nd2.get_image(nd2_all_images,
+                                               utils.nd2.get_nd2_tile_ind(t, nbp_basic.tilepos_yx_nd2,
+                                                                          nbp_basic.tilepos_yx),
+                                               channels, nbp_basic.use_z)
+            for i, c in enumerate(channels):
+                pbar.set_postfix({'tile': t, 'channel': c})
+                if from_nd2:
+                    image_t = images_t[i]
+                    # replicate non-filtering procedure in extract_and_filter
+                    if not nbp_basic.is_3d:
+                        image_t = extract.focus_stack(image_t)
+                    image_t, bad_columns = extract.strip_hack(image_t)  # find faulty columns
+                    image_t[:, bad_columns] = 0
+                    if nbp_basic.is_3d:
+                        image_t = np.moveaxis(image_t, 2, 0)  # put z-axis back to the start
                 else:
-                    image_t = load_tile(nbp_file, nbp_basic, t, r, c, apply_shift=False)
-            for z in range(z_size):
+                    if nbp_basic.is_3d:
+                        image_t = np.load(nbp_file.tile[t][r][c], mmap_mode='r')
+                    else:
+                        image_t = load_tile(nbp_file, nbp_basic, t, r, c, apply_shift=False)
                 # any tiles not used will be kept as 0.
-                pbar.set_postfix({'tile': t, 'z': z})
+                yx_slice = (slice(yx_origin[t, 0], yx_origin[t, 0] + nbp_basic.tile_sz),
+                            slice(yx_origin[t, 1], yx_origin[t, 1] + nbp_basic.tile_sz))
                 if nbp_basic.is_3d:
-                    file_z = z - z_origin[t]
-                    if file_z < 0 or file_z >= nbp_basic.nz:
-                        # Set tile to 0 if currently outside its area
-                        local_image = np.zeros((nbp_basic.tile_sz, nbp_basic.tile_sz))
-                    else:
-                        local_image = image_t[file_z]
-                    stitched_image[z, yx_origin[t, 0]:yx_origin[t, 0]+nbp_basic.tile_sz,
-                                   yx_origin[t, 1]:yx_origin[t, 1]+nbp_basic.tile_sz] = local_image
+                    # Set tile to 0 at z-planes outside its area
+                    z_start = max(z_origin[t], 0)
+                    z_stop = min(z_origin[t] + nbp_basic.nz, z_size)
+                    stitched_images[i][(slice(None, z_start),) + yx_slice] = 0
+                    stitched_images[i][(slice(z_stop, None),) + yx_slice] = 0
+                    stitched_images[i][(slice(z_start, z_stop),) + yx_slice] = \
+                        image_t[z_start - z_origin[t]:z_stop - z_origin[t]]
                 else:
-                    stitched_image[yx_origin[t, 0]:yx_origin[t, 0]+nbp_basic.tile_sz,
-                                   yx_origin[t, 1]:yx_origin[t, 1]+nbp_basic.tile_sz] = image_t
+                    stitched_images[i][yx_slice] = image_t
                 pbar.update(1)
     pbar.close()
+    for i in range(len(channels)):
+        stitched_image = stitched_images[i]
+        stitched_images[i] = None
+        if isinstance(stitched_image, np.memmap):
+            stitched_images[i] = finish_stitched_memmap(stitched_image, im_files[i], shifts[i], zero_thresh,
+                                                        nbp_basic.tile_sz ** 2)
+            if nbp_basic.is_3d and z_size > 1:
+                stitched_images[i] = np.moveaxis(stitched_images[i], 0, -1)
+            del stitched_image
+            continue
+        if shifts[i] != 0:
+            # remove shift and re-scale so fits the whole int16 range
+            stitched_image = stitched_image - shifts[i]
+            stitched_image = stitched_image * np.iinfo(np.int16).max / np.abs(stitched_image).max()
+            stitched_image = np.rint(stitched_image, np.zeros_like(stitched_image, dtype=np.int16),
+                                     casting='unsafe')
+        if zero_thresh > 0:
+            stitched_image[np.abs(stitched_image) <= zero_thresh] = 0
+
+        if im_files[i] is None:
+            if nbp_basic.is_3d and z_size > 1:
+                stitched_image = np.moveaxis(stitched_image, 0, -1)
+            stitched_images[i] = stitched_image
+        else:
+            np.savez_compressed(im_files[i], stitched_image)
+        del stitched_image
+    if any(im_file_c is None or im_file_c.endswith('.npy') for im_file_c in im_files):
+        return stitched_images[0] if single_channel else stitched_images
+
+
+def finish_stitched_memmap(stitched_image: np.memmap, im_file: str, shift: int, zero_thresh: int,
+                           block_size: int) -> np.memmap:
+    """
+    Does the same processing of a memory mapped stitched image as `save_stitched` does in memory,
+    a block of the first axis at a time so the whole image is never in memory.
+
+    Args:
+        stitched_image: `uint16` or, if `shift != 0`, shifted `int32` stitched image.
+        im_file: Path of npy file to save the final image to.
+        shift: Shift to remove. If not `0`, the image is re-scaled to fill the `int16` range and saved to `im_file`,
+            and the file of `stitched_image` is removed.
+        zero_thresh: All pixels with absolute value less than or equal to `zero_thresh` will be set to 0.
+        block_size: Approximate number of pixels processed at once.
+
+    Returns:
+        Memory mapped final image saved at `im_file`.
+    """
+    n_block = max(1, block_size // int(np.prod(stitched_image.shape[1:])))
+    blocks = [slice(i, i + n_block) for i in range(0, stitched_image.shape[0], n_block)]
     if shift != 0:
         # remove shift and re-scale so fits the whole int16 range
-        stitched_image = stitched_image - shift
-        stitched_image = stitched_image * np.iinfo(np.int16).max / np.abs(stitched_image).max()
-        stitched_image = np.rint(stitched_image, np.zeros_like(stitched_image, dtype=np.int16), casting='unsafe')
+        max_abs = max(np.abs(stitched_image[block] - shift).max() for block in blocks)
+        image_int16 = np.lib.format.open_memmap(im_file, 'w+', np.int16, stitched_image.shape)
+        for block in blocks:
+            np.rint((stitched_image[block] - shift) * np.iinfo(np.int16).max / max_abs, image_int16[block],
+                    casting='unsafe')
+        shifted_file = stitched_image.filename
+        del stitched_image
+        os.remove(shifted_file)
+        stitched_image = image_int16
     if zero_thresh > 0:
-        stitched_image[np.abs(stitched_image) <= zero_thresh] = 0
-
-    if im_file is None:
-        if z_size > 1:
-            stitched_image = np.moveaxis(stitched_image, 0, -1)
-        return stitched_image
-    else:
-        np.savez_compressed(im_file, stitched_image)
+        for block in blocks:
+            image_block = stitched_image[block]
+            image_block[np.abs(image_block) <= zero_thresh] = 0
+    stitched_image.flush()
+    return stitched_image
@@ -1,10 +1,12 @@
 import os
 import re
+import threading
 import numpy as np
-from typing import List, Optional, Union
+from collections import OrderedDict
+from typing import List, Optional, Union, Tuple
 import warnings
 from .errors import OutOfBoundsError
-from ..utils import nd2
+from ..utils import nd2, timings
 from ..setup import NotebookPage
 import dask.array
 
@@ -72,9 +74,124 @@ def metadata_sanity_check(metadata: dict, round_folder_path: str) -> List:
     return tiles
 
 
+class RawTileCache:
+    """
+    Least recently used cache of raw images loaded by `load`, so the same tile, round and channel is not decoded from
+    the raw data more than once, e.g. when finding `scale`, the psf and then filtering it in the extract step.
+
+    The total size of images kept is limited to `max_bytes`. When adding an image would exceed this, the
+    least recently used images are removed first.
+    """
+    def __init__(self, max_bytes: int = 0):
+        """
+        Args:
+            max_bytes: Maximum total size of images kept in the cache. If `0`, nothing is cached.
+        """
+        self.max_bytes = max_bytes
+        self.n_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._images = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resize(self, max_bytes: int):
+        """
+        Changes the size limit of the cache, removing least recently used images if now too large.
+
+        Args:
+            max_bytes: Maximum total size of images kept in the cache. If `0`, nothing is cached.
+        """
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._shrink(0)
+
+    def clear(self):
+        """
+        Removes all images from the cache. Hit and miss counts are kept.
+        """
+        with self._lock:
+            self._images.clear()
+            self.n_bytes = 0
+
+    def info(self) -> dict:
+        """
+        Returns:
+            Dictionary containing number of `hits`, `misses`, number of `images` in the cache,
+                their total size `n_bytes` and `max_bytes`.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'images': len(self._images),
+                    'n_bytes': self.n_bytes, 'max_bytes': self.max_bytes}
+
+    def get(self, key: Tuple, use_z: Union[int, List[int]], remove: bool = False) -> Optional[np.ndarray]:
+        """
+        Gets image from cache. If the exact z-planes are not cached but an image of the same tile, round and channel
+        containing all of them is, the z-planes are taken from that.
+
+        Args:
+            key: `(round_file, t, c)` identifying image.
+            use_z: z-planes of image wanted.
+            remove: If `True` and the image with exactly these z-planes is cached, it is removed from the cache and
+                returned without copying. Use when the image will not be loaded again.
+
+        Returns:
+            `[n_y x n_x (x len(use_z))]` copy of image or `None` if not in cache.
+        """
+        z_key = tuple(np.atleast_1d(use_z).tolist())
+        with self._lock:
+            if key + (z_key,) in self._images:
+                self.hits += 1
+                if remove:
+                    image = self._images.pop(key + (z_key,))
+                    self.n_bytes -= image.nbytes
+                    return image.reshape(image.shape[:2]) if np.ndim(use_z) == 0 else image
+                self._images.move_to_end(key + (z_key,))
+                image = self._images[key + (z_key,)].copy()
+                return image.reshape(image.shape[:2]) if np.ndim(use_z) == 0 else image
+            for cached_key in reversed(self._images):
+                if cached_key[:-1] == key and np.isin(z_key, cached_key[-1]).all():
+                    self.hits += 1
+                    self._images.move_to_end(cached_key)
+                    z_ind = [cached_key[-1].index(z) for z in z_key]
+                    image = self._images[cached_key][:, :, z_ind[0] if np.ndim(use_z) == 0 else z_ind]
+                    return image.copy()
+            self.misses += 1
+        return None
+
+    def add(self, key: Tuple, use_z: Union[int, List[int]], image: np.ndarray):
+        """
+        Adds image to cache, removing least recently used images if cache becomes too large.
+        Image is not added if larger than `max_bytes`.
+
+        Args:
+            key: `(round_file, t, c)` identifying image.
+            use_z: z-planes of image.
+            image: `[n_y x n_x (x len(use_z))]`. Image to add, this is copied.
+        """
+        if image.nbytes > self.max_bytes:
+            return
+        z_key = tuple(np.atleast_1d(use_z).tolist())
+        image = image.reshape(image.shape[:2] + (len(z_key),)).copy()
+        with self._lock:
+            if key + (z_key,) in self._images:
+                return
+            self._shrink(image.nbytes)
+            self._images[key + (z_key,)] = image
+            self.n_bytes += image.nbytes
+
+    def _shrink(self, n_bytes_add: int):
+        # remove least recently used images until there is space for n_bytes_add. Must hold lock.
+        while len(self._images) > 0 and self.n_bytes + n_bytes_add > self.max_bytes:
+            self.n_bytes -= self._images.popitem(last=False)[1].nbytes
+
+
+# Cache shared by all calls to load in this process. Size set by extract raw_cache_mb in config.
+cache = RawTileCache()
+
+
 def load(nbp_file: NotebookPage, nbp_basic: NotebookPage, round_dask_array: Optional[dask.array.Array] = None,
-         r: Optional[int] = None, t: Optional[int] = None,
-         c: Optional[int] = None, use_z: Optional[List[int]] = None) -> Union[dask.array.Array, np.ndarray]:
+         r: Optional[int] = None, t: Optional[int] = None, c: Optional[int] = None,
+         use_z: Optional[List[int]] = None, keep_in_cache: bool = True) -> Union[dask.array.Array, np.ndarray]:
     """
     Loads in raw data either from npy stack or nd2 file.
     If tile and channel specified, will return corresponding image.
@@ -95,6 +212,8 @@ def load(nbp_file: NotebookPage, nbp_basic: NotebookPage, round_dask_array: Opti
         use_z: z-planes to load in.
             Don't need to provide if want to get round_dask_array.
             If t and c given, but use_z = None, will load in all z-planes.
+        keep_in_cache: Whether to keep image in `cache` so it can be loaded again quickly.
+            Set to `False` if this is the last time image is needed. Only used if `r` given.
     Returns:
         Two options:
             - Dask array with indices in order `fov`, `channel`, `y`, `x`, `z`.
@@ -102,13 +221,14 @@ def load(nbp_file: NotebookPage, nbp_basic: NotebookPage, round_dask_array: Opti
     """
     if not np.isin(nbp_file.raw_extension, ['.nd2', '.npy']):
         raise ValueError(f"nbp_file.raw_extension must be '.nd2' or '.npy' but it is {nbp_file.raw_extension}.")
-    if round_dask_array is None:
+    if r is not None:
         if nbp_basic.use_anchor:
             # always have anchor as first round after imaging rounds
             round_files = nbp_file.round + [nbp_file.anchor]
         else:
             round_files = nbp_file.round
         round_file = os.path.join(nbp_file.input_dir, round_files[r])
+    if round_dask_array is None:
         if nbp_file.raw_extension == '.nd2':
             round_dask_array = nd2.load(round_file + nbp_file.raw_extension)
         elif nbp_file.raw_extension == '.npy':
@@ -120,12 +240,76 @@ def load(nbp_file: NotebookPage, nbp_basic: NotebookPage, round_dask_array: Opti
         # Return a tile/channel/z-planes from the dask array.
         if use_z is None:
             use_z = nbp_basic.use_z
+        if r is not None:
+            cache_key = (round_file, t, c)
+            image = cache.get(cache_key, use_z, remove=not keep_in_cache)
+            if image is not None:
+                return image
         t_nd2 = nd2.get_nd2_tile_ind(t, nbp_basic.tilepos_yx_nd2, nbp_basic.tilepos_yx)
         if nbp_file.raw_extension == '.nd2':
             # Only need this if statement because nd2.get_image will be different if use nd2reader not nd2 module
             # which is needed on M1 mac.
-            return nd2.get_image(round_dask_array, t_nd2, c, use_z)
+            image = nd2.get_image(round_dask_array, t_nd2, c, use_z)
         elif nbp_file.raw_extension == '.npy':
             # Need the with below to silence warning
             with dask.config.set(**{'array.slicing.split_large_chunks': False}):
-                return np.asarray(round_dask_array[t_nd2, c, :, :, use_z])
+                image = np.asarray(round_dask_array[t_nd2, c, :, :, use_z])
+        timings.add_bytes(read=image.nbytes)
+        if r is not None and keep_in_cache:
+            cache.add(cache_key, use_z, image)
+        return image
+
+
+def load_lazy(nbp_file: NotebookPage, nbp_basic: NotebookPage, r: int, t: int,
+              channels: Optional[List[int]] = None, use_z: Optional[List[int]] = None,
+              plane_cache: Optional[RawTileCache] = None) -> dask.array.Array:
+    """
+    Returns dask array of raw data of tile `t`, round `r` without loading any of it.
+    Each z-plane of each channel is a separate chunk which is only loaded from the raw data when it is needed e.g.
+    when it is displayed in napari. The raw data file is not opened until the first z-plane is needed either.
+
+    Args:
+        nbp_file: `file_names` notebook page
+        nbp_basic: `basic_info` notebook page
+        r: Round considering (anchor will be assumed to be the last round if using).
+        t: npy tile index considering.
+        channels: Channels to load. All other channels will be zero. If `None`, will use all channels.
+        use_z: z-planes to load. If `None`, will use `nbp_basic.use_z`.
+        plane_cache: Cache to keep loaded z-planes in, with key `(r, t, c)`, so scrolling back to a z-plane
+            does not load it again. Can be shared between dask arrays of different rounds and tiles.
+            If `None`, z-planes will not be kept.
+
+    Returns:
+        `uint16 [n_channels x len(use_z) x tile_sz x tile_sz]`. Raw data of tile `t`, round `r`.
+    """
+    if channels is None:
+        channels = np.arange(nbp_basic.n_channels)
+    if use_z is None:
+        use_z = nbp_basic.use_z
+    use_z = np.atleast_1d(use_z).tolist()
+    channels = np.atleast_1d(channels).tolist()
+    plane_shape = (1, 1, nbp_basic.tile_sz, nbp_basic.tile_sz)
+    round_dask_array = []  # only loaded when first z-plane is needed.
+    lock = threading.Lock()
+
+    def load_plane(block_id: Tuple[int, int, int, int]) -> np.ndarray:
+        c = block_id[0]
+        z = use_z[block_id[1]]
+        if c not in channels:
+            return np.zeros(plane_shape, dtype=np.uint16)
+        image = None
+        if plane_cache is not None:
+            image = plane_cache.get((r, t, c), z)
+        if image is None:
+            with lock:
+                if len(round_dask_array) == 0:
+                    round_dask_array.append(load(nbp_file, nbp_basic, r=r))
+            # r not given so plane is not added to cache used by extract.
+            image = load(nbp_file, nbp_basic, round_dask_array[0], None, t, c, [z])
+            if plane_cache is not None:
+                plane_cache.add((r, t, c), z, image)
+        return image.reshape(plane_shape)
+
+    return dask.array.map_blocks(load_plane, dtype=np.uint16, meta=np.zeros((0, 0, 0, 0), dtype=np.uint16),
+                                 chunks=((1,) * nbp_basic.n_channels, (1,) * len(use_z),
+                                         (nbp_basic.tile_sz,), (nbp_basic.tile_sz,)))
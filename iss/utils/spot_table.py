@@ -0,0 +1,114 @@
+import os
+import numpy as np
+from typing import Optional, List, Union
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # pyarrow is only needed to write spot tables to parquet or arrow files.
+    pa = None
+    pq = None
+
+# Optional columns which can be added to a spot table and the dtype they are saved as.
+OPTIONAL_COLUMNS = {'score': np.float32, 'intensity': np.float32, 'tile': np.int16,
+                    'n_neighbours_pos': np.int16, 'n_neighbours_neg': np.int16}
+FILE_FORMATS = ['parquet', 'arrow']
+
+
+class SpotTableWriter:
+    def __init__(self, file_name: str, gene_names: Union[List[str], np.ndarray], file_format: str = 'parquet',
+                 columns: Optional[List[str]] = None):
+        """
+        Writes a table of spots to a columnar parquet or arrow (feather v2) file, one row group for each call of
+        `write`, so only the spots being written need to be in memory.
+
+        The table has columns `y`, `x`, `z_stack` and `Gene`, the same as the pciSeq csv file, followed by any
+        of `OPTIONAL_COLUMNS` given in `columns`. `Gene` is dictionary encoded so each gene name is only stored
+        once.
+
+        Args:
+            file_name: Path of file to write.
+            gene_names: `str [n_genes]`. Name of each gene.
+            file_format: `'parquet'` or `'arrow'`.
+            columns: Names of optional columns to include, must be keys of `OPTIONAL_COLUMNS`.
+        """
+        if pa is None:
+            raise ImportError('pyarrow is required to write parquet or arrow files.')
+        if file_format not in FILE_FORMATS:
+            raise ValueError(f'file_format must be one of {FILE_FORMATS} but {file_format} given.')
+        if columns is None:
+            columns = []
+        bad_columns = [col for col in columns if col not in OPTIONAL_COLUMNS]
+        if len(bad_columns) > 0:
+            raise ValueError(f'columns {bad_columns} are not in {list(OPTIONAL_COLUMNS)}.')
+        self.columns = columns
+        self.gene_names = pa.array(np.asarray(gene_names).astype(str))
+        fields = [pa.field(name, pa.float32()) for name in ['y', 'x', 'z_stack']] + \
+                 [pa.field('Gene', pa.dictionary(pa.int16(), pa.string()))] + \
+                 [pa.field(col, pa.from_numpy_dtype(OPTIONAL_COLUMNS[col])) for col in columns]
+        self.schema = pa.schema(fields)
+        self.file_name = file_name
+        self.file_format = file_format
+        if file_format == 'parquet':
+            self._writer = pq.ParquetWriter(file_name, self.schema)
+        else:
+            self._writer = pa.ipc.new_file(file_name, self.schema)
+        self.n_spots = 0
+
+    def write(self, global_yxz: np.ndarray, gene_no: np.ndarray, **columns: np.ndarray):
+        """
+        Appends spots to file as a new row group.
+
+        Args:
+            global_yxz: `float [n_spots x 3]`. Global yxz coordinate of each spot.
+            gene_no: `int [n_spots]`. Gene each spot was assigned to.
+            **columns: `[n_spots]` values of each optional column given when the writer was made.
+        """
+        if len(gene_no) == 0:
+            return
+        missing_columns = [col for col in self.columns if col not in columns]
+        if len(missing_columns) > 0:
+            raise ValueError(f'No values given for columns {missing_columns}.')
+        arrays = [pa.array(np.asarray(global_yxz[:, i], dtype=np.float32)) for i in range(3)]
+        arrays.append(pa.DictionaryArray.from_arrays(pa.array(np.asarray(gene_no, dtype=np.int16)),
+                                                     self.gene_names))
+        arrays += [pa.array(np.asarray(columns[col], dtype=OPTIONAL_COLUMNS[col])) for col in self.columns]
+        batch = pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+        if self.file_format == 'parquet':
+            self._writer.write_batch(batch)
+        else:
+            self._writer.write(batch)
+        self.n_spots += len(gene_no)
+
+    def close(self):
+        """
+        Finishes writing the file.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def read_spot_table(file_name: str):
+    """
+    Reads table written by `SpotTableWriter`.
+
+    Args:
+        file_name: Path of parquet or arrow file.
+
+    Returns:
+        `pyarrow.Table` of spots. Use `.to_pandas()` to get a `DataFrame` with `Gene` as a categorical column.
+    """
+    if pa is None:
+        raise ImportError('pyarrow is required to read parquet or arrow files.')
+    if os.path.splitext(file_name)[1] == '.parquet':
+        return pq.read_table(file_name)
+    else:
+        # memory map kept open by table so columns are only read when used.
+        return pa.ipc.open_file(pa.memory_map(file_name)).read_all()
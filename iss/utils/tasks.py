@@ -0,0 +1,473 @@
+import os
+import time
+import uuid
+import socket
+import hashlib
+import threading
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Any, Callable, List, Optional, Tuple, Union
+from tqdm import tqdm
+from ..setup.notebook import NotebookPage, Notebook
+from . import timings
+
+
+def get_hash(value: Any) -> str:
+    """
+    Returns hash of `value` which only depends on its contents, so e.g. a list of integers and a numpy integer array
+    with the same values, or a `NotebookPage` before and after saving and loading, have the same hash.
+
+    Args:
+        value: `None`, `str`, number, numpy array, `NotebookPage` or a `list`, `tuple` or `dict` of these.
+
+    Returns:
+        Hexadecimal hash of `value`.
+    """
+    hasher = hashlib.md5()
+    _update_hash(hasher, value)
+    return hasher.hexdigest()
+
+
+def _update_hash(hasher, value: Any):
+    if isinstance(value, dict):
+        hasher.update(f'dict{len(value)}'.encode())
+        for key in sorted(value, key=str):
+            _update_hash(hasher, str(key))
+            _update_hash(hasher, value[key])
+    elif isinstance(value, NotebookPage):
+        hasher.update(f'page{value.name}'.encode())
+        _update_hash(hasher, {key: getattr(value, key) for key in value._times})
+    elif value is None or isinstance(value, str):
+        hasher.update(repr(value).encode())
+    else:
+        try:
+            array = np.asarray(value)
+        except ValueError:
+            array = None  # ragged list
+        if array is not None and array.dtype.kind in 'biuf':
+            # bool and all integer types hashed the same, as are all float types.
+            dtype = np.float64 if array.dtype.kind == 'f' else np.int64
+            hasher.update(f'{dtype.__name__}{array.shape}'.encode())
+            hasher.update(np.ascontiguousarray(array, dtype=dtype).tobytes())
+        else:
+            if array is not None and not isinstance(value, (list, tuple)):
+                value = array.tolist()
+            if isinstance(value, (list, tuple)):
+                hasher.update(f'list{len(value)}'.encode())
+                for val in value:
+                    _update_hash(hasher, val)
+            else:
+                hasher.update(repr(value).encode())
+
+
+def file_fingerprint(file: Union[str, List[str]]) -> Union[Optional[List[int]], list]:
+    """
+    Returns size and modification time of `file`, which change whenever `file` is written to.
+
+    Args:
+        file: Path to file or list of paths.
+
+    Returns:
+        `int [2]`. Size in bytes and modification time in ns of `file`, or `None` if it does not exist.
+            List of these if `file` is a list.
+    """
+    if file is None:
+        return None
+    if not isinstance(file, str):
+        return [file_fingerprint(f) for f in file]
+    if not os.path.isfile(file):
+        return None
+    stat = os.stat(file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class TaskScheduler:
+    """
+    Runs a set of tasks as soon as all the tasks they depend on have finished, rather than running each step of
+    the pipeline for all tiles before moving on to the next step.
+
+    Each task returns a `NotebookPage` (or a tuple of them) which is saved to `marker_dir` as soon as the
+    task finishes. If the marker of a task already exists, the task is not run again, and its result is loaded
+    from the marker instead. This means that, if the pipeline is interrupted, it can be resumed from the last
+    task which finished.
+
+    The marker also saves a hash of the `key` of the task, describing its inputs. If this has changed since the
+    marker was saved, the task is run again. To depend on the result of another task, its `result_hash` should be
+    included in the `key`. Then, if a task is run again but gives the same result as before, tasks depending on
+    it are not run again.
+
+    If `lease_time` is given, several processes, on any machines sharing `marker_dir`, can run the same tasks at
+    once, with each task only run by one of them. Before running a task, a process claims it by atomically creating
+    the lease file `{name}.lease` in `marker_dir`, which no other process can then create. While the task runs,
+    the modification time of the lease is updated every `lease_time / 4` seconds. If a process dies, its lease
+    stops being updated and, after `lease_time` seconds, is atomically renamed by another process which then runs
+    the task. A task whose lease is held and was updated less than `lease_time` seconds ago is not claimed, but
+    waited for. A task being run by another process is finished once its marker is saved with the same key, so tasks
+    depending on it can start in any process. Markers of these tasks are checked every `min(lease_time / 4, 1)`
+    seconds, with the time between checks doubling up to `min(lease_time / 4, 10)` seconds while nothing changes.
+    Tasks must give the same result whichever process runs them, so in the rare case a task is run twice, the marker
+    saved last is the same.
+
+    Example:
+    ```python
+        scheduler = TaskScheduler(marker_dir, n_workers=4)
+        scheduler.add('extract_t0_r0', lambda: extract(0, 0))
+        scheduler.add('find_spots_t0_r0', lambda: find_spots(scheduler.result('extract_t0_r0')),
+                      ['extract_t0_r0'])
+        scheduler.run()
+    ```
+    """
+    _SEP = Notebook._SEP  # Separator between page index and item name when saving to file.
+
+    def __init__(self, marker_dir: str, n_workers: int = 1, lease_time: Optional[float] = None):
+        """
+        Args:
+            marker_dir: Directory where the result of each task is saved. Will be created if it does not exist.
+            n_workers: Maximum number of tasks to run at the same time.
+            lease_time: If given, tasks are claimed with a lease file so other processes sharing `marker_dir` can
+                run the same tasks. A lease which has not been updated for this many seconds is taken to be from
+                a process which died. If `None`, this is the only process running these tasks.
+        """
+        os.makedirs(marker_dir, exist_ok=True)
+        if n_workers < 1:
+            raise ValueError(f"n_workers must be at least 1 but value given is {n_workers}.")
+        if lease_time is not None and lease_time <= 0:
+            raise ValueError(f"lease_time must be positive but value given is {lease_time}.")
+        self.marker_dir = marker_dir
+        self.n_workers = n_workers
+        self.lease_time = lease_time
+        # Unique name of this scheduler, written in its lease files and used for its temporary files.
+        self._owner = f'{socket.gethostname()}_{os.getpid()}_{uuid.uuid4().hex[:8]}'
+        self._leases = set()
+        self._leases_lock = threading.Lock()
+        self._funcs = {}
+        self._deps = {}
+        self._keys = {}
+        self._results = {}
+        self._result_hashes = {}
+        self._stale = set()
+
+    def add(self, name: str, func: Callable[[], Union[NotebookPage, Tuple[NotebookPage, ...]]],
+            deps: Optional[List[str]] = None, key: Any = None):
+        """
+        Adds a task to the scheduler. Tasks which are ready to run at the same time are started in the
+        order they were added.
+
+        Args:
+            name: Unique name of the task. Also used as the name of its marker file.
+            func: Function with no arguments which runs the task. It should get the results of the tasks it
+                depends on through `self.result`.
+            deps: Names of tasks which must finish before this task can start.
+                These must have been added before this task.
+            key: Anything the result of the task depends on e.g. config values, `file_fingerprint` of input files
+                and `result_hash` of tasks in `deps`. Must be accepted by `get_hash`.
+                Can be a function with no arguments returning this, which is called when the task is ready to run
+                and again once it has finished, so it can depend on the results of `deps` and on files which only
+                exist once `deps` finish.
+        """
+        if name in self._funcs:
+            raise ValueError(f"Task {name} has already been added.")
+        if deps is None:
+            deps = []
+        for dep in deps:
+            if dep not in self._funcs:
+                raise ValueError(f"Task {name} depends on {dep} which has not been added.")
+        self._funcs[name] = func
+        self._deps[name] = list(deps)
+        self._keys[name] = key
+
+    def marker_file(self, name: str) -> str:
+        """
+        Args:
+            name: Name of task.
+
+        Returns:
+            Path to the file where the result of task `name` is saved.
+        """
+        return os.path.join(self.marker_dir, name + '.npz')
+
+    def lease_file(self, name: str) -> str:
+        """
+        Args:
+            name: Name of task.
+
+        Returns:
+            Path to the file which exists while a process is running task `name` if `lease_time` is given.
+        """
+        return os.path.join(self.marker_dir, name + '.lease')
+
+    def _lease_fresh(self, name: str) -> bool:
+        # Returns whether the lease of task name exists and has been updated in the last lease_time seconds,
+        # in which case another process is running it and _claim would fail.
+        try:
+            return time.time() - os.path.getmtime(self.lease_file(name)) < self.lease_time
+        except FileNotFoundError:
+            return False
+
+    def _claim(self, name: str) -> bool:
+        # Returns whether the lease of task name was claimed, False if another process holds it.
+        lease_file = self.lease_file(name)
+        tmp_file = os.path.join(self.marker_dir, f'{name}_{self._owner}.lease_tmp')
+        with open(tmp_file, 'w') as f:
+            f.write(self._owner)
+        try:
+            while True:
+                try:
+                    # link fails if lease_file exists, so only one process can claim the task, also on NFS.
+                    os.link(tmp_file, lease_file)
+                    with self._leases_lock:
+                        self._leases.add(name)
+                    return True
+                except FileExistsError:
+                    pass
+                expired_file = tmp_file + '_expired'
+                try:
+                    if time.time() - os.path.getmtime(lease_file) < self.lease_time:
+                        return False
+                    # only one process can rename the expired lease, the others get FileNotFoundError.
+                    os.rename(lease_file, expired_file)
+                except FileNotFoundError:
+                    continue  # lease released or taken over by another process since checked, so try again.
+                if time.time() - os.path.getmtime(expired_file) < self.lease_time:
+                    # lease was renewed or replaced since checked, so put it back.
+                    try:
+                        os.link(expired_file, lease_file)
+                    except FileExistsError:
+                        pass
+                    os.remove(expired_file)
+                    return False
+                os.remove(expired_file)
+        finally:
+            os.remove(tmp_file)
+
+    def _release(self, name: str):
+        # Removes lease of task name if it is still held by this scheduler.
+        with self._leases_lock:
+            self._leases.discard(name)
+        try:
+            with open(self.lease_file(name), 'r') as f:
+                owner = f.read()
+            if owner == self._owner:
+                os.remove(self.lease_file(name))
+        except FileNotFoundError:
+            pass
+
+    def _heartbeat(self, stop: threading.Event):
+        # Updates modification time of leases held by this scheduler until stop is set.
+        while not stop.wait(self.lease_time / 4):
+            with self._leases_lock:
+                leases = list(self._leases)
+            for name in leases:
+                try:
+                    os.utime(self.lease_file(name))
+                except FileNotFoundError:
+                    pass
+
+    def is_done(self, name: str) -> bool:
+        """
+        Args:
+            name: Name of task.
+
+        Returns:
+            Whether task `name` has finished in `run`, either by running it or because its marker was saved with
+                the same inputs.
+        """
+        return name in self._result_hashes
+
+    def is_stale(self, name: str) -> bool:
+        """
+        Args:
+            name: Name of task.
+
+        Returns:
+            Whether task `name` is being run again because its inputs have changed since its marker was saved.
+                Files the task made previously are then out of date.
+        """
+        return name in self._stale
+
+    def task_key(self, name: str) -> str:
+        """
+        Args:
+            name: Name of a task, for which all tasks it depends on have finished.
+
+        Returns:
+            Hash of `key` of task.
+        """
+        key = self._keys[name]
+        if callable(key):
+            key = key()
+        return get_hash(key)
+
+    def result_hash(self, name: str) -> str:
+        """
+        Args:
+            name: Name of a finished task.
+
+        Returns:
+            Hash of what the task returned.
+        """
+        if not self.is_done(name):
+            raise ValueError(f"Task {name} has not finished yet.")
+        return self._result_hashes[name]
+
+    def _marker_key(self, name: str) -> Optional[Tuple[str, str]]:
+        # task_key and result hash saved in marker of task, or None if no marker.
+        if not os.path.isfile(self.marker_file(name)):
+            return None
+        f = np.load(self.marker_file(name))
+        if 'task_key' not in f.keys():
+            return '', ''
+        return str(f['task_key']), str(f['result_hash'])
+
+    def result(self, name: str) -> Union[NotebookPage, Tuple[NotebookPage, ...]]:
+        """
+        Args:
+            name: Name of a finished task.
+
+        Returns:
+            What the task returned.
+        """
+        if name not in self._results:
+            if not self.is_done(name):
+                raise ValueError(f"Task {name} has not finished yet.")
+            self._results[name] = self._load(name)
+        return self._results[name]
+
+    def _save(self, name: str, result: Union[NotebookPage, Tuple[NotebookPage, ...]], task_key: str,
+              result_hash: str):
+        pages = result if isinstance(result, tuple) else (result,)
+        d = {'n_pages': -1 if not isinstance(result, tuple) else len(pages), 'task_key': task_key,
+             'result_hash': result_hash}
+        for i, page in enumerate(pages):
+            for k, v in page.to_serial_dict().items():
+                if v is None:
+                    # save None objects as string then convert back to None on loading
+                    v = str(v)
+                d[f'{i}{self._SEP}{k}'] = v
+        # Write to temporary file first so a marker only ever exists for a task that finished.
+        tmp_file = os.path.join(self.marker_dir, f'{name}_{self._owner}_tmp.npz')
+        np.savez(tmp_file, **d)
+        os.replace(tmp_file, self.marker_file(name))
+
+    def _load(self, name: str) -> Union[NotebookPage, Tuple[NotebookPage, ...]]:
+        f = np.load(self.marker_file(name))
+        n_pages = int(f['n_pages'])
+        page_items = [{} for _ in range(max(n_pages, 1))]
+        for key in f.keys():
+            if key in ['n_pages', 'task_key', 'result_hash']:
+                continue
+            i, k = key.split(self._SEP, 1)
+            page_items[int(i)][k] = f[key]
+        pages = tuple([NotebookPage.from_serial_dict(d) for d in page_items])
+        if n_pages == -1:
+            return pages[0]
+        return pages
+
+    def _run_task(self, name: str) -> Union[NotebookPage, Tuple[NotebookPage, ...]]:
+        """
+        Runs task `name` inside a timings span so sub-steps of the task are recorded with the task name.
+        """
+        with timings.span(name):
+            return self._funcs[name]()
+
+    def run(self):
+        """
+        Runs all tasks which have not finished yet, starting each as soon as all the tasks it depends on
+        have finished. Tasks with a marker saved with the same inputs are not run again.
+
+        If `lease_time` is given, tasks being run by another process are not run but waited for, so this returns
+        once all tasks have finished in any process.
+
+        If a task raises an error, no more tasks are started and the error is raised once the tasks already
+        running have finished. All tasks which finished are saved so will not be run again.
+        """
+        to_do = [name for name in self._funcs if not self.is_done(name)]
+        running = {}
+        error = None
+        n_reused = 0
+        task_keys = {}
+        shared = self.lease_time is not None
+        # how often to check for tasks finished by other processes. Doubles each time nothing has changed, so
+        # processes waiting on long tasks do not keep reading markers and leases on the shared file system.
+        min_poll_time = min(self.lease_time / 4, 1) if shared else None
+        max_poll_time = min(self.lease_time / 4, 10) if shared else None
+        poll_time = min_poll_time
+        stop_heartbeat = threading.Event()
+        if shared:
+            threading.Thread(target=self._heartbeat, args=(stop_heartbeat,), daemon=True).start()
+        try:
+            with tqdm(total=len(to_do)) as pbar, ThreadPoolExecutor(max_workers=self.n_workers) as executor:
+                pbar.set_description(f'Running tasks with {self.n_workers} workers')
+                while len(to_do) > 0 or len(running) > 0:
+                    n_to_do = len(to_do)
+                    if error is None:
+                        ready = [name for name in to_do if all(self.is_done(dep) for dep in self._deps[name])]
+                        while len(ready) > 0:
+                            name = ready.pop(0)
+                            if name not in task_keys or shared:
+                                # if shared, marker may have been saved by another process since last checked.
+                                if name not in task_keys:
+                                    task_keys[name] = self.task_key(name)
+                                marker_key = self._marker_key(name)
+                                if marker_key is not None and marker_key[0] == task_keys[name]:
+                                    # inputs same as when marker saved so use saved result.
+                                    to_do.remove(name)
+                                    self._result_hashes[name] = marker_key[1]
+                                    n_reused += 1
+                                    pbar.set_postfix({'task': name, 'reused': n_reused})
+                                    pbar.update(1)
+                                    # tasks depending on this may now be ready.
+                                    ready += [name for name in to_do if name not in ready and
+                                              (name not in task_keys or shared) and
+                                              all(self.is_done(dep) for dep in self._deps[name])]
+                                    continue
+                                if marker_key is not None:
+                                    self._stale.add(name)
+                            if len(running) < self.n_workers:
+                                if shared:
+                                    if self._lease_fresh(name) or not self._claim(name):
+                                        continue  # being run by another process
+                                    marker_key = self._marker_key(name)
+                                    if marker_key is not None and marker_key[0] == task_keys[name]:
+                                        # finished by another process between checking marker and claiming.
+                                        self._release(name)
+                                        ready.insert(0, name)
+                                        continue
+                                to_do.remove(name)
+                                running[executor.submit(self._run_task, name)] = (name, time.time())
+                    if shared and len(to_do) < n_to_do:
+                        # a task was started or found to be finished so check again soon.
+                        poll_time = min_poll_time
+                    if len(running) == 0:
+                        if error is not None or not shared:
+                            # only way to get here with tasks left is if an error occurred
+                            break
+                        if len(to_do) > 0:
+                            # all tasks left are being run by other processes or depend on them.
+                            time.sleep(poll_time)
+                            poll_time = min(2 * poll_time, max_poll_time)
+                        continue
+                    finished = wait(running, timeout=poll_time, return_when=FIRST_COMPLETED)[0]
+                    if shared:
+                        poll_time = min_poll_time if len(finished) > 0 else min(2 * poll_time, max_poll_time)
+                    for future in finished:
+                        name, start_time = running.pop(future)
+                        if future.exception() is not None:
+                            if shared:
+                                self._release(name)
+                            if error is None:
+                                error = future.exception()
+                            continue
+                        self._results[name] = future.result()
+                        result_hash = get_hash(list(self._results[name]) if isinstance(self._results[name], tuple)
+                                               else self._results[name])
+                        self._save(name, self._results[name], self.task_key(name), result_hash)
+                        if shared:
+                            self._release(name)
+                        self._result_hashes[name] = result_hash
+                        pbar.set_postfix({'task': name, 'time': round(time.time() - start_time, 1)})
+                        pbar.update(1)
+        finally:
+            stop_heartbeat.set()
+        if error is not None:
+            raise error
@@ -1,2 +1,6 @@
 from .test_morphology import TestMorphology
 from .test_npy import TestNPY
+from .test_timings import TestTimings
+from .test_raw import TestRawTileCache, TestLoadLazy
+from .test_spot_table import TestSpotTable
+from .test_matlab import TestSaveNbResults
@@ -0,0 +1,74 @@
+import os
+import json
+import tempfile
+import unittest
+import numpy as np
+from scipy import io
+from ..matlab import save_nb_results
+from ...setup.notebook import Notebook, NotebookPage
+
+
+def make_page(name: str, **values) -> NotebookPage:
+    # Page with all variables in notebook_comments.json, those not given are None.
+    nbp = NotebookPage(name)
+    with open(nbp._comments_file) as f:
+        variables = [var for var in json.load(f)[name] if var != 'DESCRIPTION']
+    for var in variables:
+        setattr(nbp, var, values.get(var, None))
+    return nbp
+
+
+class TestSaveNbResults(unittest.TestCase):
+    CONFIG_FILE = os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', '..', 'setup', 'test', 'examples',
+                               'simplest_settings.ini')
+
+    def test_save_nb_results(self):
+        # only spots with score above the thresholds given and intensity above intensity threshold should be saved.
+        rng = np.random.default_rng(0)
+        n_genes = 4
+        n_ref_spots = 50
+        n_omp_spots = 60
+        intensity_thresh = 0.3
+        spot_shape = np.zeros((3, 3, 1), dtype=int)
+        spot_shape[1, :, 0] = 1
+        spot_shape[0, 0, 0] = -1
+        with tempfile.TemporaryDirectory() as tmpdir:
+            nb = Notebook(os.path.join(tmpdir, 'notebook.npz'), self.CONFIG_FILE)
+            nb += make_page('call_spots', gene_names=np.array([f'g{g}' for g in range(n_genes)]),
+                            gene_efficiency_intensity_thresh=intensity_thresh)
+            nb += make_page('ref_spots', local_yxz=rng.integers(0, 100, (n_ref_spots, 3)),
+                            isolated=rng.integers(0, 2, n_ref_spots).astype(bool),
+                            tile=rng.integers(0, 2, n_ref_spots), colors=rng.integers(0, 100, (n_ref_spots, 2, 3)),
+                            gene_no=rng.integers(0, n_genes, n_ref_spots), score=rng.uniform(0, 1, n_ref_spots),
+                            score_diff=rng.uniform(0, 1, n_ref_spots), intensity=rng.uniform(0, 1, n_ref_spots))
+            nb += make_page('omp', spot_shape=spot_shape, local_yxz=rng.integers(0, 100, (n_omp_spots, 3)),
+                            tile=rng.integers(0, 2, n_omp_spots), colors=rng.integers(0, 100, (n_omp_spots, 2, 3)),
+                            gene_no=rng.integers(0, n_genes, n_omp_spots),
+                            n_neighbours_pos=rng.integers(0, 4, n_omp_spots),
+                            n_neighbours_neg=rng.integers(0, 2, n_omp_spots),
+                            intensity=rng.uniform(0, 1, n_omp_spots))
+            mat_file = os.path.join(tmpdir, 'results.mat')
+            save_nb_results(nb, mat_file, 0.4, 0.5)
+            results = io.loadmat(mat_file)
+            # no files other than those asked for should be made.
+            self.assertEqual(sorted(os.listdir(tmpdir)), ['notebook.npz', 'results.mat'])
+
+        keep_ref = (nb.ref_spots.score > 0.4) & (nb.ref_spots.intensity > intensity_thresh)
+        score_omp_multiplier = nb.get_config()['thresholds']['score_omp_multiplier']
+        score_omp = (score_omp_multiplier * nb.omp.n_neighbours_pos + nb.omp.n_neighbours_neg) / \
+                    (score_omp_multiplier * 3 + 1)
+        keep_omp = (score_omp > 0.5) & (nb.omp.intensity > intensity_thresh)
+        self.assertTrue(0 < keep_ref.sum() < n_ref_spots)
+        self.assertTrue(0 < keep_omp.sum() < n_omp_spots)
+        for var in ['local_yxz', 'isolated', 'tile', 'colors', 'gene_no', 'score', 'score_diff', 'intensity']:
+            self.assertTrue(np.array_equal(results['ref_spots_' + var].squeeze(),
+                                           getattr(nb.ref_spots, var)[keep_ref].squeeze()))
+        for var in ['local_yxz', 'tile', 'colors', 'gene_no', 'n_neighbours_pos', 'n_neighbours_neg', 'intensity']:
+            self.assertTrue(np.array_equal(results['omp_' + var].squeeze(), getattr(nb.omp, var)[keep_omp].squeeze()))
+        self.assertTrue(np.array_equal(results['omp_spot_shape'], spot_shape))
+        self.assertNotIn('omp_spot_shape_float', results)
+        self.assertTrue(np.array_equal(results['gene_names'], nb.call_spots.gene_names))
+
+
+if __name__ == '__main__':
+    unittest.main()
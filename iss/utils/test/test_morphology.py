@@ -1,7 +1,8 @@
 import unittest
 import os
 import numpy as np
-from ..morphology import hanning_diff, convolve_2d, top_hat, dilate, imfilter, imfilter_coords, ensure_odd_kernel
+from ..morphology import hanning_diff, convolve_2d, top_hat, dilate, imfilter, imfilter_coords, ensure_odd_kernel, \
+    get_kernel_rectangles
 from ..strel import disk, disk_3d, annulus, fspecial
 from ...utils import matlab, errors
 
@@ -291,6 +292,19 @@ class TestMorphology(unittest.TestCase):
             diff = jax_result - np.round(im_filt_result).astype(int)
             self.assertTrue(np.abs(diff).max() <= tol)  # check match full image filtering
 
+    def test_get_kernel_rectangles(self):
+        # rectangles should cover every non-zero element of kernel exactly once.
+        rng = np.random.default_rng(0)
+        for kernel in [annulus(4, 14),
+                       (rng.random((11, 7)) > 0.5).astype(int), np.zeros((3, 3), dtype=int)]:
+            kernel_count = np.zeros_like(kernel)
+            rectangles = get_kernel_rectangles(kernel)
+            for y_start, y_stop, x_start, x_stop in rectangles:
+                kernel_count[y_start:y_stop, x_start:x_stop] += 1
+            self.assertTrue(np.array_equal(kernel_count, kernel > 0))
+        # disk needs fewer rectangles than rows.
+        self.assertTrue(len(get_kernel_rectangles(annulus(0, 14))) < 29)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -195,3 +195,33 @@ class TestNPY(unittest.TestCase):
             spot_yxz[:, i] = np.random.randint(0, tile_sz[i] - 1, n_spots)
         self.load_subset_all(np.random.randint(self.N_Rounds), np.random.randint(self.N_Channels), True,
                              tile_sz, spot_yxz, np.random.randint(2, dtype=bool))
+
+    def test_load_tile_pixels(self):
+        # Test loading pixels of several channels in storage order gives same as load_tile for each channel,
+        # both when reading blocks of z-planes and reading few pixels directly.
+        for is_3d in [False, True]:
+            tile_sz = np.zeros(3, dtype=int)
+            tile_sz[:2] = np.random.randint(self.MinYX, self.MaxYX)
+            tile_sz[2] = np.random.randint(self.MinZ, self.MaxZ) if is_3d else 1
+            r = np.random.randint(self.N_Rounds)
+            with tempfile.TemporaryDirectory() as tile_dir:
+                nbp_file, nbp_basic = get_notebook_pages(tile_dir, is_3d, tile_sz, self.Z_Scale, self.N_Rounds,
+                                                         self.N_Channels)
+                if is_3d:
+                    for c in range(nbp_basic.n_channels):
+                        utils.npy.save_tile(nbp_file, nbp_basic, single_random_tile(nbp_basic, r, c, tile_sz),
+                                            self.t, r, c)
+                else:
+                    image = np.zeros((nbp_basic.n_channels,) + tuple(tile_sz[:2]), dtype=np.int32)
+                    for c in range(nbp_basic.n_channels):
+                        image[c] = single_random_tile(nbp_basic, r, c, tile_sz[:2])
+                    utils.npy.save_tile(nbp_file, nbp_basic, image, self.t, r)
+                channels = [2, 0, 5]
+                n_dim = 2 + int(is_3d)
+                yxz = [np.random.randint(0, tile_sz[:n_dim], (n_spots, n_dim)) for n_spots in [3, self.MaxSpots, 0]]
+                for max_read_bytes in [1, 2 ** 26]:
+                    pixels = utils.npy.load_tile_pixels(nbp_file, nbp_basic, self.t, r, channels, yxz,
+                                                        max_read_bytes=max_read_bytes)
+                    for i, c in enumerate(channels):
+                        pixels_c = utils.npy.load_tile(nbp_file, nbp_basic, self.t, r, c, yxz[i])
+                        self.assertTrue(np.array_equal(pixels[i], pixels_c))
@@ -0,0 +1,84 @@
+import unittest
+import os
+import tempfile
+import numpy as np
+import dask.array
+from ..raw import RawTileCache, load, load_lazy
+from ...setup import NotebookPage
+
+
+class TestRawTileCache(unittest.TestCase):
+    def test_cache(self):
+        rng = np.random.default_rng(0)
+        images = [rng.integers(0, 1000, (10, 12, 4)).astype(np.uint16) for _ in range(3)]
+        use_z = [1, 2, 3, 4]
+        cache = RawTileCache(2 * images[0].nbytes)
+        self.assertIsNone(cache.get(('round0', 0, 0), use_z))
+        for i in range(3):
+            cache.add(('round0', i, 0), use_z, images[i])
+        # least recently used image should be removed as only space for 2.
+        self.assertIsNone(cache.get(('round0', 0, 0), use_z))
+        image = cache.get(('round0', 1, 0), use_z)
+        self.assertTrue(np.array_equal(image, images[1]))
+        # changing returned image should not change cached image.
+        image[:] = 0
+        self.assertTrue(np.array_equal(cache.get(('round0', 1, 0), use_z), images[1]))
+        # z-planes can be taken from image with more z-planes.
+        self.assertTrue(np.array_equal(cache.get(('round0', 2, 0), 3), images[2][:, :, 2]))
+        self.assertTrue(np.array_equal(cache.get(('round0', 2, 0), [4, 1]), images[2][:, :, [3, 0]]))
+        self.assertIsNone(cache.get(('round0', 2, 0), [0, 1]))
+        # remove means image no longer in cache.
+        self.assertTrue(np.array_equal(cache.get(('round0', 2, 0), use_z, remove=True), images[2]))
+        self.assertIsNone(cache.get(('round0', 2, 0), use_z))
+        info = cache.info()
+        self.assertEqual(info['hits'], 5)
+        self.assertEqual(info['misses'], 4)
+        self.assertEqual(info['images'], 1)
+        self.assertEqual(info['n_bytes'], images[0].nbytes)
+        # nothing cached if size 0.
+        cache.resize(0)
+        self.assertEqual(cache.info()['images'], 0)
+        cache.add(('round0', 0, 0), use_z, images[0])
+        self.assertIsNone(cache.get(('round0', 0, 0), use_z))
+
+
+class TestLoadLazy(unittest.TestCase):
+    def test_load_lazy(self):
+        rng = np.random.default_rng(0)
+        n_tiles, n_channels, tile_sz, n_z = 2, 3, 8, 5
+        data = rng.integers(0, 1000, (n_tiles, n_channels, tile_sz, tile_sz, n_z)).astype(np.uint16)
+        with tempfile.TemporaryDirectory() as input_dir:
+            dask.array.to_npy_stack(os.path.join(input_dir, 'round0'),
+                                    dask.array.from_array(data, chunks=(1,) + data.shape[1:]))
+            nbp_file = NotebookPage('file_names')
+            nbp_file.raw_extension = '.npy'
+            nbp_file.input_dir = input_dir
+            nbp_file.round = ['round0']
+            nbp_file.anchor = None
+            nbp_basic = NotebookPage('basic_info')
+            nbp_basic.use_anchor = False
+            nbp_basic.use_z = [1, 2, 4]
+            nbp_basic.tile_sz = tile_sz
+            nbp_basic.n_channels = n_channels
+            nbp_basic.tilepos_yx = np.array([[0, 0], [0, 1]])
+            nbp_basic.tilepos_yx_nd2 = np.array([[0, 1], [0, 0]])
+            plane_cache = RawTileCache(10 * tile_sz ** 2 * 2)
+            for t in range(n_tiles):
+                image = load_lazy(nbp_file, nbp_basic, 0, t, [0, 2], plane_cache=plane_cache)
+                self.assertEqual(image.shape, (n_channels, len(nbp_basic.use_z), tile_sz, tile_sz))
+                # nothing loaded until array computed.
+                self.assertEqual(plane_cache.info()['images'], 0 if t == 0 else 6)
+                image = image.compute()
+                for c in range(n_channels):
+                    if c == 1:
+                        self.assertTrue((image[c] == 0).all())
+                    else:
+                        image_c = load(nbp_file, nbp_basic, None, 0, t, c, nbp_basic.use_z)
+                        self.assertTrue(np.array_equal(image[c], np.moveaxis(image_c, -1, 0)))
+            # only the 10 most recently loaded planes kept.
+            self.assertEqual(plane_cache.info()['images'], 10)
+            self.assertEqual(plane_cache.info()['misses'], 12)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,36 @@
+import os
+import tempfile
+import unittest
+import numpy as np
+from ..spot_table import SpotTableWriter, read_spot_table, pa
+
+
+@unittest.skipIf(pa is None, 'pyarrow not installed')
+class TestSpotTable(unittest.TestCase):
+    def test_write_read(self):
+        # table read back should match spots written in several row groups.
+        rng = np.random.default_rng(0)
+        gene_names = np.array(['Gad1', 'Sst', 'Npy'])
+        global_yxz = rng.uniform(0, 1000, (50, 3)).astype(np.float32)
+        gene_no = rng.integers(0, 3, 50)
+        score = rng.uniform(0, 1, 50).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for file_format in ['parquet', 'arrow']:
+                file_name = os.path.join(tmpdir, 'spots.' + file_format)
+                with SpotTableWriter(file_name, gene_names, file_format, ['score']) as writer:
+                    for spots in np.split(np.arange(50), [20, 20, 45]):
+                        writer.write(global_yxz[spots], gene_no[spots], score=score[spots])
+                self.assertEqual(writer.n_spots, 50)
+                table = read_spot_table(file_name)
+                self.assertEqual(table.column_names, ['y', 'x', 'z_stack', 'Gene', 'score'])
+                self.assertTrue(np.array_equal(table.column('x').to_numpy(), global_yxz[:, 1]))
+                self.assertTrue(np.array_equal(table.column('score').to_numpy(), score))
+                self.assertEqual(table.column('Gene').to_pylist(), list(gene_names[gene_no]))
+                self.assertTrue(pa.types.is_dictionary(table.schema.field('Gene').type))
+                del table
+            with self.assertRaises(ValueError):
+                SpotTableWriter(os.path.join(tmpdir, 'spots.parquet'), gene_names, columns=['gene_no'])
+
+
+if __name__ == '__main__':
+    unittest.main()
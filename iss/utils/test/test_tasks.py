@@ -0,0 +1,197 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+import multiprocessing
+import numpy as np
+from unittest import mock
+from ..tasks import TaskScheduler, get_hash
+from ...setup.notebook import NotebookPage
+
+
+def make_page(value: int, order: list) -> NotebookPage:
+    order.append(value)
+    nbp = NotebookPage('test_task')
+    nbp.value = value
+    nbp.array = np.arange(value)
+    nbp.none = None
+    return nbp
+
+
+def run_shared(marker_dir: str, log_file: str, n_tasks: int):
+    # Runs the same tasks as other processes sharing marker_dir, appending name of each task run to log_file.
+    def task(name: str, value: int) -> NotebookPage:
+        time.sleep(0.05)
+        with open(log_file, 'a') as f:
+            f.write(name + '\n')
+        return make_page(value, [])
+
+    scheduler = TaskScheduler(marker_dir, n_workers=2, lease_time=10)
+    for i in range(n_tasks):
+        scheduler.add(f'a{i}', lambda i=i: task(f'a{i}', i))
+    scheduler.add('sum', lambda: task('sum', sum([scheduler.result(f'a{i}').value for i in range(n_tasks)])),
+                  [f'a{i}' for i in range(n_tasks)])
+    scheduler.run()
+
+
+class TestTaskScheduler(unittest.TestCase):
+    def test_dependencies(self):
+        # task added first is slowest, but task depending on it must still be run after it.
+        with tempfile.TemporaryDirectory() as marker_dir:
+            order = []
+            scheduler = TaskScheduler(marker_dir, n_workers=3)
+            scheduler.add('slow', lambda: (time.sleep(0.2), make_page(1, order))[1])
+            scheduler.add('fast', lambda: make_page(2, order))
+            scheduler.add('sum', lambda: make_page(scheduler.result('slow').value +
+                                                   scheduler.result('fast').value, order), ['slow', 'fast'])
+            scheduler.run()
+            self.assertEqual(order, [2, 1, 3])
+            self.assertEqual(scheduler.result('sum').value, 3)
+
+    def test_resume(self):
+        # tasks with marker saved should not be run again and their results should be the same.
+        with tempfile.TemporaryDirectory() as marker_dir:
+            order = []
+            scheduler = TaskScheduler(marker_dir)
+            scheduler.add('a', lambda: make_page(4, order))
+            scheduler.add('b', lambda: (make_page(5, order), make_page(6, order)), ['a'])
+            scheduler.run()
+            self.assertTrue(os.path.isfile(scheduler.marker_file('b')))
+
+            scheduler_resume = TaskScheduler(marker_dir)
+            scheduler_resume.add('a', lambda: make_page(4, order))
+            scheduler_resume.add('b', lambda: (make_page(5, order), make_page(6, order)), ['a'])
+            scheduler_resume.add('c', lambda: make_page(7, order), ['b'])
+            scheduler_resume.run()
+            self.assertEqual(order, [4, 5, 6, 7])
+            self.assertEqual(scheduler_resume.result('a'), scheduler.result('a'))
+            self.assertEqual(len(scheduler_resume.result('b')), 2)
+            self.assertEqual(scheduler_resume.result('b')[1], scheduler.result('b')[1])
+            self.assertIsNone(scheduler_resume.result('b')[0].none)
+
+    def test_key(self):
+        # tasks are only run again if their key or the results of the tasks they depend on change.
+        def add_tasks(scheduler: TaskScheduler, order: list, key_a: int, key_b: int, value_b: int):
+            scheduler.add('a', lambda: make_page(1, order), key=key_a)
+            scheduler.add('b', lambda: make_page(value_b, order), ['a'],
+                          key=lambda: {'b': [key_b], 'a': scheduler.result_hash('a')})
+            scheduler.add('c', lambda: make_page(scheduler.result('b').value + 10, order), ['b'],
+                          key=lambda: scheduler.result_hash('b'))
+
+        with tempfile.TemporaryDirectory() as marker_dir:
+            # a run again with same result so b not run again. Then b run again with same, then different result.
+            for key_a, key_b, value_b, order_expected in [(0, 0, 2, [1, 2, 12]), (0, 0, 2, []),
+                                                          (1, 0, 2, [1]), (1, 1, 2, [2]), (1, 2, 3, [3, 13])]:
+                order = []
+                scheduler = TaskScheduler(marker_dir)
+                add_tasks(scheduler, order, key_a, key_b, value_b)
+                scheduler.run()
+                self.assertEqual(order, order_expected)
+                self.assertEqual(scheduler.is_stale('b'), order_expected in [[2], [3, 13]])
+                self.assertEqual(scheduler.result('c').value, value_b + 10)
+
+    def test_get_hash(self):
+        # hash should only depend on values, not types.
+        self.assertEqual(get_hash({'a': [1, 2], 'b': None, 'c': 2.5}),
+                         get_hash({'c': np.float32(2.5), 'b': None, 'a': np.array([1, 2], dtype=np.int16)}))
+        self.assertEqual(get_hash([['a', 'bc'], ['d']]), get_hash([np.array(['a', 'bc']), ['d']]))
+        self.assertNotEqual(get_hash([1, 2]), get_hash([1.0, 2.0]))
+        self.assertNotEqual(get_hash([1, 2]), get_hash([[1, 2]]))
+
+    def test_error(self):
+        # tasks depending on a failed task should not be run, but other tasks should still be saved.
+        def fail():
+            raise ValueError('task failed')
+
+        with tempfile.TemporaryDirectory() as marker_dir:
+            order = []
+            scheduler = TaskScheduler(marker_dir)
+            scheduler.add('ok', lambda: make_page(1, order))
+            scheduler.add('fail', fail)
+            scheduler.add('after_fail', lambda: make_page(2, order), ['fail'])
+            self.assertRaises(ValueError, scheduler.run)
+            self.assertEqual(order, [1])
+            self.assertTrue(scheduler.is_done('ok'))
+            self.assertFalse(scheduler.is_done('fail'))
+            self.assertFalse(os.path.isfile(scheduler.marker_file('fail')))
+
+
+    def test_shared(self):
+        # each task should be run by only one of the processes sharing marker_dir.
+        n_tasks = 12
+        with tempfile.TemporaryDirectory() as marker_dir:
+            log_file = os.path.join(marker_dir, 'log.txt')
+            ctx = multiprocessing.get_context('spawn')
+            processes = [ctx.Process(target=run_shared, args=(marker_dir, log_file, n_tasks)) for _ in range(3)]
+            for process in processes:
+                process.start()
+            for process in processes:
+                process.join()
+                self.assertEqual(process.exitcode, 0)
+            with open(log_file, 'r') as f:
+                tasks_run = f.read().split()
+            self.assertEqual(sorted(tasks_run), sorted([f'a{i}' for i in range(n_tasks)] + ['sum']))
+            self.assertFalse(any(file.endswith('.lease') for file in os.listdir(marker_dir)))
+            scheduler = TaskScheduler(marker_dir, lease_time=10)
+            scheduler.add('sum', lambda: make_page(-1, []))
+            scheduler.run()
+            self.assertEqual(scheduler.result('sum').value, sum(range(n_tasks)))
+
+    def test_lease(self):
+        # task with expired lease should be taken over, but task with lease being updated should be waited for.
+        with tempfile.TemporaryDirectory() as marker_dir:
+            order = []
+            scheduler = TaskScheduler(marker_dir, lease_time=1)
+            scheduler.add('expired', lambda: make_page(1, order))
+            scheduler.add('held', lambda: make_page(2, order))
+            for name in ['expired', 'held']:
+                with open(scheduler.lease_file(name), 'w') as f:
+                    f.write('other')
+            os.utime(scheduler.lease_file('expired'), (time.time() - 10, time.time() - 10))
+
+            def other_process():
+                # keeps lease of held updated then saves its result.
+                for _ in range(6):
+                    os.utime(scheduler.lease_file('held'))
+                    time.sleep(0.25)
+                other = TaskScheduler(marker_dir)
+                other._save('held', make_page(3, []), scheduler.task_key('held'), 'other_hash')
+                os.remove(scheduler.lease_file('held'))
+
+            thread = threading.Thread(target=other_process)
+            thread.start()
+            scheduler.run()
+            thread.join()
+            self.assertEqual(order, [1])
+            self.assertEqual(scheduler.result('held').value, 3)
+            self.assertEqual(scheduler.result_hash('held'), 'other_hash')
+            self.assertFalse(os.path.isfile(scheduler.lease_file('expired')))
+
+    def test_poll(self):
+        # task with a fresh lease should not be claimed, and should be checked less often the longer it runs.
+        with tempfile.TemporaryDirectory() as marker_dir:
+            scheduler = TaskScheduler(marker_dir, lease_time=20)
+            scheduler.add('held', lambda: make_page(1, []))
+            with open(scheduler.lease_file('held'), 'w') as f:
+                f.write('other')
+            sleep_times = []
+
+            def sleep(seconds: float):
+                # other process finishes task after 5 checks.
+                sleep_times.append(seconds)
+                if len(sleep_times) == 5:
+                    other = TaskScheduler(marker_dir)
+                    other._save('held', make_page(2, []), scheduler.task_key('held'), 'other_hash')
+                    os.remove(scheduler.lease_file('held'))
+
+            with mock.patch.object(scheduler, '_claim', wraps=scheduler._claim) as claim, \
+                    mock.patch('time.sleep', side_effect=sleep):
+                scheduler.run()
+            claim.assert_not_called()
+            self.assertEqual(sleep_times, [1, 2, 4, 5, 5])
+            self.assertEqual(scheduler.result('held').value, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
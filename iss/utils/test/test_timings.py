@@ -0,0 +1,74 @@
+import os
+import json
+import tempfile
+import unittest
+import numpy as np
+from .. import timings
+from ...setup.notebook import Notebook
+
+
+class TestTimings(unittest.TestCase):
+    def tearDown(self):
+        timings.stop()
+
+    def test_not_recording(self):
+        # span should do nothing and no page should be added if not recording.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            nb = Notebook(os.path.join(tmpdir, 'nb.npz'))
+            with timings.span('a', tile=0):
+                timings.add_bytes(read=10)
+            timings.update_page(nb)
+            self.assertFalse(nb.has_page('timings'))
+
+    def test_nested(self):
+        # inner span should inherit tile from outer span and bytes should be added to both.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            log_file = os.path.join(tmpdir, 'timings.jsonl')
+            nb = Notebook(os.path.join(tmpdir, 'nb.npz'))
+            timings.start(log_file)
+            with timings.span('outer', tile=3):
+                with timings.span('inner', round=1):
+                    timings.add_bytes(read=10, written=5)
+                timings.add_bytes(read=1)
+            timings.update_page(nb)
+            self.assertEqual(list(nb.timings.span_name), ['outer/inner', 'outer'])
+            self.assertEqual(list(nb.timings.tile), [3, 3])
+            self.assertEqual(list(nb.timings.round), [1, -1])
+            self.assertEqual(list(nb.timings.bytes_read), [10, 11])
+            self.assertEqual(list(nb.timings.bytes_written), [5, 5])
+            self.assertTrue(nb.timings.wall_time[1] >= nb.timings.wall_time[0])
+
+            # spans from later calls, including saving the notebook when the page was added, should be appended.
+            with timings.span('after'):
+                pass
+            timings.update_page(nb)
+            self.assertEqual(list(nb.timings.span_name), ['outer/inner', 'outer', 'notebook_save', 'after'])
+            with open(log_file, 'r') as f:
+                logged = [json.loads(line)['name'] for line in f]
+            # last save of notebook is only in the log file as it finishes after the page is added.
+            self.assertEqual(logged, list(nb.timings.span_name) + ['notebook_save'])
+
+            # page should be the same after reloading the notebook.
+            nb_loaded = Notebook(os.path.join(tmpdir, 'nb.npz'))
+            self.assertTrue(np.array_equal(nb_loaded.timings.wall_time, nb.timings.wall_time))
+            self.assertIn('outer/inner', timings.summary(nb_loaded.timings))
+
+    @unittest.skipIf(np.isnan(timings.get_rss()), 'current RSS only found on linux')
+    def test_rss(self):
+        # rss_change should show memory kept by a span and freed by a later span.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            nb = Notebook(os.path.join(tmpdir, 'nb.npz'))
+            timings.start()
+            with timings.span('allocate'):
+                array = np.ones(50 * 1024 ** 2 // 8)  # 50 MB
+            with timings.span('free'):
+                del array
+            timings.update_page(nb)
+            self.assertTrue(nb.timings.rss_change[0] > 40)
+            self.assertTrue(nb.timings.rss_change[1] < -40)
+            # process peak can only increase.
+            self.assertTrue(nb.timings.process_peak_rss[1] >= nb.timings.process_peak_rss[0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,277 @@
+import os
+import json
+import time
+import threading
+import contextlib
+import numpy as np
+from typing import Optional, List
+from ..setup.notebook import NotebookPage, Notebook
+try:
+    import resource
+except ImportError:
+    # resource module only exists on unix.
+    resource = None
+
+# Recorder which spans are added to. None if timings are not being recorded.
+_recorder = None
+# Context manager returned by span when timings are not being recorded so there is negligible overhead.
+_null_span = contextlib.nullcontext()
+
+
+class TimingRecorder:
+    """
+    Stores the time and memory used by each span since recording started.
+    Spans are recorded from all threads and, if `log_file` is given, each is also appended to it as a json line
+    as soon as it finishes, so there is a record even if the pipeline crashes.
+    """
+    def __init__(self, log_file: Optional[str] = None):
+        """
+        Args:
+            log_file: Path to `.jsonl` file to append each span to. If `None`, spans are only kept in memory.
+        """
+        self.log_file = log_file
+        self.spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def stack(self) -> List['Span']:
+        """Spans which are currently open in this thread, outermost first."""
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def record(self, span_info: dict):
+        """
+        Adds a finished span.
+
+        Args:
+            span_info: Dictionary returned by `Span.info`.
+        """
+        with self._lock:
+            self.spans.append(span_info)
+            if self.log_file is not None:
+                with open(self.log_file, 'a') as f:
+                    f.write(json.dumps(span_info) + '\n')
+
+    def pop_spans(self) -> List[dict]:
+        """
+        Returns:
+            All spans recorded since the last call, removing them from the recorder.
+        """
+        with self._lock:
+            spans = self.spans
+            self.spans = []
+        return spans
+
+
+class Span:
+    """
+    Context manager which records the wall time, CPU time, change in RSS and bytes read/written between entering
+    and exiting. Spans can be nested, in which case the name recorded is the names of all open spans
+    in the current thread separated by `/`, and `tile`, `round` and `channel` are inherited from the outer span
+    if not given.
+    """
+    def __init__(self, recorder: TimingRecorder, name: str, tile: Optional[int] = None,
+                 round: Optional[int] = None, channel: Optional[int] = None):
+        self.recorder = recorder
+        self.name = name
+        self.tile = tile
+        self.round = round
+        self.channel = channel
+        self.bytes_read = 0
+        self.bytes_written = 0
+
+    def __enter__(self):
+        stack = self.recorder.stack
+        if len(stack) > 0:
+            parent = stack[-1]
+            self.name = parent.name + '/' + self.name
+            self.tile = parent.tile if self.tile is None else self.tile
+            self.round = parent.round if self.round is None else self.round
+            self.channel = parent.channel if self.channel is None else self.channel
+        stack.append(self)
+        self.start = time.time()
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        self.rss_start = get_rss()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.wall_time = time.perf_counter() - self.wall_start
+        self.cpu_time = time.process_time() - self.cpu_start
+        self.rss_change = get_rss() - self.rss_start
+        self.recorder.stack.pop()
+        self.recorder.record(self.info())
+        return False
+
+    def info(self) -> dict:
+        """
+        Returns:
+            Dictionary containing `name`, `tile`, `round`, `channel`, `start`, `wall_time`, `cpu_time`,
+                `rss_start`, `rss_change`, `process_peak_rss`, `bytes_read` and `bytes_written` of span.
+                `rss_start` and `rss_change` are the RSS of the process when the span started and how much it
+                changed by when the span finished, so show the memory the span kept or freed.
+                `process_peak_rss` is the maximum RSS of the process since it started, not of this span.
+        """
+        # tile, round and channel may be numpy integers which can't be saved to json.
+        trc = [None if i is None else int(i) for i in [self.tile, self.round, self.channel]]
+        return {'name': self.name, 'tile': trc[0], 'round': trc[1], 'channel': trc[2],
+                'start': self.start, 'wall_time': self.wall_time, 'cpu_time': self.cpu_time,
+                'rss_start': self.rss_start, 'rss_change': self.rss_change, 'process_peak_rss': get_max_rss(),
+                'bytes_read': self.bytes_read, 'bytes_written': self.bytes_written}
+
+
+def get_max_rss() -> float:
+    """
+    Gets the maximum resident set size of this process so far.
+
+    Returns:
+        Maximum resident set size in MB or `nan` if not on unix.
+    """
+    if resource is None:
+        return np.nan
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on mac but KB on linux.
+    return max_rss / 1024 ** 2 if os.uname().sysname == 'Darwin' else max_rss / 1024
+
+
+def get_rss() -> float:
+    """
+    Gets the current resident set size of this process.
+
+    Returns:
+        Resident set size in MB or `nan` if not on linux.
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            n_pages = int(f.read().split()[1])
+        return n_pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, IndexError):
+        return np.nan
+
+
+def start(log_file: Optional[str] = None):
+    """
+    Starts recording spans. Until this is called, `span` does nothing.
+
+    Args:
+        log_file: Path to `.jsonl` file to append each span to as soon as it finishes.
+    """
+    global _recorder
+    _recorder = TimingRecorder(log_file)
+
+
+def stop():
+    """
+    Stops recording spans. Any spans not yet added to the notebook through `update_page` are lost.
+    """
+    global _recorder
+    _recorder = None
+
+
+def is_recording() -> bool:
+    """
+    Returns:
+        Whether spans are currently being recorded.
+    """
+    return _recorder is not None
+
+
+def span(name: str, tile: Optional[int] = None, round: Optional[int] = None, channel: Optional[int] = None):
+    """
+    Context manager to record the time and memory used by the code inside it.
+
+    Example:
+    ```python
+        with utils.timings.span('filter', tile=t, round=r, channel=c):
+            im = utils.morphology.convolve_2d(im, filter_kernel)
+    ```
+
+    Args:
+        name: Name of the span. If inside another span, the name recorded will be `{outer_name}/{name}`.
+        tile: Tile the code inside the span is working on.
+        round: Round the code inside the span is working on.
+        channel: Channel the code inside the span is working on.
+
+    Returns:
+        `Span` if recording, otherwise a context manager which does nothing.
+    """
+    if _recorder is None:
+        return _null_span
+    return Span(_recorder, name, tile, round, channel)
+
+
+def add_bytes(read: int = 0, written: int = 0):
+    """
+    Adds the bytes read from or written to disk to all spans currently open in this thread.
+    Does nothing if not recording.
+
+    Args:
+        read: Number of bytes read.
+        written: Number of bytes written.
+    """
+    if _recorder is None:
+        return
+    for open_span in _recorder.stack:
+        open_span.bytes_read += read
+        open_span.bytes_written += written
+
+
+def update_page(nb: Notebook):
+    """
+    Adds all spans recorded since the last call to the `timings` page of the notebook,
+    replacing the page if it already exists. Does nothing if not recording.
+
+    Args:
+        nb: Notebook to add `timings` page to.
+    """
+    if _recorder is None:
+        return
+    spans = _recorder.pop_spans()
+    if len(spans) == 0:
+        return
+    nbp = NotebookPage('timings')
+    nbp.span_name = np.array([s['name'] for s in spans])
+    for key in ['tile', 'round', 'channel']:
+        nbp.__setattr__(key, np.array([-1 if s[key] is None else s[key] for s in spans], dtype=int))
+    for key in ['start', 'wall_time', 'cpu_time', 'rss_start', 'rss_change', 'process_peak_rss']:
+        nbp.__setattr__(key, np.array([s[key] for s in spans], dtype=float))
+    for key in ['bytes_read', 'bytes_written']:
+        nbp.__setattr__(key, np.array([s[key] for s in spans], dtype=np.int64))
+    if nb.has_page('timings'):
+        # Combine with spans from previous calls, which may have been in a previous session.
+        nbp_old = nb.timings
+        nbp_new = nbp
+        nbp = NotebookPage('timings')
+        for key in nbp_new._times:
+            nbp.__setattr__(key, np.append(nbp_old.__getattribute__(key), nbp_new.__getattribute__(key)))
+        del nb.timings
+    nb += nbp
+
+
+def summary(nbp_timings: NotebookPage, by: str = 'span_name') -> str:
+    """
+    Makes a table of the total time and bytes read/written, summed over all spans with the same `by` value,
+    sorted by total wall time.
+
+    Args:
+        nbp_timings: `timings` notebook page.
+        by: Which variable in `nbp_timings` to group spans by e.g. `'span_name'` or `'tile'`.
+
+    Returns:
+        Table with a row for each group.
+    """
+    groups, group_ind = np.unique(nbp_timings.__getattribute__(by), return_inverse=True)
+    n_spans = np.bincount(group_ind, minlength=len(groups))
+    totals = {key: np.bincount(group_ind, nbp_timings.__getattribute__(key), minlength=len(groups))
+              for key in ['wall_time', 'cpu_time', 'bytes_read', 'bytes_written']}
+    name_width = max([len(by)] + [len(str(group)) for group in groups]) + 2
+    lines = [by.ljust(name_width) + 'n'.rjust(8) + 'wall_time/s'.rjust(14) + 'cpu_time/s'.rjust(14) +
+             'read/MB'.rjust(12) + 'written/MB'.rjust(12)]
+    for i in np.argsort(-totals['wall_time']):
+        lines.append(str(groups[i]).ljust(name_width) + f"{n_spans[i]}".rjust(8) +
+                     f"{totals['wall_time'][i]:.2f}".rjust(14) + f"{totals['cpu_time'][i]:.2f}".rjust(14) +
+                     f"{totals['bytes_read'][i] / 1024 ** 2:.1f}".rjust(12) +
+                     f"{totals['bytes_written'][i] / 1024 ** 2:.1f}".rjust(12))
+    return '\n'.join(lines)
@@ -1,4 +1,4 @@
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Union
 from iss.pcr import get_single_affine_transform
 from iss.pipeline.run import initialize_nb, run_extract, run_find_spots
 from iss import setup, utils
@@ -6,18 +6,19 @@ from iss.call_spots import get_non_duplicate
 from iss.stitch import compute_shift
 from iss.find_spots import get_isolated_points
 from iss.pipeline import stitch
-from iss.spot_colors import apply_transform_jax
 from iss.plot.register import view_shifts
 import numpy as np
-import jax.numpy as jnp
 import os
+import threading
+import h5py
+from scipy import ndimage
+from concurrent.futures import ThreadPoolExecutor
 import warnings
 import matplotlib
-matplotlib.use('Qt5Agg')
-matplotlib.pyplot.style.use('dark_background')
 
 
-def run_sep_round_reg(config_file: str, config_file_full: str, channels_to_save: List):
+def run_sep_round_reg(config_file: str, config_file_full: str, channels_to_save: List, order: int = 0,
+                      chunk_shape: Tuple[int, int, int] = (512, 512, 32)):
     """
     This runs the pipeline for a separate round up till the end of the stitching stage and then finds the
     affine transform that takes it to the anchor image of the full pipeline run.
@@ -31,6 +32,9 @@ def run_sep_round_reg(config_file: str, config_file_full: str, channels_to_save:
         config_file_full: Path to config file for full pipeline run, for which full notebook exists.
         channels_to_save: Channels of the separate round, that will be saved to the output directory in
             the same coordinate system as the anchor round of the full run.
+            Each is saved as dataset `'image'` in a chunked hdf5 file, with z as the first axis if 3D.
+        order: Interpolation used when transforming images, `0` for nearest neighbour or `1` for linear.
+        chunk_shape: yxz size of chunks in which transformed images are made and saved.
     """
     # Get all information from full pipeline results - global spot positions and z scaling
     nb_full = initialize_nb(config_file_full)
@@ -101,21 +105,42 @@ def run_sep_round_reg(config_file: str, config_file_full: str, channels_to_save:
         nbp = nb.reg_to_anchor_info
 
     # save all the images
+    # Each stitched image is written to a temporary npy file as tiles are read,
+    # so only one tile of each channel is in memory rather than the whole stitched image.
+    # The memory map is then passed to transform_image, which only reads the region each chunk needs.
+    stitch_files = {c: os.path.join(nb.file_names.output_dir, f'sep_round_channel{c}_stitched.npy')
+                    for c in channels_to_save}
+    # Channels other than ref_channel are stitched from the nd2 file, all in one pass so each tile is read once.
+    nd2_channels = [c for c in channels_to_save if c != nb.basic_info.ref_channel]
+    images_stitch = {}
+    if len(nd2_channels) > 0:
+        images_stitch = dict(zip(nd2_channels, utils.npy.save_stitched(
+            [stitch_files[c] for c in nd2_channels], nb.file_names, nb.basic_info, nb.stitch.tile_origin,
+            nb.basic_info.ref_round, nd2_channels, True, config['stitch']['save_image_zero_thresh'])))
     for c in channels_to_save:
-        im_file = os.path.join(nb.file_names.output_dir, f'sep_round_channel{c}_transformed.npz')
-        if c == nb.basic_info.ref_channel:
-            from_nd2 = False
+        im_file = os.path.join(nb.file_names.output_dir, f'sep_round_channel{c}_transformed.h5')
+        if c in images_stitch:
+            image_stitch = images_stitch.pop(c)
         else:
-            from_nd2 = True
-        image_stitch = utils.npy.save_stitched(None, nb.file_names, nb.basic_info, nb.stitch.tile_origin,
-                                               nb.basic_info.ref_round, c, from_nd2,
-                                               config['stitch']['save_image_zero_thresh'])
+            image_stitch = utils.npy.save_stitched(stitch_files[c], nb.file_names, nb.basic_info,
+                                                   nb.stitch.tile_origin, nb.basic_info.ref_round, c, False,
+                                                   config['stitch']['save_image_zero_thresh'])
 
-        image_transform = transform_image(image_stitch, nbp.transform, image_centre[:image_stitch.ndim], z_scale)
         if nb.basic_info.is_3d:
             # Put z axis first for saving
-            image_transform = np.moveaxis(image_transform, -1, 0)
-        np.savez_compressed(im_file, image_transform)
+            out_shape = (image_stitch.shape[2],) + image_stitch.shape[:2]
+            out_chunks = (chunk_shape[2],) + tuple(chunk_shape[:2])
+        else:
+            out_shape = image_stitch.shape
+            out_chunks = tuple(chunk_shape[:2])
+        out_chunks = tuple(np.minimum(out_chunks, out_shape))
+        with h5py.File(im_file, 'w') as file:
+            out = file.create_dataset('image', shape=out_shape, dtype=image_stitch.dtype, chunks=out_chunks,
+                                      compression='gzip', fillvalue=0)
+            transform_image(image_stitch, nbp.transform, image_centre[:image_stitch.ndim], z_scale, out, order,
+                            chunk_shape)
+        del image_stitch
+        os.remove(stitch_files[c])
 
 
 def get_shift(config: dict, spot_yxz_base: np.ndarray, spot_yxz_transform: np.ndarray, z_scale_base: float,
@@ -162,13 +187,51 @@ def get_shift(config: dict, spot_yxz_base: np.ndarray, spot_yxz_transform: np.nd
     return shift, np.asarray(shift_score), np.asarray(shift_score_thresh), debug_info
 
 
-def transform_image(image: np.ndarray, transform: np.ndarray, image_centre: np.ndarray, z_scale: int) -> np.ndarray:
+def get_inverse_transform(transform: np.ndarray, image_centre: np.ndarray,
+                          z_scale: float) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Finds the `matrix` and `offset` such that pixel `yxz` in the transformed image came from pixel
+    `matrix @ yxz + offset` in the original image, i.e. the inverse of applying `transform` as in
+    `spot_colors.apply_transform_jax`.
+
+    Args:
+        transform: `float [4 x 3]`.
+            Affine transform which transforms original image to transformed image.
+        image_centre: `int [n_dim]`.
+            Pixel coordinates were centred by subtracting this first when computing affine transform.
+        z_scale: Scaling to put z coordinates in same units as yx coordinates.
+
+    Returns:
+        - `matrix` - `float [n_dim x n_dim]`.
+        - `offset` - `float [n_dim]`.
+    """
+    n_dim = len(image_centre)
+    z_multiplier = np.array([1, 1, z_scale])[:n_dim]
+    # Forward transform in pixel units is yxz_transform - centre = (yxz - centre) @ forward + shift
+    forward = transform[:n_dim, :n_dim] * z_multiplier[:, np.newaxis] / z_multiplier
+    shift = transform[3, :n_dim] / z_multiplier
+    matrix = np.linalg.inv(forward).T
+    offset = image_centre - matrix @ (image_centre + shift)
+    return matrix, offset
+
+
+def transform_image(image: Union[np.ndarray, h5py.Dataset], transform: np.ndarray, image_centre: np.ndarray, z_scale: float,
+                    out: Optional[Union[np.ndarray, h5py.Dataset]] = None, order: int = 0,
+                    chunk_shape: Tuple[int, int, int] = (512, 512, 32),
+                    n_threads: Optional[int] = None) -> Optional[np.ndarray]:
     """
     This transforms `image` to a new coordinate system by applying `transform` to every pixel in `image`.
 
+    Each pixel of the transformed image is found by applying the inverse transform to it and interpolating
+    `image` there, so there are no gaps if `transform` scales the image up.
+    The transformed image is made in chunks of size `chunk_shape` in parallel, each only using the region of `image`
+    it needs, and each chunk is written to `out` as soon as it is made.
+    So if `image` is on disk e.g. a memory map or `h5py` dataset, only the region each chunk needs is read.
+
     Args:
         image: `int [n_y x n_x (x n_z)]`.
-            image which is to be transformed.
+            image which is to be transformed. Can be any array supporting slicing such as a memory map
+            or `h5py` dataset.
         transform: `float [4 x 3]`.
             Affine transform which transforms image which is applied to every pixel in image to form a
             new transformed image.
@@ -177,29 +240,78 @@ def transform_image(image: np.ndarray, transform: np.ndarray, image_centre: np.n
             So when applying affine transform, pixels will also be shifted by this amount.
             z centre i.e. `image_centre[2]` is in units of z-pixels.
         z_scale: Scaling to put z coordinates in same units as yx coordinates.
+        out: `int [(n_z x) n_y x n_x]`.
+            Array to write transformed image to, with z as the first axis as in saved images
+            e.g. a chunked `h5py` dataset. Chunks which are all zero are not written so must be zero initially.
+            If `None`, transformed image is returned.
+        order: Interpolation used, `0` for nearest neighbour or `1` for linear.
+        chunk_shape: yxz size of chunks of transformed image made at once.
+        n_threads: Number of chunks made at the same time. If `None`, will use the number of CPUs.
 
     Returns: `int [n_y x n_x (x n_z)]`.
-        `image` transformed according to `transform`.
+        `image` transformed according to `transform`. `None` if `out` given.
 
     """
-    im_transformed = np.zeros_like(image)
-    yxz = jnp.asarray(np.where(image != 0)).T.reshape(-1, image.ndim)
-    image_values = image[tuple([yxz[:, i] for i in range(image.ndim)])]
-    tile_size = jnp.asarray(im_transformed.shape)
-    if image.ndim == 2:
-        tile_size = jnp.append(tile_size, 1)
-        image_centre = np.append(image_centre, 0)
-        yxz = np.hstack((yxz, np.zeros((yxz.shape[0], 1))))
-
-    yxz_transform, in_range = apply_transform_jax(yxz, jnp.asarray(transform), jnp.asarray(image_centre), z_scale,
-                                                  tile_size)
-    yxz_transform = np.asarray(yxz_transform[in_range])
-    image_values = image_values[np.asarray(in_range)]
-    im_transformed[tuple([yxz_transform[:, i] for i in range(image.ndim)])] = image_values
-    return im_transformed
+    if order not in [0, 1]:
+        raise ValueError(f'order must be 0 (nearest neighbour) or 1 (linear) but {order} given.')
+    matrix, offset = get_inverse_transform(transform, np.asarray(image_centre[:image.ndim]), z_scale)
+    im_shape = np.array(image.shape)
+    chunk_shape = np.array(chunk_shape[:image.ndim])
+    return_image = out is None
+    if return_image:
+        out = np.zeros(image.shape, dtype=image.dtype)
+    # all pixels of chunk with corner at 0 are inside box with these corners.
+    chunk_corners = np.array(np.meshgrid(*[[0, size - 1] for size in chunk_shape], indexing='ij'))
+    chunk_corners = chunk_corners.reshape(image.ndim, -1)
+    lock = threading.Lock()
+
+    def transform_chunk(chunk_start: np.ndarray):
+        chunk_size = np.minimum(chunk_shape, im_shape - chunk_start)
+        # Input region needed by chunk, padded by a pixel for interpolation.
+        input_corners = matrix @ (chunk_corners + chunk_start[:, np.newaxis]) + offset[:, np.newaxis]
+        input_start = np.clip(np.floor(input_corners.min(axis=1)).astype(int) - 1, 0, im_shape)
+        input_stop = np.clip(np.ceil(input_corners.max(axis=1)).astype(int) + 2, 0, im_shape)
+        if (input_stop <= input_start).any():
+            if return_image:
+                return
+            chunk = np.zeros(chunk_size, dtype=image.dtype)
+        else:
+            chunk = ndimage.affine_transform(image[tuple(slice(i0, i1) for i0, i1 in zip(input_start, input_stop))],
+                                             matrix, offset + matrix @ chunk_start - input_start,
+                                             output_shape=tuple(chunk_size), output=image.dtype, order=order,
+                                             mode='constant', cval=0)
+            if not return_image and not chunk.any():
+                return
+        out_slice = tuple(slice(o0, o0 + size) for o0, size in zip(chunk_start, chunk_size))
+        if return_image:
+            out[out_slice] = chunk
+        else:
+            if image.ndim == 3:
+                # Put z axis first for saving
+                out_slice = out_slice[2:] + out_slice[:2]
+                chunk = np.moveaxis(chunk, -1, 0)
+            with lock:
+                out[out_slice] = chunk
+
+    chunk_starts = np.array(np.meshgrid(*[np.arange(0, size, step) for size, step in zip(im_shape, chunk_shape)],
+                                        indexing='ij')).reshape(image.ndim, -1).T
+    if n_threads is None:
+        n_threads = os.cpu_count() or 1
+    if min(n_threads, len(chunk_starts)) > 1:
+        # ndimage releases the GIL while interpolating so chunks are made in parallel.
+        with ThreadPoolExecutor(max_workers=n_threads) as executor:
+            list(executor.map(transform_chunk, chunk_starts))
+    else:
+        for chunk_start in chunk_starts:
+            transform_chunk(chunk_start)
+    if return_image:
+        return out
 
 
 if __name__ == "__main__":
+    # set up plotting here, so functions can be imported without Qt.
+    matplotlib.use('Qt5Agg')
+    matplotlib.pyplot.style.use('dark_background')
     channels = [0, 18]
 
     run_sep_round_reg(config_file='sep_round_settings_example.ini',
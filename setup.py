@@ -20,7 +20,7 @@ setup(
     python_requires='>=3.8',
     url='https://github.com/mwshinn/spatiotemporal',
     packages=['iss', 'iss.setup', 'iss.utils', 'iss.extract', 'iss.stitch', 'iss.spot_colors', 'iss.plot',
-              'iss.pipeline', 'iss.pcr', 'iss.omp', 'iss.find_spots', 'iss.call_spots'],
+              'iss.pipeline', 'iss.pcr', 'iss.omp', 'iss.find_spots', 'iss.call_spots', 'iss.benchmark'],
     install_requires=['jax', 'jaxlib', 'numpy', 'numpy_indexed', 'tqdm', 'scipy', 'sklearn', 'opencv-python',
                       'scikit-image', 'nd2', 'matplotlib', 'h5py', 'ipympl'],
     package_data={'iss.setup': ['settings.default.ini', 'notebook_comments.json']},
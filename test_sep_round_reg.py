@@ -0,0 +1,124 @@
+import os
+import tempfile
+import unittest
+import h5py
+import numpy as np
+import jax.numpy as jnp
+from scipy import ndimage
+from iss.spot_colors import apply_transform_jax
+from sep_round_reg import get_inverse_transform, transform_image
+
+
+def get_transform(scale: float, angle: float, shift: np.ndarray) -> np.ndarray:
+    """
+    Returns affine transform, in the form used by `apply_transform_jax`, which scales yx by `scale`, rotates
+    about z by `angle` radians and then shifts by `shift`. z is scaled by `scale` too.
+    """
+    transform = np.zeros((4, 3))
+    transform[:2, :2] = scale * np.array([[np.cos(angle), np.sin(angle)], [-np.sin(angle), np.cos(angle)]])
+    transform[2, 2] = scale
+    transform[3] = shift
+    return transform
+
+
+class TestTransformImage(unittest.TestCase):
+    """
+    Check that `transform_image` in `sep_round_reg.py` moves each pixel to where `apply_transform_jax` moves it,
+    without gaps, and gives the same result however it is split into chunks.
+    """
+    z_scale = 3.0
+
+    def test_get_inverse_transform(self):
+        # Inverse of transformed coordinates should be original coordinates, up to rounding of transformed ones.
+        rng = np.random.default_rng(0)
+        tile_sz = np.array([200, 200, 30])
+        image_centre = (tile_sz - 1) / 2
+        transform = get_transform(1.1, 0.1, np.array([4.3, -6.1, 5.2]))
+        transform[:3, :3] += rng.normal(0, 0.01, (3, 3))
+        yxz = np.round(rng.random((500, 3)) * (tile_sz - 1)).astype(np.int16)
+        yxz_transform = np.asarray(apply_transform_jax(jnp.asarray(yxz), jnp.asarray(transform),
+                                                       jnp.asarray(image_centre), self.z_scale,
+                                                       jnp.asarray(tile_sz))[0])
+        matrix, offset = get_inverse_transform(transform, image_centre, self.z_scale)
+        yxz_inverse = yxz_transform @ matrix.transpose() + offset
+        # rounding yxz_transform moves it by at most 0.5 in each dimension.
+        max_error = np.abs(matrix) @ np.full(3, 0.5) + 1e-6
+        self.assertTrue((np.abs(yxz_inverse - yxz) <= max_error).all())
+
+        # 2D inverse should be the same as yx part of 3D.
+        matrix_2d, offset_2d = get_inverse_transform(transform, image_centre[:2], self.z_scale)
+        transform_2d = transform.copy()
+        transform_2d[[0, 1, 3], 2] = 0
+        transform_2d[2, :2] = 0
+        matrix, offset = get_inverse_transform(transform_2d, image_centre, self.z_scale)
+        self.assertTrue(np.allclose(matrix_2d, matrix[:2, :2]))
+        self.assertTrue(np.allclose(offset_2d, offset[:2]))
+
+    def test_no_holes(self):
+        # If image is scaled up, every pixel of transformed image should come from a pixel in image.
+        for tile_sz in [(40, 50), (40, 50, 8)]:
+            image = np.ones(tile_sz, dtype=np.uint16)
+            image_centre = (np.array(tile_sz) - 1) / 2
+            transform = get_transform(1.5, 0.2, np.zeros(3))
+            for order in [0, 1]:
+                image_transform = transform_image(image, transform, image_centre, self.z_scale, order=order,
+                                                  chunk_shape=(16, 16, 4))
+                self.assertTrue((image_transform == 1).all())
+
+    def test_chunks(self):
+        # Result should not depend on chunk size or whether it is saved to h5 file.
+        rng = np.random.default_rng(1)
+        tile_sz = (40, 50, 10)
+        image = rng.integers(0, 1000, tile_sz, dtype=np.uint16)
+        image_centre = (np.array(tile_sz) - 1) / 2
+        transform = get_transform(1.2, 0.3, np.array([3.4, -2.2, 1.7]))
+        chunk_shape = (16, 16, 4)
+        with tempfile.TemporaryDirectory() as output_dir:
+            for order in [0, 1]:
+                image_transform = transform_image(image, transform, image_centre, self.z_scale, order=order,
+                                                  chunk_shape=chunk_shape)
+                image_transform_one_chunk = transform_image(image, transform, image_centre, self.z_scale,
+                                                            order=order, chunk_shape=tile_sz)
+                matrix, offset = get_inverse_transform(transform, image_centre, self.z_scale)
+                image_transform_scipy = ndimage.affine_transform(image, matrix, offset, output=image.dtype,
+                                                                 order=order, mode='constant', cval=0)
+                with h5py.File(os.path.join(output_dir, f'image{order}.h5'), 'w') as file:
+                    out = file.create_dataset('image', shape=(tile_sz[2], tile_sz[0], tile_sz[1]),
+                                              dtype=image.dtype, chunks=(chunk_shape[2],) + chunk_shape[:2],
+                                              compression='gzip', fillvalue=0)
+                    self.assertIsNone(transform_image(image, transform, image_centre, self.z_scale, out, order,
+                                                      chunk_shape, n_threads=2))
+                    image_transform_h5 = np.moveaxis(out[:], 0, -1)
+                self.assertTrue(image_transform.any())
+                self.assertTrue(np.array_equal(image_transform, image_transform_h5))
+                self.assertTrue(np.array_equal(image_transform, image_transform_one_chunk))
+                self.assertTrue(np.array_equal(image_transform, image_transform_scipy))
+
+    def test_on_disk_input(self):
+        # Result should be the same if image is a memory map, with z first as saved by save_stitched,
+        # or a h5py dataset.
+        rng = np.random.default_rng(2)
+        tile_sz = (40, 50, 10)
+        image = rng.integers(0, 1000, tile_sz, dtype=np.uint16)
+        image_centre = (np.array(tile_sz) - 1) / 2
+        transform = get_transform(1.2, 0.3, np.array([3.4, -2.2, 1.7]))
+        chunk_shape = (16, 16, 4)
+        image_transform = transform_image(image, transform, image_centre, self.z_scale, chunk_shape=chunk_shape)
+        with tempfile.TemporaryDirectory() as input_dir:
+            image_mmap = np.lib.format.open_memmap(os.path.join(input_dir, 'image.npy'), 'w+', image.dtype,
+                                                   (tile_sz[2], tile_sz[0], tile_sz[1]))
+            image_mmap[:] = np.moveaxis(image, -1, 0)
+            image_transform_mmap = transform_image(np.moveaxis(image_mmap, 0, -1), transform, image_centre,
+                                                   self.z_scale, chunk_shape=chunk_shape, n_threads=2)
+            del image_mmap
+            with h5py.File(os.path.join(input_dir, 'image.h5'), 'w') as file:
+                image_h5 = file.create_dataset('image', data=image, chunks=chunk_shape)
+                image_transform_h5 = transform_image(image_h5, transform, image_centre, self.z_scale,
+                                                     chunk_shape=chunk_shape, n_threads=2)
+        self.assertTrue(image_transform.any())
+        self.assertTrue(np.array_equal(image_transform, image_transform_mmap))
+        self.assertTrue(np.array_equal(image_transform, image_transform_h5))
+
+
+if __name__ == '__main__':
+    unittest.main()